@@ -0,0 +1,319 @@
+
+
+import logging
+from typing import Dict, List, NamedTuple, Optional, Text, Tuple
+import numpy as np
+import pandas as pd
+
+# Personal modules.
+from config.config import LOG_PROCESSING_FILEPATH, BACKTEST_MAX_CELLS, BACKTEST_MIN_YEARS
+from config.config_logger import setup_logger
+from autoprocess_ticker import query_api, walk_forward
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# ----------------------------------------------------------------------
+# Rules.
+# ----------------------------------------------------------------------
+
+# Sign and strictness of each comparison, so every rule compares as (sign * x > sign * threshold).
+RULE_OPS = {'>': (1, True), '>=': (1, False), '<': (-1, True), '<=': (-1, False)}
+
+
+class Rule(NamedTuple):
+    '''
+    Trade a period in a year when the trailing stat of the period, known before the
+    year starts, passes the threshold. Every threshold is a separate run.
+    Example: Rule('up_prob', '>', (0.6, 0.7, 0.8)) goes long when up_prob > 0.6 and so on.
+    '''
+
+    metric: Text
+    op: Text
+    thresholds: Tuple[float, ...]
+    side: int = 1
+
+    @property
+    def name(self) -> Text:
+        return f'{"long" if self.side > 0 else "short"} {self.metric}{self.op}'
+
+
+DEFAULT_RULES = [
+    Rule('up_prob', '>', (0.5, 0.6, 0.7, 0.8, 0.9)),
+    Rule('up_prob', '<', (0.5, 0.4, 0.3, 0.2, 0.1), side=-1),
+    Rule('avg_diff', '>', (0.0, 0.0025, 0.005, 0.01)),
+]
+
+
+# ----------------------------------------------------------------------
+# Universe.
+# ----------------------------------------------------------------------
+
+class Universe(NamedTuple):
+    '''
+    Realized returns and trailing stats of many tickers for one pivot key, aligned
+    on the same periods and years. The stats of a year only use the earlier years.
+    '''
+
+    tickers: List[Text]
+    periods: pd.MultiIndex
+    years: np.ndarray
+    metrics: List[Text]
+    returns: np.ndarray     # ticker x period x year
+    stats: np.ndarray       # ticker x period x year x metric
+
+
+def build_universe(pivots:Dict[Text, pd.DataFrame], metrics:List[Text], window:Optional[int]=None) -> Universe:
+    '''
+    Purpose:
+        Align the pivot tables of many tickers and their walk-forward stats.
+
+    Input  :
+        pivots : Dictionary of ticker and its pivot table for the same key.
+        metrics: List of the stats the rules need. Example: ['up_prob', 'avg_diff']
+        window : Int. Number of trailing years of the stats. Every earlier year if not given.
+
+    Return :
+        Universe. The periods are in the order the tickers first list them, and a
+        period or year that a ticker doesn't have is NaN.
+    '''
+
+    metrics = list(dict.fromkeys([*metrics, 'n_years']))
+
+    aligned = walk_forward.align_pivots(pivots)
+    returns = aligned.values
+
+    # The trailing stats of every ticker at once. Shift them by a year, so each year
+    # only sees the stats of the years before it. The first year has no stats.
+    stats = np.full((*returns.shape, len(metrics)), np.nan)
+    for i, values in enumerate(walk_forward.trailing_stats(returns, window, metrics).values()):
+        stats[..., 1:, i] = values[..., :-1]
+
+    logger.debug(f'----- Built a universe of ({len(pivots)}) tickers, ({len(aligned.periods)}) periods and ({len(aligned.years)}) years.')
+    return Universe(aligned.tickers, aligned.periods, aligned.years, metrics, returns, stats)
+
+
+def load_universe(ticker_dirs:List[Tuple[Text, Text]], key:Text, source:Text, metrics:List[Text],
+                  window:Optional[int]=None) -> Universe:
+    '''
+    Purpose:
+        Same as (build_universe) with the stored pivot tables of the tickers. A ticker
+        without its storage file is skipped.
+
+    Input  :
+        ticker_dirs: List of (ticker, etf_dir). Example: 'stats_store.list_ticker_dirs(jobs)'
+        key        : Str. Pivot key. Example: 'monthly' / 'compiled_holiday'
+        source     : Str. One of (query_api.SOURCE_FILES). Example: 'price' / 'holiday'
+    '''
+
+    pivots = {}
+    for ticker, etf_dir in ticker_dirs:
+        try:
+            pivots[ticker] = query_api.load_pivot(ticker, key, source, etf_dir)
+        except KeyError as error:
+            logger.warning(f'----- Skipped ({ticker}) in the backtest -- {error}')
+    return build_universe(pivots, metrics, window)
+
+
+# ----------------------------------------------------------------------
+# Backtest.
+# ----------------------------------------------------------------------
+
+class BacktestResult(NamedTuple):
+    '''
+    Summary of every (rule, threshold, ticker), and optionally their equity curves
+    as an array of rule x threshold x ticker x time. The time runs through the
+    periods of each year in turn, with the (year, *period) of (time_index).
+    '''
+
+    summary: pd.DataFrame
+    equity: Optional[np.ndarray]
+    time_index: pd.MultiIndex
+
+
+def evaluate_batch(returns:np.ndarray, values:np.ndarray, n_years:np.ndarray, rules:List[Rule],
+                   thresholds:np.ndarray, min_years:int) -> Dict[Text, np.ndarray]:
+    '''
+    Purpose:
+        Evaluate every rule and threshold on a batch of tickers at once by
+        broadcasting over rule x threshold x ticker x period x year.
+
+    Input  :
+        returns   : Array of ticker x period x year.
+        values    : Array of rule x ticker x period x year. The trailing stat of each rule.
+        n_years   : Array of ticker x period x year. Number of trailing years with a value.
+        rules     : List of Rule.
+        thresholds: Array of rule x threshold, padded with NaN.
+        min_years : Int. Don't trade a period with fewer trailing years.
+
+    Return :
+        Dictionary of the summary columns as arrays of rule x threshold x ticker, and
+        the equity curves as an array of rule x threshold x ticker x time.
+    '''
+
+    ops = [RULE_OPS[rule.op] for rule in rules]
+    shape = (len(rules), 1, 1, 1, 1)
+    signs = np.array([sign for sign, _ in ops], dtype=np.float64).reshape(shape)
+    strict = np.array([is_strict for _, is_strict in ops]).reshape(shape)
+    sides = np.array([rule.side for rule in rules], dtype=np.float64).reshape(shape)
+
+    with np.errstate(invalid='ignore'):
+        x, t = signs * values[:, None], signs * thresholds[:, :, None, None, None]
+        signal = np.where(strict, x > t, x >= t)
+        signal &= (n_years >= min_years) & ~np.isnan(returns)
+        trade = sides * returns
+        pnl = np.where(signal, trade, 0.0)
+        wins = (signal & (trade > 0)).sum(axis=(-2, -1))
+
+    # Order the trades by year, then by period.
+    pnl = pnl.swapaxes(-1, -2).reshape(*pnl.shape[:3], -1)
+    equity = np.cumprod(1 + pnl, axis=-1)
+    peak = np.maximum(np.maximum.accumulate(equity, axis=-1), 1.0)
+
+    n_trades = signal.sum(axis=(-2, -1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {
+            'n_trades': n_trades,
+            'hit_rate': wins / n_trades,
+            'avg_return': pnl.sum(axis=-1) / n_trades,
+            'total_return': equity[..., -1] - 1,
+            'max_drawdown': (1 - equity / peak).max(axis=-1),
+            'equity': equity,
+        }
+
+
+def run_backtest(universe:Universe, rules:List[Rule]=DEFAULT_RULES, min_years:int=BACKTEST_MIN_YEARS,
+                 keep_equity:bool=False) -> BacktestResult:
+    '''
+    Purpose:
+        Backtest every rule and threshold on every ticker of the universe. The
+        tickers are evaluated in batches of at most (BACKTEST_MAX_CELLS) cells.
+
+    Input  :
+        universe   : Universe of (build_universe) or (load_universe) with the metrics of the rules.
+        rules      : List of Rule.
+        min_years  : Int. Don't trade a period with fewer trailing years.
+        keep_equity: Bool. Keep the equity curves in the result.
+
+    Return :
+        BacktestResult. The summary has one row per rule, threshold and ticker.
+    '''
+
+    logger.info('Start running (run_backtest) function.')
+
+    n_thresholds = max(len(rule.thresholds) for rule in rules)
+    thresholds = np.array([list(rule.thresholds) + [np.nan] * (n_thresholds - len(rule.thresholds)) for rule in rules])
+    metric_idx = [universe.metrics.index(rule.metric) for rule in rules]
+    n_years = universe.stats[..., universe.metrics.index('n_years')]
+
+    n_tickers, n_periods, n_years_total = universe.returns.shape
+    batch = max(1, BACKTEST_MAX_CELLS // (len(rules) * n_thresholds * n_periods * n_years_total))
+    batches = []
+    for lo in range(0, n_tickers, batch):
+        hi = min(lo + batch, n_tickers)
+        values = np.moveaxis(universe.stats[lo:hi][..., metric_idx], -1, 0)
+        batches.append(evaluate_batch(universe.returns[lo:hi], values, n_years[lo:hi], rules, thresholds, min_years))
+    logger.debug(f'----- Evaluated ({n_tickers}) tickers in ({len(batches)}) batches of up to ({batch}) tickers.')
+
+    results = {col: np.concatenate([result[col] for result in batches], axis=2) for col in batches[0]}
+    rule_idx, threshold_idx, ticker_idx = np.indices(results['n_trades'].shape).reshape(3, -1)
+    summary = pd.DataFrame({
+        'rule': [rules[i].name for i in rule_idx],
+        'threshold': thresholds[rule_idx, threshold_idx],
+        'ticker': [universe.tickers[i] for i in ticker_idx],
+        **{col: values.reshape(-1) for col, values in results.items() if col != 'equity'},
+    })
+    summary = summary[summary['threshold'].notna()].reset_index(drop=True)
+
+    time_index = pd.MultiIndex.from_tuples(
+        [(year, *period) for year in universe.years for period in universe.periods],
+        names=['year', *universe.periods.names],
+    )
+    return BacktestResult(summary, results['equity'] if keep_equity else None, time_index)
+
+
+def backtest(ticker_dirs:List[Tuple[Text, Text]], key:Text, source:Text='price', rules:List[Rule]=DEFAULT_RULES,
+             window:Optional[int]=None, min_years:int=BACKTEST_MIN_YEARS, keep_equity:bool=False) -> BacktestResult:
+    '''
+    Purpose:
+        Load the stored pivot tables of the tickers and backtest the rules on them.
+        Same as (load_universe) and (run_backtest) for the inputs.
+        Example: backtest([('SPY', SYMBOL_STORE_DIR)], 'monthly', window=10)
+    '''
+
+    universe = load_universe(ticker_dirs, key, source, [rule.metric for rule in rules], window)
+    return run_backtest(universe, rules, min_years, keep_equity)
+
+
+# ----------------------------------------------------------------------
+# Verification.
+# ----------------------------------------------------------------------
+
+def reference_backtest(universe:Universe, rule:Rule, threshold:float, ticker_idx:int,
+                       min_years:int=BACKTEST_MIN_YEARS) -> Dict[Text, float]:
+    '''
+    Purpose:
+        Backtest a single rule, threshold and ticker with a plain loop over the years
+        and periods. Used to check (run_backtest).
+    '''
+
+    sign, strict = RULE_OPS[rule.op]
+    metric_idx, n_years_idx = universe.metrics.index(rule.metric), universe.metrics.index('n_years')
+    equity, peak, max_drawdown = 1.0, 1.0, 0.0
+    n_trades, wins, total = 0, 0, 0.0
+
+    for year_idx in range(len(universe.years)):
+        for period_idx in range(len(universe.periods)):
+            ret = universe.returns[ticker_idx, period_idx, year_idx]
+            value = universe.stats[ticker_idx, period_idx, year_idx, metric_idx]
+            n_years = universe.stats[ticker_idx, period_idx, year_idx, n_years_idx]
+            if np.isnan(ret) or np.isnan(value) or n_years < min_years:
+                continue
+            if not (sign * value > sign * threshold if strict else sign * value >= sign * threshold):
+                continue
+
+            trade = rule.side * ret
+            n_trades += 1
+            wins += trade > 0
+            total += trade
+            equity *= 1 + trade
+            peak = max(peak, equity)
+            max_drawdown = max(max_drawdown, 1 - equity / peak)
+
+    return {
+        'n_trades': n_trades,
+        'hit_rate': wins / n_trades if n_trades else np.nan,
+        'avg_return': total / n_trades if n_trades else np.nan,
+        'total_return': equity - 1,
+        'max_drawdown': max_drawdown,
+    }
+
+
+def verify_backtest(universe:Universe, rules:List[Rule]=DEFAULT_RULES, min_years:int=BACKTEST_MIN_YEARS,
+                    n_verify:int=3) -> bool:
+    '''
+    Purpose:
+        Check the summary of (run_backtest) against (reference_backtest) for the
+        first (n_verify) tickers of the universe.
+
+    Return :
+        True if every checked row matches. Raises AssertionError otherwise.
+    '''
+
+    logger.info('Start running (verify_backtest) function.')
+
+    summary = run_backtest(universe, rules, min_years).summary.set_index(['rule', 'threshold', 'ticker'])
+    for rule in rules:
+        for threshold in rule.thresholds:
+            for ticker_idx in range(min(n_verify, len(universe.tickers))):
+                expected = reference_backtest(universe, rule, threshold, ticker_idx, min_years)
+                row = summary.loc[(rule.name, threshold, universe.tickers[ticker_idx])]
+                np.testing.assert_allclose(row[list(expected)].to_numpy(dtype=np.float64), list(expected.values()),
+                                           rtol=1e-9, atol=1e-12)
+    return True
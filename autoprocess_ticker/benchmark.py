@@ -0,0 +1,1030 @@
+
+
+import os, io, gc, logging, pickle, shutil, socket, subprocess, tempfile, threading, time, tracemalloc
+import multiprocessing as mp
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Text, Tuple
+import luigi
+from luigi.task import flatten
+import numpy as np
+import pandas as pd
+
+# Personal modules.
+from config.config import (
+    LOG_PROCESSING_FILEPATH, YAHOO_VERSION, FREQ_KEYS, FREQ_COLS, START_YR_RANGE, END_YR, PERIOD_KEYS, MEMORY_BUDGETS_MB
+)
+from config.config_logger import setup_logger
+from autoprocess_ticker import (
+    local_download_server, preprocessing, panel, stream_executor, shared_frames, ticker_stages, walk_forward, backtest,
+    significance, intraday, periods, incremental, memory_budget, export_scheduler, equivalence
+)
+from luigi_pipeline import CompileToExcel, ProcessTickerData
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# ----------------------------------------------------------------------
+# Helpers.
+# ----------------------------------------------------------------------
+
+def synthetic_tickers(n_tickers:int) -> List[Text]:
+    return [f'T{i:04d}' for i in range(n_tickers)]
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def synthetic_raw_data(ticker:Text, start_yr:int) -> Dict[Text, pd.DataFrame]:
+    '''
+    Purpose:
+        Generate the raw dataframes of a ticker as (ProcessTickerData) reads them,
+        without going through the download server.
+    '''
+
+    start_dates = {'1mo': datetime(start_yr - 1, 11, 30), '1wk': datetime(start_yr - 1, 12, 28), '1d': datetime(start_yr - 1, 12, 23)}
+    end_date = int(datetime.timestamp(datetime(END_YR + 1, 1, 6)))
+
+    df_raw = {}
+    for freq, ticker_freq in zip(FREQ_KEYS, ['1mo', '1wk', '1d', '1d']):
+        content = local_download_server.generate_ticker_csv(ticker, int(datetime.timestamp(start_dates[ticker_freq])),
+                                                            end_date, ticker_freq)
+        df_raw[freq] = pd.read_csv(io.BytesIO(content), parse_dates=['Date'])
+    return df_raw
+
+
+def start_central_scheduler(port:int, state_dir:Text, timeout:float=30.0) -> subprocess.Popen:
+    '''
+    Purpose:
+        Start a local 'luigid' and wait until it accepts connections.
+
+    Input  :
+        port     : Int. Port for the scheduler.
+        state_dir: Str. Folder for the scheduler state and logs.
+        timeout  : Float. Seconds to wait for the scheduler to start.
+
+    Return :
+        The scheduler process. Terminate it once the benchmark is done.
+    '''
+
+    os.makedirs(state_dir, exist_ok=True)
+    process = subprocess.Popen([
+        'luigid', '--port', str(port), '--logdir', state_dir,
+        '--state-path', os.path.join(state_dir, 'luigi-state.pickle')
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('localhost', port), timeout=1):
+                return process
+        except OSError:
+            time.sleep(0.2)
+
+    process.terminate()
+    raise RuntimeError(f'The central scheduler did not start on port ({port}) within ({timeout}) seconds.')
+
+
+# ----------------------------------------------------------------------
+# Multi-Process Worker Scaling.
+# ----------------------------------------------------------------------
+
+def run_central_worker(jobs:List[Tuple[Text, int, Text]], scheduler_port:int) -> bool:
+    '''
+    Purpose:
+        Run a single-process Luigi worker against the central scheduler. Every
+        worker submits the same jobs and pulls whatever is pending from the queue.
+    '''
+
+    tasks = [CompileToExcel(ticker, start_yr, etf_dir, YAHOO_VERSION) for ticker, start_yr, etf_dir in jobs]
+    return luigi.build(tasks, workers=1, scheduler_host='localhost', scheduler_port=scheduler_port,
+                       log_level='WARNING')
+
+
+def bench_worker_scaling(
+        n_tickers:int,
+        worker_counts:List[int],
+        start_yr:int=1999,
+        latency:float=0.0,
+        dataset_root:Text=None,
+    ) -> List[Dict]:
+
+    '''
+    Purpose:
+        Measure the throughput of the pipeline when several worker processes share a
+        local central scheduler and a dataset root. The downloads are served by the
+        stand-in download server, so the network is not involved.
+
+    Input  :
+        n_tickers    : Int. Number of synthetic tickers to process per run.
+        worker_counts: List. Number of worker processes for each run. Example: [1, 2, 4]
+        start_yr     : Int. Starting year for every ticker.
+        latency      : Float. Seconds of simulated network latency per download.
+        dataset_root : Str. Shared dataset root. A temporary folder is used if not given.
+
+    Return :
+        List of result dictionaries, one per worker count.
+    '''
+
+    logger.info('Start running (bench_worker_scaling) function.')
+
+    dataset_root = dataset_root or tempfile.mkdtemp(prefix='bench_workers_')
+    server, host = local_download_server.start_server(latency=latency)
+    scheduler_port = get_free_port()
+    scheduler = start_central_scheduler(scheduler_port, os.path.join(dataset_root, 'luigid'))
+
+    # The spawned workers read the download host from the config on import.
+    os.environ['YAHOO_DOWNLOAD_HOST'] = host
+    ctx = mp.get_context('spawn')
+    results = []
+
+    try:
+        for n_workers in worker_counts:
+            etf_dir = os.path.join(dataset_root, f'workers_{n_workers}')
+            shutil.rmtree(etf_dir, ignore_errors=True)
+            jobs = [(ticker, start_yr, etf_dir) for ticker in synthetic_tickers(n_tickers)]
+
+            start_time = time.perf_counter()
+            processes = [ctx.Process(target=run_central_worker, args=(jobs, scheduler_port)) for _ in range(n_workers)]
+            for process in processes: process.start()
+            for process in processes: process.join()
+            elapsed = time.perf_counter() - start_time
+
+            completed = sum(os.path.exists(f'{etf_dir}/{ticker}/{ticker}_seasonal_stats.xlsx') for ticker, _, _ in jobs)
+            results.append({
+                'workers': n_workers,
+                'tickers': n_tickers,
+                'completed': completed,
+                'seconds': round(elapsed, 2),
+                'tickers_per_min': round(completed / elapsed * 60, 2),
+            })
+            logger.debug(f'----- Benchmarked ({n_workers}) worker(s) -- {results[-1]}')
+    finally:
+        scheduler.terminate()
+        scheduler.wait()
+        server.shutdown()
+
+    # Express the throughput relative to the first run.
+    for result in results:
+        # No ticker finishes in the first run when every download fails. 
+        result['speedup'] = round(result['tickers_per_min'] / results[0]['tickers_per_min'], 2) \
+            if results[0]['tickers_per_min'] else None
+    return results
+
+
+# ----------------------------------------------------------------------
+# Streaming Executor.
+# ----------------------------------------------------------------------
+
+def run_engine(engine:Text, jobs:List[Tuple[Text, int, Text]], workers:int, result_queue:mp.Queue):
+    '''
+    Purpose:
+        Run the jobs with Luigi ('luigi') or the streaming executor ('stream') in a
+        spawned process and put the seconds taken into (result_queue).
+    '''
+
+    tasks = [CompileToExcel(ticker, start_yr, etf_dir, YAHOO_VERSION) for ticker, start_yr, etf_dir in jobs]
+    start_time = time.perf_counter()
+    if engine == 'luigi':
+        luigi.build(tasks, workers=workers, local_scheduler=True, log_level='WARNING')
+    else:
+        stream_executor.run_streaming(tasks, workers)
+    result_queue.put(time.perf_counter() - start_time)
+
+
+def bench_streaming(
+        n_tickers:int,
+        workers:int,
+        start_yr:int=1999,
+        latency:float=0.2,
+        dataset_root:Text=None,
+    ) -> List[Dict]:
+
+    '''
+    Purpose:
+        Compare the end-to-end throughput of Luigi and the streaming executor with the
+        same number of worker processes. The downloads are served by the stand-in
+        download server with a simulated latency.
+
+    Input  :
+        n_tickers   : Int. Number of synthetic tickers to process per engine.
+        workers     : Int. Number of worker processes for both engines.
+        start_yr    : Int. Starting year for every ticker.
+        latency     : Float. Seconds of simulated network latency per download.
+        dataset_root: Str. Dataset root for the outputs, the run manifest and the raw
+                      archive. A temporary folder is used if not given.
+
+    Return :
+        List of result dictionaries, one per engine.
+    '''
+
+    logger.info('Start running (bench_streaming) function.')
+
+    dataset_root = dataset_root or tempfile.mkdtemp(prefix='bench_stream_')
+    os.makedirs(dataset_root, exist_ok=True)
+    server, host = local_download_server.start_server(latency=latency)
+
+    # The spawned processes read these from the config on import. Keep the manifest, the 
+    # stage cache and the raw archive of the benchmark apart from the real dataset.
+    os.environ.update({
+        'YAHOO_DOWNLOAD_HOST': host,
+        'RUN_MANIFEST_PATH': os.path.join(dataset_root, 'run_manifest.sqlite'),
+        'STAGE_CACHE_DIR': os.path.join(dataset_root, '.stage_cache'),
+        'RAW_ARCHIVE_DIR': os.path.join(dataset_root, 'raw_archive'),
+    })
+    ctx = mp.get_context('spawn')
+    results = []
+
+    try:
+        for engine in ['luigi', 'stream']:
+            # A new folder for every run, so no task is complete in the manifest yet.
+            etf_dir = tempfile.mkdtemp(prefix=f'{engine}_', dir=dataset_root)
+            jobs = [(ticker, start_yr, etf_dir) for ticker in synthetic_tickers(n_tickers)]
+
+            result_queue = ctx.Queue()
+            process = ctx.Process(target=run_engine, args=(engine, jobs, workers, result_queue))
+            process.start()
+            elapsed = result_queue.get()
+            process.join()
+
+            completed = sum(os.path.exists(f'{etf_dir}/{ticker}/{ticker}_seasonal_stats.xlsx') for ticker, _, _ in jobs)
+            results.append({
+                'engine': engine,
+                'workers': workers,
+                'tickers': n_tickers,
+                'completed': completed,
+                'seconds': round(elapsed, 2),
+                'tickers_per_min': round(completed / elapsed * 60, 2),
+            })
+            logger.debug(f'----- Benchmarked ({engine}) -- {results[-1]}')
+    finally:
+        server.shutdown()
+
+    for result in results:
+        # No ticker finishes in the first run when every download fails. 
+        result['speedup'] = round(result['tickers_per_min'] / results[0]['tickers_per_min'], 2) \
+            if results[0]['tickers_per_min'] else None
+    return results
+
+
+def run_budgeted(jobs:List[Tuple[Text, int, Text]], workers:int, budget_mb:int, result_queue:mp.Queue):
+    # Same as (run_engine) for the streaming executor under a memory budget.
+    tasks = [CompileToExcel(ticker, start_yr, etf_dir, YAHOO_VERSION) for ticker, start_yr, etf_dir in jobs]
+    start_time = time.perf_counter()
+    results = stream_executor.run_streaming(tasks, workers, budget_mb=budget_mb)
+    result_queue.put((time.perf_counter() - start_time, sum(bool(result.get('spilled')) for result in results)))
+
+
+def bench_memory_budget(
+        n_tickers:int,
+        workers:int,
+        budgets_mb:List[int],
+        start_yrs:Tuple[int, ...]=(2012, 1999, 1990),
+        dataset_root:Text=None,
+    ) -> List[Dict]:
+
+    '''
+    Purpose:
+        Measure the throughput and the peak resident memory of the streaming executor
+        under each memory budget. The tickers cycle through (start_yrs), so short and
+        long histories are mixed. The resident memory of the executor and its workers
+        is sampled while the run goes on.
+
+    Input  :
+        n_tickers   : Int. Number of synthetic tickers per budget.
+        workers     : Int. Number of worker processes.
+        budgets_mb  : List. Budgets in MB. 0 runs without a budget.
+        start_yrs   : Tuple. Starting years of the tickers.
+        dataset_root: Str. Dataset root for the outputs. A temporary folder is used if not given.
+
+    Return :
+        List of result dictionaries, one per budget.
+    '''
+
+    logger.info('Start running (bench_memory_budget) function.')
+
+    dataset_root = dataset_root or tempfile.mkdtemp(prefix='bench_budget_')
+    os.makedirs(dataset_root, exist_ok=True)
+    server, host = local_download_server.start_server(latency=0.0)
+    os.environ.update({
+        'YAHOO_DOWNLOAD_HOST': host,
+        'RUN_MANIFEST_PATH': os.path.join(dataset_root, 'run_manifest.sqlite'),
+        'STAGE_CACHE_DIR': os.path.join(dataset_root, '.stage_cache'),
+        'RAW_ARCHIVE_DIR': os.path.join(dataset_root, 'raw_archive'),
+    })
+    ctx = mp.get_context('spawn')
+    results = []
+
+    try:
+        for budget_mb in budgets_mb:
+            etf_dir = tempfile.mkdtemp(prefix=f'budget_{budget_mb}_', dir=dataset_root)
+            jobs = [(ticker, start_yrs[i % len(start_yrs)], etf_dir) for i, ticker in enumerate(synthetic_tickers(n_tickers))]
+
+            result_queue = ctx.Queue()
+            process = ctx.Process(target=run_budgeted, args=(jobs, workers, budget_mb, result_queue))
+            process.start()
+
+            # Sample the resident memory of the executor and its workers until the result is sent.
+            samples = []
+            def sample():
+                while process.is_alive() and result_queue.empty():
+                    samples.append(memory_budget.read_tree_rss(process.pid) or 0)
+                    time.sleep(0.05)
+            sampler = threading.Thread(target=sample, daemon=True)
+            sampler.start()
+            elapsed, n_spilled = result_queue.get()
+            process.join()
+            sampler.join()
+
+            completed = sum(os.path.exists(f'{etf_dir}/{ticker}/{ticker}_seasonal_stats.xlsx') for ticker, _, _ in jobs)
+            results.append({
+                'budget_mb': budget_mb or 'none',
+                'workers': workers,
+                'tickers': n_tickers,
+                'completed': completed,
+                'spilled': n_spilled,
+                'peak_rss_mb': round(max(samples, default=0) / 1024 ** 2, 1),
+                'seconds': round(elapsed, 2),
+                'tickers_per_min': round(completed / elapsed * 60, 2),
+            })
+            logger.debug(f'----- Benchmarked the memory budget -- {results[-1]}')
+    finally:
+        server.shutdown()
+    return results
+
+
+# ----------------------------------------------------------------------
+# Export Scheduler.
+# ----------------------------------------------------------------------
+
+def run_exported(jobs:List[Tuple[Text, int, Text]], workers:int, order:Text, result_queue:mp.Queue):
+    # Run the pivot stages with Luigi, then time the export scheduler alone.
+    tasks = [CompileToExcel(ticker, start_yr, etf_dir, YAHOO_VERSION) for ticker, start_yr, etf_dir in jobs]
+    luigi.build([dep for task in tasks for dep in flatten(task.requires())], workers=workers,
+                local_scheduler=True, log_level='WARNING')
+    start_time = time.perf_counter()
+    results = export_scheduler.run_export(tasks, workers, order)
+    result_queue.put((time.perf_counter() - start_time, results))
+
+
+def bench_export(
+        n_tickers:int,
+        workers:int,
+        start_yrs:Tuple[int, ...]=(2012, 2012, 2012, 2012, 2012, 1990),
+        dataset_root:Text=None,
+    ) -> List[Dict]:
+
+    '''
+    Purpose:
+        Compare the export phase when the workbooks are written in the given order and
+        the costliest first. The tickers cycle through (start_yrs), and the given order
+        puts the longest histories last, like a config that lists SPY at the end.
+
+    Input  :
+        n_tickers   : Int. Number of synthetic tickers per order.
+        workers     : Int. Number of worker processes of the export scheduler.
+        start_yrs   : Tuple. Starting years of the tickers.
+        dataset_root: Str. Dataset root for the outputs. A temporary folder is used if not given.
+
+    Return :
+        List of result dictionaries, one per order.
+    '''
+
+    logger.info('Start running (bench_export) function.')
+
+    dataset_root = dataset_root or tempfile.mkdtemp(prefix='bench_export_')
+    os.makedirs(dataset_root, exist_ok=True)
+    server, host = local_download_server.start_server(latency=0.0)
+    os.environ.update({
+        'YAHOO_DOWNLOAD_HOST': host,
+        'RUN_MANIFEST_PATH': os.path.join(dataset_root, 'run_manifest.sqlite'),
+        'STAGE_CACHE_DIR': os.path.join(dataset_root, '.stage_cache'),
+        'RAW_ARCHIVE_DIR': os.path.join(dataset_root, 'raw_archive'),
+    })
+    ctx = mp.get_context('spawn')
+    results = []
+
+    try:
+        for order in ['given', 'cost']:
+            etf_dir = tempfile.mkdtemp(prefix=f'export_{order}_', dir=dataset_root)
+            jobs = sorted([(ticker, start_yrs[i % len(start_yrs)], etf_dir) for i, ticker in enumerate(synthetic_tickers(n_tickers))],
+                          key=lambda job: -job[1])
+
+            result_queue = ctx.Queue()
+            process = ctx.Process(target=run_exported, args=(jobs, workers, order, result_queue))
+            process.start()
+            elapsed, workbooks = result_queue.get()
+            process.join()
+
+            seconds = [workbook['seconds'] for workbook in workbooks if workbook['status'] == 'done']
+            results.append({
+                'order': order,
+                'workers': workers,
+                'tickers': n_tickers,
+                'completed': len(seconds),
+                'seconds': round(elapsed, 2),
+                'slowest_workbook': max(seconds, default=0),
+                'last_finished': workbooks[-1].get('finished'),
+                'busy': round(sum(seconds) / (min(workers, n_tickers) * elapsed), 2),
+            })
+            logger.debug(f'----- Benchmarked the export order ({order}) -- {results[-1]}')
+    finally:
+        server.shutdown()
+
+    for result in results:
+        result['speedup'] = round(results[0]['seconds'] / result['seconds'], 2)
+    return results
+
+
+# ----------------------------------------------------------------------
+# Preprocessing Engines.
+# ----------------------------------------------------------------------
+
+def load_recorded(ticker:Text, start_yr:int, etf_dir:Text) -> Dict[Text, pd.DataFrame]:
+    # Preprocessed frames of a ticker that (ProcessTickerData) stored in an earlier run.
+    with ProcessTickerData(ticker, start_yr, etf_dir, YAHOO_VERSION).output().open('r') as in_file:
+        return pickle.load(in_file)
+
+
+def bench_engines(start_yrs:List[int], recorded:Optional[List[Tuple[Text, int, Text]]]=None, engine:Text='fast',
+                  repeats:int=3) -> List[Dict]:
+    '''
+    Purpose:
+        Check the outputs of a preprocessing engine against the legacy engine with
+        'equivalence.verify_engines', and time both, on synthetic and recorded tickers.
+
+    Input  :
+        start_yrs: List of the starting years of the synthetic tickers, one ticker each.
+        recorded : List of (ticker, start_yr, etf_dir) of the tickers already processed.
+        engine   : Str. Engine to check against 'legacy'.
+        repeats  : Int. Runs of each stage. The fastest is kept.
+
+    Return :
+        List of result dictionaries, one per stage of each ticker, and a total per ticker.
+        The (status) is 'mismatch' if any frame differs beyond the tolerance.
+    '''
+
+    logger.info('Start running (bench_engines) function.')
+
+    datasets = []
+    for ticker, start_yr in zip(synthetic_tickers(len(start_yrs)), start_yrs):
+        df_ticker = synthetic_raw_data(ticker, start_yr)
+        preprocessing.init_preprocess(df_ticker, FREQ_KEYS, FREQ_COLS)
+        datasets.append((f'{ticker} ({start_yr})', df_ticker, start_yr))
+    for ticker, start_yr, etf_dir in recorded or []:
+        datasets.append((f'{ticker} ({start_yr}) recorded', load_recorded(ticker, start_yr, etf_dir), start_yr))
+
+    results = []
+    for name, df_ticker, start_yr in datasets:
+        stages = equivalence.verify_engines(df_ticker, start_yr, engine, repeats=repeats)
+        total = {
+            'stage': 'total', 'frames': sum(stage['frames'] for stage in stages),
+            'mismatches': sum(stage['mismatches'] for stage in stages),
+            'max_abs_diff': max(stage['max_abs_diff'] for stage in stages),
+            'legacy_ms': round(sum(stage['legacy_ms'] for stage in stages), 1),
+            f'{engine}_ms': round(sum(stage[f'{engine}_ms'] for stage in stages), 1),
+        }
+        total['speedup'] = round(total['legacy_ms'] / total[f'{engine}_ms'], 2)
+        total['status'] = 'mismatch' if total['mismatches'] else 'ok'
+        total['detail'] = ''
+        results += [{'dataset': name, **stage} for stage in stages + [total]]
+        logger.debug(f'----- Compared the engines on ({name}) -- {total}')
+    return results
+
+
+# ----------------------------------------------------------------------
+# Panel Preprocessing.
+# ----------------------------------------------------------------------
+
+def bench_panel(n_tickers:int, start_yr:int=1999, n_verify:int=5) -> List[Dict]:
+    '''
+    Purpose:
+        Compare the per-ticker preprocessing and summary with the panel engine on
+        the same synthetic tickers.
+
+    Input  :
+        n_tickers: Int. Number of synthetic tickers.
+        start_yr : Int. Starting year for every ticker.
+        n_verify : Int. Number of tickers to check for identical outputs first.
+
+    Return :
+        List of result dictionaries, one per engine.
+    '''
+
+    logger.info('Start running (bench_panel) function.')
+
+    df_tickers = {ticker: synthetic_raw_data(ticker, start_yr) for ticker in synthetic_tickers(n_tickers)}
+    start_yr_range = [start_yr] + START_YR_RANGE[1:]
+    panel.verify_panel(dict(list(df_tickers.items())[:n_verify]), FREQ_KEYS, FREQ_COLS, start_yr_range, END_YR)
+
+    start_time = time.perf_counter()
+    for df_raw in df_tickers.values():
+        df_ticker = {freq: df_raw[freq].copy() for freq in FREQ_KEYS}
+        preprocessing.init_preprocess(df_ticker, FREQ_KEYS, FREQ_COLS)
+        pivot_dict, pivot_dict_stats = {}, {}
+        preprocessing.create_pivot(df_ticker, pivot_dict, FREQ_KEYS, FREQ_COLS, pivot_value='price_diff')
+        preprocessing.summarise_pivot(pivot_dict, pivot_dict_stats, FREQ_KEYS, start_yr_range, END_YR)
+    per_ticker_elapsed = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    df_panel = panel.load_panel(df_tickers, FREQ_KEYS)
+    panel.init_preprocess_panel(df_panel, FREQ_KEYS, FREQ_COLS)
+    panel.split_panel(df_panel, FREQ_KEYS)
+    panel.summarise_panel(df_panel, FREQ_KEYS, FREQ_COLS, start_yr_range, END_YR)
+    panel_elapsed = time.perf_counter() - start_time
+
+    return [
+        {'engine': engine, 'tickers': n_tickers, 'seconds': round(elapsed, 2),
+         'speedup': round(per_ticker_elapsed / elapsed, 2)}
+        for engine, elapsed in [('per_ticker', per_ticker_elapsed), ('panel', panel_elapsed)]
+    ]
+
+
+# ----------------------------------------------------------------------
+# Shared-Memory Transport.
+# ----------------------------------------------------------------------
+
+def count_rows(df_ticker:Dict[Text, pd.DataFrame], start_yr:int) -> int:
+    # Stand-in stage that only receives the frames, to time the transport alone.
+    return sum(len(df) for df in df_ticker.values())
+
+
+def bench_shared_frames(universe_sizes:List[int], workers:int=4, start_yr:int=1999, n_distinct:int=2) -> List[Dict]:
+    '''
+    Purpose:
+        Compare sending the traced frames of each ticker to the process pool as a
+        pickle with placing them in shared memory once per ticker. Each transport is
+        timed with a stand-in stage that only receives the frames ('transfer'), and
+        with the three summary stages ('summarise').
+
+    Input  :
+        universe_sizes: List. Number of tickers per run. Example: [8, 32, 128]
+        workers       : Int. Number of worker processes.
+        start_yr      : Int. Starting year for every ticker.
+        n_distinct    : Int. Number of synthetic tickers to preprocess. The universe
+                        repeats them, since only the transport is compared.
+
+    Return :
+        List of result dictionaries, one per universe size and transport.
+    '''
+
+    logger.info('Start running (bench_shared_frames) function.')
+
+    prepared = []
+    for ticker in synthetic_tickers(n_distinct):
+        df_ticker = synthetic_raw_data(ticker, start_yr)
+        preprocessing.init_preprocess(df_ticker, FREQ_KEYS, FREQ_COLS)
+        prepared.append(ticker_stages.trace_unique_period(df_ticker, start_yr))
+    ticker_mb = len(pickle.dumps(prepared[0], protocol=5)) / 1024 ** 2
+
+    results = []
+    with ProcessPoolExecutor(workers, mp_context=mp.get_context('spawn')) as pool:
+        # Start the workers and check both transports give the same summaries.
+        list(pool.map(count_rows, [prepared[0]] * workers, [start_yr] * workers))
+        expected = {name: pool.submit(stage, prepared[0], start_yr).result() for name, stage in ticker_stages.SUMMARY_STAGES.items()}
+        actual = ticker_stages.summarise_shared(pool, prepared[0], start_yr)
+        for name in expected:
+            if pickle.dumps(expected[name]) != pickle.dumps(actual[name]):
+                raise AssertionError(f'The ({name}) summary differs between the transports.')
+
+        for n_tickers in universe_sizes:
+            universe = [prepared[i % n_distinct] for i in range(n_tickers)]
+            for transport in ['pickle', 'shared']:
+                result = {'tickers': n_tickers, 'transport': transport, 'ticker_mb': round(ticker_mb, 2)}
+
+                for mode, stages in [('transfer', [count_rows]), ('summarise', list(ticker_stages.SUMMARY_STAGES.values()))]:
+                    start_time = time.perf_counter()
+                    if transport == 'pickle':
+                        futures = [pool.submit(stage, df_ticker, start_yr) for df_ticker in universe for stage in stages]
+                        for future in futures: future.result()
+                    else:
+                        handles = [shared_frames.share_frames(df_ticker) for df_ticker in universe]
+                        futures = [
+                            pool.submit(shared_frames.run_attached, stage, handle, start_yr)
+                            for handle in handles for stage in stages
+                        ]
+                        for future in futures: future.result()
+                        for handle in handles: shared_frames.release_frames(handle)
+                    result[f'{mode}_seconds'] = round(time.perf_counter() - start_time, 2)
+
+                results.append(result)
+                logger.debug(f'----- Benchmarked ({transport}) transport -- {result}')
+
+    # Express the time relative to the pickle transport of the same universe size.
+    baseline = {result['tickers']: result for result in results if result['transport'] == 'pickle'}
+    for result in results:
+        for mode in ['transfer', 'summarise']:
+            result[f'{mode}_speedup'] = round(baseline[result['tickers']][f'{mode}_seconds'] / max(result[f'{mode}_seconds'], 0.01), 2)
+    return results
+
+
+
+# ----------------------------------------------------------------------
+# Walk-Forward Stats.
+# ----------------------------------------------------------------------
+
+def bench_walk_forward(windows:List[int], start_yr:int=1999) -> List[Dict]:
+    '''
+    Purpose:
+        Compare summarising the trailing years of every end year one at a time with
+        the walk-forward cube, on the pivot tables of a synthetic ticker. Every cube
+        is checked against the summaries first.
+
+    Input  :
+        windows : List of the number of trailing years. 0 for every earlier year.
+        start_yr: Int. Starting year of the ticker.
+
+    Return :
+        List of result dictionaries, one per window.
+    '''
+
+    logger.info('Start running (bench_walk_forward) function.')
+
+    df_ticker = synthetic_raw_data(synthetic_tickers(1)[0], start_yr)
+    preprocessing.init_preprocess(df_ticker, FREQ_KEYS, FREQ_COLS)
+    pivot_ticker = {}
+    preprocessing.create_pivot(df_ticker, pivot_ticker, FREQ_KEYS, FREQ_COLS, pivot_value='price_diff')
+    pivot_ticker = {freq: preprocessing.flatten_pivot(pivot) for freq, pivot in pivot_ticker.items()}
+
+    results = []
+    for window in windows:
+        start_time = time.perf_counter()
+        cubes = walk_forward.walk_forward_pivots(pivot_ticker, FREQ_KEYS, window or None)
+        cube_elapsed = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        n_tables = sum(walk_forward.verify_cube(pivot_ticker[freq], freq, cubes[freq]) for freq in FREQ_KEYS)
+        per_year_elapsed = time.perf_counter() - start_time
+
+        results.append({'window': window or 'max_yr', 'tables': n_tables, 'per_year_seconds': round(per_year_elapsed, 2),
+                        'cube_seconds': round(cube_elapsed, 3), 'speedup': round(per_year_elapsed / cube_elapsed, 1)})
+    return results
+
+
+
+# ----------------------------------------------------------------------
+# Seasonal Backtest.
+# ----------------------------------------------------------------------
+
+def bench_backtest(n_tickers:int, freq:Text='daily_by_trdr_day', window:int=10, start_yr:int=1999,
+                   n_verify:int=2) -> List[Dict]:
+    '''
+    Purpose:
+        Time a sweep of the default rules over a universe of synthetic tickers, and
+        compare it with the plain loop of (backtest.reference_backtest) on a few of
+        the tickers, scaled up to the whole universe.
+
+    Input  :
+        n_tickers: Int. Number of synthetic tickers.
+        freq     : Str. Pivot key of the price pivot tables to backtest.
+        window   : Int. Number of trailing years of the stats.
+        start_yr : Int. Starting year for every ticker.
+        n_verify : Int. Number of tickers to check and to time the loop on.
+
+    Return :
+        List of result dictionaries, one per engine.
+    '''
+
+    logger.info('Start running (bench_backtest) function.')
+
+    df_tickers = {ticker: synthetic_raw_data(ticker, start_yr) for ticker in synthetic_tickers(n_tickers)}
+    df_panel = panel.load_panel(df_tickers, FREQ_KEYS)
+    panel.init_preprocess_panel(df_panel, FREQ_KEYS, FREQ_COLS)
+    cube = panel.create_cube(df_panel[freq], FREQ_COLS[FREQ_KEYS.index(freq)], 'price_diff')
+    pivots = {ticker: preprocessing.flatten_pivot(cube.ticker_pivot(idx)) for idx, ticker in enumerate(cube.symbols)}
+
+    rules = backtest.DEFAULT_RULES
+    start_time = time.perf_counter()
+    universe = backtest.build_universe(pivots, [rule.metric for rule in rules], window)
+    summary = backtest.run_backtest(universe, rules).summary
+    sweep_elapsed = time.perf_counter() - start_time
+
+    backtest.verify_backtest(universe, rules, n_verify=n_verify)
+    start_time = time.perf_counter()
+    for rule in rules:
+        for threshold in rule.thresholds:
+            for ticker_idx in range(n_verify):
+                backtest.reference_backtest(universe, rule, threshold, ticker_idx)
+    loop_elapsed = (time.perf_counter() - start_time) * n_tickers / n_verify
+
+    return [
+        {'engine': engine, 'tickers': n_tickers, 'freq': freq, 'runs': len(summary), 'seconds': round(elapsed, 2),
+         'speedup': round(loop_elapsed / elapsed, 1)}
+        for engine, elapsed in [('loop_estimate', loop_elapsed), ('vectorized', sweep_elapsed)]
+    ]
+
+
+# ----------------------------------------------------------------------
+# Significance.
+# ----------------------------------------------------------------------
+
+def bench_significance(n_tickers:int, freq:Text='monthly', n_resamples:int=2000, start_yr:int=1999,
+                       n_verify:int=2) -> List[Dict]:
+    '''
+    Purpose:
+        Time the significance tables of a universe of synthetic tickers, tested one
+        ticker at a time like (PivotSignificance) and in batches, after checking them
+        with (significance.verify_significance) on a few of the tickers.
+
+    Input  :
+        n_tickers  : Int. Number of synthetic tickers.
+        freq       : Str. Pivot key of the price pivot tables to test.
+        n_resamples: Int. Number of bootstrap resamples and of shuffles per cell.
+        start_yr   : Int. Starting year for every ticker.
+        n_verify   : Int. Number of tickers to check.
+
+    Return :
+        List of result dictionaries, one per mode.
+    '''
+
+    logger.info('Start running (bench_significance) function.')
+
+    df_tickers = {ticker: synthetic_raw_data(ticker, start_yr) for ticker in synthetic_tickers(n_tickers)}
+    df_panel = panel.load_panel(df_tickers, FREQ_KEYS)
+    panel.init_preprocess_panel(df_panel, FREQ_KEYS, FREQ_COLS)
+    cube = panel.create_cube(df_panel[freq], FREQ_COLS[FREQ_KEYS.index(freq)], 'price_diff')
+    pivots = {ticker: preprocessing.flatten_pivot(cube.ticker_pivot(idx)) for idx, ticker in enumerate(cube.symbols)}
+    significance.verify_significance(dict(list(pivots.items())[:n_verify]), freq, start_yr)
+
+    windows = significance.get_windows(start_yr)
+    results = []
+    for mode in ['per_ticker', 'batched']:
+        start_time = time.perf_counter()
+        if mode == 'per_ticker':
+            for ticker, pivot in pivots.items():
+                significance.test_pivots({ticker: pivot}, freq, windows, n_resamples=n_resamples)
+        else:
+            significance.test_pivots(pivots, freq, windows, n_resamples=n_resamples)
+        elapsed = time.perf_counter() - start_time
+        cells = sum(len(pivot) for pivot in pivots.values()) * len(windows)
+        results.append({'mode': mode, 'tickers': n_tickers, 'freq': freq, 'resamples': n_resamples,
+                        'seconds': round(elapsed, 2), 'cells_per_second': int(cells / elapsed)})
+    return results
+
+
+# ----------------------------------------------------------------------
+# Intraday Ingestion.
+# ----------------------------------------------------------------------
+
+def write_intraday_csv(path:Text, ticker:Text, start_yr:int, n_years:int, interval:Text) -> int:
+    # Write the synthetic bars of the stand-in server chunk by chunk, and return the file size.
+    period1 = int(datetime.timestamp(datetime(start_yr, 1, 1)))
+    period2 = int(datetime.timestamp(datetime(start_yr + n_years, 1, 1)))
+    with open(path, 'wb') as out_file:
+        for chunk in local_download_server.iter_intraday_csv(ticker, period1, period2, interval):
+            out_file.write(chunk)
+    return os.path.getsize(path)
+
+
+def bench_intraday(years_list:List[int], interval:Text='5m', chunk_rows:int=50000, start_yr:int=2010) -> List[Dict]:
+    '''
+    Purpose:
+        Compare the peak memory and the time of the intraday pivot tables made by
+        reading the whole CSV into one frame, with the chunked aggregation of
+        (intraday.aggregate_intraday). The chunked peak should stay flat as the
+        history grows. The aggregation is checked with (intraday.verify_intraday)
+        on the shortest history first.
+
+    Input  :
+        years_list: List of the number of years of bars. Example: [1, 4, 16]
+        interval  : Str. Yahoo interval of the bars. Example: '5m' / '60m'
+        chunk_rows: Int. Number of rows per chunk.
+        start_yr  : Int. First year of the bars.
+
+    Return :
+        List of result dictionaries, one per history length and mode.
+    '''
+
+    logger.info('Start running (bench_intraday) function.')
+
+    ticker = synthetic_tickers(1)[0]
+    keys = intraday.get_intraday_keys(interval)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = f'{tmp_dir}/{ticker}_{interval}.csv'
+        write_intraday_csv(path, ticker, start_yr, min(years_list), interval)
+        intraday.verify_intraday({interval: path}, chunk_rows=max(chunk_rows // 50, 1000))
+
+        for n_years in years_list:
+            file_mb = write_intraday_csv(path, ticker, start_yr, n_years, interval) / 1024 ** 2
+            for mode in ['whole_file', 'chunked']:
+                tracemalloc.start()
+                start_time = time.perf_counter()
+                if mode == 'whole_file':
+                    df, _ = intraday.init_preprocess_intraday(pd.read_csv(path))
+                    n_rows = len(df)
+                    for key in keys:
+                        for value in intraday.INTRADAY_VALUES:
+                            df.pivot_table(values=value, index=intraday.IntradayAggregator([key]).period_cols[key],
+                                           columns='year', aggfunc='mean')
+                    del df
+                else:
+                    n_rows = intraday.aggregate_intraday({interval: path}, chunk_rows).rows
+                elapsed = time.perf_counter() - start_time
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                results.append({'years': n_years, 'mode': mode, 'rows': n_rows, 'file_mb': round(file_mb, 1),
+                                'peak_mb': round(peak / 1024 ** 2, 1), 'seconds': round(elapsed, 2)})
+                logger.debug(f'----- Benchmarked ({mode}) intraday ingestion -- {results[-1]}')
+    return results
+
+
+# ----------------------------------------------------------------------
+# Custom Periods.
+# ----------------------------------------------------------------------
+
+def bench_periods(n_tickers:int, start_yr:int=1999) -> List[Dict]:
+    '''
+    Purpose:
+        Compare one 'pivot_table' and 'summarise_pivot' per custom period key with
+        the batched pass of (periods.pivot_period_summary), on the daily data of
+        synthetic tickers. The batched pass is checked with (periods.verify_periods)
+        on the first ticker.
+
+    Input  :
+        n_tickers: Int. Number of synthetic tickers.
+        start_yr : Int. Starting year for every ticker.
+
+    Return :
+        List of result dictionaries, one per mode.
+    '''
+
+    logger.info('Start running (bench_periods) function.')
+
+    df_dailies = []
+    for ticker in synthetic_tickers(n_tickers):
+        df_ticker = synthetic_raw_data(ticker, start_yr)
+        preprocessing.init_preprocess(df_ticker, FREQ_KEYS, FREQ_COLS)
+        df_dailies.append(df_ticker['daily_by_trdr_day'])
+    start_yr_range = [start_yr] + START_YR_RANGE[1:]
+    periods.verify_periods(df_dailies[0], PERIOD_KEYS, start_yr_range, END_YR)
+
+    results = []
+    for mode in ['per_key', 'batched']:
+        start_time = time.perf_counter()
+        for df_daily in df_dailies:
+            if mode == 'batched':
+                periods.pivot_period_summary(df_daily, PERIOD_KEYS, start_yr_range, END_YR)
+                continue
+            pivot_dict, pivot_dict_stats = {}, {}
+            for key in PERIOD_KEYS:
+                spec, cols = periods.PERIOD_SPECS[key], periods.get_period_cols(key)
+                df = df_daily.assign(**spec.codes(df_daily)).dropna(subset=cols)
+                aggfunc = (lambda values: np.prod(1 + values) - 1) if spec.compound else 'mean'
+                pivot_dict[key] = df.pivot_table(values='price_diff', index=cols, columns='year', aggfunc=aggfunc)
+            preprocessing.summarise_pivot(pivot_dict, pivot_dict_stats, PERIOD_KEYS, start_yr_range, END_YR)
+        elapsed = time.perf_counter() - start_time
+        results.append({'mode': mode, 'tickers': n_tickers, 'keys': len(PERIOD_KEYS), 'seconds': round(elapsed, 2)})
+
+    for result in results:
+        result['speedup'] = round(results[0]['seconds'] / max(result['seconds'], 0.01), 1)
+    return results
+
+
+# ----------------------------------------------------------------------
+# Incremental Stats.
+# ----------------------------------------------------------------------
+
+def bench_incremental(n_tickers:int, start_yr:int=1999) -> List[Dict]:
+    '''
+    Purpose:
+        Compare a full rebuild of the summary stages with an incremental update,
+        after the last daily bar of synthetic tickers is added. The states are built
+        before the timer starts, from the data without the last bar, and the update
+        is checked with (incremental.verify_incremental) on the first ticker.
+
+    Input  :
+        n_tickers: Int. Number of synthetic tickers.
+        start_yr : Int. Starting year for every ticker.
+
+    Return :
+        List of result dictionaries, one per mode.
+    '''
+
+    logger.info('Start running (bench_incremental) function.')
+
+    inputs, states = [], []
+    for ticker in synthetic_tickers(n_tickers):
+        df_raw = synthetic_raw_data(ticker, start_yr)
+        last_date = df_raw[FREQ_KEYS[2]]['Date'].max()
+        df_base = {freq: df[df['Date'] < last_date] for freq, df in df_raw.items()}
+        if not inputs:
+            incremental.verify_incremental(df_base, df_raw, start_yr)
+
+        # The preprocessing and the tracing are the same for both modes, so they are not timed.
+        states.append({})
+        incremental.run_stages(df_base, start_yr, states[-1])
+        df_ticker = {freq: df.copy() for freq, df in df_raw.items()}
+        preprocessing.init_preprocess(df_ticker, FREQ_KEYS, FREQ_COLS)
+        inputs.append({'ticker': df_ticker, 'vol': df_ticker, 'unique_days': ticker_stages.trace_unique_period(df_ticker, start_yr)})
+
+    full_stages = {
+        'ticker': ticker_stages.pivot_ticker_summary,
+        'vol': ticker_stages.pivot_vol_summary,
+        'unique_days': ticker_stages.pivot_unique_days_summary,
+    }
+    results = []
+    for mode in ['full', 'incremental']:
+        start_time = time.perf_counter()
+        for df_inputs, ticker_states in zip(inputs, states):
+            for stage, df in df_inputs.items():
+                if mode == 'full':
+                    full_stages[stage](df, start_yr)
+                else:
+                    incremental.INCREMENTAL_STAGES[stage](df, start_yr, ticker_states[stage])
+        elapsed = time.perf_counter() - start_time
+        results.append({'mode': mode, 'tickers': n_tickers, 'seconds': round(elapsed, 2)})
+
+    for result in results:
+        result['speedup'] = round(results[0]['seconds'] / max(result['seconds'], 0.01), 1)
+    return results
+
+
+# ----------------------------------------------------------------------
+# Memory Budgets.
+# ----------------------------------------------------------------------
+
+def trace_peak(func:Callable, *args) -> float:
+    # Peak of the allocations of one call in MB. The first call is not traced, so the caches are warm.
+    func(*args)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024 ** 2
+
+
+def bench_memory(start_yr:int=1999, budgets:Dict[Text, float]=MEMORY_BUDGETS_MB) -> List[Dict]:
+    '''
+    Purpose:
+        Measure the peak allocation of each preprocessing hot path on a synthetic
+        ticker with tracemalloc, and compare it with its budget.
+
+    Input  :
+        start_yr: Int. Starting year of the synthetic ticker. The budgets are set for 1999.
+        budgets : Dictionary of function name and its peak budget in MB.
+
+    Return :
+        List of result dictionaries, one per function. The (status) is 'over' for a regression.
+    '''
+
+    logger.info('Start running (bench_memory) function.')
+
+    df_ticker = synthetic_raw_data(synthetic_tickers(1)[0], start_yr)
+    preprocessing.init_preprocess(df_ticker, FREQ_KEYS, FREQ_COLS)
+    df_traced = ticker_stages.trace_unique_period(df_ticker, start_yr)
+    start_yr_range = [start_yr] + START_YR_RANGE[1:]
+
+    pivot_ticker, pivot_volume, pivot_volume_avg = {}, {}, {}
+    preprocessing.create_pivot(df_ticker, pivot_ticker, FREQ_KEYS, FREQ_COLS, pivot_value='price_diff')
+    preprocessing.create_pivot(df_ticker, pivot_volume, FREQ_KEYS, FREQ_COLS, pivot_value='volume')
+    preprocessing.compute_avg_vol(pivot_volume, pivot_volume_avg, FREQ_KEYS, [start_yr], END_YR)
+
+    funcs = {
+        'trace_unique_period': lambda: ticker_stages.trace_unique_period(df_ticker, start_yr),
+        'create_unique_days_pivots': lambda: ticker_stages.create_unique_days_pivots(df_traced, start_yr),
+        'summarise_pivot': lambda: preprocessing.summarise_pivot(pivot_ticker, {}, FREQ_KEYS, start_yr_range, END_YR),
+        'compute_avg_vol': lambda: preprocessing.compute_avg_vol(pivot_volume, {}, FREQ_KEYS, [start_yr], END_YR),
+        'summarise_pivot_vol': lambda: preprocessing.summarise_pivot_vol(pivot_volume, dict(pivot_volume_avg), FREQ_KEYS,
+                                                                         [start_yr], END_YR),
+        'pivot_ticker_summary': lambda: ticker_stages.pivot_ticker_summary(df_ticker, start_yr),
+        'pivot_vol_summary': lambda: ticker_stages.pivot_vol_summary(df_ticker, start_yr),
+        'pivot_unique_days_summary': lambda: ticker_stages.pivot_unique_days_summary(df_traced, start_yr),
+    }
+
+    results = []
+    for name, func in funcs.items():
+        peak = trace_peak(func)
+        budget = budgets.get(name)
+        status = 'no_budget' if budget is None else ('ok' if peak <= budget else 'over')
+        results.append({'function': name, 'peak_mb': round(peak, 2), 'budget_mb': budget, 'status': status})
+        logger.debug(f'----- Traced the peak allocation of ({name}) -- {results[-1]}')
+    return results
+
+
+def format_results(results:List[Dict]) -> Text:
+    '''
+    Purpose:
+        Format the benchmark results as a plain text table.
+    '''
+
+    if not results:
+        return ''
+    cols = list(results[0].keys())
+    widths = [max(len(str(col)), *(len(str(result[col])) for result in results)) for col in cols]
+    lines = ['  '.join(str(col).rjust(width) for col, width in zip(cols, widths))]
+    lines += ['  '.join(str(result[col]).rjust(width) for col, width in zip(cols, widths)) for result in results]
+    return '\n'.join(lines)
@@ -1,15 +1,21 @@
 
 
-import subprocess, os, logging
-from typing import Dict, List, Text
+import subprocess, os, logging, zlib, json
+from typing import Dict, List, Text, Tuple, Optional
+import luigi
+from luigi.task import flatten
 
 # Personal modules.
 from config.config import (
     ETF_SECTOR_DIR, ETF_EQUITY_DIR, LOG_PROCESSING_FILEPATH, 
     LOG_PIPELINE_SECTOR_DIR, LOG_PIPELINE_EQUITY_DIR, 
-    YAHOO_VERSION, LOCAL_SCHEDULER, WORKERS
+    YAHOO_VERSION, LOCAL_SCHEDULER, WORKERS, 
+    SCHEDULER_MODE, SCHEDULER_HOST, SCHEDULER_PORT, SHARD, 
+    USE_SYMBOL_STORE, SYMBOL_STORE_DIR, USE_STATS_STORE, MEMORY_BUDGET_MB, EXPORT_WORKERS
 )
 from config.config_logger import setup_logger
+from autoprocess_ticker import run_manifest, symbol_store, stats_store, stream_executor, export_scheduler, progress
+import luigi_pipeline
 
 
 # --------------------------------------------------------------
@@ -20,6 +26,183 @@ logger = logging.getLogger(__name__)
 logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH) 
 
 
+# --------------------------------------------------------------
+# Scheduler & Sharding.
+# --------------------------------------------------------------
+
+def get_scheduler_args(scheduler_mode:Text=SCHEDULER_MODE) -> List[Text]:
+    '''
+    Purpose : 
+        Build the Luigi CLI params for the scheduler. 
+
+    Input   :
+        scheduler_mode: Str. Must be 'local' or 'central'. 
+
+    Return  :
+        List of Luigi CLI params. 
+    '''
+
+    if scheduler_mode == 'central': 
+        return ['--scheduler-host', SCHEDULER_HOST, '--scheduler-port', SCHEDULER_PORT]
+    return [LOCAL_SCHEDULER]
+
+
+def parse_shard(shard:Text=SHARD) -> Tuple[int, int]:
+    '''
+    Purpose : 
+        Parse the shard config. Example: '1/3' returns (1, 3). 
+    '''
+
+    shard_idx, shard_count = map(int, shard.split('/'))
+    if not 0 <= shard_idx < shard_count: 
+        raise ValueError(f'Invalid shard ({shard}). The index must be within [0, count).')
+    return shard_idx, shard_count
+
+
+def in_shard(ticker:Text, shard_idx:int, shard_count:int) -> bool:
+    '''
+    Purpose : 
+        Assign a ticker to a shard. Use a stable hash so that every host 
+        computes the same assignment regardless of the ticker order. 
+    '''
+
+    return zlib.crc32(ticker.encode()) % shard_count == shard_idx
+
+
+def list_ticker_jobs(
+        dict_sectors:Optional[Dict[int, List]]=None, 
+        dict_equities:Optional[Dict[Text, Dict[int, List]]]=None, 
+        shard:Text=SHARD, 
+    ) -> List[Tuple[Text, int, Text]]:
+
+    '''
+    Purpose : 
+        Flatten the sector and equity dictionaries into a list of jobs. 
+
+    Input   :
+        dict_sectors : Dictionary. Same format as (collect_sectors). 
+        dict_equities: Dictionary. Same format as (collect_equities). 
+        shard        : Str. Only keep the jobs for this shard. Example: '0/1'. 
+
+    Return  :
+        List of (ticker, start_yr, etf_dir). 
+    '''
+
+    shard_idx, shard_count = parse_shard(shard)
+    jobs = []
+
+    for start_yr, ticker_list in (dict_sectors or {}).items(): 
+        for ticker in ticker_list:
+            jobs.append((ticker, start_yr, ETF_SECTOR_DIR))
+
+    for etf, dict_obj in (dict_equities or {}).items():
+        for start_yr, ticker_list in dict_obj.items(): 
+            for ticker in ticker_list:
+                jobs.append((ticker, start_yr, f'{ETF_EQUITY_DIR}/{etf}'))
+
+    return [job for job in jobs if in_shard(job[0], shard_idx, shard_count)]
+
+
+def build_tasks(jobs:List[Tuple[Text, int, Text]]) -> List[luigi.Task]:
+    '''
+    Purpose : 
+        Create the final Luigi task for each job. With the symbol store, the jobs of 
+        the same symbol are merged into one task that processes the symbol once and 
+        links each of its ETF folders to it. The symbol starts at the earliest year 
+        of its baskets in the membership file, so every run of the symbol writes 
+        its outputs under the same task. 
+
+    Input   :
+        jobs: List of (ticker, start_yr, etf_dir). 
+
+    Return  :
+        List of Luigi tasks. 
+    '''
+
+    if not USE_SYMBOL_STORE: 
+        return [luigi_pipeline.CompileToExcel(ticker, start_yr, etf_dir, YAHOO_VERSION) for ticker, start_yr, etf_dir in jobs]
+
+    membership = symbol_store.load_membership()
+    return [
+        luigi_pipeline.SymbolBasketViews(
+            ticker, min(start_yr, membership.get(ticker, {}).get('start_yr', start_yr)), basket_dirs, SYMBOL_STORE_DIR, YAHOO_VERSION
+        ) 
+        for ticker, (start_yr, basket_dirs) in symbol_store.group_jobs(jobs).items()
+    ]
+
+
+def get_task_cli_args(task:luigi.Task) -> List[Text]:
+    '''
+    Purpose : 
+        Convert a Luigi task into its CLI params. Example: 
+            ['CompileToExcel', '--ticker', 'SPY', '--start-yr', '1999', ...]
+    '''
+
+    cli_args = [task.get_task_family()]
+    for name, value in task.param_kwargs.items(): 
+        value = json.dumps(list(value)) if isinstance(value, (list, tuple)) else str(value)
+        cli_args += [f'--{name.replace("_", "-")}', value]
+    return cli_args
+
+
+# --------------------------------------------------------------
+# Dry Run & Resume.
+# --------------------------------------------------------------
+
+def report_pending(jobs:List[Tuple[Text, int, Text]]) -> Dict[Text, List[Text]]:
+    '''
+    Purpose : 
+        Find the stages that would be recomputed for each ticker without running 
+        anything. Walk the task graph the same way as the Luigi scheduler. The 
+        completeness check uses the run manifest, and only checks that the target files exist. 
+
+    Input   :
+        jobs: List of (ticker, start_yr, etf_dir). 
+
+    Return  :
+        Dictionary of ticker folder and the stages to recompute. Example: 
+            dict = {'docs/dataset/ETF_sector/SPY': ['CompileToExcel', 'PivotVolSummary']}
+    '''
+
+    pending = {}
+    visited = set()
+    stack = build_tasks(jobs)
+
+    while stack: 
+        task = stack.pop()
+        if task.task_id in visited: 
+            continue
+        visited.add(task.task_id)
+
+        # Only the incomplete tasks require checking their dependencies. 
+        if not task.complete(): 
+            pending.setdefault(f'{task.etf_dir}/{task.ticker}', []).append(task.get_task_family())
+            stack.extend(flatten(task.requires()))
+
+    logger.debug(f'----- Checked ({len(visited)}) tasks -- ({len(pending)}) tickers have stages to recompute.')
+    return pending
+
+
+def resume_last_run(workers:int=int(WORKERS), scheduler_mode:Text=SCHEDULER_MODE) -> bool:
+    '''
+    Purpose : 
+        Resubmit the jobs of the latest failed or crashed run. The stages that 
+        finished before the failure are complete in the run manifest and are skipped. 
+
+    Return  :
+        True if every scheduled task succeeded or there is nothing to resume. 
+    '''
+
+    last_run = run_manifest.get_manifest().last_unfinished_run()
+    if last_run is None: 
+        logger.info('The latest run has finished. Nothing to resume.')
+        return True
+
+    run_id, jobs = last_run
+    logger.info(f'Resuming run ({run_id}) with ({len(jobs)}) tickers.')
+    return collect_distributed(workers=workers, scheduler_mode=scheduler_mode, jobs=jobs)
+
+
 # --------------------------------------------------------------
 # Collect Multiple Tickers Data.
 # --------------------------------------------------------------
@@ -38,20 +221,38 @@ def collect_sectors(dict_data:Dict[Text, List]):
             } 
     '''
 
-    # (start_yr) and (ticker) will be iterated. 
-    for start_yr, ticker_list in dict_data.items(): 
-        for ticker in ticker_list:
+    scheduler_args = get_scheduler_args()
+    jobs = list_ticker_jobs(dict_sectors=dict_data)
+    run_id = run_manifest.get_manifest().start_run(jobs)
+    if USE_SYMBOL_STORE: 
+        symbol_store.update_membership(jobs)
+        symbol_store.migrate_basket_folders(jobs)
+    succeeded = True
+
+    # (start_yr) and (ticker) will be iterated. Only the tickers of this shard are kept. 
+    tasks = build_tasks(jobs)
+    luigi_pipeline.adopt_outputs(tasks)
+    with progress.ProgressReporter(tasks, run_id) as reporter: 
+        for task in tasks: 
+            ticker = task.ticker
             try: os.makedirs(LOG_PIPELINE_SECTOR_DIR)
             except: logger.debug(f'----- The ({LOG_PIPELINE_SECTOR_DIR}) directory has already been created.')
 
+            reporter.ticker_started(task)
             with open(f'{LOG_PIPELINE_SECTOR_DIR}/{ticker}.log', 'w') as log_file:
-                logger.debug(f'----- Luigi CLI params -- Scheduler: ({LOCAL_SCHEDULER}) -- Ticker: ({ticker}) -- Start year: ({start_yr}) -- ETF dir: ({ETF_SECTOR_DIR}) -- Download version: ({YAHOO_VERSION})')
+                logger.debug(f'----- Luigi CLI params -- Scheduler: ({scheduler_args}) -- Task: ({get_task_cli_args(task)})')
                 subprocess.run([
-                    'python', 'luigi_pipeline.py', LOCAL_SCHEDULER, 'CompileToExcel', 
-                    '--ticker', ticker, '--start-yr', str(start_yr), '--etf-dir', ETF_SECTOR_DIR, 
-                    '--yahoo-version', YAHOO_VERSION, '--workers', WORKERS
+                    'python', 'luigi_pipeline.py', *scheduler_args, *get_task_cli_args(task), '--workers', WORKERS
                 ], stderr=log_file) 
 
+            # The Luigi CLI exits with 0 even if a task fails, so check the manifest instead. 
+            completed = task.complete()
+            reporter.ticker_finished(task, completed)
+            succeeded = succeeded and completed
+
+    run_manifest.get_manifest().finish_run(run_id, succeeded)
+    if USE_STATS_STORE: stats_store.get_store().refresh(jobs)
+
 
 def collect_equities(dict_data:Dict[Text, Dict[Text, List]]):
     '''
@@ -68,19 +269,142 @@ def collect_equities(dict_data:Dict[Text, Dict[Text, List]]):
             }
     '''
 
-    # (etf_dif), (start_yr), and (ticker) will be iterated. 
-    for etf, dict_obj in dict_data.items():
-        etf_dir = f'{ETF_EQUITY_DIR}/{etf}' 
+    scheduler_args = get_scheduler_args()
+    jobs = list_ticker_jobs(dict_equities=dict_data)
+    run_id = run_manifest.get_manifest().start_run(jobs)
+    if USE_SYMBOL_STORE: 
+        symbol_store.update_membership(jobs)
+        symbol_store.migrate_basket_folders(jobs)
+    succeeded = True
 
-        for start_yr, ticker_list in dict_obj.items(): 
-            for ticker in ticker_list:
-                try: os.makedirs(LOG_PIPELINE_EQUITY_DIR) 
-                except: logger.debug(f'----- The ({LOG_PIPELINE_EQUITY_DIR}) directory has already been created.')
-
-                with open(f'{LOG_PIPELINE_EQUITY_DIR}/{ticker}.log', 'w') as log_file: 
-                    logger.debug(f'----- Luigi CLI params -- Scheduler: ({LOCAL_SCHEDULER}) -- Ticker: ({ticker}) -- Start year: ({start_yr}) -- ETF dir: ({etf_dir}) -- Download version: ({YAHOO_VERSION})')
-                    subprocess.run([
-                        'python', 'luigi_pipeline.py', LOCAL_SCHEDULER, 'CompileToExcel', 
-                        '--ticker', ticker, '--start-yr', str(start_yr), '--etf-dir', etf_dir, 
-                        '--yahoo-version', YAHOO_VERSION, '--workers', WORKERS
-                    ], stderr=log_file) 
+    # (etf_dif), (start_yr), and (ticker) will be iterated. Only the tickers of this shard are kept. 
+    tasks = build_tasks(jobs)
+    luigi_pipeline.adopt_outputs(tasks)
+    with progress.ProgressReporter(tasks, run_id) as reporter: 
+        for task in tasks: 
+            ticker = task.ticker
+            try: os.makedirs(LOG_PIPELINE_EQUITY_DIR) 
+            except: logger.debug(f'----- The ({LOG_PIPELINE_EQUITY_DIR}) directory has already been created.')
+
+            reporter.ticker_started(task)
+            with open(f'{LOG_PIPELINE_EQUITY_DIR}/{ticker}.log', 'w') as log_file: 
+                logger.debug(f'----- Luigi CLI params -- Scheduler: ({scheduler_args}) -- Task: ({get_task_cli_args(task)})')
+                subprocess.run([
+                    'python', 'luigi_pipeline.py', *scheduler_args, *get_task_cli_args(task), '--workers', WORKERS
+                ], stderr=log_file) 
+
+            # The Luigi CLI exits with 0 even if a task fails, so check the manifest instead. 
+            completed = task.complete()
+            reporter.ticker_finished(task, completed)
+            succeeded = succeeded and completed
+
+    run_manifest.get_manifest().finish_run(run_id, succeeded)
+    if USE_STATS_STORE: stats_store.get_store().refresh(jobs)
+
+
+def collect_distributed(
+        dict_sectors:Optional[Dict[int, List]]=None, 
+        dict_equities:Optional[Dict[Text, Dict[int, List]]]=None, 
+        workers:int=int(WORKERS), 
+        scheduler_mode:Text=SCHEDULER_MODE, 
+        shard:Text=SHARD, 
+        jobs:Optional[List[Tuple[Text, int, Text]]]=None, 
+        export_workers:int=EXPORT_WORKERS, 
+    ) -> bool:
+
+    '''
+    Purpose : 
+        Submit every ticker to a single Luigi worker instead of one subprocess per 
+        ticker. Run the same call on several processes or hosts with a central 
+        scheduler ('luigid') to let them pull the ticker tasks from a shared queue. 
+        The scheduler only hands out each task to one worker, so no ticker 
+        is processed twice. 
+
+    Input   :
+        dict_sectors  : Dictionary. Same format as (collect_sectors). 
+        dict_equities : Dictionary. Same format as (collect_equities). 
+        workers       : Int. Number of worker processes on this host. 
+        scheduler_mode: Str. Must be 'local' or 'central'. 
+        shard         : Str. Only submit the jobs for this shard. Example: '0/1'. 
+        jobs          : List of (ticker, start_yr, etf_dir). Overrides the dictionaries if given. 
+        export_workers: Int. Number of processes of the export scheduler. The workbooks are written 
+                        by the Luigi workers if 0 or with the central scheduler. 
+
+    Return  :
+        True if every scheduled task succeeded. 
+    '''
+
+    if jobs is None: 
+        jobs = list_ticker_jobs(dict_sectors, dict_equities, shard)
+    tasks = build_tasks(jobs)
+    run_id = run_manifest.get_manifest().start_run(jobs)
+    if USE_SYMBOL_STORE: 
+        symbol_store.update_membership(jobs)
+        symbol_store.migrate_basket_folders(jobs)
+    luigi_pipeline.adopt_outputs(tasks)
+    logger.info(f'Submitting ({len(tasks)}) tickers -- Scheduler: ({scheduler_mode}) -- Workers: ({workers}) -- Shard: ({shard})') 
+
+    # Run the pivot stages first, then write the workbooks with the export scheduler. The hosts of a central 
+    # scheduler would write the same workbooks, so they keep writing them with Luigi. 
+    with progress.ProgressReporter(tasks, run_id): 
+        if export_workers and scheduler_mode == 'local': 
+            export_tasks = [export_scheduler.get_export_task(task) for task in tasks]
+            luigi.build([dep for task in export_tasks for dep in flatten(task.requires())], workers=workers, local_scheduler=True)
+            export_scheduler.run_export(tasks, export_workers)
+
+        if scheduler_mode == 'central': 
+            succeeded = luigi.build(tasks, workers=workers, scheduler_host=SCHEDULER_HOST, scheduler_port=int(SCHEDULER_PORT))
+        else: 
+            succeeded = luigi.build(tasks, workers=workers, local_scheduler=True)
+
+    run_manifest.get_manifest().finish_run(run_id, succeeded)
+    if USE_STATS_STORE: stats_store.get_store().refresh(jobs)
+    logger.info(f'Finished run ({run_id}) -- Succeeded: ({succeeded}) -- Cache hit rates: ({run_manifest.get_manifest().cache_summary()})')
+    return succeeded
+
+
+def collect_streaming(
+        dict_sectors:Optional[Dict[int, List]]=None, 
+        dict_equities:Optional[Dict[Text, Dict[int, List]]]=None, 
+        workers:int=int(WORKERS), 
+        shard:Text=SHARD, 
+        jobs:Optional[List[Tuple[Text, int, Text]]]=None, 
+        budget_mb:int=MEMORY_BUDGET_MB, 
+    ) -> bool:
+
+    '''
+    Purpose : 
+        Same as (collect_distributed), but run the tasks with the streaming executor 
+        instead of the Luigi scheduler. The next tickers are downloaded while the 
+        worker processes preprocess the earlier ones. 
+
+    Input   :
+        dict_sectors : Dictionary. Same format as (collect_sectors). 
+        dict_equities: Dictionary. Same format as (collect_equities). 
+        workers      : Int. Number of worker processes. 
+        shard        : Str. Only run the jobs for this shard. Example: '0/1'. 
+        jobs         : List of (ticker, start_yr, etf_dir). Overrides the dictionaries if given. 
+        budget_mb    : Int. Limit of the resident memory of the workers in MB. Unbounded if 0. 
+
+    Return  :
+        True if every ticker succeeded. 
+    '''
+
+    if jobs is None: 
+        jobs = list_ticker_jobs(dict_sectors, dict_equities, shard)
+    tasks = build_tasks(jobs)
+    run_id = run_manifest.get_manifest().start_run(jobs)
+    if USE_SYMBOL_STORE: 
+        symbol_store.update_membership(jobs)
+        symbol_store.migrate_basket_folders(jobs)
+    luigi_pipeline.adopt_outputs(tasks)
+    logger.info(f'Streaming ({len(tasks)}) tickers -- Workers: ({workers}) -- Shard: ({shard}) -- Memory budget: ({budget_mb or "none"} MB)') 
+
+    with progress.ProgressReporter(tasks, run_id): 
+        results = stream_executor.run_streaming(tasks, workers, budget_mb=budget_mb)
+    succeeded = all(result['status'] != 'failed' for result in results)
+
+    run_manifest.get_manifest().finish_run(run_id, succeeded)
+    if USE_STATS_STORE: stats_store.get_store().refresh(jobs)
+    logger.info(f'Finished run ({run_id}) -- Succeeded: ({succeeded}) -- Cache hit rates: ({run_manifest.get_manifest().cache_summary()})')
+    return succeeded
@@ -0,0 +1,192 @@
+
+
+import logging, time
+from typing import Any, Dict, Iterator, List, Text, Tuple
+import numpy as np
+import pandas as pd
+
+# Personal modules.
+from config.config import LOG_PROCESSING_FILEPATH, ENGINE_RTOL, ENGINE_ATOL
+from config.config_logger import setup_logger
+from autoprocess_ticker import ticker_stages
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# ----------------------------------------------------------------------
+# Frame Comparison.
+# ----------------------------------------------------------------------
+
+def iter_frames(output:Any, name:Text='') -> Iterator[Tuple[Text, pd.DataFrame]]:
+    '''
+    Purpose:
+        Yield every frame of the output of a stage with its path in the output.
+        Example: ('pivot_stats/monthly', df) or ('[1]/compiled_tww', df)
+    '''
+
+    if isinstance(output, pd.Series):
+        yield name, output.to_frame()
+    elif isinstance(output, pd.DataFrame):
+        yield name, output
+    elif isinstance(output, dict):
+        for key, value in output.items():
+            yield from iter_frames(value, f'{name}/{key}' if name else str(key))
+    elif isinstance(output, (tuple, list)):
+        for i, value in enumerate(output):
+            yield from iter_frames(value, f'{name}[{i}]')
+
+
+def compare_frames(expected:pd.DataFrame, actual:pd.DataFrame, rtol:float=ENGINE_RTOL, atol:float=ENGINE_ATOL) -> Dict:
+    '''
+    Purpose:
+        Diff two frames. The index, the columns and the dtypes must be the same, the
+        NaN in the same cells, and the numbers within (rtol) and (atol). The other
+        values must be equal.
+
+    Input  :
+        expected: Dataframe. Output of the legacy engine.
+        actual  : Dataframe. Output of the engine under test.
+
+    Return :
+        Dictionary of the status, the reason of a mismatch, and the largest absolute
+        difference of the numbers. Example: {'status': 'ok', 'reason': '', 'max_abs_diff': 0.0}
+    '''
+
+    result = {'status': 'mismatch', 'reason': '', 'max_abs_diff': 0.0}
+    for axis, expected_idx, actual_idx in [('index', expected.index, actual.index), ('columns', expected.columns, actual.columns)]:
+        try:
+            pd.testing.assert_index_equal(expected_idx, actual_idx, exact='equiv', check_names=True)
+        except AssertionError as error:
+            result['reason'] = f'{axis}: ' + ' '.join(str(error).split())
+            return result
+
+    for i, col in enumerate(expected.columns):
+        expected_col, actual_col = expected.iloc[:,i], actual.iloc[:,i]
+        if expected_col.dtype != actual_col.dtype:
+            result['reason'] = f'dtype of ({col}): {expected_col.dtype} != {actual_col.dtype}'
+            return result
+
+        if not pd.api.types.is_numeric_dtype(expected_col) or pd.api.types.is_bool_dtype(expected_col):
+            if not expected_col.equals(actual_col):
+                result['reason'] = f'values of ({col})'
+                return result
+            continue
+
+        expected_values = expected_col.to_numpy(dtype=np.float64)
+        actual_values = actual_col.to_numpy(dtype=np.float64)
+        expected_nan, actual_nan = np.isnan(expected_values), np.isnan(actual_values)
+        if not np.array_equal(expected_nan, actual_nan):
+            result['reason'] = f'NaN placement of ({col}) at ({int(np.count_nonzero(expected_nan != actual_nan))}) rows'
+            return result
+
+        both = ~expected_nan
+        with np.errstate(invalid='ignore'):
+            diffs = np.abs(expected_values[both] - actual_values[both])
+        # The same infinities give NaN differences and are equal.
+        diffs = np.where(expected_values[both] == actual_values[both], 0.0, diffs)
+        if len(diffs):
+            result['max_abs_diff'] = max(result['max_abs_diff'], float(diffs.max()))
+        if not np.allclose(actual_values[both], expected_values[both], rtol=rtol, atol=atol):
+            result['reason'] = f'values of ({col}) beyond the tolerance'
+            return result
+
+    result['status'] = 'ok'
+    return result
+
+
+def compare_outputs(expected:Any, actual:Any, rtol:float=ENGINE_RTOL, atol:float=ENGINE_ATOL) -> List[Dict]:
+    '''
+    Purpose:
+        Diff every frame of the outputs of a stage with (compare_frames). A frame
+        that is in one output only is a mismatch.
+
+    Return :
+        List of result dictionaries, one per frame, with its path in the output under (frame).
+    '''
+
+    expected_frames, actual_frames = dict(iter_frames(expected)), dict(iter_frames(actual))
+    results = []
+    for name in list(expected_frames) + [name for name in actual_frames if name not in expected_frames]:
+        if name not in expected_frames or name not in actual_frames:
+            side = 'legacy' if name in expected_frames else 'fast'
+            results.append({'frame': name, 'status': 'mismatch', 'reason': f'only in the {side} output', 'max_abs_diff': 0.0})
+            continue
+        results.append({'frame': name, **compare_frames(expected_frames[name], actual_frames[name], rtol, atol)})
+    return results
+
+
+# ----------------------------------------------------------------------
+# Engines.
+# ----------------------------------------------------------------------
+
+# Stages compared between the engines, and the frames they run on. The unique day stages
+# run on the frames traced by the legacy engine, so a difference only shows in its stage.
+ENGINE_STAGES = {
+    'trace_unique_period': ('preprocessed', ticker_stages.trace_unique_period),
+    'pivot_ticker_summary': ('preprocessed', ticker_stages.pivot_ticker_summary),
+    'pivot_vol_summary': ('preprocessed', ticker_stages.pivot_vol_summary),
+    'create_unique_days_pivots': ('traced', ticker_stages.create_unique_days_pivots),
+    'pivot_unique_days_summary': ('traced', ticker_stages.pivot_unique_days_summary),
+}
+
+
+def time_stage(stage, df_ticker:Dict[Text, pd.DataFrame], start_yr:int, engine:Text, repeats:int) -> Tuple[Any, float]:
+    # Output of a stage and its fastest run in seconds.
+    seconds = []
+    for _ in range(max(repeats, 1)):
+        start_time = time.perf_counter()
+        output = stage(df_ticker, start_yr, engine=engine)
+        seconds.append(time.perf_counter() - start_time)
+    return output, min(seconds)
+
+
+def verify_engines(df_ticker:Dict[Text, pd.DataFrame], start_yr:int, engine:Text='fast', rtol:float=ENGINE_RTOL,
+                   atol:float=ENGINE_ATOL, repeats:int=3) -> List[Dict]:
+    '''
+    Purpose:
+        Run every stage of (ENGINE_STAGES) on a ticker with the legacy engine and with
+        (engine), diff all their frames, and time them.
+
+    Input  :
+        df_ticker: Dictionary. Preprocessed ticker data of (ProcessTickerData).
+        start_yr : Int. Starting year of the ticker.
+        engine   : Str. Engine to check against 'legacy'. See 'ticker_stages.ENGINES'.
+        rtol     : Float. Relative tolerance of the numbers.
+        atol     : Float. Absolute tolerance of the numbers.
+        repeats  : Int. Runs of each stage. The fastest is kept.
+
+    Return :
+        List of result dictionaries, one per stage. Example:
+            {'stage': 'pivot_ticker_summary', 'frames': 64, 'mismatches': 0, 'max_abs_diff': 0.0,
+             'legacy_ms': 290.1, 'fast_ms': 41.7, 'speedup': 6.96, 'status': 'ok', 'detail': ''}
+    '''
+
+    logger.info('Start running (verify_engines) function.')
+
+    inputs = {'preprocessed': df_ticker, 'traced': ticker_stages.trace_unique_period(df_ticker, start_yr, engine='legacy')}
+    results = []
+    for name, (source, stage) in ENGINE_STAGES.items():
+        expected, legacy_seconds = time_stage(stage, inputs[source], start_yr, 'legacy', repeats)
+        actual, engine_seconds = time_stage(stage, inputs[source], start_yr, engine, repeats)
+
+        frames = compare_outputs(expected, actual, rtol, atol)
+        mismatches = [frame for frame in frames if frame['status'] != 'ok']
+        for frame in mismatches:
+            logger.warning(f'----- ({name}) of the ({engine}) engine differs at ({frame["frame"]}) -- {frame["reason"]}')
+
+        results.append({
+            'stage': name, 'frames': len(frames), 'mismatches': len(mismatches),
+            'max_abs_diff': max([frame['max_abs_diff'] for frame in frames], default=0.0),
+            'legacy_ms': round(legacy_seconds * 1000, 1), f'{engine}_ms': round(engine_seconds * 1000, 1),
+            'speedup': round(legacy_seconds / engine_seconds, 2),
+            'status': 'mismatch' if mismatches else 'ok',
+            'detail': f'{mismatches[0]["frame"]}: {mismatches[0]["reason"]}' if mismatches else '',
+        })
+        logger.debug(f'----- Compared ({name}) of the ({engine}) engine -- {results[-1]}')
+    return results
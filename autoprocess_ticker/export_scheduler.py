@@ -0,0 +1,120 @@
+
+
+import logging, time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Text
+import luigi
+from luigi.task import flatten
+
+# Personal modules.
+from config.config import LOG_PROCESSING_FILEPATH, TICKER_FREQ, END_YR, EXPORT_WORKERS
+from config.config_logger import setup_logger
+from autoprocess_ticker import memory_budget, stream_executor
+import luigi_pipeline
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# ----------------------------------------------------------------------
+# Cost.
+# ----------------------------------------------------------------------
+
+def get_export_task(task:luigi.Task) -> luigi_pipeline.CompileToExcel:
+    # The workbook task of a final task. With the symbol store, the basket views require it.
+    return task if isinstance(task, luigi_pipeline.CompileToExcel) else task.requires()
+
+
+def estimate_cost(task:luigi_pipeline.CompileToExcel) -> Dict[Text, int]:
+    '''
+    Purpose:
+        Estimate the cost of the workbook of a ticker. The pivot tables and their stats
+        grow with the daily bars, so the rows of the daily download are counted. The
+        years are the fallback before the ticker is downloaded, and break the ties.
+
+    Input  :
+        task: The (CompileToExcel) task of a ticker.
+
+    Return :
+        Dictionary of the daily rows and the years. Example: {'rows': 5751, 'years': 22}
+    '''
+
+    years = max(END_YR - task.start_yr + 1, 1)
+    daily = [
+        stage.output() for stage in stream_executor.list_stages(task)
+        if isinstance(stage, luigi_pipeline.DownloadTickerData) and stage.ticker_freq == TICKER_FREQ[2]
+    ]
+    rows = memory_budget.count_rows(daily[0]) if daily and daily[0].exists() else 0
+    return {'rows': rows, 'years': years}
+
+
+# ----------------------------------------------------------------------
+# Export Scheduler.
+# ----------------------------------------------------------------------
+
+def run_export(tasks:List[luigi.Task], workers:int=EXPORT_WORKERS, order:Text='cost') -> List[Dict]:
+    '''
+    Purpose:
+        Write the workbooks of the tickers in a pool of worker processes once their
+        pivot stages are done. The costliest tickers are submitted first, so a long
+        history like SPY doesn't start last and run alone while the other workers
+        are idle. The workbooks and the run manifest are the same as with Luigi.
+
+    Input  :
+        tasks  : List of the final task of each ticker. Same as (collect_tickers.build_tasks).
+        workers: Int. Number of worker processes.
+        order  : Str. 'cost' for the costliest first, or 'given' to keep the order of (tasks).
+
+    Return :
+        List of result dictionaries, one per workbook in the order they were submitted. Example:
+            {'ticker': 'SPY', 'etf_dir': '...', 'rows': 5751, 'years': 22, 'status': 'done',
+             'seconds': 3.2, 'finished': 7.9, 'pid': 4120}
+    '''
+
+    logger.info('Start running (run_export) function.')
+
+    export_tasks = [get_export_task(task) for task in tasks]
+    results = [{'ticker': task.ticker, 'etf_dir': task.etf_dir, **estimate_cost(task)} for task in export_tasks]
+    if order == 'cost':
+        ranked = sorted(zip(export_tasks, results), key=lambda item: (item[1]['rows'], item[1]['years']), reverse=True)
+        export_tasks, results = [task for task, _ in ranked], [result for _, result in ranked]
+
+    # A workbook is only written once the pivot stages of its ticker are done.
+    pending = {}
+    for task, result in zip(export_tasks, results):
+        if task.complete():
+            result['status'] = 'skipped'
+        elif not all(dep.complete() for dep in flatten(task.requires())):
+            result['status'] = 'blocked'
+        else:
+            pending[task] = result
+
+    start_time = time.perf_counter()
+    if pending:
+        # Spawn the workers, so they don't inherit the open manifest connection.
+        with ProcessPoolExecutor(min(workers, len(pending)), mp_context=mp.get_context('spawn')) as pool:
+            futures = {pool.submit(stream_executor.run_stages, [task]): result for task, result in pending.items()}
+            for future in as_completed(futures):
+                result = futures[future]
+                result['finished'] = round(time.perf_counter() - start_time, 2)
+                try:
+                    worker = future.result()
+                    result.update(status='done', seconds=worker['process_seconds'], pid=worker['pid'])
+                    logger.debug(f'----- Exported ({result["ticker"]}) in ({result["seconds"]}) seconds -- {result["rows"]} rows')
+                except Exception as error:
+                    result.update(status='failed', error=repr(error))
+                    logger.error(f'----- Failed to export ({result["ticker"]}) -- {error}')
+
+    # The share of the worker time spent writing, so 1.0 means every worker was busy until the end.
+    elapsed = time.perf_counter() - start_time
+    busy = sum(result.get('seconds', 0) for result in results) / (min(workers, len(pending)) * elapsed) if pending else 0
+    counts = {status: sum(result['status'] == status for result in results) for status in ['done', 'skipped', 'blocked', 'failed']}
+    logger.info(f'Exported ({len(pending)}) workbooks in ({elapsed:.1f}) seconds with ({workers}) workers -- '
+                f'Busy: ({busy:.0%}) -- {counts}')
+    return results
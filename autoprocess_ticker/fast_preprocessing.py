@@ -0,0 +1,357 @@
+
+
+import logging
+from typing import Dict, List, Optional, Text
+import numpy as np
+import pandas as pd
+
+# Personal modules.
+from config.config import LOG_PROCESSING_FILEPATH, HOLIDAYS_KEYS
+from config.config_logger import setup_logger
+from autoprocess_ticker import preprocessing, panel
+
+# The functions without a fast version are the legacy ones, so this module can be used
+# in place of 'preprocessing'. See 'ticker_stages.get_engine'.
+from autoprocess_ticker.preprocessing import (
+    init_preprocess, create_pivot, compute_avg_vol, trace_special_days, insert_holiday_col, get_unique_days_pivot_cols,
+    concat_pivot_tww, concat_pivot_unique_days, get_stats_index, flatten_pivot, flatten_stats, flatten_summary
+)
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# ----------------------------------------------------------------------
+# Data Summarisation.
+# ----------------------------------------------------------------------
+
+# Same signatures and outputs as the functions of 'preprocessing'. The stats are computed
+# on the values of each window at once with the kernel of 'panel', which is bit-identical
+# to the pandas row reductions, instead of one pandas reduction per column.
+
+def summarise_pivot(
+        pivot_dict:Dict[Text, pd.DataFrame],
+        pivot_dict_stats:Dict[Text, pd.DataFrame],
+        freq_keys:List[Text],
+        start_yr_range:List[int],
+        end_yr:int
+    ):
+
+    '''
+    Purpose:
+        Same as 'preprocessing.summarise_pivot'.
+    '''
+
+    logger.info('Start running (summarise_pivot) function.')
+
+    for freq in freq_keys:
+        for suffix, start_yr in panel.iter_stats_windows(start_yr_range):
+            df_window = pivot_dict[freq].loc[:,start_yr:end_yr]
+            values = df_window.to_numpy(dtype=np.float64)
+            # Sum in the order of the pandas reductions of the legacy function. See 'panel.summarise_cube'.
+            pairwise = df_window.values.flags['C_CONTIGUOUS'] or np.isnan(values).any()
+            stats = panel.summarise_cube(values, pairwise)
+            pivot_dict_stats[f'{freq}{suffix}'] = pd.DataFrame(stats, index=get_stats_index(df_window.index, freq))
+        logger.debug(f'----- Created the stats of ({freq}) ticker data.')
+
+
+def summarise_pivot_vol(
+        pivot_dict:Dict[Text, pd.DataFrame],
+        pivot_dict_stats:Dict[Text, pd.DataFrame],
+        freq_keys:List[Text],
+        start_yr_range:List[int],
+        end_yr:int
+    ):
+
+    '''
+    Purpose:
+        Same as 'preprocessing.summarise_pivot_vol'. The flags and the counts are
+        written into one array, so the frame is created once.
+    '''
+
+    logger.info('Start running (summarise_pivot_vol) function.')
+
+    for freq in freq_keys:
+        for suffix, start_yr in panel.iter_stats_windows(start_yr_range):
+            stats_key = f'{freq}{suffix}'
+            years = list(range(start_yr, end_yr + 1, 1))
+            values = pivot_dict[freq][years].to_numpy(dtype=np.float64)
+            avg_vol = pivot_dict_stats[f'{stats_key}_avg_vol_col'].loc[years,'avg_vol_col'].to_numpy()
+
+            # Flags of the years, then the counts above and below the average, and the probability.
+            data = np.full((len(values), len(years) + 3), np.nan)
+            flags = data[:,:len(years)]
+            np.copyto(flags, 1.0, where=values > avg_vol)
+            np.copyto(flags, 0.0, where=values < avg_vol)
+            total_counts = np.count_nonzero(~np.isnan(flags), axis=1)
+            data[:,-3] = np.count_nonzero(flags == 1.0, axis=1)
+            data[:,-2] = total_counts - data[:,-3]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                data[:,-1] = data[:,-3] / total_counts
+
+            columns = [f'abv_avg_vol_{year}' for year in years] + ['abv_avg_vol_counts', 'blw_avg_vol_counts', 'abv_avg_vol_prob']
+            pivot_dict_stats[stats_key] = pd.DataFrame(data, index=pivot_dict[freq].index,
+                                                       columns=pd.Index(columns, name=pivot_dict[freq].columns.name))
+        logger.debug(f'----- Created the volume stats of ({freq}) ticker volume data.')
+
+
+# ----------------------------------------------------------------------
+# Preprocessing Holidays/Observances/SpecialDay Data.
+# ----------------------------------------------------------------------
+
+# The legacy functions look up every holiday with 'list.index' on the dates of the ticker.
+# Here the trading dates are searched once with 'searchsorted', and the periods are read
+# by their positions. A holiday outside the trading dates or a period that runs past them
+# is left to the legacy function, so its behaviour, errors included, stays the same.
+
+def get_date_positions(df_ticker_data:pd.DataFrame, dates:pd.DatetimeIndex) -> Optional[np.ndarray]:
+    # Positions of the dates among the trading dates. None if any isn't a trading date,
+    # or if the trading dates aren't sorted and unique.
+    daily_dates = df_ticker_data['date'].dt.normalize().to_numpy()
+    if np.any(daily_dates[1:] <= daily_dates[:-1]):
+        return None
+    positions = np.searchsorted(daily_dates, dates.normalize().to_numpy())
+    found = positions < len(daily_dates)
+    found[found] = daily_dates[positions[found]] == dates.normalize().to_numpy()[found]
+    return positions if found.all() else None
+
+
+def get_period_positions(df_ticker_data:pd.DataFrame, first_positions:np.ndarray, date_range:int) -> Optional[np.ndarray]:
+    # Positions of every date of each period. None if a period runs past the trading dates.
+    positions = first_positions[:, None] + np.arange(date_range)
+    if len(positions) and (positions.min() < 0 or positions.max() >= len(df_ticker_data)):
+        return None
+    return positions
+
+
+def add_holiday_periods(df_ticker_data:pd.DataFrame, holidays_dict:Dict[Text, List], holiday_col:Text,
+                        positions:np.ndarray, day_counts:List[int], years:np.ndarray):
+    '''
+    Purpose:
+        Add the dates, day counts, and specific years of the holiday periods to
+        (holidays_dict) like the legacy loops, then create the holiday columns.
+
+    Input  :
+        df_ticker_data: Dataframe. Contains ticker data. Must be 'daily_by_trdr_day'.
+        holidays_dict : Dictionary. Contains list of dates within for each holiday.
+        holiday_col   : Str. Name of the holiday to create new column.
+        positions     : Array of holiday x day of the positions of the period dates.
+        day_counts    : List. Day counts of each day of a period. Example: [0, 1, 2, 3, 4, 5]
+        years         : Array. Specific year of each holiday.
+    '''
+
+    dates = df_ticker_data['date'].dt.normalize().to_numpy()[positions.ravel()]
+    holidays_dict[f'{holiday_col}_day_counts'] = day_counts * len(positions)
+    holidays_dict[f'{holiday_col}_spec_year'] = np.repeat(years, len(day_counts)).tolist()
+    holidays_dict[holiday_col].extend(pd.DatetimeIndex(dates).to_pydatetime().tolist())
+    insert_holiday_col(df_ticker_data, holidays_dict, holiday_col)
+
+
+def trace_tww_trdr_days(df_ticker_data:pd.DataFrame, df_tww:pd.DataFrame):
+    '''
+    Purpose:
+        Same as 'preprocessing.trace_tww_trdr_days'. The rows are matched to every
+        TWW week at once by their year and week, instead of one filter per week.
+    '''
+
+    logger.info('Start running (trace_tww_trdr_days) function.')
+
+    # Year and week of each row as one number. Example: 2019 week 12 is 201912.
+    row_weeks = df_ticker_data['year'].to_numpy(dtype=np.float64) * 100 + df_ticker_data['week'].to_numpy(dtype=np.float64)
+
+    for quarter in df_tww.columns:
+        tww_weeks = df_tww[quarter].dt.year.to_numpy(dtype=np.float64) * 100 + df_tww[quarter].dt.week.to_numpy(dtype=np.float64)
+
+        # Indicate the trading days that fall within TWW and the week after.
+        df_ticker_data[quarter] = np.isin(row_weeks, tww_weeks).astype(np.int64)
+        df_ticker_data[f'{quarter}_week_aft'] = np.isin(row_weeks, tww_weeks + 1).astype(np.int64)
+        logger.debug(f'----- Created columns ({quarter}), ({quarter}_week_aft) of ticker data.')
+
+        # Compute the day counts for each TWW period of each quarter.
+        insert_day_counts_col(df_ticker_data, quarter)
+        insert_day_counts_col(df_ticker_data, f'{quarter}_week_aft')
+
+
+def insert_day_counts_col(df_ticker_data:pd.DataFrame, period_col:Text):
+    '''
+    Purpose:
+        Same as 'preprocessing.insert_day_counts_col'. The days are numbered from
+        the dates of the period alone, instead of grouping a copy of every column.
+    '''
+
+    period_bool = (df_ticker_data[period_col] == 1).to_numpy()
+    dates = df_ticker_data['date'].to_numpy()[period_bool]
+
+    # Number the days from the start till the end of the month. The dates are sorted,
+    # so a day count is its position after the first day of its month.
+    months = dates.astype('datetime64[M]')
+    if np.any(months[1:] < months[:-1]):
+        return preprocessing.insert_day_counts_col(df_ticker_data, period_col)
+    day_counts = np.arange(len(months)) - np.searchsorted(months, months, side='left')
+    df_ticker_data.loc[period_bool, f'{period_col}_day_counts'] = day_counts
+    logger.debug(f'----- Created a column ({period_col}_day_counts) for (daily_by_trdr_day) ticker data.')
+
+
+def trace_new_year(df_ticker_data:pd.DataFrame, holidays_dict:Dict[Text, List], date_range:int=6):
+    '''
+    Purpose:
+        Same as 'preprocessing.trace_new_year'.
+    '''
+
+    logger.info('Start running (trace_new_year) function.')
+
+    # Remove the last first trading date of January (end_yr + 1).
+    first_positions = np.flatnonzero(((df_ticker_data['month'] == 1) & (df_ticker_data['trdr_day'] == 0)).to_numpy())[:-1]
+    daily_dates = df_ticker_data['date'].to_numpy()
+    positions = get_period_positions(df_ticker_data, first_positions - 3, date_range)
+    if positions is None or np.any(daily_dates[1:] <= daily_dates[:-1]):
+        return preprocessing.trace_new_year(df_ticker_data, holidays_dict, date_range)
+
+    years = df_ticker_data['date'].dt.year.to_numpy()[first_positions]
+    add_holiday_periods(df_ticker_data, holidays_dict, 'new_year', positions, list(range(date_range)), years)
+
+
+def trace_spec_weekday_holiday(df_ticker_data:pd.DataFrame, df_holidays:pd.DataFrame, holidays_dict:Dict[Text, List],
+                               holiday_col:Text, day_forward:int=1, idx_backtrace:int=3, date_range:int=6):
+    '''
+    Purpose:
+        Same as 'preprocessing.trace_spec_weekday_holiday'.
+    '''
+
+    logger.info('Start running (trace_spec_weekday_holiday) function.')
+
+    holidays = pd.DatetimeIndex(df_holidays[holiday_col])
+    found = get_date_positions(df_ticker_data, holidays + pd.Timedelta(days=day_forward))
+    positions = None if found is None else get_period_positions(df_ticker_data, found - idx_backtrace, date_range)
+    if positions is None:
+        return preprocessing.trace_spec_weekday_holiday(df_ticker_data, df_holidays, holidays_dict, holiday_col,
+                                                        day_forward, idx_backtrace, date_range)
+
+    add_holiday_periods(df_ticker_data, holidays_dict, holiday_col, positions, list(range(date_range)), holidays.year.to_numpy())
+
+
+def trace_non_spec_holiday(df_ticker_data:pd.DataFrame, df_holidays:pd.DataFrame, holidays_dict:Dict[Text, List],
+                           holiday_col:Text, date_range:int=6):
+    '''
+    Purpose:
+        Same as 'preprocessing.trace_non_spec_holiday'.
+    '''
+
+    logger.info('Start running (trace_non_spec_holiday) function.')
+
+    # Same moves as the legacy function by the weekday of the holiday. 0 == Monday, 6 == Sunday.
+    holidays = pd.DatetimeIndex(df_holidays[holiday_col])
+    weekdays = holidays.weekday.to_numpy()
+    days = np.select([weekdays == 4, weekdays == 5, weekdays == 6], [-1, -2, 2], default=1)
+    backtrace = np.where((weekdays == 4) | (weekdays == 5), 2, 3)
+
+    found = get_date_positions(df_ticker_data, holidays + pd.to_timedelta(days, unit='D'))
+    positions = None if found is None else get_period_positions(df_ticker_data, found - backtrace, date_range)
+    if positions is None:
+        return preprocessing.trace_non_spec_holiday(df_ticker_data, df_holidays, holidays_dict, holiday_col, date_range)
+
+    add_holiday_periods(df_ticker_data, holidays_dict, holiday_col, positions, list(range(date_range)), holidays.year.to_numpy())
+
+
+def get_observance_day_counts(date_range:int) -> List[int]:
+    '''
+    Purpose:
+        Number the days of an observance period exactly like the loop of
+        'preprocessing.trace_non_spec_observance'. Its 'i += 1 if ... else i' adds
+        (i) to itself unless the observance moved off a weekend or holiday.
+
+    Return :
+        List of day counts. Example: 7 returns [0, 2, 4, 6, 8, 10, 12], 6 returns [0, 2, 4, 4, 5, 6]
+    '''
+
+    day_counts = []
+    for i in range(0, date_range, 1):
+        i += 1 if i >= 3 and date_range == 6 else i
+        day_counts.append(i)
+    return day_counts
+
+
+def trace_non_spec_observance(df_ticker_data:pd.DataFrame, df_holidays:pd.DataFrame, holidays_dict:Dict[Text, List],
+                              holiday_col:Text, date_range:int=7):
+    '''
+    Purpose:
+        Same as 'preprocessing.trace_non_spec_observance'. An observance that isn't a
+        trading date moves to the next trading date, and its period has 6 days.
+    '''
+
+    logger.info('Start running (trace_non_spec_observance) function.')
+
+    holidays = pd.DatetimeIndex(df_holidays[holiday_col])
+    daily_dates = df_ticker_data['date'].dt.normalize().to_numpy()
+    found = np.searchsorted(daily_dates, holidays.normalize().to_numpy())
+    if np.any(daily_dates[1:] <= daily_dates[:-1]) or np.any(found >= len(daily_dates)):
+        return preprocessing.trace_non_spec_observance(df_ticker_data, df_holidays, holidays_dict, holiday_col, date_range)
+    moved = daily_dates[found] != holidays.normalize().to_numpy()
+
+    # The legacy function always uses 7 days, or 6 once the observance moved.
+    periods = {}
+    for n_days, observances in [(7, ~moved), (6, moved)]:
+        periods[n_days] = get_period_positions(df_ticker_data, found[observances] - 3, n_days)
+        if periods[n_days] is None:
+            return preprocessing.trace_non_spec_observance(df_ticker_data, df_holidays, holidays_dict, holiday_col, date_range)
+
+    # Keep the order of the observances, with the day counts of their period.
+    dates, day_counts, years = [], [], holidays.year.to_numpy()
+    rows = {7: iter(periods[7]), 6: iter(periods[6])}
+    for is_moved in moved:
+        n_days = 6 if is_moved else 7
+        dates.append(daily_dates[next(rows[n_days])])
+        day_counts += get_observance_day_counts(n_days)
+
+    holidays_dict[f'{holiday_col}_day_counts'] = day_counts
+    holidays_dict[f'{holiday_col}_spec_year'] = np.repeat(years, np.where(moved, 6, 7)).tolist()
+    holidays_dict[holiday_col].extend(pd.DatetimeIndex(np.concatenate(dates) if dates else []).to_pydatetime().tolist())
+    insert_holiday_col(df_ticker_data, holidays_dict, holiday_col)
+
+
+# ----------------------------------------------------------------------
+# Unique Days Pivot Tables.
+# ----------------------------------------------------------------------
+
+def create_pivot_unique_days(df_ticker_data:pd.DataFrame, pivot_dict:Dict[Text, pd.DataFrame],
+                             pivot_dict_keys:List[Text], start_yr:int, end_yr:int, drop_idx:bool=False,
+                             raw_pivots:Optional[Dict[Text, pd.DataFrame]]=None):
+    '''
+    Purpose:
+        Same as 'preprocessing.create_pivot_unique_days'. The price changes are
+        averaged with one 'groupby' over the rows of the period and the years in
+        the window, which is what 'pivot_table' runs after copying the columns.
+    '''
+
+    logger.info('Start running (create_pivot_unique_days) function.')
+
+    for key in pivot_dict_keys:
+        idx_col, spec_year = get_unique_days_pivot_cols(key)
+        idx_cols = idx_col if isinstance(idx_col, list) else [idx_col]
+
+        if raw_pivots is not None:
+            pivot_dict[key] = raw_pivots[key].loc[:,start_yr:end_yr]
+        else:
+            agged = df_ticker_data.groupby(idx_cols + [spec_year])['price_diff'].mean().dropna()
+            if agged.empty:
+                preprocessing.create_pivot_unique_days(df_ticker_data, pivot_dict, [key], start_yr, end_yr, drop_idx)
+                continue
+            # Keep the column-major layout of 'pivot_table', which decides the order the pandas
+            # reductions of the legacy 'summarise_pivot' add the years in.
+            pivot = agged.unstack(spec_year)
+            pivot = pd.DataFrame(np.asfortranarray(pivot.to_numpy()), index=pivot.index, columns=pivot.columns)
+            pivot_dict[key] = pivot.loc[:,start_yr:end_yr]
+        logger.debug(f'----- Created a pivot table for ({key}) for ticker data.')
+
+        # Index the holidays by their category, the same as the legacy function.
+        if 'tww' not in key:
+            if drop_idx:
+                pivot_dict[key].index = pd.RangeIndex(len(pivot_dict[key]))
+            if key in HOLIDAYS_KEYS:
+                category = pd.Index([key] * len(pivot_dict[key]), name='holiday_category')
+                pivot_dict[key].set_index(category, append=not drop_idx, inplace=True)
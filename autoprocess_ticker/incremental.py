@@ -0,0 +1,579 @@
+
+
+import logging, os, pickle
+from typing import Dict, List, Optional, Text, Tuple, Union
+import numpy as np
+import pandas as pd
+
+# Personal modules.
+from config.config import (
+    LOG_PROCESSING_FILEPATH, FREQ_KEYS, FREQ_COLS, START_YR_RANGE, END_YR, HOLIDAYS_KEYS, SPECIAL_DAYS_KEYS,
+    QUANTILE_LEVELS, QUANTILE_COLS, PREPROCESSING_ENGINE
+)
+from config.config_logger import setup_logger
+from autoprocess_ticker import preprocessing, panel, ticker_stages
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# ----------------------------------------------------------------------
+# Year-Partitioned Pivots.
+# ----------------------------------------------------------------------
+
+def hash_year_rows(df:pd.DataFrame, year_col:Text, cols:List[Text]) -> Dict[float, Tuple[int, int, int]]:
+    '''
+    Purpose:
+        Hash the rows behind each year column of a pivot table, to find the years
+        that changed. The row hashes are summed per year, plain and weighted by the
+        position of the row within its year, so a change of any value, or of the
+        row order, changes the hash of its year.
+
+    Return :
+        Dictionary of the year and its row count and hash sums.
+    '''
+
+    df = df[df[year_col].notna()]
+    row_hashes = pd.util.hash_pandas_object(df[cols], index=False).to_numpy()
+    years = df[year_col].to_numpy()
+    order = np.argsort(years, kind='stable')
+    row_hashes, years = row_hashes[order], years[order]
+
+    starts = np.flatnonzero(np.r_[True, years[1:] != years[:-1]]) if len(years) else np.array([], dtype=np.int64)
+    sizes = np.diff(np.r_[starts, len(years)])
+    positions = (np.arange(len(years)) - np.repeat(starts, sizes) + 1).astype(np.uint64)
+    # The uint64 sums wrap around, which keeps every bit of the hashes.
+    sums = np.add.reduceat(row_hashes, starts) if len(years) else row_hashes
+    weighted_sums = np.add.reduceat(row_hashes * positions, starts) if len(years) else row_hashes
+    return {year: (int(size), int(hash_sum), int(weighted_sum))
+            for year, size, hash_sum, weighted_sum in zip(years[starts], sizes, sums, weighted_sums)}
+
+
+class YearPivot:
+    '''
+    Pivot table of 'pivot_table' with one column per year, kept with the hash of
+    the rows behind each year. An update only pivots the rows of the years whose
+    rows changed, and replaces those columns. A cell only depends on the rows of
+    its own year, so the table is the same as pivoting every row again.
+    '''
+
+    def __init__(self, index:Union[Text, List[Text]], year_col:Text, value:Text):
+        self.index = index
+        self.year_col = year_col
+        self.value = value
+        self.table: Optional[pd.DataFrame] = None
+        self.hashes: Dict[float, Tuple[int, int, int]] = {}
+        self.last_changed: List[float] = []
+
+    def update(self, df:pd.DataFrame) -> List[float]:
+        '''
+        Purpose:
+            Pivot the years of (df) that changed since the last update.
+
+        Input  :
+            df: Dataframe. Every row of the ticker, with the index, year and value columns.
+
+        Return :
+            List of the years that were pivoted again or removed.
+        '''
+
+        index = [self.index] if isinstance(self.index, str) else list(self.index)
+        hashes = hash_year_rows(df, self.year_col, index + [self.value])
+        changed = sorted(year for year in set(hashes) | set(self.hashes) if hashes.get(year) != self.hashes.get(year))
+        self.hashes, self.last_changed = hashes, changed
+        if not changed and self.table is not None:
+            return changed
+
+        rows = df[df[self.year_col].isin(changed)]
+        table = rows.pivot_table(values=self.value, index=self.index, columns=self.year_col, aggfunc='mean')
+        if self.table is not None:
+            table = self.table.drop(columns=changed, errors='ignore').join(table, how='outer')
+
+        # Same order and the same empty rows and columns dropped as 'pivot_table'.
+        table = table.sort_index().reindex(columns=sorted(table.columns))
+        table = table.dropna(how='all').dropna(axis=1, how='all')
+        table.columns.name = self.year_col
+        self.table = table
+        return changed
+
+
+# ----------------------------------------------------------------------
+# Per-Year Partial Aggregates.
+# ----------------------------------------------------------------------
+
+# Partial aggregates of each row of a year column. The squared deviations (m2) are
+# merged with the update of Chan et al., which stays accurate for any mean.
+PARTIAL_FIELDS = ['count', 'sum', 'm2', 'max', 'min', 'pos_sum', 'pos_count', 'neg_sum', 'neg_count']
+
+
+class YearPartials:
+    '''
+    Partial aggregates of every row of a pivot table, one array per year. The
+    stats of a window of years are merged from the partials of its years, so an
+    update only computes the partials of the years that changed. The values are
+    kept as well, for the median and the percentiles.
+    '''
+
+    def __init__(self):
+        self.periods: Optional[pd.Index] = None
+        self.values: Dict[float, np.ndarray] = {}
+        self.parts: Dict[float, np.ndarray] = {}
+        self.col_avg: Dict[float, float] = {}
+
+    def update(self, pivot:pd.DataFrame, changed:List[float]) -> List[float]:
+        '''
+        Purpose:
+            Compute the partials of the changed years, and of the years that are new
+            to (pivot). Every year is computed again if the rows of (pivot) changed.
+
+        Input  :
+            pivot  : Dataframe. Pivot table indexed by its periods.
+            changed: List of the years whose column changed.
+
+        Return :
+            List of the years whose partials were computed.
+        '''
+
+        year_cols = list(pivot.columns)
+        periods = pivot.index
+        if self.periods is None or not periods.equals(self.periods) or periods.names != self.periods.names:
+            self.values, self.parts, self.col_avg = {}, {}, {}
+        self.periods = periods
+
+        for year in set(self.values) - set(year_cols):
+            del self.values[year], self.parts[year], self.col_avg[year]
+
+        computed = [year for year in year_cols if year in changed or year not in self.values]
+        for year in computed:
+            values = pivot[year].to_numpy(dtype=np.float64)
+            valid, pos, neg = ~np.isnan(values), values > 0, values < 0
+            filled = np.where(valid, values, 0.0)
+            self.values[year] = values
+            self.parts[year] = np.array([
+                valid.astype(np.float64), filled, np.zeros(len(values)), values, values,
+                np.where(pos, values, 0.0), pos.astype(np.float64), np.where(neg, values, 0.0), neg.astype(np.float64)
+            ])
+            self.col_avg[year] = pivot[year].mean()
+        return computed
+
+    def window_years(self, start_yr:int, end_yr:int) -> List[float]:
+        return sorted(year for year in self.values if start_yr <= year <= end_yr)
+
+    def merge(self, start_yr:int, end_yr:int) -> Dict[Text, np.ndarray]:
+        '''
+        Purpose:
+            Merge the partials of the years of a window, in year order.
+
+        Return :
+            Dictionary of the field of (PARTIAL_FIELDS) and its array, one value per row.
+        '''
+
+        n_rows = len(self.periods)
+        merged = dict(zip(PARTIAL_FIELDS, np.zeros((len(PARTIAL_FIELDS), n_rows))))
+        merged['max'], merged['min'] = np.full(n_rows, np.nan), np.full(n_rows, np.nan)
+        mean = np.zeros(n_rows)
+
+        for year in self.window_years(start_yr, end_yr):
+            part = dict(zip(PARTIAL_FIELDS, self.parts[year]))
+            count = merged['count'] + part['count']
+            with np.errstate(invalid='ignore', divide='ignore'):
+                part_mean = np.where(part['count'] > 0, part['sum'] / np.maximum(part['count'], 1), 0.0)
+                delta = part_mean - mean
+                merged['m2'] = merged['m2'] + part['m2'] + np.where(count > 0, delta ** 2 * merged['count'] * part['count'] / count, 0.0)
+                mean = np.where(count > 0, mean + delta * part['count'] / np.maximum(count, 1), 0.0)
+            for field in ['sum', 'pos_sum', 'pos_count', 'neg_sum', 'neg_count']:
+                merged[field] = merged[field] + part[field]
+            merged['max'], merged['min'] = np.fmax(merged['max'], part['max']), np.fmin(merged['min'], part['min'])
+            merged['count'] = count
+        return merged
+
+    def window_values(self, start_yr:int, end_yr:int) -> np.ndarray:
+        # Array of row x year of the window.
+        years = self.window_years(start_yr, end_yr)
+        return np.stack([self.values[year] for year in years], axis=1) if years else np.full((len(self.periods), 0), np.nan)
+
+
+def row_quantiles(values:np.ndarray, levels:List[float]) -> np.ndarray:
+    '''
+    Purpose:
+        Same as 'np.nanquantile' along the rows, with the linear interpolation of
+        the pandas quantiles, for every row at once.
+
+    Input  :
+        values: Array of row x year. NaN where a row has no value.
+        levels: List of the quantile levels. Example: [0.5, 0.05]
+
+    Return :
+        Array of level x row. NaN for the rows without values.
+    '''
+
+    counts = (~np.isnan(values)).sum(axis=1)
+    values = np.sort(values, axis=1)
+    quantiles = np.full((len(levels), len(values)), np.nan)
+    rows = np.flatnonzero(counts > 0)
+    for i, level in enumerate(levels):
+        positions = level * (counts[rows] - 1)
+        lower = np.floor(positions).astype(np.int64)
+        upper = np.minimum(lower + 1, counts[rows] - 1)
+        lower_values, upper_values = values[rows, lower], values[rows, upper]
+        quantiles[i, rows] = lower_values + (upper_values - lower_values) * (positions - lower)
+    return quantiles
+
+
+def summarise_partials(partials:YearPartials, start_yr:int, end_yr:int, index:pd.Index) -> pd.DataFrame:
+    '''
+    Purpose:
+        Compute the columns of 'preprocessing.summarise_pivot' for a window of years
+        from the merged partials.
+
+    Input  :
+        partials: YearPartials of a pivot table.
+        start_yr: Int. First year of the window.
+        end_yr  : Int. Last year of the window.
+        index   : Index of the pivot table, for the index of the stats.
+
+    Return :
+        Dataframe of the stats, indexed by (index).
+    '''
+
+    merged = partials.merge(start_yr, end_yr)
+    counts, up_counts, down_counts = merged['count'], merged['pos_count'], merged['neg_count']
+
+    # At most one value per year, so the order statistics are taken from the values.
+    order_stats = row_quantiles(partials.window_values(start_yr, end_yr), [0.5] + QUANTILE_LEVELS)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_diff = np.where(counts > 0, merged['sum'] / counts, np.nan)
+        prob = np.round(up_counts / (up_counts + down_counts), 4)
+        stats = {
+            'avg_diff': avg_diff,
+            'med_diff': order_stats[0],
+            **{f'{col}_diff': level_values for col, level_values in zip(QUANTILE_COLS, order_stats[1:])},
+            'tot_diff': merged['sum'],
+            'max_diff': merged['max'],
+            'min_diff': merged['min'],
+            'std_diff': np.where(counts > 1, np.sqrt(merged['m2'] / (counts - 1)), np.nan),
+            'up_overall': (avg_diff > 0).astype(np.int64),
+            'pos_avg_diff': np.where(up_counts > 0, merged['pos_sum'] / up_counts, np.nan),
+            'up_counts': up_counts.astype(np.int64),
+            'neg_avg_diff': np.where(down_counts > 0, merged['neg_sum'] / down_counts, np.nan),
+            'down_counts': down_counts.astype(np.int64),
+            'up_prob': prob,
+            'down_prob': 1 - prob,
+        }
+    return pd.DataFrame(stats, index=index)
+
+
+def summarise_partials_vol(partials:YearPartials, start_yr:int, end_yr:int, pivot:pd.DataFrame) -> Tuple[pd.DataFrame, ...]:
+    '''
+    Purpose:
+        Compute the frames of 'preprocessing.compute_avg_vol' and
+        'preprocessing.summarise_pivot_vol' for a window of years from the partials.
+        The average volume of a year and the rows above it only depend on that year.
+
+    Input  :
+        partials: YearPartials of a volume pivot table.
+        start_yr: Int. First year of the window.
+        end_yr  : Int. Last year of the window.
+        pivot   : Dataframe. The volume pivot table, indexed by its periods.
+
+    Return :
+        Tuple of the (avg_vol_row), (avg_vol_col) and the above average count dataframes,
+        indexed by the periods of (pivot), except (avg_vol_col) by the years.
+    '''
+
+    merged = partials.merge(start_yr, end_yr)
+    percentiles = row_quantiles(partials.window_values(start_yr, end_yr), QUANTILE_LEVELS)
+    years = partials.window_years(start_yr, end_yr)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_vol_row = pd.DataFrame({
+            'avg_vol_row': np.where(merged['count'] > 0, merged['sum'] / merged['count'], np.nan),
+            **{f'{col}_vol': level_values for col, level_values in zip(QUANTILE_COLS, percentiles)}
+        }, index=pivot.index)
+
+    avg_vol_col = pd.DataFrame({'avg_vol_col': [partials.col_avg[year] for year in years]},
+                               index=pivot.loc[:, start_yr:end_yr].columns)
+
+    # Same as 'summarise_pivot_vol', which takes every year of the window.
+    abv_avg_vol = {}
+    for year in range(start_yr, end_yr + 1):
+        year_values = partials.values[year]
+        flags = np.full(len(year_values), np.nan)
+        flags[year_values > partials.col_avg[year]] = 1
+        flags[year_values < partials.col_avg[year]] = 0
+        abv_avg_vol[f'abv_avg_vol_{year}'] = flags
+    stats = pd.DataFrame(abv_avg_vol, index=pivot.index)
+    stats.columns.name = pivot.columns.name
+
+    total_counts = stats.count(axis=1)
+    abv_counts = stats.sum(axis=1)
+    stats['abv_avg_vol_counts'] = abv_counts
+    stats['blw_avg_vol_counts'] = total_counts - abv_counts
+    stats['abv_avg_vol_prob'] = abv_counts / total_counts
+    return avg_vol_row, avg_vol_col, stats
+
+
+# ----------------------------------------------------------------------
+# Incremental Stages.
+# ----------------------------------------------------------------------
+
+class IncrementalState:
+    '''
+    Year-partitioned pivot tables and per-year partials of a ticker, kept between
+    runs in its storage folder. A state of other config values is discarded.
+    '''
+
+    def __init__(self):
+        self.config_version = get_config_version()
+        self.pivots: Dict[Text, YearPivot] = {}
+        self.partials: Dict[Text, YearPartials] = {}
+
+    def year_pivot(self, name:Text, index:Union[Text, List[Text]], year_col:Text, value:Text) -> YearPivot:
+        return self.pivots.setdefault(name, YearPivot(index, year_col, value))
+
+    def year_partials(self, name:Text) -> YearPartials:
+        return self.partials.setdefault(name, YearPartials())
+
+
+def get_config_version() -> Tuple:
+    # The partials of another engine are discarded, as are those of other config values. 
+    return (FREQ_KEYS, FREQ_COLS, HOLIDAYS_KEYS, SPECIAL_DAYS_KEYS, QUANTILE_LEVELS, PREPROCESSING_ENGINE)
+
+
+def load_state(path:Text) -> IncrementalState:
+    if os.path.exists(path):
+        with open(path, 'rb') as in_file:
+            state = pickle.load(in_file)
+        if state.config_version == get_config_version():
+            return state
+        logger.debug(f'----- Discarded the incremental state ({path}) of other config values.')
+    return IncrementalState()
+
+
+def save_state(state:IncrementalState, path:Text):
+    # Write to a temporary file first, so a crash never leaves a partial state.
+    tmp_path = f'{path}.part-{os.getpid()}'
+    with open(tmp_path, 'wb') as out_file:
+        pickle.dump(state, out_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def summarise_windows(state:IncrementalState, source:Text, pivot_dict:Dict[Text, pd.DataFrame],
+                      pivot_dict_stats:Dict[Text, pd.DataFrame], freq_keys:List[Text], start_yr_range:List[int], end_yr:int):
+    # Same keys and windows as 'preprocessing.summarise_pivot'.
+    for freq in freq_keys:
+        for suffix, start_yr in panel.iter_stats_windows(start_yr_range):
+            stats_key = f'{freq}{suffix}'
+            index = preprocessing.get_stats_index(pivot_dict[freq].index, freq)
+            pivot_dict_stats[stats_key] = summarise_partials(state.partials[f'{source}_{freq}'], start_yr, end_yr, index)
+
+
+def update_pivots(state:IncrementalState, source:Text, df_ticker:Dict[Text, pd.DataFrame], pivot_value:Text) -> Dict[Text, pd.DataFrame]:
+    # Same pivot tables as 'preprocessing.create_pivot', with the partials of the changed years.
+    pivot_dict = {}
+    for freq_col, freq in zip(FREQ_COLS, FREQ_KEYS):
+        year_pivot = state.year_pivot(f'{source}_{freq}', panel.get_pivot_index(freq_col), 'year', pivot_value)
+        changed = year_pivot.update(df_ticker[freq])
+        pivot_dict[freq] = year_pivot.table
+        computed = state.year_partials(f'{source}_{freq}').update(pivot_dict[freq], changed)
+        logger.debug(f'----- Pivoted the years ({changed}) and computed the partials of ({computed}) for ({source}_{freq}).')
+    return pivot_dict
+
+
+def pivot_ticker_summary(df_ticker:Dict[Text, pd.DataFrame], start_yr:int, state:IncrementalState) -> Tuple[Dict, Dict]:
+    '''
+    Purpose:
+        Same as 'ticker_stages.pivot_ticker_summary', but only the years that
+        changed since the last run of (state) are pivoted and aggregated again.
+
+    Input  :
+        df_ticker: Dictionary. Preprocessed ticker data of (ProcessTickerData).
+        start_yr : Int. Starting year of the ticker.
+        state    : IncrementalState of the ticker. Updated in place.
+
+    Return :
+        Tuple of the pivot tables and their stats.
+    '''
+
+    logger.info('Start running (pivot_ticker_summary) function.')
+
+    pivot_ticker, pivot_stats = update_pivots(state, 'price', df_ticker, 'price_diff'), {}
+    summarise_windows(state, 'price', pivot_ticker, pivot_stats, FREQ_KEYS, [start_yr] + START_YR_RANGE[1:], END_YR)
+    return preprocessing.flatten_summary(pivot_ticker, pivot_stats)
+
+
+def pivot_vol_summary(df_ticker:Dict[Text, pd.DataFrame], start_yr:int, state:IncrementalState) -> Tuple[Dict, Dict]:
+    '''
+    Purpose:
+        Same as 'ticker_stages.pivot_vol_summary', but only the years that changed
+        since the last run of (state) are pivoted and aggregated again.
+
+    Return :
+        Tuple of the pivot tables and their stats.
+    '''
+
+    logger.info('Start running (pivot_vol_summary) function.')
+
+    pivot_volume, pivot_volume_stats = update_pivots(state, 'volume', df_ticker, 'volume'), {}
+    for freq in FREQ_KEYS:
+        for suffix, window_start_yr in panel.iter_stats_windows([start_yr]):
+            stats_key = f'{freq}{suffix}'
+            avg_vol_row, avg_vol_col, stats = summarise_partials_vol(state.partials[f'volume_{freq}'], window_start_yr,
+                                                                     END_YR, pivot_volume[freq])
+            pivot_volume_stats[f'{stats_key}_avg_vol_row'] = avg_vol_row
+            pivot_volume_stats[f'{stats_key}_avg_vol_col'] = avg_vol_col
+            pivot_volume_stats[stats_key] = stats
+    return preprocessing.flatten_summary(pivot_volume, pivot_volume_stats)
+
+
+def pivot_unique_days_summary(df_ticker:Dict[Text, pd.DataFrame], start_yr:int, state:IncrementalState) -> Tuple[Tuple, Tuple, Tuple]:
+    '''
+    Purpose:
+        Same as 'ticker_stages.pivot_unique_days_summary', but only the years that
+        changed since the last run of (state) are pivoted and aggregated again.
+
+    Return :
+        Tuple of the (pivot, stats) pairs of the holidays, the special days and the
+        weekly special days.
+    '''
+
+    logger.info('Start running (pivot_unique_days_summary) function.')
+
+    raw_pivots = {}
+    for source, (freq, keys) in ticker_stages.UNIQUE_DAYS_PIVOTS.items():
+        raw_pivots[source] = {}
+        for key in keys:
+            idx_col, spec_year = preprocessing.get_unique_days_pivot_cols(key)
+            year_pivot = state.year_pivot(f'{source}_{key}', idx_col, spec_year, 'price_diff')
+            year_pivot.update(df_ticker[freq])
+            raw_pivots[source][key] = year_pivot.table
+
+    # The compiled tables are cheap to concat again. Their partials are only computed for
+    # the years whose column changed, or again for every year if their rows changed.
+    pivot_dicts = ticker_stages.create_unique_days_pivots(df_ticker, start_yr, raw_pivots)
+    start_yr_range = [start_yr] + START_YR_RANGE[1:]
+    results = []
+    for (source, stats_keys), pivot_dict in zip(ticker_stages.UNIQUE_DAYS_STATS_KEYS.items(), pivot_dicts):
+        changed = sorted({year for key in ticker_stages.UNIQUE_DAYS_PIVOTS[source][1]
+                          for year in state.pivots[f'{source}_{key}'].last_changed})
+        for key in stats_keys:
+            state.year_partials(f'{source}_{key}').update(pivot_dict[key], changed)
+        pivot_dict_stats = {}
+        summarise_windows(state, source, pivot_dict, pivot_dict_stats, stats_keys, start_yr_range, END_YR)
+        results.append(preprocessing.flatten_summary(pivot_dict, pivot_dict_stats))
+    return tuple(results)
+
+
+# Incremental version of each summary stage and the name of its state file.
+INCREMENTAL_STAGES = {
+    'ticker': pivot_ticker_summary,
+    'vol': pivot_vol_summary,
+    'unique_days': pivot_unique_days_summary,
+}
+
+
+def run_stage(stage:Text, df_ticker:Dict[Text, pd.DataFrame], start_yr:int, storage_dir:Text):
+    '''
+    Purpose:
+        Run the incremental version of a summary stage with the state kept in the
+        storage folder of the ticker, and save the updated state. The state is only
+        a cache. A missing or outdated state is rebuilt from every year.
+
+    Input  :
+        stage      : Str. Key of (INCREMENTAL_STAGES). Example: 'ticker'
+        df_ticker  : Dictionary. Input frames of the stage.
+        start_yr   : Int. Starting year of the ticker.
+        storage_dir: Str. Storage folder of the ticker.
+
+    Return :
+        Same as the stage of 'ticker_stages'.
+    '''
+
+    path = os.path.join(storage_dir, f'year_partials_{stage}.pickle')
+    state = load_state(path)
+    result = INCREMENTAL_STAGES[stage](df_ticker, start_yr, state)
+    save_state(state, path)
+    return result
+
+
+# ----------------------------------------------------------------------
+# Verification.
+# ----------------------------------------------------------------------
+
+def run_stages(df_raw:Dict[Text, pd.DataFrame], start_yr:int, states:Optional[Dict[Text, IncrementalState]]=None) -> Dict[Text, Tuple]:
+    '''
+    Purpose:
+        Preprocess and trace the raw data of a ticker, and run the summary stages of
+        'ticker_stages', or the incremental ones if (states) is given.
+
+    Input  :
+        df_raw  : Dictionary. Raw dataframes of a ticker as (ProcessTickerData) reads them.
+        start_yr: Int. Starting year of the ticker.
+        states  : Dictionary of the stage name and its IncrementalState. Updated in place.
+
+    Return :
+        Dictionary of the stage name and its results.
+    '''
+
+    df_ticker = {freq: df.copy() for freq, df in df_raw.items()}
+    preprocessing.init_preprocess(df_ticker, FREQ_KEYS, FREQ_COLS)
+    df_unique_days = ticker_stages.trace_unique_period(df_ticker, start_yr)
+
+    stages = {
+        'ticker': (ticker_stages.pivot_ticker_summary, df_ticker),
+        'vol': (ticker_stages.pivot_vol_summary, df_ticker),
+        'unique_days': (ticker_stages.pivot_unique_days_summary, df_unique_days),
+    }
+    if states is None:
+        return {stage: full(df, start_yr) for stage, (full, df) in stages.items()}
+    return {stage: INCREMENTAL_STAGES[stage](df, start_yr, states.setdefault(stage, IncrementalState()))
+            for stage, (_, df) in stages.items()}
+
+
+def verify_incremental(df_base:Dict[Text, pd.DataFrame], df_raw:Dict[Text, pd.DataFrame], start_yr:int) -> bool:
+    '''
+    Purpose:
+        Check an incremental update against a full rebuild. The states are built
+        from (df_base) and updated with (df_raw), so only the years whose rows
+        differ are pivoted and aggregated again. The pivot tables must be the same,
+        and the stats the same to a relative tolerance, since the partials are
+        summed in another order.
+
+    Input  :
+        df_base : Dictionary. Raw dataframes of the ticker before the update. Example: without the last bars.
+        df_raw  : Dictionary. Raw dataframes of the ticker after the update.
+        start_yr: Int. Starting year of the ticker.
+
+    Return :
+        True if every check passes. Raises AssertionError otherwise.
+    '''
+
+    logger.info('Start running (verify_incremental) function.')
+
+    states = {}
+    run_stages(df_base, start_yr, states)
+    results = run_stages(df_raw, start_yr, states)
+    expected_results = run_stages(df_raw, start_yr)
+
+    def flatten(result):
+        # The (pivot, stats) pairs of a stage.
+        return [result] if isinstance(result[0], dict) else list(result)
+
+    for stage, expected_result in expected_results.items():
+        for (pivot_dict, stats_dict), (expected_pivots, expected_stats) in zip(flatten(results[stage]), flatten(expected_result)):
+            assert pivot_dict.keys() == expected_pivots.keys(), stage
+            for key, df in expected_pivots.items():
+                pd.testing.assert_frame_equal(pivot_dict[key], df, check_names=False)
+            assert stats_dict.keys() == expected_stats.keys(), stage
+            for key, df in expected_stats.items():
+                pd.testing.assert_frame_equal(stats_dict[key], df, check_exact=False, rtol=1e-9, check_dtype=False)
+
+    changed = {name: year_pivot.last_changed for state in states.values() for name, year_pivot in state.pivots.items()}
+    logger.debug(f'----- Verified the incremental update of the years ({changed}) against a full rebuild.')
+    return True
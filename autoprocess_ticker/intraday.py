@@ -0,0 +1,251 @@
+
+
+import logging, re
+from typing import Dict, IO, Iterator, List, Optional, Text, Tuple, Union
+import numpy as np
+import pandas as pd
+
+# Personal modules.
+from config.config import (
+    LOG_PROCESSING_FILEPATH, START_YR_RANGE, END_YR, INTRADAY_KEYS, INTRADAY_COLS, INTRADAY_TICKER_FREQ,
+    INTRADAY_BUCKET_MINUTES, INTRADAY_CHUNK_ROWS, INTRADAY_TIMEZONE, SKETCH_K, QUANTILE_LEVELS, QUANTILE_COLS
+)
+from config.config_logger import setup_logger
+from autoprocess_ticker import preprocessing, quantile_sketch
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# ----------------------------------------------------------------------
+# Chunked Ingestion.
+# ----------------------------------------------------------------------
+
+# Values aggregated for each period and year.
+INTRADAY_VALUES = ['price_diff', 'volume']
+
+
+def get_intraday_keys(ticker_freq:Text) -> List[Text]:
+    # Example: '60m' -> ['intraday_by_hour', 'intraday_by_weekday_hour']
+    return [key for key, key_freq in zip(INTRADAY_KEYS, INTRADAY_TICKER_FREQ) if key_freq == ticker_freq]
+
+
+def init_preprocess_intraday(df:pd.DataFrame, prev_close:float=np.nan) -> Tuple[pd.DataFrame, float]:
+    '''
+    Purpose:
+        Same as 'preprocessing.init_preprocess' for a chunk of intraday bars.
+        1. Cast the column names to lowercase.
+        2. Compute the price change from the close before the chunk.
+        3. Convert the bar times to the exchange time, and extract the year.
+        4. Create the period columns of every intraday key: hour, weekday and
+           minute_bucket (the minute of the day the bucket starts at).
+
+    Input  :
+        df        : Dataframe. Chunk of a Yahoo intraday CSV, with a 'Datetime' column.
+        prev_close: Float. Last close of the previous chunk. NaN for the first chunk.
+
+    Return :
+        Tuple of the preprocessed chunk and its last close for the next chunk.
+    '''
+
+    df.columns = list(map(str.lower, df.columns))
+    time_col = 'datetime' if 'datetime' in df.columns else 'date'
+
+    # Yahoo adds the UTC offset to the bar times. Naive times are already exchange times.
+    if re.search(r'(?:[+-]\d{2}:?\d{2}|Z)$', str(df[time_col].iloc[0])):
+        times = pd.to_datetime(df[time_col], utc=True).dt.tz_convert(INTRADAY_TIMEZONE).dt.tz_localize(None)
+    else:
+        times = pd.to_datetime(df[time_col])
+    df['datetime'] = times
+
+    # Forward fill the missing closes like 'pct_change', carrying the close across chunks.
+    close = df['adj close'] if 'adj close' in df.columns else df['close']
+    close = pd.concat([pd.Series([prev_close]), close], ignore_index=True).ffill()
+    df['price_diff'] = (close / close.shift(1) - 1).iloc[1:].to_numpy()
+
+    df['year'] = times.dt.year
+    df['hour'] = times.dt.hour
+    df['weekday'] = times.dt.weekday
+    df['minute_bucket'] = (times.dt.hour * 60 + times.dt.minute) // INTRADAY_BUCKET_MINUTES * INTRADAY_BUCKET_MINUTES
+    return df, close.iloc[-1]
+
+
+def iter_intraday_chunks(in_file:Union[Text, IO], chunk_rows:int=INTRADAY_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    '''
+    Purpose:
+        Read an intraday CSV (chunk_rows) rows at a time and preprocess each chunk
+        with (init_preprocess_intraday).
+
+    Input  :
+        in_file   : Str or file object. Intraday CSV.
+        chunk_rows: Int. Number of rows per chunk.
+
+    Return :
+        Iterator of the preprocessed chunks.
+    '''
+
+    prev_close = np.nan
+    for df in pd.read_csv(in_file, chunksize=chunk_rows):
+        df, prev_close = init_preprocess_intraday(df, prev_close)
+        yield df
+
+
+# ----------------------------------------------------------------------
+# Incremental Aggregation.
+# ----------------------------------------------------------------------
+
+class IntradayAggregator:
+    '''
+    Running sums and counts of the price change and the volume of each period and
+    year of every intraday key, and the quantile sketches of the price change. The
+    chunks are added one at a time, so only the aggregates are kept.
+
+    Example:
+        aggregator = IntradayAggregator()
+        for df in iter_intraday_chunks('SPY_60m.csv'):
+            aggregator.update(df, get_intraday_keys('60m'))
+        pivot_intraday = aggregator.pivots('price_diff')
+    '''
+
+    def __init__(self, keys:List[Text]=INTRADAY_KEYS, k:Optional[int]=SKETCH_K):
+        self.keys = list(keys)
+        self.period_cols = {key: INTRADAY_COLS[INTRADAY_KEYS.index(key)] for key in self.keys}
+        self.sums: Dict[Text, Optional[pd.DataFrame]] = dict.fromkeys(self.keys)
+        self.grids = {key: quantile_sketch.SketchGrid(self.period_cols[key], k) for key in self.keys}
+        self.rows = 0
+
+    def update(self, df:pd.DataFrame, keys:List[Text]) -> 'IntradayAggregator':
+        for key in keys:
+            agg = df.groupby(self.period_cols[key] + ['year'])[INTRADAY_VALUES].agg(['sum', 'count'])
+            self.sums[key] = agg if self.sums[key] is None else self.sums[key].add(agg, fill_value=0)
+            self.grids[key].update(df, 'price_diff')
+        self.rows += len(df)
+        return self
+
+    def pivots(self, value:Text) -> Dict[Text, pd.DataFrame]:
+        '''
+        Purpose:
+            Create the pivot tables of a value, with the mean of each period and
+            year, indexed by the periods like 'preprocessing.create_pivot'.
+
+        Input  :
+            value: Str. One of (INTRADAY_VALUES).
+
+        Return :
+            Dictionary of intraday key and its pivot table.
+        '''
+
+        pivot_dict = {}
+        for key in self.keys:
+            if self.sums[key] is None:
+                continue
+            sums, counts = self.sums[key][(value, 'sum')], self.sums[key][(value, 'count')]
+            pivot = (sums / counts.where(counts > 0)).unstack('year').sort_index()
+            pivot.columns = pivot.columns.astype(np.int64)
+            pivot.columns.name = 'year'
+            pivot_dict[key] = pivot
+        return pivot_dict
+
+
+def aggregate_intraday(csv_files:Dict[Text, Union[Text, IO]], chunk_rows:int=INTRADAY_CHUNK_ROWS,
+                       k:Optional[int]=SKETCH_K) -> IntradayAggregator:
+    '''
+    Purpose:
+        Aggregate the intraday CSVs of a ticker chunk by chunk.
+
+    Input  :
+        csv_files : Dictionary of the Yahoo interval and its CSV. Example: {'60m': 'SPY_60m.csv', '5m': ...}
+        chunk_rows: Int. Number of rows per chunk.
+        k         : Int. Accuracy of the quantile sketches. Exact if None.
+
+    Return :
+        IntradayAggregator of every intraday key of the intervals.
+    '''
+
+    logger.info('Start running (aggregate_intraday) function.')
+
+    aggregator = IntradayAggregator([key for ticker_freq in csv_files for key in get_intraday_keys(ticker_freq)], k)
+    for ticker_freq, in_file in csv_files.items():
+        for df in iter_intraday_chunks(in_file, chunk_rows):
+            aggregator.update(df, get_intraday_keys(ticker_freq))
+        logger.debug(f'----- Aggregated the ({ticker_freq}) bars -- ({aggregator.rows}) rows so far.')
+    return aggregator
+
+
+def pivot_intraday_summary(aggregator:IntradayAggregator, start_yr:int) -> Tuple[Tuple, Tuple]:
+    '''
+    Purpose:
+        Create the pivot tables and the stats of the price change and the volume
+        of the intraday keys, the same way as (pivot_ticker_summary) and
+        (pivot_vol_summary) of 'ticker_stages'.
+
+    Input  :
+        aggregator: IntradayAggregator of (aggregate_intraday).
+        start_yr  : Int. Starting year of the ticker. The intraday history often
+                    starts later, and then its first year is used instead.
+
+    Return :
+        Tuple of the flat (pivot, stats) pairs of the price change and the volume.
+    '''
+
+    pivot_intraday, pivot_intraday_stats = aggregator.pivots('price_diff'), {}
+    pivot_volume, pivot_volume_stats = aggregator.pivots('volume'), {}
+    keys = list(pivot_intraday)
+    if not keys:
+        return (pivot_intraday, pivot_intraday_stats), (pivot_volume, pivot_volume_stats)
+
+    first_yr = max(start_yr, min(int(pivot.columns[0]) for pivot in pivot_intraday.values()))
+    start_yr_range = [first_yr] + START_YR_RANGE[1:]
+
+    preprocessing.summarise_pivot(pivot_intraday, pivot_intraday_stats, keys, start_yr_range, END_YR)
+    preprocessing.compute_avg_vol(pivot_volume, pivot_volume_stats, keys, [first_yr], END_YR)
+    preprocessing.summarise_pivot_vol(pivot_volume, pivot_volume_stats, keys, [first_yr], END_YR)
+    return (preprocessing.flatten_summary(pivot_intraday, pivot_intraday_stats),
+            preprocessing.flatten_summary(pivot_volume, pivot_volume_stats))
+
+
+# ----------------------------------------------------------------------
+# Verification.
+# ----------------------------------------------------------------------
+
+def verify_intraday(csv_files:Dict[Text, Text], chunk_rows:int=INTRADAY_CHUNK_ROWS) -> bool:
+    '''
+    Purpose:
+        Check the chunked aggregation against the whole CSV in one frame, pivoted
+        with 'pivot_table' like 'preprocessing.create_pivot'. The exact sketches of
+        the chunks must also give the same percentiles as the whole frame.
+
+    Input  :
+        csv_files : Dictionary of the Yahoo interval and its CSV path.
+        chunk_rows: Int. Number of rows per chunk. Should split the CSVs into several chunks.
+
+    Return :
+        True if every check passes. Raises AssertionError otherwise.
+    '''
+
+    logger.info('Start running (verify_intraday) function.')
+
+    aggregator = aggregate_intraday(csv_files, chunk_rows, k=None)
+    for ticker_freq, path in csv_files.items():
+        df, _ = init_preprocess_intraday(pd.read_csv(path))
+        for key in get_intraday_keys(ticker_freq):
+            index = aggregator.period_cols[key]
+            for value, pivot_dict in [(value, aggregator.pivots(value)) for value in INTRADAY_VALUES]:
+                expected = df.pivot_table(values=value, index=index, columns='year', aggfunc='mean')
+                pd.testing.assert_frame_equal(pivot_dict[key], expected, check_exact=False, rtol=1e-9,
+                                              check_dtype=False, check_names=False)
+
+            last_yr = df['year'].max()
+            expected = df[df['year'] == last_yr].groupby(index)['price_diff'].quantile(QUANTILE_LEVELS[0])
+            # The grid also has the periods without bars in the year, with NaN percentiles.
+            quantiles = aggregator.grids[key].quantiles(last_yr, last_yr).dropna().sort_values(index)
+            assert np.allclose(quantiles[f'{QUANTILE_COLS[0]}_diff'].to_numpy(), expected.to_numpy(),
+                               rtol=1e-12, atol=1e-15), key
+
+    logger.debug(f'----- Verified the intraday aggregation of ({aggregator.rows}) rows in chunks of ({chunk_rows}).')
+    return True
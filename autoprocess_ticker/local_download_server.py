@@ -0,0 +1,166 @@
+
+
+import logging, threading, time, zlib
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Iterator, Text, Tuple
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import pandas as pd
+
+# Personal modules.
+from config.config import LOG_PROCESSING_FILEPATH
+from config.config_logger import setup_logger
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# ----------------------------------------------------------------------
+# Synthetic Ticker Data.
+# ----------------------------------------------------------------------
+
+# Resample rules for each Yahoo interval.
+INTERVAL_RULES = {'1d': None, '1wk': 'W-MON', '1mo': 'MS'}
+
+# Minutes of each intraday bar. The session runs from 09:30 to 16:00.
+INTRADAY_MINUTES = {'60m': 60, '30m': 30, '15m': 15, '5m': 5, '1m': 1}
+SESSION_START_MINUTE, SESSION_MINUTES = 9 * 60 + 30, 390
+
+
+def generate_ticker_csv(ticker:Text, period1:int, period2:int, interval:Text) -> bytes:
+    '''
+    Purpose:
+        Generate a Yahoo-like CSV of random walk prices for a ticker. The same
+        ticker always produces the same prices, so the downstream outputs are
+        reproducible across runs.
+
+    Input  :
+        ticker  : Str. Ticker symbol. Used as the random seed.
+        period1 : Int. Start timestamp.
+        period2 : Int. End timestamp.
+        interval: Str. Must be '1d' / '1wk' / '1mo', or one of (INTRADAY_MINUTES).
+
+    Return :
+        CSV content in bytes.
+    '''
+
+    if interval in INTRADAY_MINUTES:
+        return b''.join(iter_intraday_csv(ticker, period1, period2, interval))
+
+    rng = np.random.default_rng(zlib.crc32(ticker.encode()))
+    dates = pd.bdate_range(datetime.fromtimestamp(period1).date(), datetime.fromtimestamp(period2).date())
+    prices = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.01, len(dates))))
+    volumes = rng.integers(1e6, 5e6, len(dates))
+
+    df = pd.DataFrame({
+        'Date': dates, 'Open': prices, 'High': prices, 'Low': prices,
+        'Close': prices, 'Adj Close': prices, 'Volume': volumes
+    })
+
+    # Aggregate the daily bars into weekly or monthly bars.
+    if INTERVAL_RULES[interval] is not None:
+        df = df.set_index('Date').resample(INTERVAL_RULES[interval], label='left', closed='left').agg({
+            'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Adj Close': 'last', 'Volume': 'sum'
+        }).dropna().reset_index()
+
+    return df.to_csv(index=False, date_format='%Y-%m-%d').encode()
+
+
+def iter_intraday_csv(ticker:Text, period1:int, period2:int, interval:Text, chunk_days:int=250) -> Iterator[bytes]:
+    '''
+    Purpose:
+        Generate a Yahoo-like CSV of random walk intraday bars for a ticker,
+        (chunk_days) business days at a time, so a long history can be written
+        to a file without holding it in memory.
+
+    Input  :
+        ticker    : Str. Ticker symbol. Used as the random seed.
+        period1   : Int. Start timestamp.
+        period2   : Int. End timestamp.
+        interval  : Str. One of (INTRADAY_MINUTES). Example: '60m' / '5m'
+        chunk_days: Int. Number of business days per chunk.
+
+    Return :
+        Iterator of the CSV content in bytes. The first chunk has the header.
+    '''
+
+    rng = np.random.default_rng(zlib.crc32(ticker.encode()))
+    days = pd.bdate_range(datetime.fromtimestamp(period1).date(), datetime.fromtimestamp(period2).date())
+    minutes = SESSION_START_MINUTE + np.arange(0, SESSION_MINUTES, INTRADAY_MINUTES[interval])
+    offsets = pd.to_timedelta(minutes, unit='m')
+    last_price = 100.0
+
+    for lo in range(0, len(days), chunk_days):
+        times = (days[lo:lo + chunk_days].values[:, None] + offsets.values[None, :]).ravel()
+        prices = last_price * np.exp(np.cumsum(rng.normal(0.00002, 0.002, len(times))))
+        last_price = prices[-1]
+
+        df = pd.DataFrame({
+            'Datetime': times, 'Open': prices, 'High': prices, 'Low': prices,
+            'Close': prices, 'Adj Close': prices, 'Volume': rng.integers(1e4, 5e4, len(times))
+        })
+        yield df.to_csv(index=False, header=lo == 0, date_format='%Y-%m-%d %H:%M:%S').encode()
+
+
+# ----------------------------------------------------------------------
+# Stand-In Download Server.
+# ----------------------------------------------------------------------
+
+class DownloadRequestHandler(BaseHTTPRequestHandler):
+    '''
+    Serve '/{version}/finance/download/{ticker}?period1=&period2=&interval='
+    like the Yahoo download endpoint.
+    '''
+
+    # Seconds to wait before responding to mimic the network latency.
+    latency = 0.0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        try:
+            ticker = url.path.rstrip('/').split('/')[-1]
+            content = generate_ticker_csv(ticker, int(query['period1'][0]), int(query['period2'][0]),
+                                          query['interval'][0])
+        except (KeyError, ValueError):
+            self.send_error(400, 'Invalid download params.')
+            return
+
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        logger.debug(f'----- Stand-in download server -- {format % args}')
+
+
+def start_server(port:int=0, latency:float=0.0) -> Tuple[ThreadingHTTPServer, Text]:
+    '''
+    Purpose:
+        Start the stand-in download server on a background thread.
+
+    Input  :
+        port   : Int. Port to listen on. 0 picks a free port.
+        latency: Float. Seconds to wait before responding to each request.
+
+    Return :
+        The server (call 'shutdown()' to stop it) and its host URL for 'YAHOO_DOWNLOAD_HOST'.
+    '''
+
+    handler = type('DownloadRequestHandler', (DownloadRequestHandler,), {'latency': latency})
+    server = ThreadingHTTPServer(('localhost', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    host = f'http://localhost:{server.server_address[1]}'
+    logger.info(f'Started the stand-in download server at ({host}).')
+    return server, host
@@ -0,0 +1,226 @@
+
+
+import os, asyncio, ctypes, ctypes.util, gc, logging, resource, sys
+from typing import Dict, Iterable, List, Optional, Text
+import luigi
+
+# psutil is optional. Without it the resident memory is read from '/proc' on Linux only.
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Personal modules.
+from config.config import (
+    LOG_PROCESSING_FILEPATH, TICKER_FREQ, MEMORY_BASE_MB, MEMORY_BYTES_PER_ROW, MEMORY_LARGE_MB, MEMORY_MAX_LARGE,
+    MEMORY_SPILL_RATIO
+)
+from config.config_logger import setup_logger
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# ----------------------------------------------------------------------
+# Resident Memory.
+# ----------------------------------------------------------------------
+
+def read_rss(pid:Optional[int]=None) -> Optional[int]:
+    '''
+    Purpose:
+        Read the resident memory of a process in bytes. The current process if
+        (pid) is not given. None if it can't be read on this platform.
+    '''
+
+    pid = pid or os.getpid()
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            return None
+    try:
+        with open(f'/proc/{pid}/statm') as in_file:
+            return int(in_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def read_tree_rss(pid:int) -> Optional[int]:
+    '''
+    Purpose:
+        Read the resident memory of a process and all its child processes in
+        bytes. Example: the executor and its worker processes.
+    '''
+
+    if psutil is not None:
+        try:
+            parent = psutil.Process(pid)
+            return sum(proc.memory_info().rss for proc in [parent] + parent.children(recursive=True))
+        except psutil.Error:
+            return None
+
+    # Without psutil, walk the parent ids in '/proc'.
+    if not os.path.isdir('/proc'):
+        return None
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as in_file:
+                # The command name is in brackets and may contain spaces, so split after it.
+                ppid = int(in_file.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        total += read_rss(current) or 0
+        stack.extend(children.get(current, []))
+    return total
+
+
+def read_peak_rss() -> int:
+    # Peak resident memory of the current process in bytes. Linux reports KB, macOS bytes.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def release_memory():
+    '''
+    Purpose:
+        Collect the garbage, and return the freed heap pages to the system when the
+        C library supports it (glibc). Otherwise the resident memory of a worker
+        only grows to the peak of its largest ticker.
+    '''
+
+    gc.collect()
+    libc_path = ctypes.util.find_library('c')
+    if libc_path is None:
+        return
+    malloc_trim = getattr(ctypes.CDLL(libc_path), 'malloc_trim', None)
+    if malloc_trim is not None:
+        malloc_trim(0)
+
+
+# ----------------------------------------------------------------------
+# Footprint.
+# ----------------------------------------------------------------------
+
+def count_rows(target:luigi.Target) -> int:
+    # Number of bars of a downloaded CSV, without the header.
+    with target.open('r') as in_file:
+        return max(sum(1 for _ in in_file) - 1, 0)
+
+
+def estimate_footprint(stages:Iterable[luigi.Task]) -> Dict[Text, int]:
+    '''
+    Purpose:
+        Estimate the memory a worker needs for the stages of a ticker from the rows
+        of its daily bars, which the traced frames and the daily pivot tables grow
+        with. The downloads must be complete.
+
+    Input  :
+        stages: List of the stages of a ticker. Example: from 'stream_executor.list_stages'.
+
+    Return :
+        Dictionary of the daily rows and the estimated bytes. Example: {'rows': 5751, 'bytes': 61000000}
+    '''
+
+    rows = max([count_rows(stage.output()) for stage in stages
+                if getattr(stage, 'ticker_freq', None) == TICKER_FREQ[2]], default=0)
+    return {'rows': rows, 'bytes': int(MEMORY_BASE_MB * 1024 ** 2 + rows * MEMORY_BYTES_PER_ROW)}
+
+
+# ----------------------------------------------------------------------
+# Admission.
+# ----------------------------------------------------------------------
+
+class MemoryBudget:
+    '''
+    Admission of the tickers to the worker processes under a global limit of the
+    resident memory. A ticker runs once its estimated footprint fits next to the
+    running tickers, and at most (max_large) tickers above (large_bytes) run at
+    once. Past (spill_ratio) of the limit, the tickers are admitted in spill mode,
+    so their pivot tables are read from the storage files when they are written
+    instead of being held together. Create it on the running event loop.
+
+    Example:
+        budget = MemoryBudget(4 * 1024 ** 3, workers=4)
+        spill = await budget.acquire(footprint)
+        ...
+        budget.release(footprint, pid, rss)
+    '''
+
+    def __init__(self, limit_bytes:int, workers:int, large_bytes:int=MEMORY_LARGE_MB * 1024 ** 2,
+                 max_large:int=MEMORY_MAX_LARGE, spill_ratio:float=MEMORY_SPILL_RATIO):
+        self.limit_bytes = limit_bytes
+        self.workers = workers
+        self.large_bytes = large_bytes
+        self.max_large = max_large
+        self.spill_ratio = spill_ratio
+        self.reserved = 0
+        self.n_running = 0
+        self.n_large = 0
+        self.n_waits = 0
+        self.rss: Dict[int, int] = {}
+        self.condition = asyncio.Condition()
+
+    def worker_rss(self) -> int:
+        # Resident memory of the workers after their last ticker. An idle worker keeps its heap.
+        return sum(self.rss.values())
+
+    def fits(self, footprint:int) -> bool:
+        # A ticker always runs when nothing else does, so a ticker above the limit still finishes.
+        if self.n_running == 0:
+            return True
+        if footprint >= self.large_bytes and self.n_large >= self.max_large:
+            return False
+        return self.reserved + footprint <= self.limit_bytes and self.worker_rss() <= self.limit_bytes
+
+    def near_limit(self, footprint:int) -> bool:
+        used = max(self.reserved + footprint, self.worker_rss())
+        return used >= self.spill_ratio * self.limit_bytes
+
+    async def acquire(self, footprint:int) -> bool:
+        '''
+        Purpose:
+            Wait until the ticker fits in the budget, then reserve its footprint.
+
+        Input  :
+            footprint: Int. Estimated bytes of the ticker. See (estimate_footprint).
+
+        Return :
+            True if the ticker should run in spill mode.
+        '''
+
+        async with self.condition:
+            if not self.fits(footprint):
+                self.n_waits += 1
+                await self.condition.wait_for(lambda: self.fits(footprint))
+            spill = self.near_limit(footprint)
+            self.reserved += footprint
+            self.n_running += 1
+            self.n_large += footprint >= self.large_bytes
+            return spill
+
+    async def release(self, footprint:int, pid:Optional[int]=None, rss:Optional[int]=None):
+        # Free the reservation of a finished ticker, and keep the resident memory its worker reported.
+        async with self.condition:
+            self.reserved -= footprint
+            self.n_running -= 1
+            self.n_large -= footprint >= self.large_bytes
+            if pid is not None and rss is not None:
+                self.rss[pid] = rss
+            self.condition.notify_all()
+
+    def summary(self) -> Dict:
+        return {'limit_mb': round(self.limit_bytes / 1024 ** 2), 'waits': self.n_waits,
+                'worker_rss_mb': round(self.worker_rss() / 1024 ** 2, 1)}
@@ -0,0 +1,420 @@
+
+
+import logging
+from typing import Dict, Iterator, List, Optional, Text, Tuple
+import numpy as np
+import pandas as pd
+
+# Personal modules.
+from config.config import LOG_PROCESSING_FILEPATH, YR_RANGE, QUANTILE_LEVELS, QUANTILE_COLS
+from config.config_logger import setup_logger
+from autoprocess_ticker import preprocessing
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# ----------------------------------------------------------------------
+# Panel Preprocessing.
+# ----------------------------------------------------------------------
+
+def load_panel(df_tickers:Dict[Text, Dict[Text, pd.DataFrame]], freq_keys:List[Text]) -> Dict[Text, pd.DataFrame]:
+    '''
+    Purpose:
+        Stack the raw data of many tickers into one long frame per frequency with
+        a (symbol) column.
+
+    Input  :
+        df_tickers: Dictionary of ticker and its dictionary of raw dataframes. Example:
+                        dict = {'SPY': {'monthly': df, 'weekly': df, ...}}
+        freq_keys : List. Example: ['monthly', 'weekly', 'daily_by_trdr_day', 'daily_by_weekday']
+
+    Return :
+        Dictionary of frequency and the long dataframe.
+    '''
+
+    logger.info('Start running (load_panel) function.')
+
+    df_panel = {}
+    for freq in freq_keys:
+        df_panel[freq] = pd.concat([df_ticker[freq].assign(symbol=ticker) for ticker, df_ticker in df_tickers.items()],
+                                   ignore_index=True)
+        logger.debug(f'----- Stacked ({len(df_tickers)}) tickers into ({len(df_panel[freq])}) rows for ({freq}).')
+    return df_panel
+
+
+def init_preprocess_panel(df_panel:Dict[Text, pd.DataFrame], freq_keys:List[Text], freq_cols:List[Text]):
+    '''
+    Purpose:
+        Same as 'preprocessing.init_preprocess' but for the long frames of many
+        tickers. The price change and the trading day counts are computed within
+        each symbol with grouped operations.
+
+    Input  :
+        df_panel : Dictionary. Should contain the long dataframes from (load_panel).
+        freq_keys: List. Example: ['monthly', 'weekly', 'daily_by_trdr_day', 'daily_by_weekday']
+        freq_cols: List. Example: ['month', 'week', 'trdr_day', 'weekday']
+
+    Return :
+        None.
+    '''
+
+    logger.info('Start running (init_preprocess_panel) function.')
+
+    for freq in freq_keys:
+        df_panel[freq].columns = list(map(str.lower, df_panel[freq].columns))
+        df_panel[freq]['price_diff'] = df_panel[freq].groupby('symbol', sort=False)['adj close'].pct_change(periods=1)
+        df_panel[freq]['year'] = df_panel[freq]['date'].dt.year
+        logger.debug(f'----- Added (price_diff) and (year) columns for ({freq}) panel data.')
+
+    # Monthly data.
+    df_panel[freq_keys[0]][freq_cols[0]] = df_panel[freq_keys[0]]['date'].dt.month
+
+    # Weekly data.
+    df_panel[freq_keys[1]][freq_cols[1]] = df_panel[freq_keys[1]]['date'].dt.week
+
+    # Daily data (by_month). Count the trading days within each month of each symbol.
+    df_daily = df_panel[freq_keys[2]]
+    df_daily[freq_cols[0]] = df_daily['date'].dt.month
+    df_daily[freq_cols[1]] = df_daily['date'].dt.week
+    df_daily[freq_cols[2]] = df_daily.groupby(['symbol', 'year', freq_cols[0]], sort=False).cumcount().values
+
+    # Daily data (byWeekday).
+    df_panel[freq_keys[3]][freq_cols[1]] = df_panel[freq_keys[3]]['date'].dt.week
+    df_panel[freq_keys[3]][freq_cols[3]] = df_panel[freq_keys[3]]['date'].dt.weekday
+    logger.debug('----- Added the period columns for the panel data.')
+
+
+def split_panel(df_panel:Dict[Text, pd.DataFrame], freq_keys:List[Text]) -> Dict[Text, Dict[Text, pd.DataFrame]]:
+    '''
+    Purpose:
+        Split the long frames back into the per-ticker dictionaries that
+        'preprocessing.init_preprocess' would have produced.
+    '''
+
+    df_tickers = {}
+    for freq in freq_keys:
+        for ticker, df in df_panel[freq].groupby('symbol', sort=False):
+            df_tickers.setdefault(ticker, {})[freq] = df.drop(columns='symbol').reset_index(drop=True)
+    return df_tickers
+
+
+# ----------------------------------------------------------------------
+# Symbol x Period x Year Cube.
+# ----------------------------------------------------------------------
+
+def get_pivot_index(freq_col:Text) -> List[Text]:
+    # Same index as 'preprocessing.create_pivot'.
+    if freq_col == 'trdr_day': return ['month', freq_col]
+    if freq_col == 'weekday': return ['week', freq_col]
+    return [freq_col]
+
+
+class PanelCube:
+    '''
+    Pivot values of many symbols as a 3-D array of symbol x period x year. A
+    (period, year) cell that a symbol does not have is NaN, and (present) marks
+    the periods that the per-ticker pivot table of each symbol contains.
+    '''
+
+    def __init__(self, symbols:List[Text], periods:pd.Index, years:np.ndarray, values:np.ndarray):
+        self.symbols = symbols
+        self.periods = periods
+        self.years = years
+        self.values = values
+        self.present = ~np.isnan(values).all(axis=2)
+
+    def window(self, start_yr:int, end_yr:int) -> np.ndarray:
+        return self.values[:, :, (self.years >= start_yr) & (self.years <= end_yr)]
+
+    def split_by_years(self) -> List['PanelCube']:
+        '''
+        Purpose:
+            Split the cube into the groups of symbols that have values in the same
+            years, each with those years only. A symbol that starts later has no
+            NaN years in front of its own, so the pairwise sums along the years
+            add the values in the same order as its per-ticker pivot table.
+        '''
+
+        has_year = ~np.isnan(self.values).all(axis=1)
+        groups = {}
+        for idx, mask in enumerate(has_year):
+            groups.setdefault(mask.tobytes(), []).append(idx)
+
+        cubes = []
+        for idxs in groups.values():
+            mask = has_year[idxs[0]]
+            cubes.append(PanelCube([self.symbols[idx] for idx in idxs], self.periods, self.years[mask],
+                                   self.values[idxs][:, :, mask]))
+        return cubes
+
+    def ticker_pivot(self, idx:int) -> pd.DataFrame:
+        '''
+        Purpose:
+            Rebuild the per-ticker pivot table of 'preprocessing.create_pivot',
+            indexed by its periods.
+        '''
+
+        values = self.values[idx][self.present[idx]]
+        has_year = ~np.isnan(values).all(axis=0)
+        pivot = pd.DataFrame(values[:, has_year], index=self.periods[self.present[idx]],
+                             columns=pd.Index(self.years[has_year], name='year'))
+        return pivot
+
+
+def create_cube(df_panel:pd.DataFrame, freq_col:Text, pivot_value:Text, index:Optional[List[Text]]=None) -> PanelCube:
+    '''
+    Purpose:
+        Pivot the long frame of one frequency into a symbol x period x year cube
+        with a single grouped aggregation across all symbols.
+
+    Input  :
+        df_panel   : Dataframe. Long frame of one frequency from (init_preprocess_panel).
+        freq_col   : Str. Must be 'month' / 'week' / 'trdr_day' / 'weekday'.
+        pivot_value: Str. The column to perform processing on.
+        index      : List. Period columns to pivot on instead of those of (freq_col).
+
+    Return :
+        PanelCube.
+    '''
+
+    index = index or get_pivot_index(freq_col)
+
+    # Same aggregation as 'pivot_table', so a (period, year) cell that holds two
+    # rows is averaged the same way. Example: ISO week 1 in late December.
+    agged = df_panel.groupby(['symbol', *index, 'year'])[pivot_value].mean().dropna()
+    table = agged.unstack('year').sort_index(axis=1)
+
+    # Scatter the rows of the table into the cube by their symbol and period positions.
+    symbols = list(pd.unique(df_panel['symbol']))
+    row_periods = table.index.droplevel('symbol')
+    periods = row_periods.unique().sort_values()
+    values = np.full((len(symbols), len(periods), len(table.columns)), np.nan)
+    values[pd.Index(symbols).get_indexer(table.index.get_level_values('symbol')),
+           periods.get_indexer(row_periods)] = table.to_numpy(dtype=np.float64)
+    return PanelCube(symbols, periods, table.columns.to_numpy(), values)
+
+
+# ----------------------------------------------------------------------
+# Stats Kernel.
+# ----------------------------------------------------------------------
+
+def _nansum(values:np.ndarray, pairwise:bool=False) -> np.ndarray:
+    # Add the years one at a time like the pandas row reductions, so the sums
+    # are bit-identical to the per-ticker path. With (pairwise), sum every row
+    # along a contiguous row instead, which numpy does pairwise.
+    filled = np.where(np.isnan(values), 0.0, values)
+    if pairwise:
+        return np.ascontiguousarray(filled).sum(axis=-1)
+    total = np.zeros(values.shape[:-1])
+    for k in range(values.shape[-1]):
+        total += filled[..., k]
+    return total
+
+
+def _nanmean(values:np.ndarray, pairwise:bool=False) -> Tuple[np.ndarray, np.ndarray]:
+    counts = (~np.isnan(values)).sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = _nansum(values, pairwise) / counts
+    return np.where(counts > 0, mean, np.nan), counts
+
+
+def _nanstd(values:np.ndarray, mean:np.ndarray, counts:np.ndarray) -> np.ndarray:
+    # Unlike the sums above, pandas always copies the rows before the variance, so it adds
+    # the squared deviations from a pairwise mean along a contiguous row, which numpy sums
+    # pairwise. Do the same to keep the results bit-identical. (mean) must be pairwise.
+    sqr = np.ascontiguousarray(np.where(np.isnan(values), 0.0, (mean[..., None] - values) ** 2))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        std = np.sqrt(sqr.sum(axis=-1) / (counts - 1))
+    return np.where(counts > 1, std, np.nan)
+
+
+def _nanquantile(values:np.ndarray, levels:List[float]) -> np.ndarray:
+    # Same as 'np.nanquantile' with the linear method along the last axis, bit for bit, for rows
+    # with at least one value. The rows are sorted at once instead of one call per row.
+    counts = (~np.isnan(values)).sum(axis=-1)
+    ordered = np.sort(values, axis=-1)
+    quantiles = []
+    for level in levels:
+        virtual = (counts - 1) * level
+        previous = np.floor(virtual)
+        following = previous + 1
+        # Past the last value, numpy takes the last value on both sides (index -1).
+        above = virtual >= counts - 1
+        previous[above] = -1
+        following[above] = -1
+        gamma = virtual - previous
+        lower = np.take_along_axis(ordered, np.where(above, counts - 1, previous).astype(np.intp)[..., None], axis=-1)[..., 0]
+        upper = np.take_along_axis(ordered, np.where(above, counts - 1, following).astype(np.intp)[..., None], axis=-1)[..., 0]
+        diff = upper - lower
+        quantiles.append(np.where(gamma >= 0.5, upper - diff * (1 - gamma), lower + diff * gamma))
+    return np.array(quantiles).reshape((len(levels),) + values.shape[:-1])
+
+
+def summarise_cube(values:np.ndarray, pairwise:bool=False) -> Dict[Text, np.ndarray]:
+    '''
+    Purpose:
+        Compute the columns of 'preprocessing.summarise_pivot' for every symbol
+        and period at once.
+
+    Input  :
+        values  : Array of symbol x period x year for one window of years.
+        pairwise: Bool. Sum the rows pairwise for the average and the total. pandas does
+                  it when the window has NaN or its values are row-major, because it
+                  copies the rows first. The average of the positive and negative
+                  changes is always pairwise, as they are read from a new row-major array.
+
+    Return :
+        Dictionary of column name and array of symbol x period.
+    '''
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stats = {}
+        stats['avg_diff'], counts = _nanmean(values, pairwise)
+        with_values = counts > 0
+        stats['med_diff'] = np.full(counts.shape, np.nan)
+        stats['med_diff'][with_values] = np.nanmedian(values[with_values], axis=-1)
+        percentiles = _nanquantile(values[with_values], QUANTILE_LEVELS)
+        for col, level_values in zip(QUANTILE_COLS, percentiles):
+            stats[f'{col}_diff'] = np.full(counts.shape, np.nan)
+            stats[f'{col}_diff'][with_values] = level_values
+        stats['tot_diff'] = _nansum(values, pairwise)
+        stats['max_diff'] = np.fmax.reduce(values, axis=-1)
+        stats['min_diff'] = np.fmin.reduce(values, axis=-1)
+        stats['std_diff'] = _nanstd(values, stats['avg_diff'] if pairwise else _nanmean(values, True)[0], counts)
+        stats['up_overall'] = (stats['avg_diff'] > 0).astype(np.int64)
+
+        stats['pos_avg_diff'], up_counts = _nanmean(np.where(values > 0, values, np.nan), True)
+        stats['up_counts'] = up_counts.astype(np.int64)
+        stats['neg_avg_diff'], down_counts = _nanmean(np.where(values < 0, values, np.nan), True)
+        stats['down_counts'] = down_counts.astype(np.int64)
+
+        prob = np.round(up_counts / (up_counts + down_counts), 4)
+        stats['up_prob'] = prob
+        stats['down_prob'] = 1 - prob
+    return stats
+
+
+def iter_stats_windows(start_yr_range:List[int]) -> Iterator[Tuple[Text, int]]:
+    '''
+    Purpose:
+        Yield the key suffix and the start year of each window the same way as
+        'preprocessing.summarise_pivot'. The first window has no suffix.
+    '''
+
+    repeated_start_yr = False
+    for i, start_yr in enumerate(start_yr_range):
+        if start_yr < start_yr_range[0]:
+            continue
+        if start_yr == start_yr_range[0]:
+            if repeated_start_yr:
+                continue
+            repeated_start_yr = True
+            yield '', start_yr
+        else:
+            yield f'_{YR_RANGE[i]}', start_yr
+
+
+def summarise_panel(
+        df_panel:Dict[Text, pd.DataFrame],
+        freq_keys:List[Text],
+        freq_cols:List[Text],
+        start_yr_range:List[int],
+        end_yr:int,
+        pivot_value:Text='price_diff',
+    ) -> Dict[Text, Tuple[Dict[Text, pd.DataFrame], Dict[Text, pd.DataFrame]]]:
+
+    '''
+    Purpose:
+        Create the pivot tables and the statistical summary of every ticker in
+        the panel. The tickers may start in different years.
+
+    Input  :
+        df_panel      : Dictionary. Should contain the long dataframes from (init_preprocess_panel).
+        freq_keys     : List. Example: ['monthly', 'weekly', 'daily_by_trdr_day', 'daily_by_weekday']
+        freq_cols     : List. Example: ['month', 'week', 'trdr_day', 'weekday']
+        start_yr_range: List. Range of starting year to summarise the data on.
+        end_yr        : Int. Ending year to summarise the data on.
+        pivot_value   : Str. The column to perform processing on.
+
+    Return :
+        Dictionary of ticker and its (pivot_dict, pivot_dict_stats), the same as
+        'preprocessing.create_pivot' and 'preprocessing.summarise_pivot' produce.
+    '''
+
+    logger.info('Start running (summarise_panel) function.')
+
+    results = {}
+    for freq_col, freq in zip(freq_cols, freq_keys):
+        panel_cube = create_cube(df_panel[freq], freq_col, pivot_value)
+        logger.debug(f'----- Created a cube of shape ({panel_cube.values.shape}) for ({freq}) panel data.')
+
+        for cube in panel_cube.split_by_years():
+            windows = [(f'{freq}{suffix}', summarise_cube(cube.window(start_yr, end_yr)))
+                       for suffix, start_yr in iter_stats_windows(start_yr_range)]
+
+            for idx, ticker in enumerate(cube.symbols):
+                pivot_dict, pivot_dict_stats = results.setdefault(ticker, ({}, {}))
+                pivot_dict[freq] = cube.ticker_pivot(idx)
+
+                present = cube.present[idx]
+                for stats_key, stats in windows:
+                    pivot_dict_stats[stats_key] = pd.DataFrame({col: values[idx][present] for col, values in stats.items()},
+                                                               index=pivot_dict[freq].index)
+
+    return results
+
+
+# ----------------------------------------------------------------------
+# Verification.
+# ----------------------------------------------------------------------
+
+def verify_panel(
+        df_tickers:Dict[Text, Dict[Text, pd.DataFrame]],
+        freq_keys:List[Text],
+        freq_cols:List[Text],
+        start_yr_range:List[int],
+        end_yr:int,
+    ) -> bool:
+
+    '''
+    Purpose:
+        Run the panel path and the per-ticker path on the same raw data and check
+        that every dataframe is identical.
+
+    Input  :
+        df_tickers: Dictionary of ticker and its dictionary of raw dataframes.
+        Other inputs are the same as (summarise_panel).
+
+    Return :
+        True if every output is identical. Raises AssertionError otherwise.
+    '''
+
+    logger.info('Start running (verify_panel) function.')
+
+    df_panel = load_panel(df_tickers, freq_keys)
+    init_preprocess_panel(df_panel, freq_keys, freq_cols)
+    panel_tickers = split_panel(df_panel, freq_keys)
+    panel_results = summarise_panel(df_panel, freq_keys, freq_cols, start_yr_range, end_yr)
+
+    for ticker, df_raw in df_tickers.items():
+        df_ticker = {freq: df_raw[freq].copy() for freq in freq_keys}
+        preprocessing.init_preprocess(df_ticker, freq_keys, freq_cols)
+        pivot_dict, pivot_dict_stats = {}, {}
+        preprocessing.create_pivot(df_ticker, pivot_dict, freq_keys, freq_cols, pivot_value='price_diff')
+        preprocessing.summarise_pivot(pivot_dict, pivot_dict_stats, freq_keys, start_yr_range, end_yr)
+
+        for freq in freq_keys:
+            pd.testing.assert_frame_equal(panel_tickers[ticker][freq], df_ticker[freq], check_exact=True)
+            pd.testing.assert_frame_equal(panel_results[ticker][0][freq], pivot_dict[freq], check_exact=True)
+        assert panel_results[ticker][1].keys() == pivot_dict_stats.keys(), ticker
+        for stats_key in pivot_dict_stats:
+            pd.testing.assert_frame_equal(panel_results[ticker][1][stats_key], pivot_dict_stats[stats_key], check_exact=True)
+
+    logger.debug(f'----- Verified the panel outputs of ({len(df_tickers)}) tickers.')
+    return True
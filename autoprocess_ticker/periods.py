@@ -0,0 +1,261 @@
+
+
+import logging
+from typing import Callable, Dict, List, NamedTuple, Text, Tuple
+import numpy as np
+import pandas as pd
+
+# Personal modules.
+from config.config import LOG_PROCESSING_FILEPATH, PERIOD_KEYS, PERIOD_COLS, TURN_OF_MONTH_DAYS, YR_EDGE_DAYS
+from config.config_logger import setup_logger
+from autoprocess_ticker import preprocessing, panel
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# ----------------------------------------------------------------------
+# Period Codes.
+# ----------------------------------------------------------------------
+
+# Each code function takes the daily bars in date order and returns the period
+# columns of every row as float arrays. A row that is not in any period is NaN.
+
+def get_trdr_day_positions(group_ids:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Purpose:
+        Count the trading days within each run of equal group ids, from the start
+        and from the end. Example: the positions of each day within its month.
+        The download may start or end within a group, so the positions from the
+        start of the first group and from the end of the last group are unknown.
+
+    Input  :
+        group_ids: Array. Group id of every row, in date order. Example: year * 12 + month
+
+    Return :
+        Tuple of float arrays of the positions from the start (1 for the first day)
+        and from the end (1 for the last day). NaN where unknown.
+    '''
+
+    n_rows = len(group_ids)
+    starts = np.flatnonzero(np.r_[True, group_ids[1:] != group_ids[:-1]])
+    sizes = np.diff(np.r_[starts, n_rows])
+    from_start = (np.arange(n_rows) - np.repeat(starts, sizes) + 1).astype(np.float64)
+    from_end = np.repeat(sizes, sizes) - from_start + 1
+    from_start[:sizes[0]] = np.nan
+    from_end[starts[-1]:] = np.nan
+    return from_start, from_end
+
+
+def quarter_codes(df:pd.DataFrame) -> Dict[Text, np.ndarray]:
+    return {'quarter': df['date'].dt.quarter.to_numpy(np.float64)}
+
+
+def dom_codes(df:pd.DataFrame) -> Dict[Text, np.ndarray]:
+    return {'month': df['date'].dt.month.to_numpy(np.float64), 'dom': df['date'].dt.day.to_numpy(np.float64)}
+
+
+def week_of_month_codes(df:pd.DataFrame) -> Dict[Text, np.ndarray]:
+    # Week 1 is the 1st to the 7th of the month, week 5 the 29th to the 31st.
+    return {
+        'month': df['date'].dt.month.to_numpy(np.float64),
+        'week_of_month': ((df['date'].dt.day - 1) // 7 + 1).to_numpy(np.float64)
+    }
+
+
+def turn_of_month_codes(df:pd.DataFrame, n_days:int=TURN_OF_MONTH_DAYS) -> Dict[Text, np.ndarray]:
+    # -1 for the last trading day of the month, 1 for the first trading day of the next month.
+    from_start, from_end = get_trdr_day_positions((df['date'].dt.year * 12 + df['date'].dt.month).to_numpy())
+    codes = np.where(from_end <= n_days, -from_end, np.where(from_start <= n_days, from_start, np.nan))
+    return {'turn_of_month': codes}
+
+
+def first_trdr_days_codes(df:pd.DataFrame, n_days:int=YR_EDGE_DAYS) -> Dict[Text, np.ndarray]:
+    from_start, _ = get_trdr_day_positions(df['date'].dt.year.to_numpy())
+    return {'first_trdr_day_of_yr': np.where(from_start <= n_days, from_start, np.nan)}
+
+
+def last_trdr_days_codes(df:pd.DataFrame, n_days:int=YR_EDGE_DAYS) -> Dict[Text, np.ndarray]:
+    # -1 for the last trading day of the year.
+    _, from_end = get_trdr_day_positions(df['date'].dt.year.to_numpy())
+    return {'last_trdr_day_of_yr': np.where(from_end <= n_days, -from_end, np.nan)}
+
+
+class PeriodSpec(NamedTuple):
+    codes: Callable[[pd.DataFrame], Dict[Text, np.ndarray]]
+    # Whether a period spans consecutive days, so its daily changes are compounded
+    # into the change of the period. Otherwise the daily changes are averaged.
+    compound: bool
+
+
+# Every period key that (PERIOD_KEYS) of the config can choose from.
+PERIOD_SPECS = {
+    'quarterly': PeriodSpec(quarter_codes, True),
+    'daily_by_dom': PeriodSpec(dom_codes, False),
+    'daily_by_week_of_month': PeriodSpec(week_of_month_codes, True),
+    'turn_of_month': PeriodSpec(turn_of_month_codes, False),
+    'first_trdr_days_of_yr': PeriodSpec(first_trdr_days_codes, False),
+    'last_trdr_days_of_yr': PeriodSpec(last_trdr_days_codes, False),
+}
+
+# The period columns of every key share the two generic index columns of the long frame.
+MAX_PERIOD_COLS = 2
+
+
+def get_period_cols(key:Text) -> List[Text]:
+    # Example: 'daily_by_dom' -> ['month', 'dom']
+    return PERIOD_COLS[PERIOD_KEYS.index(key)]
+
+
+def stack_period_codes(df_daily:pd.DataFrame, period_keys:List[Text]) -> pd.DataFrame:
+    '''
+    Purpose:
+        Stack the rows of every period key into one long frame, with the key in the
+        (symbol) column and the period columns in the generic (p0) and (p1) columns,
+        so every key is aggregated in the same grouped pass.
+
+    Input  :
+        df_daily   : Dataframe. Preprocessed daily bars of 'preprocessing.init_preprocess'.
+        period_keys: List. Keys of (PERIOD_SPECS). Example: ['quarterly', 'turn_of_month']
+
+    Return :
+        Long dataframe with the columns ['symbol', 'p0', 'p1', 'year', 'price_diff', 'log_diff'].
+    '''
+
+    df_daily = df_daily.sort_values('date')
+    years = df_daily['year'].to_numpy()
+    price_diff = df_daily['price_diff'].to_numpy(np.float64)
+    log_diff = np.log1p(price_diff)
+
+    frames = []
+    for key in period_keys:
+        codes = list(PERIOD_SPECS[key].codes(df_daily).values())
+        codes += [np.zeros(len(df_daily))] * (MAX_PERIOD_COLS - len(codes))
+        in_period = ~np.isnan(codes).any(axis=0)
+        frames.append(pd.DataFrame({
+            'symbol': key,
+            **{f'p{i}': code[in_period].astype(np.int64) for i, code in enumerate(codes)},
+            'year': years[in_period],
+            'price_diff': price_diff[in_period],
+            'log_diff': log_diff[in_period],
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+# ----------------------------------------------------------------------
+# Batched Pivot & Stats.
+# ----------------------------------------------------------------------
+
+def create_period_cube(df_daily:pd.DataFrame, period_keys:List[Text]) -> panel.PanelCube:
+    '''
+    Purpose:
+        Aggregate the daily price change of every period and year of every key in
+        one grouped pass, and pivot them into a key x period x year cube.
+
+    Input  :
+        df_daily   : Dataframe. Preprocessed daily bars of 'preprocessing.init_preprocess'.
+        period_keys: List. Keys of (PERIOD_SPECS).
+
+    Return :
+        PanelCube with the period keys as the symbols.
+    '''
+
+    df_long = stack_period_codes(df_daily, period_keys)
+    index = ['symbol'] + [f'p{i}' for i in range(MAX_PERIOD_COLS)] + ['year']
+    grouped = df_long.groupby(index, sort=False)
+
+    # The mean for the keys of single days, the compounded change for the spans of days.
+    mean_diff = grouped['price_diff'].mean()
+    compound_diff = np.expm1(grouped['log_diff'].sum(min_count=1))
+    compound = mean_diff.index.get_level_values('symbol').isin([key for key in period_keys if PERIOD_SPECS[key].compound])
+    df_cells = mean_diff.where(~compound, compound_diff).rename('price_diff').reset_index()
+
+    return panel.create_cube(df_cells, None, 'price_diff', index=index[1:-1])
+
+
+def pivot_period_summary(df_daily:pd.DataFrame, period_keys:List[Text], start_yr_range:List[int],
+                         end_yr:int) -> Tuple[Dict[Text, pd.DataFrame], Dict[Text, pd.DataFrame]]:
+    '''
+    Purpose:
+        Create the pivot tables of the custom periods and their statistical summary
+        from the daily bars, for every period key and year window in one batch.
+
+    Input  :
+        df_daily      : Dataframe. Preprocessed daily bars of 'preprocessing.init_preprocess'.
+        period_keys   : List. Keys of (PERIOD_SPECS).
+        start_yr_range: List. Range of starting year to summarise the data on.
+        end_yr        : Int. Ending year to summarise the data on.
+
+    Return :
+        Tuple of the pivot tables and their stats, indexed by the period columns of
+        each key like 'preprocessing.create_pivot' and 'preprocessing.summarise_pivot'.
+    '''
+
+    logger.info('Start running (pivot_period_summary) function.')
+
+    cube = create_period_cube(df_daily, period_keys)
+    logger.debug(f'----- Created a cube of shape ({cube.values.shape}) for ({len(period_keys)}) period keys.')
+    windows = [(suffix, panel.summarise_cube(cube.window(start_yr, end_yr)))
+               for suffix, start_yr in panel.iter_stats_windows(start_yr_range)]
+
+    pivot_dict, pivot_dict_stats = {}, {}
+    for idx, key in enumerate(cube.symbols):
+        cols = get_period_cols(key)
+        pivot = cube.ticker_pivot(idx)
+        pivot.index = pivot.index.droplevel(list(range(len(cols), MAX_PERIOD_COLS))).set_names(cols)
+        pivot_dict[key] = pivot
+
+        # Same columns as 'preprocessing.summarise_pivot', indexed by the periods of the pivot table.
+        present = cube.present[idx]
+        for suffix, stats in windows:
+            pivot_dict_stats[f'{key}{suffix}'] = pd.DataFrame({col: values[idx][present] for col, values in stats.items()},
+                                                              index=pivot.index)
+    return pivot_dict, pivot_dict_stats
+
+
+# ----------------------------------------------------------------------
+# Verification.
+# ----------------------------------------------------------------------
+
+def verify_periods(df_daily:pd.DataFrame, period_keys:List[Text], start_yr_range:List[int], end_yr:int) -> bool:
+    '''
+    Purpose:
+        Check the batched pass against one 'pivot_table' per period key on the
+        daily bars with the period columns added, summarised with 'summarise_pivot'.
+        The compounded changes are multiplied instead of summed as logs, so the
+        values only agree to a relative tolerance.
+
+    Input  :
+        Same as (pivot_period_summary).
+
+    Return :
+        True if every check passes. Raises AssertionError otherwise.
+    '''
+
+    logger.info('Start running (verify_periods) function.')
+
+    pivot_dict, pivot_dict_stats = pivot_period_summary(df_daily, period_keys, start_yr_range, end_yr)
+    expected_pivots, expected_stats = {}, {}
+    for key in period_keys:
+        spec, cols = PERIOD_SPECS[key], get_period_cols(key)
+        df = df_daily.sort_values('date')
+        df = df.assign(**spec.codes(df)).dropna(subset=cols)
+        aggfunc = (lambda values: np.prod(1 + values.dropna()) - 1 if values.notna().any() else np.nan) \
+            if spec.compound else 'mean'
+        expected_pivots[key] = df.pivot_table(values='price_diff', index=cols, columns='year', aggfunc=aggfunc)
+        pd.testing.assert_frame_equal(pivot_dict[key], expected_pivots[key], check_exact=False, rtol=1e-9,
+                                      check_dtype=False, check_index_type=False, check_names=False)
+
+    preprocessing.summarise_pivot(expected_pivots, expected_stats, period_keys, start_yr_range, end_yr)
+    assert pivot_dict_stats.keys() == expected_stats.keys()
+    for stats_key, df in expected_stats.items():
+        pd.testing.assert_frame_equal(pivot_dict_stats[stats_key], df, check_exact=False, rtol=1e-9, check_dtype=False,
+                                      check_index_type=False)
+
+    logger.debug(f'----- Verified the pivot tables and the stats of ({len(period_keys)}) period keys.')
+    return True
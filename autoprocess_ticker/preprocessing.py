@@ -2,13 +2,13 @@
 
 from datetime import datetime, timedelta
 import logging
-from typing import List, Tuple, Dict, Optional, Text
+from typing import List, Tuple, Dict, Optional, Text, Union
 import numpy as np
 import pandas as pd
 
 # Personal module. 
 from config.config import (
-    HOLIDAYS_KEYS, LOG_PROCESSING_FILEPATH, YR_RANGE, 
+    HOLIDAYS_KEYS, LOG_PROCESSING_FILEPATH, YR_RANGE, QUANTILE_LEVELS, QUANTILE_COLS
 )
 from config.config_logger import setup_logger
 
@@ -79,67 +79,6 @@ def init_preprocess(df_dict:Dict[Text, pd.DataFrame], freq_keys:List[Text], freq
     logger.debug(f'----- Added ({freq_cols[3]}) column for ({freq_keys[3]}) ticker data.')
 
 
-def custom_set_index(
-        pivot_dict:Dict[Text, pd.DataFrame], 
-        pivot_dict_stats:Dict[Text, pd.DataFrame], 
-        stats_key:Text, 
-        freq:Text, 
-    ):
-
-    '''
-    Purpose: 
-        To set custom index for pivot table (dataframe). 
-    
-    Input  :
-        pivot_dict      : Dictionary. Containing the pivot tables.
-        pivot_dict_stats: Dictionary. For storing processes pivot table. 
-        stats_key       : Str. Specify the dictionary key for storing the specific dataframe. 
-        freq            : Str. Must be 'monthly' / 'weekly' / 'daily_by_trdr_day' / 'daily_by_weekday'. 
-        
-    Return :
-        None.
-    '''
-
-    # REFINE: Need to find a better way to set the index. 
-    # Add new column(s) to indicate the interval. 
-    if  freq == 'monthly': 
-        pivot_dict_stats[stats_key]['month'] = pivot_dict[freq]['month'] 
-        logger.debug(f'----- Added the (month) column for ({stats_key}) ticker data.') 
-    elif  freq == 'weekly': 
-        pivot_dict_stats[stats_key]['week'] = pivot_dict[freq]['week'] 
-        logger.debug(f'----- Added the (month) column for ({stats_key}) ticker data.') 
-    elif freq == 'daily_by_trdr_day':
-        pivot_dict_stats[stats_key]['month'] = pivot_dict[freq]['month']
-        pivot_dict_stats[stats_key]['trdr_day'] = pivot_dict[freq]['trdr_day']
-        logger.debug(f'----- Added the (month) and (trdr_day) column for ({stats_key}) ticker data.') 
-    elif freq == 'daily_by_weekday':
-        pivot_dict_stats[stats_key]['week'] = pivot_dict[freq]['week']
-        pivot_dict_stats[stats_key]['weekday'] = pivot_dict[freq]['weekday']
-        logger.debug(f'----- Added the (week) and (weekday) column for ({stats_key}) ticker data.') 
-    elif freq == 'first_trdr_dom': 
-        pivot_dict_stats[stats_key][freq] = pivot_dict[freq][freq]
-        logger.debug(f'----- Added the ({freq}) column for ({stats_key}) ticker data.') 
-    elif freq == 'super_day' or freq == 'santa_rally': 
-        pivot_dict_stats[stats_key][freq] = pivot_dict[freq][f'{freq}_day_counts']
-        logger.debug(f'----- Added the ({freq}) column for ({stats_key}) ticker data.') 
-    elif 'first_trdr_dom_by_month' == freq: 
-        pivot_dict_stats[stats_key]['month'] = pivot_dict[freq]['month']
-        pivot_dict_stats[stats_key]['first_trdr_dom'] = pivot_dict[freq]['first_trdr_dom']
-        logger.debug(f'----- Added the (month) and (first_trdr_dom) column for ({stats_key}) ticker data.') 
-    elif 'super_day_by_month' == freq: 
-        pivot_dict_stats[stats_key]['super_day_spec_month'] = pivot_dict[freq]['super_day_spec_month']
-        pivot_dict_stats[stats_key]['super_day_day_counts'] = pivot_dict[freq]['super_day_day_counts']
-        logger.debug(f'----- Added the (super_day_spec_month) and (super_day_day_counts) column for ({stats_key}) ticker data.') 
-    elif 'tww' in freq: 
-        pivot_dict_stats[stats_key]['tww_period'] = pivot_dict[freq]['tww_period']
-        pivot_dict_stats[stats_key]['day_counts'] = pivot_dict[freq]['day_counts']
-        logger.debug(f'----- Added the (tww_period) and (day_counts) column for ({stats_key}) ticker data.') 
-    else: 
-        pivot_dict_stats[stats_key]['holiday_category'] = pivot_dict[freq]['holiday_category']
-        pivot_dict_stats[stats_key]['day_counts'] = pivot_dict[freq]['day_counts']
-        logger.debug(f'----- Added the (holiday_category) and (day_counts) column for ({stats_key}) ticker data.') 
-
-
 def create_pivot(
         df_dict:Dict[Text, pd.DataFrame], 
         pivot_dict:Dict[Text, pd.DataFrame], 
@@ -180,15 +119,11 @@ def create_pivot(
         elif freq_col == 'weekday': index = ['week', freq_col]
 
         # Create a pivot table to display the 'price_diff' for each month / week / trading days for each year.  
+        # The periods stay in the index until the export. See (flatten_pivot). 
         pivot_dict[freq] = df_dict[freq].pivot_table(values=pivot_value, index=index, 
                                                      columns=column, aggfunc='mean')
         logger.debug(f'----- Created a pivot table for ({freq}) ticker data.')
 
-        # Reset the index. Some visualisation tools like 'Tableau' require 
-        # a specific format of data structure to process and visualise the data. 
-        pivot_dict[freq].reset_index(inplace=True)
-        logger.debug(f'----- Resetted the index for ({freq}) ticker data.') 
-
         
 def summarise_pivot(
         pivot_dict:Dict[Text, pd.DataFrame], 
@@ -241,27 +176,35 @@ def summarise_pivot(
                     continue
                 repeated_start_yr = True
         
+            # Filter the columns to specific year range. The stats below only read this window. 
+            df_window = pivot_dict[freq].loc[:,start_yr:end_yr]
+
             # Compute the average price change across years. 
             # Store it as a DataFrame object. 
-            pivot_dict_stats[stats_key] = pd.DataFrame(pivot_dict[freq].loc[:,start_yr:end_yr].mean(axis=1), 
-                                                       columns=['avg_diff'])
+            pivot_dict_stats[stats_key] = pd.DataFrame(df_window.mean(axis=1), columns=['avg_diff'])
             logger.debug(f'----- Created a column (avg_diff) for ({stats_key}) ticker data.')
 
             # Compute median price change.
-            pivot_dict_stats[stats_key]['med_diff'] = pivot_dict[freq].loc[:,start_yr:end_yr].median(axis=1)
+            pivot_dict_stats[stats_key]['med_diff'] = df_window.median(axis=1)
             logger.debug(f'----- Created a column (med_diff) for ({stats_key}) ticker data.')
 
+            # Compute the percentiles of the price change. Same interpolation as the median.
+            percentiles = df_window.quantile(QUANTILE_LEVELS, axis=1)
+            for col, level in zip(QUANTILE_COLS, QUANTILE_LEVELS):
+                pivot_dict_stats[stats_key][f'{col}_diff'] = percentiles.loc[level]
+            logger.debug(f'----- Created columns ({QUANTILE_COLS[0]}_diff) to ({QUANTILE_COLS[-1]}_diff) for ({stats_key}) ticker data.')
+
             # Compute total price change.
-            pivot_dict_stats[stats_key]['tot_diff'] = pivot_dict[freq].loc[:,start_yr:end_yr].sum(axis=1)
+            pivot_dict_stats[stats_key]['tot_diff'] = df_window.sum(axis=1)
             logger.debug(f'----- Created a column (tot_diff) for ({stats_key}) ticker data.')
 
             # Compute max and min price change.
-            pivot_dict_stats[stats_key]['max_diff'] = pivot_dict[freq].loc[:,start_yr:end_yr].max(axis=1)
-            pivot_dict_stats[stats_key]['min_diff'] = pivot_dict[freq].loc[:,start_yr:end_yr].min(axis=1)
+            pivot_dict_stats[stats_key]['max_diff'] = df_window.max(axis=1)
+            pivot_dict_stats[stats_key]['min_diff'] = df_window.min(axis=1)
             logger.debug(f'----- Created columns (max_diff) and (min_diff) for ({stats_key}) ticker data.')
 
             # Compute standard deviation. 
-            pivot_dict_stats[stats_key]['std_diff'] = pivot_dict[freq].loc[:,start_yr:end_yr].std(axis=1)
+            pivot_dict_stats[stats_key]['std_diff'] = df_window.std(axis=1)
             logger.debug(f'----- Created a column (std_diff) for ({stats_key}) ticker data.')
 
             # Indicate whether the average price change is positive or negative. 
@@ -269,23 +212,28 @@ def summarise_pivot(
             pivot_dict_stats[stats_key].loc[pivot_dict_stats[stats_key]['avg_diff'] > 0,'up_overall'] = 1
             logger.debug(f'----- Created a column (up_overall) for ({stats_key}) ticker data.')
 
-            # Compute average positive price change.
-            df = pivot_dict[freq][pivot_dict[freq].loc[:,start_yr:end_yr] > 0]
-            pivot_dict_stats[stats_key]['pos_avg_diff'] = df.loc[:,start_yr:end_yr].mean(axis=1)
+            # Compute average positive price change. The positive and the negative changes 
+            # are written in turn into one buffer, and the other cells are NaN. 
+            values = df_window.to_numpy(dtype=np.float64)
+            signed = np.where(values > 0, values, np.nan)
+            df = pd.DataFrame(signed, index=df_window.index, columns=df_window.columns)
+            pivot_dict_stats[stats_key]['pos_avg_diff'] = df.mean(axis=1)
             logger.debug(f'----- Created a column (pos_avg_diff) for ({stats_key}) ticker data.')
 
             # Count positive price change. 
-            up_counts = df.loc[:,start_yr:end_yr].count(axis=1)
+            up_counts = df.count(axis=1)
             pivot_dict_stats[stats_key]['up_counts'] = up_counts
             logger.debug(f'----- Created a column (up_counts) for ({stats_key}) ticker data.')
 
-            # Compute average negative price change.
-            df = pivot_dict[freq][pivot_dict[freq].loc[:,start_yr:end_yr] < 0]
-            pivot_dict_stats[stats_key]['neg_avg_diff'] = df.loc[:,start_yr:end_yr].mean(axis=1)
+            # Compute average negative price change. 
+            signed.fill(np.nan)
+            np.copyto(signed, values, where=values < 0)
+            df = pd.DataFrame(signed, index=df_window.index, columns=df_window.columns)
+            pivot_dict_stats[stats_key]['neg_avg_diff'] = df.mean(axis=1)
             logger.debug(f'----- Created a column (neg_avg_diff) for ({stats_key}) ticker data.')
 
             # Count negative price change. 
-            down_counts = df.loc[:,start_yr:end_yr].count(axis=1)
+            down_counts = df.count(axis=1)
             pivot_dict_stats[stats_key]['down_counts'] = down_counts
             logger.debug(f'----- Created a column (down_counts) for ({stats_key}) ticker data.')
 
@@ -295,8 +243,8 @@ def summarise_pivot(
             pivot_dict_stats[stats_key]['down_prob'] = 1 - prob
             logger.debug(f'----- Created columns (up_prob) and (down_prob) for ({stats_key}) ticker data.')
             
-            # Add new column(s) to indicate the interval. 
-            custom_set_index(pivot_dict, pivot_dict_stats, stats_key, freq)
+            # The stats share the period index of the pivot table. 
+            pivot_dict_stats[stats_key].index = get_stats_index(pivot_dict_stats[stats_key].index, freq)
 
 
 # ----------------------------------------------------------------------
@@ -353,19 +301,22 @@ def compute_avg_vol(
                     continue
                 repeated_start_yr = True
                 
-            # Filter the columns to specific year range. 
-            pivot_dict_copy = pivot_dict[freq].loc[:,start_yr:end_yr].copy()
+            # Filter the columns to specific year range. Only read, so not copied. 
+            df_window = pivot_dict[freq].loc[:,start_yr:end_yr]
 
             # Compute the average volume across columns and rows. 
-            pivot_dict_avg[f'{stats_key}_avg_vol_row'] = pd.DataFrame(pivot_dict_copy.mean(axis=1), 
+            pivot_dict_avg[f'{stats_key}_avg_vol_row'] = pd.DataFrame(df_window.mean(axis=1), 
                                                                       columns=['avg_vol_row'])
-            pivot_dict_avg[f'{stats_key}_avg_vol_col'] = pd.DataFrame(pivot_dict_copy.mean(axis=0), 
+            pivot_dict_avg[f'{stats_key}_avg_vol_col'] = pd.DataFrame(df_window.mean(axis=0), 
                                                                       columns=['avg_vol_col'])
             logger.debug(f'----- Created a column (avg_vol_row) for ({stats_key}_avg_vol_row) ticker volume data.')
             logger.debug(f'----- Created a column (avg_vol_col) for ({stats_key}_avg_vol_col) ticker volume data.')
 
-            # Add new column(s) to indicate the interval. 
-            custom_set_index(pivot_dict, pivot_dict_avg, f'{stats_key}_avg_vol_row', freq)
+            # Compute the percentiles of the volume of each row across years.
+            percentiles = df_window.quantile(QUANTILE_LEVELS, axis=1)
+            for col, level in zip(QUANTILE_COLS, QUANTILE_LEVELS):
+                pivot_dict_avg[f'{stats_key}_avg_vol_row'][f'{col}_vol'] = percentiles.loc[level]
+            logger.debug(f'----- Created columns ({QUANTILE_COLS[0]}_vol) to ({QUANTILE_COLS[-1]}_vol) for ({stats_key}_avg_vol_row) ticker volume data.')
 
 
 def summarise_pivot_vol(
@@ -418,26 +369,20 @@ def summarise_pivot_vol(
                     continue
                 repeated_start_yr = True
                 
-            # List containing dataframes for 'pandas concat'. 
-            ls_df = []
-
-            for year in range(start_yr, end_yr + 1, 1):
-                # Find rows of each year that are above the average volume. 
-                df_filteredYear = pivot_dict[freq][[year]].copy()
-                avg_vol = pivot_dict_stats[f'{stats_key}_avg_vol_col'].loc[year,:][0]
-                abv_avg_vol = df_filteredYear[year] > avg_vol
-                blw_avgVol = df_filteredYear[year] < avg_vol
-
-                # Indicate the rows that are above the average volume. 
-                df_filteredYear[f'abv_avg_vol_{year}'] = np.nan
-                df_filteredYear.loc[abv_avg_vol, f'abv_avg_vol_{year}'] = 1 
-                df_filteredYear.loc[blw_avgVol, f'abv_avg_vol_{year}'] = 0 
+            # Compare the volume of every year with its average volume at once, instead of 
+            # copying each year column. 
+            years = list(range(start_yr, end_yr + 1, 1))
+            values = pivot_dict[freq][years].to_numpy(dtype=np.float64)
+            avg_vol = pivot_dict_stats[f'{stats_key}_avg_vol_col'].loc[years,'avg_vol_col'].to_numpy()
 
-                ls_df.append(df_filteredYear[[f'abv_avg_vol_{year}']]) 
-                logger.debug(f'----- Created a column (abv_avg_vol_{year}) for ({stats_key}_avg_vol_col) ticker volume data.')
+            # Indicate the rows that are above (1) or below (0) the average volume of each year. 
+            flags = np.full(values.shape, np.nan)
+            np.copyto(flags, 1.0, where=values > avg_vol)
+            np.copyto(flags, 0.0, where=values < avg_vol)
 
-            # Perform pandas concat. 
-            pivot_dict_stats[stats_key] = pd.concat(ls_df, axis=1)
+            columns = pd.Index([f'abv_avg_vol_{year}' for year in years], name=pivot_dict[freq].columns.name)
+            pivot_dict_stats[stats_key] = pd.DataFrame(flags, index=pivot_dict[freq].index, columns=columns)
+            logger.debug(f'----- Created columns (abv_avg_vol_{start_yr}) to (abv_avg_vol_{end_yr}) for ({stats_key}_avg_vol_col) ticker volume data.')
 
             # Count the total monthly volume that are above or below the average volume. 
             totalCounts = pivot_dict_stats[stats_key].count(axis=1) 
@@ -447,9 +392,6 @@ def summarise_pivot_vol(
             pivot_dict_stats[stats_key]['abv_avg_vol_prob'] = abvCounts / totalCounts
             logger.debug(f'----- Created columns (abv_avg_vol_counts), (blw_avg_vol_counts), (abv_avg_vol_prob) for ({stats_key}) ticker volume data.')
 
-            # Add new column(s) to indicate the interval. 
-            custom_set_index(pivot_dict, pivot_dict_stats, stats_key, freq)
-
 
 # ----------------------------------------------------------------------
 # Preprocessing Holidays/Observances/SpecialDay Data. 
@@ -859,8 +801,42 @@ def trace_non_spec_observance(df_ticker_data:pd.DataFrame, df_holidays:pd.DataFr
     insert_holiday_col(df_ticker_data, holidays_dict, holiday_col)
 
 
+def get_unique_days_pivot_cols(key:Text) -> Tuple[Union[Text, List[Text]], Text]:
+    '''
+    Purpose:
+        Get the index and the year column of the pivot table of a holiday,
+        observance, or special day key. See the notes of (create_pivot_unique_days).
+
+    Return :
+        Tuple of the index column(s) and the year column. Example: ('new_year_day_counts', 'new_year_spec_year')
+    '''
+
+    # REFINE: Need to refine this function in the future. 
+    spec_year = f'{key}_spec_year'
+    idx_col = f'{key}_day_counts'
+    
+    if key == 'first_trdr_dom': 
+        spec_year, idx_col = 'year', key 
+    elif 'tww' in key:
+        spec_year = 'year'
+    
+    # The 'by_month' refers to the partial name of the dataframe which 
+    # contains the average value of each month for each year. 
+    # Without 'by_month' means the value is averaged across all the months for each year. 
+    if 'by_month' in key:
+        # Remove '_byMonth' from the str name. 
+        idx_col = key[:-9]
+        
+        if idx_col == 'super_day': 
+            spec_year, idx_col = f'{idx_col}_spec_year', [f'{idx_col}_spec_month', f'{idx_col}_day_counts']
+        elif idx_col == 'first_trdr_dom':
+            spec_year, idx_col = 'year', ['month', idx_col]
+    return idx_col, spec_year
+
+
 def create_pivot_unique_days(df_ticker_data: pd.DataFrame, pivot_dict: Dict[Text, pd.DataFrame], 
-                            pivot_dict_keys:List[Text], start_yr:Text, end_yr:Text, drop_idx:bool=False): 
+                            pivot_dict_keys:List[Text], start_yr:Text, end_yr:Text, drop_idx:bool=False,
+                            raw_pivots:Optional[Dict[Text, pd.DataFrame]]=None): 
     '''
     Purpose: 
         Create pivot tables for holidays, observances, and special day.
@@ -873,6 +849,8 @@ def create_pivot_unique_days(df_ticker_data: pd.DataFrame, pivot_dict: Dict[Text
         start_yr        : Int. Starting year to compile the data on. 
         end_yr          : Int. Ending year to compile the data on. 
         drop_idx        : Bool. Indicate whether to drop the index or not. 
+        raw_pivots      : Dictionary. Pivot tables of every year to use instead of 
+                          pivoting (df_ticker_data). Example: the pivot tables of 'incremental'.
 
     Return :
         None.
@@ -888,42 +866,27 @@ def create_pivot_unique_days(df_ticker_data: pd.DataFrame, pivot_dict: Dict[Text
 
     logger.info('Start running (create_pivot_unique_days) function.')
     
-    # REFINE: Need to refine this function in the future. 
     for key in pivot_dict_keys: 
-        spec_year = f'{key}_spec_year'
-        idx_col = f'{key}_day_counts'
-        
-        if key == 'first_trdr_dom': 
-            spec_year, idx_col = 'year', key 
-        elif 'tww' in key:
-            spec_year = 'year'
-        
-        # The 'by_month' refers to the partial name of the dataframe which 
-        # contains the average value of each month for each year. 
-        # Without 'by_month' means the value is averaged across all the months for each year. 
-        if 'by_month' in key:
-            # Remove '_byMonth' from the str name. 
-            idx_col = key[:-9]
-            
-            if idx_col == 'super_day': 
-                spec_year, idx_col = f'{idx_col}_spec_year', [f'{idx_col}_spec_month', f'{idx_col}_day_counts']
-            elif idx_col == 'first_trdr_dom':
-                spec_year, idx_col = 'year', ['month', idx_col] 
-        
+        idx_col, spec_year = get_unique_days_pivot_cols(key)
+
         # Create a pivot table. 
-        pivot_dict[key] = df_ticker_data.pivot_table(values='price_diff', 
-                                                     index=idx_col, columns=spec_year, 
-                                                     aggfunc='mean').loc[:,start_yr:end_yr]
+        if raw_pivots is None:
+            pivot_dict[key] = df_ticker_data.pivot_table(values='price_diff', 
+                                                         index=idx_col, columns=spec_year, 
+                                                         aggfunc='mean').loc[:,start_yr:end_yr]
+        else:
+            pivot_dict[key] = raw_pivots[key].loc[:,start_yr:end_yr]
         logger.debug(f'----- Created a pivot table for ({key}) for ticker data.') 
 
-        # Reset the index. Some visualisation tools like 'Tableau' require 
-        # a specific format of data structure to process and visualise the data. 
-        # Except for TWW data. We will reset the index at later stage. 
+        # Index the holidays by their category. Except for TWW data, which is indexed 
+        # at later stage. The periods stay in the index until the export. See (flatten_pivot). 
         if 'tww' not in key: 
-            pivot_dict[key].reset_index(inplace=True, drop=drop_idx)
+            if drop_idx: 
+                pivot_dict[key].index = pd.RangeIndex(len(pivot_dict[key]))
             if key in HOLIDAYS_KEYS: 
-                pivot_dict[key]['holiday_category'] = key 
-            logger.debug(f'----- Resetted the index for ({key}) ticker data.')
+                category = pd.Index([key] * len(pivot_dict[key]), name='holiday_category')
+                pivot_dict[key].set_index(category, append=not drop_idx, inplace=True)
+            logger.debug(f'----- Indexed the pivot table for ({key}) ticker data.')
 
 
 def concat_pivot_tww(pivot_dict:Dict[Text, pd.DataFrame], pivot_dict_keys:List[Text]):
@@ -945,9 +908,9 @@ def concat_pivot_tww(pivot_dict:Dict[Text, pd.DataFrame], pivot_dict_keys:List[T
         tww_key = key 
         tww_weekAft_key = f'{key}_week_aft'
         
-        # Concat the 'TWW' and 'TWW week after' dataframes. 
+        # Concat the 'TWW' and 'TWW week after' dataframes, indexed by the TWW period and the day counts. 
         ls_df = [pivot_dict[tww_key], pivot_dict[tww_weekAft_key]]
-        df_concat = pd.concat(ls_df, keys=(tww_key, tww_weekAft_key), names=('tww_period', 'day_counts')).copy() 
+        df_concat = pd.concat(ls_df, keys=(tww_key, tww_weekAft_key), names=('tww_period', 'day_counts')) 
         logger.debug(f'----- Concatenated ({tww_key}) and ({tww_weekAft_key}) for ticker data.') 
 
         # Delete the other data after concatenating both of the data. 
@@ -956,11 +919,6 @@ def concat_pivot_tww(pivot_dict:Dict[Text, pd.DataFrame], pivot_dict_keys:List[T
         # Assign the updated TWW data back to the dict obj. 
         pivot_dict[tww_key] = df_concat
 
-        # Reset the index. Some visualisation tools like 'Tableau' require 
-        # a specific format of data structure to process and visualise the data. 
-        pivot_dict[tww_key].reset_index(inplace=True) 
-        logger.debug(f'----- Resetted the index for ({tww_key}) ticker data.') 
-
 
 def concat_pivot_unique_days(pivot_dict:Dict[Text, pd.DataFrame], pivot_dict_keys:List[Text], cat_name:Text):
     '''
@@ -980,11 +938,98 @@ def concat_pivot_unique_days(pivot_dict:Dict[Text, pd.DataFrame], pivot_dict_key
 
     logger.info('Start running (concat_pivot_unique_days) function.')
 
-    df_list = []
-    for key in pivot_dict_keys:
-        df_copy = pivot_dict[key].copy()
-        df_copy['day_counts'] = df_copy.index
-        df_list.append(df_copy)
+    df_list = [pivot_dict[key] for key in pivot_dict_keys]
+    df_concat = pd.concat(df_list)
+
+    # The day counts are the positions of the rows within each dataframe. They replace 
+    # the day counts of the TWW data, and are added after the holiday category. 
+    day_counts = np.concatenate([np.arange(len(df)) for df in df_list])
+    names = [name for name in df_concat.index.names if name != 'day_counts']
+    levels = [df_concat.index.get_level_values(name) for name in names]
+    df_concat.index = pd.MultiIndex.from_arrays(levels + [day_counts], names=names + ['day_counts'])
+
+    pivot_dict[f'compiled_{cat_name}'] = df_concat
+    logger.debug(f'----- Concatenated the dataframes for {cat_name}.')
+
+
+# ----------------------------------------------------------------------
+# Export Layout. 
+# ----------------------------------------------------------------------
+
+# The pivot tables and their stats keep the periods in the index in memory. They are 
+# only flattened for the storage files and the workbooks, since some visualisation 
+# tools like 'Tableau' require the periods as plain columns. 
+
+def get_stats_index(index:pd.Index, freq:Text) -> pd.Index:
+    # The stats of the single day keys name their day counts after the key. Example: 'super_day'
+    return index.rename(freq) if freq in ['super_day', 'santa_rally'] else index
+
+
+def flatten_pivot(pivot:pd.DataFrame) -> pd.DataFrame:
+    '''
+    Purpose: 
+        Move the period index of a pivot table into columns before the years. The 
+        holiday category and the index levels after it go after the years. 
+
+    Input  :
+        pivot: Dataframe. Pivot table indexed by its periods. 
+
+    Return :
+        New flat dataframe with a range index. Example: ['month', 'trdr_day', 2004, ..., 2020]
+    '''
+
+    names = [name for name in pivot.index.names if name is not None]
+    if not names: 
+        return pivot
+
+    split = names.index('holiday_category') if 'holiday_category' in names else len(names)
+    if split == len(names): 
+        return pivot.reset_index()
+
+    df = pivot.reset_index(level=names[:split]) if split else pivot.copy(deep=False)
+    for name in names[split:]: 
+        df[name] = pivot.index.get_level_values(name)
+    return df.reset_index(drop=True)
+
+
+def flatten_stats(df_stats:pd.DataFrame) -> pd.DataFrame:
+    '''
+    Purpose: 
+        Move the period index of a stats dataframe into columns after the stats. 
+
+    Input  :
+        df_stats: Dataframe. Stats of (summarise_pivot) or (summarise_pivot_vol). 
+
+    Return :
+        New flat dataframe with a range index. Example: ['avg_diff', ..., 'down_prob', 'month']
+    '''
+
+    names = [name for name in df_stats.index.names if name is not None]
+    if not names: 
+        return df_stats
+
+    df = df_stats.reset_index(drop=True)
+    for name in names: 
+        df[name] = df_stats.index.get_level_values(name)
+    return df
+
+
+def flatten_summary(pivot_dict:Dict[Text, pd.DataFrame], 
+                    pivot_dict_stats:Dict[Text, pd.DataFrame]) -> Tuple[Dict[Text, pd.DataFrame], Dict[Text, pd.DataFrame]]:
+    '''
+    Purpose: 
+        Flatten the pivot tables and their stats for the export. The average volume 
+        of each year is indexed by the years, and is kept as it is. 
+
+    Input  :
+        pivot_dict      : Dictionary. Pivot tables indexed by their periods. 
+        pivot_dict_stats: Dictionary. Stats of the pivot tables. 
+
+    Return :
+        Tuple of new dictionaries of the flat pivot tables and stats. 
+    '''
 
-    pivot_dict[f'compiled_{cat_name}'] = pd.concat(df_list).reset_index(drop=True)
-    logger.debug(f'----- Concatenated the dataframes for {cat_name}.') 
+    pivot_dict = {key: flatten_pivot(pivot) for key, pivot in pivot_dict.items()}
+    pivot_dict_stats = {key: df if key.endswith('_avg_vol_col') else flatten_stats(df) 
+                        for key, df in pivot_dict_stats.items()}
+    return pivot_dict, pivot_dict_stats 
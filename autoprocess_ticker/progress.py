@@ -0,0 +1,322 @@
+
+
+import os, sys, json, logging, sqlite3, threading, time
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Text, TextIO
+import luigi
+from luigi.task import flatten
+
+# Personal modules.
+from config.config import (
+    LOG_PROCESSING_FILEPATH, USE_RUN_MANIFEST, RUN_MANIFEST_PATH, RAW_ARCHIVE_DIR,
+    USE_PROGRESS, PROGRESS_STATUS_PATH, PROGRESS_INTERVAL, PROGRESS_WINDOW
+)
+from config.config_logger import setup_logger
+from autoprocess_ticker import raw_archive, stream_executor, export_scheduler
+import luigi_pipeline
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# ----------------------------------------------------------------------
+# Status File.
+# ----------------------------------------------------------------------
+
+def write_status(status:Dict, path:Text=PROGRESS_STATUS_PATH):
+    # Write into a temporary file, then move it into place, so a poller never reads a partial file.
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = f'{path}.part-{os.getpid()}'
+    with open(temp_path, 'w') as out_file:
+        json.dump(status, out_file, indent=2)
+    os.replace(temp_path, path)
+
+
+def read_status(path:Text=PROGRESS_STATUS_PATH) -> Optional[Dict]:
+    # Latest status of (write_status). None if no run has written one yet.
+    if not os.path.exists(path):
+        return None
+    with open(path) as in_file:
+        return json.load(in_file)
+
+
+def format_duration(seconds:Optional[float]) -> Text:
+    # Example: '1h02m' / '4m10s' / '?' when unknown.
+    if seconds is None:
+        return '?'
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}h{minutes:02d}m' if hours else f'{minutes}m{seconds:02d}s'
+
+
+def format_status(status:Dict) -> Text:
+    '''
+    Purpose:
+        Format a status as one line for the terminal. Example:
+            Run 12 -- 40/100 done, 3 in flight, 2 failed -- 20.0 tickers/min, 0.12 MB/s --
+            Queued: ProcessTickerData 2, PivotTickerSummary 1 -- ETA 2m55s -- network-bound
+    '''
+
+    tickers, throughput = status['tickers'], status['throughput']
+    queued = [f'{stage} {counts["queued"]}' for stage, counts in status['stages'].items() if counts['queued']]
+    return ' -- '.join([
+        f'Run {status["run_id"]}',
+        f'{tickers["completed"] + tickers["skipped"]}/{tickers["total"]} done, {tickers["in_flight"]} in flight, '
+        f'{tickers["failed"]} failed',
+        f'{throughput["tickers_per_min"]} tickers/min, {throughput["download_mb_per_s"]} MB/s',
+        f'Queued: {", ".join(queued) or "none"}',
+        'Finished' if status['finished'] else f'ETA {format_duration(status["eta_seconds"])}',
+        f'{status["bound"]}-bound',
+    ])
+
+
+# ----------------------------------------------------------------------
+# Progress Reporter.
+# ----------------------------------------------------------------------
+
+class ProgressReporter:
+    '''
+    Live progress of a run. The Luigi event handlers of 'luigi_pipeline' record the
+    start, the success and the failure of every stage in the run manifest, from any
+    process or host, so a thread polls the manifest and counts the tickers completed,
+    in flight and failed, the stages queued, and the throughput. The batch runner
+    reports the tickers it hands out and their result, which also covers a Luigi
+    process that failed before its first stage.
+
+    Each poll is printed on (stream), on one line if it is a terminal, and written
+    to (status_path). The run is network-bound when the downloads take most of the
+    busy seconds of the stages finished within (window), else CPU-bound.
+
+    Example:
+        with ProgressReporter(tasks, run_id) as reporter:
+            reporter.ticker_started(task)
+            ...
+            reporter.ticker_finished(task, task.complete())
+    '''
+
+    def __init__(self, tasks:List[luigi.Task], run_id:Optional[int]=None, status_path:Text=PROGRESS_STATUS_PATH,
+                 interval:float=PROGRESS_INTERVAL, window:float=PROGRESS_WINDOW, stream:TextIO=sys.stderr,
+                 db_path:Text=RUN_MANIFEST_PATH):
+        self.run_id = run_id
+        self.status_path = status_path
+        self.interval = interval
+        self.window = window
+        self.stream = stream
+        self.db_path = db_path
+        self.started_at = time.time()
+
+        # Stage graph of every ticker, with the stages recorded in the manifest. A ticker is complete once its
+        # workbook is. Example: {task_id: {'stage': 'PivotVolSummary', 'ticker': '.../SPY', 'deps': [...]}}
+        self.roots: Dict[Text, Text] = {}
+        self.graph: Dict[Text, Dict] = {}
+        for task in tasks:
+            key = f'{task.etf_dir}/{task.ticker}'
+            self.roots[key] = export_scheduler.get_export_task(task).task_id
+            for stage in stream_executor.list_stages(task):
+                if not isinstance(stage, luigi_pipeline.ManifestMixin):
+                    continue
+                self.graph[stage.task_id] = {
+                    'stage': stage.get_task_family(), 'ticker': key, 'task': stage,
+                    'deps': [dep.task_id for dep in flatten(stage.requires())],
+                }
+
+        self.entries: Dict[Text, Dict] = {}
+        self.sizes: Dict[Text, int] = {}
+        self.started: Set[Text] = set()
+        self.finished: Dict[Text, bool] = {}
+        self.last_update = 0.0
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.conn = None
+        self.archive = None
+
+    # Batch runner hooks. -------------------------------------------------
+
+    def ticker_started(self, task:luigi.Task):
+        with self.lock:
+            self.started.add(f'{task.etf_dir}/{task.ticker}')
+
+    def ticker_finished(self, task:luigi.Task, succeeded:bool):
+        with self.lock:
+            self.finished[f'{task.etf_dir}/{task.ticker}'] = succeeded
+
+    # Polling. ------------------------------------------------------------
+
+    def read_entries(self):
+        # Read the manifest entries updated since the last poll. The reporter keeps its own connection, used by the
+        # polling thread, then by (stop) once the thread has ended.
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.db_path, timeout=60, check_same_thread=False)
+            self.conn.row_factory = sqlite3.Row
+        try:
+            rows = self.conn.execute(
+                'SELECT task_id, status, duration, updated_at FROM stages WHERE updated_at >= ?', (self.last_update - 1,)
+            ).fetchall()
+        except sqlite3.OperationalError as error:
+            # The manifest is created by the first stage of the run.
+            logger.debug(f'----- Failed to read the run manifest ({self.db_path}) -- {error}')
+            return
+
+        for row in rows:
+            if row['task_id'] in self.graph:
+                self.entries[row['task_id']] = dict(row)
+            self.last_update = max(self.last_update, row['updated_at'] or 0.0)
+
+    def download_size(self, task_id:Text) -> int:
+        # Bytes of a finished download, read once.
+        if task_id not in self.sizes:
+            target = self.graph[task_id]['task'].output()
+            if isinstance(target, raw_archive.ArchiveTarget):
+                # A separate archive index, as the main thread may read the shared one.
+                self.archive = self.archive or raw_archive.RawArchive(RAW_ARCHIVE_DIR)
+                entry = self.archive.get(target.key)
+                self.sizes[task_id] = entry['size'] if entry else 0
+            else:
+                self.sizes[task_id] = os.path.getsize(target.path) if os.path.exists(target.path) else 0
+        return self.sizes[task_id]
+
+    def snapshot(self, finished:bool=False) -> Dict:
+        '''
+        Purpose:
+            Count the tickers and the stages from the manifest entries read so far.
+
+        Return :
+            Dictionary of the status. Example:
+                {'run_id': 12, 'finished': False, 'elapsed_seconds': 310.2,
+                 'tickers': {'total': 100, 'completed': 40, 'skipped': 0, 'in_flight': 3, 'queued': 55, 'failed': 2},
+                 'throughput': {'tickers_per_min': 20.0, 'download_mb': 35.1, 'download_mb_per_s': 0.12},
+                 'eta_seconds': 175.0, 'bound': 'network', 'busy_seconds': {'download': 180.4, 'process': 95.0},
+                 'stages': {'DownloadTickerData': {'done': 135, 'running': 2, 'queued': 10, 'failed': 2}, ...},
+                 'failed_tickers': ['docs/dataset/ETF_sector/XLK']}
+        '''
+
+        now = time.time()
+        window_start = max(now - self.window, self.started_at)
+
+        def this_run(entry):
+            return entry is not None and (entry['updated_at'] or 0.0) >= self.started_at
+
+        def status_of(task_id):
+            entry = self.entries.get(task_id)
+            if entry is None or (entry['status'] != 'done' and not this_run(entry)):
+                return None
+            return entry['status']
+
+        stages, tickers, failed_tickers = {}, {}, []
+        busy = {'download': 0.0, 'process': 0.0}
+        download_bytes = window_bytes = 0
+        for task_id, node in self.graph.items():
+            counts = stages.setdefault(node['stage'], {'done': 0, 'running': 0, 'queued': 0, 'failed': 0})
+            status = status_of(task_id)
+            if status in counts:
+                counts[status] += 1
+            elif all(status_of(dep) == 'done' for dep in node['deps']):
+                counts['queued'] += 1
+
+            entry = self.entries.get(task_id)
+            if status is not None and this_run(entry):
+                tickers.setdefault(node['ticker'], set()).add(status)
+            if status == 'done' and this_run(entry):
+                is_download = node['stage'] == luigi_pipeline.DownloadTickerData.get_task_family()
+                if is_download:
+                    download_bytes += self.download_size(task_id)
+                if entry['updated_at'] >= window_start:
+                    busy['download' if is_download else 'process'] += entry['duration'] or 0.0
+                    window_bytes += self.download_size(task_id) if is_download else 0
+
+        counts = {'total': len(self.roots), 'completed': 0, 'skipped': 0, 'in_flight': 0, 'queued': 0, 'failed': 0}
+        window_completed = 0
+        with self.lock:
+            for key, root_id in self.roots.items():
+                statuses = tickers.get(key, set())
+                entry = self.entries.get(root_id)
+                if status_of(root_id) == 'done':
+                    state = 'completed' if this_run(entry) else 'skipped'
+                    window_completed += state == 'completed' and entry['updated_at'] >= window_start
+                elif 'failed' in statuses or self.finished.get(key) is False:
+                    state = 'failed'
+                    failed_tickers.append(key)
+                elif statuses or (key in self.started and key not in self.finished):
+                    state = 'in_flight'
+                else:
+                    state = 'queued'
+                counts[state] += 1
+
+        window_seconds = max(now - window_start, 1e-9)
+        tickers_per_min = window_completed / window_seconds * 60
+        remaining = counts['total'] - counts['completed'] - counts['skipped'] - counts['failed']
+        return {
+            'run_id': self.run_id,
+            'started_at': datetime.fromtimestamp(self.started_at).isoformat(timespec='seconds'),
+            'updated_at': datetime.fromtimestamp(now).isoformat(timespec='seconds'),
+            'elapsed_seconds': round(now - self.started_at, 1),
+            'finished': finished,
+            'tickers': counts,
+            'throughput': {
+                'tickers_per_min': round(tickers_per_min, 2),
+                'download_mb': round(download_bytes / 1024 ** 2, 2),
+                'download_mb_per_s': round(window_bytes / 1024 ** 2 / window_seconds, 3),
+            },
+            'eta_seconds': round(remaining / tickers_per_min * 60, 1) if tickers_per_min and remaining else None,
+            'bound': 'unknown' if not any(busy.values()) else ('network' if busy['download'] >= busy['process'] else 'cpu'),
+            'busy_seconds': {name: round(seconds, 2) for name, seconds in busy.items()},
+            'stages': stages,
+            'failed_tickers': failed_tickers,
+        }
+
+    def report(self, finished:bool=False) -> Dict:
+        # Poll the manifest, then write the status file and the terminal line.
+        self.read_entries()
+        status = self.snapshot(finished)
+        write_status(status, self.status_path)
+
+        line = format_status(status)
+        if self.stream.isatty():
+            self.stream.write(f'\r\033[K{line}' + ('\n' if finished else ''))
+        else:
+            self.stream.write(f'{line}\n')
+        self.stream.flush()
+        return status
+
+    def poll(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.report()
+            except Exception as error:
+                logger.warning(f'----- Failed to report the progress -- {error}')
+
+    # Lifecycle. ----------------------------------------------------------
+
+    def start(self) -> 'ProgressReporter':
+        # Nothing is reported without the run manifest, which the Luigi events are recorded in.
+        if not (USE_PROGRESS and USE_RUN_MANIFEST):
+            return self
+        self.thread = threading.Thread(target=self.poll, name='progress', daemon=True)
+        self.thread.start()
+        logger.debug(f'----- Reporting the progress of ({len(self.roots)}) tickers to ({self.status_path})')
+        return self
+
+    def stop(self) -> Optional[Dict]:
+        # Stop polling and report the final status.
+        if self.thread is None:
+            return None
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        status = self.report(finished=True)
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        return status
+
+    def __enter__(self) -> 'ProgressReporter':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,331 @@
+
+
+import copy, logging
+from typing import Dict, Iterable, List, Optional, Text, Tuple
+import numpy as np
+import pandas as pd
+
+# Personal modules.
+from config.config import LOG_PROCESSING_FILEPATH, START_YR_RANGE, END_YR, QUANTILE_LEVELS, QUANTILE_COLS, SKETCH_K
+from config.config_logger import setup_logger
+from autoprocess_ticker import preprocessing, panel, query_api, walk_forward
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# ----------------------------------------------------------------------
+# Quantile Sketch.
+# ----------------------------------------------------------------------
+
+class QuantileSketch:
+    '''
+    Mergeable quantile sketch in the style of KLL. The values are kept in levels,
+    and a value of level (h) stands for (2 ** h) values. A full level is sorted and
+    every other value moves up a level, so the sketch keeps at most about 3 x (k)
+    values for any number of inputs, with a rank error within about 2 / (k).
+
+    The sketch is exact until its first compaction, and with k=None it never
+    compacts. The exact quantiles use the same interpolation as pandas.
+
+    Example:
+        sketch = QuantileSketch(k=200).update(chunk_1).update(chunk_2)
+        sketch.merge(other_sketch).quantile([0.05, 0.95])
+    '''
+
+    def __init__(self, k:Optional[int]=SKETCH_K):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.count = 0
+        self.min_value, self.max_value = np.inf, -np.inf
+        self._parity = 0
+
+    @property
+    def exact(self) -> bool:
+        # Every value is still kept with a weight of 1.
+        return len(self.levels) == 1
+
+    @property
+    def size(self) -> int:
+        return sum(len(items) for items in self.levels)
+
+    def capacity(self, level:int) -> int:
+        # The top level holds (k) values, and each level below holds 2/3 of the one above.
+        return max(2, int(np.ceil(self.k * (2 / 3) ** (len(self.levels) - level - 1))))
+
+    def update(self, values:Iterable[float]) -> 'QuantileSketch':
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if len(values):
+            self.count += len(values)
+            self.min_value, self.max_value = min(self.min_value, values.min()), max(self.max_value, values.max())
+            self.levels[0] = np.concatenate([self.levels[0], values])
+            self._compress()
+        return self
+
+    def merge(self, other:'QuantileSketch') -> 'QuantileSketch':
+        if self.k != other.k:
+            raise ValueError(f'Cannot merge sketches of different accuracy ({self.k}) and ({other.k}).')
+        self.levels += [np.empty(0)] * (len(other.levels) - len(self.levels))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.count += other.count
+        self.min_value, self.max_value = min(self.min_value, other.min_value), max(self.max_value, other.max_value)
+        self._compress()
+        return self
+
+    def copy(self) -> 'QuantileSketch':
+        return copy.deepcopy(self)
+
+    def _compress(self):
+        if self.k is None:
+            return
+        while True:
+            full = [level for level, items in enumerate(self.levels) if len(items) > self.capacity(level)]
+            if not full:
+                return
+            level = full[0]
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+
+            # Keep the smallest value of an odd level, and move up the odd or the even
+            # positions of the rest in turns, so the errors of the compactions cancel out.
+            items = np.sort(self.levels[level])
+            keep = len(items) % 2
+            self._parity ^= 1
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], items[keep + self._parity::2]])
+            self.levels[level] = items[:keep]
+
+    def quantile(self, levels:Iterable[float]) -> np.ndarray:
+        '''
+        Purpose:
+            Estimate the quantiles of every value seen. NaN if the sketch is empty.
+
+        Input  :
+            levels: List of Float within [0, 1]. Example: [0.05, 0.95]
+
+        Return :
+            Array of the quantiles, one per level.
+        '''
+
+        levels = np.asarray(levels, dtype=np.float64)
+        if self.count == 0:
+            return np.full(levels.shape, np.nan)
+        if self.exact:
+            return np.quantile(self.levels[0], levels)
+
+        # Each value stands for the ranks it was compacted from, centred on its weight.
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2.0 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        items, weights = items[order], weights[order]
+        ranks = (np.cumsum(weights) - weights / 2) / weights.sum()
+        return np.interp(levels, ranks, items, left=self.min_value, right=self.max_value)
+
+
+# ----------------------------------------------------------------------
+# Sketch Grid.
+# ----------------------------------------------------------------------
+
+class SketchGrid:
+    '''
+    Quantile sketches of the values of each period and year. The sketches of
+    a window are merged from its years, and the grids of different tickers or
+    chunks of data are merged cell by cell, without the raw values.
+
+    Example:
+        grid = SketchGrid.from_pivot(pivot_ticker['monthly'])
+        grid.merge(SketchGrid.from_pivot(other_pivot)).quantiles(2010, 2020)
+    '''
+
+    def __init__(self, period_cols:List[Text], k:Optional[int]=SKETCH_K):
+        self.period_cols = list(period_cols)
+        self.k = k
+        # {period: {year: sketch}}. Example: {('1',): {2004: QuantileSketch, ...}}
+        self.sketches: Dict[Tuple, Dict[int, QuantileSketch]] = {}
+
+    def cell(self, period:Tuple, year:int) -> QuantileSketch:
+        cells = self.sketches.setdefault(period, {})
+        if year not in cells:
+            cells[year] = QuantileSketch(self.k)
+        return cells[year]
+
+    def update(self, df:pd.DataFrame, value_col:Text, year_col:Text='year') -> 'SketchGrid':
+        '''
+        Purpose:
+            Add the values of a frame with the period and year columns, such as a
+            chunk of a ticker frame of (ProcessTickerData).
+        '''
+
+        df = df[df[value_col].notna()]
+        for key, values in df.groupby(self.period_cols + [year_col], sort=False)[value_col]:
+            *period, year = key
+            self.cell(tuple(period), int(year)).update(values.to_numpy())
+        return self
+
+    @classmethod
+    def from_pivot(cls, pivot:pd.DataFrame, k:Optional[int]=SKETCH_K) -> 'SketchGrid':
+        '''
+        Purpose:
+            Create the grid of a pivot table of 'preprocessing.create_pivot' or
+            'preprocessing.create_pivot_unique_days'. Every cell holds one value.
+        '''
+
+        periods, years, values = walk_forward.split_pivot(pivot)
+        grid = cls(list(periods.columns), k)
+        for period, row in zip(periods.itertuples(index=False, name=None), values):
+            grid.sketches[period] = {}
+            for year, value in zip(years, row):
+                if not np.isnan(value):
+                    grid.cell(period, int(year)).update([value])
+        return grid
+
+    def merge(self, other:'SketchGrid') -> 'SketchGrid':
+        if self.period_cols != other.period_cols:
+            raise ValueError(f'Cannot merge grids of the periods ({self.period_cols}) and ({other.period_cols}).')
+        for period, cells in other.sketches.items():
+            for year, sketch in cells.items():
+                self.cell(period, year).merge(sketch)
+        return self
+
+    def window(self, start_yr:int, end_yr:int) -> Dict[Tuple, QuantileSketch]:
+        # One merged sketch per period. The sketches of the grid are unchanged.
+        merged = {}
+        for period, cells in self.sketches.items():
+            merged[period] = QuantileSketch(self.k)
+            for year in sorted(cells):
+                if start_yr <= year <= end_yr:
+                    merged[period].merge(cells[year])
+        return merged
+
+    def quantiles(self, start_yr:int, end_yr:int, levels:List[float]=QUANTILE_LEVELS,
+                  cols:List[Text]=QUANTILE_COLS, suffix:Text='diff') -> pd.DataFrame:
+        '''
+        Purpose:
+            Compute the percentiles of each period over the years of a window.
+
+        Input  :
+            start_yr: Int. First year of the window.
+            end_yr  : Int. Last year of the window.
+            levels  : List of Float. Example: [0.05, 0.25, 0.75, 0.95]
+            cols    : List of the column prefix of each level. Example: ['p5', 'p25', 'p75', 'p95']
+            suffix  : Str. Column suffix. Example: 'diff' / 'vol'
+
+        Return :
+            Dataframe of the period columns and the percentile columns, one row per
+            period in the order of the grid. Example columns: ['month', 'p5_diff', ...]
+        '''
+
+        merged = self.window(start_yr, end_yr)
+        df = pd.DataFrame(list(merged), columns=self.period_cols)
+        values = np.array([sketch.quantile(levels) for sketch in merged.values()]).reshape(len(merged), len(levels))
+        for col, level_values in zip(cols, values.T):
+            df[f'{col}_{suffix}'] = level_values
+        return df
+
+
+def merge_grids(grids:Iterable[SketchGrid]) -> SketchGrid:
+    # Merge into a new grid, so the input grids are unchanged.
+    grids = list(grids)
+    merged = SketchGrid(grids[0].period_cols, grids[0].k)
+    for grid in grids:
+        merged.merge(grid)
+    return merged
+
+
+def sketch_tickers(tickers:List[Text], key:Text, source:Text='price', etf_dir:Optional[Text]=None,
+                   k:Optional[int]=SKETCH_K) -> SketchGrid:
+    '''
+    Purpose:
+        Merge the grids of the stored pivot tables of many tickers, for the
+        percentiles of each period across the tickers.
+        Example: sketch_tickers(['SPY', 'QQQ'], 'monthly').quantiles(2010, 2020)
+
+    Input  :
+        tickers: List of Str. Ticker symbols.
+        key    : Str. Pivot key. Example: 'monthly' / 'compiled_holiday'
+        source : Str. Source of the pivot tables. Example: 'price' / 'holiday'
+        etf_dir: Str. Directory of the tickers.
+        k      : Int. Accuracy of the sketches. Exact if None.
+
+    Return :
+        SketchGrid of every ticker.
+    '''
+
+    logger.info('Start running (sketch_tickers) function.')
+
+    merged = None
+    for ticker in tickers:
+        grid = SketchGrid.from_pivot(query_api.load_pivot(ticker, key, source, etf_dir), k)
+        merged = grid if merged is None else merged.merge(grid)
+    logger.debug(f'----- Merged the sketches of ({len(tickers)}) tickers for ({key}).')
+    return merged
+
+
+# ----------------------------------------------------------------------
+# Verification.
+# ----------------------------------------------------------------------
+
+def verify_sketches(pivot:pd.DataFrame, key:Text, start_yr:int, k:int=SKETCH_K,
+                    n_values:int=10 ** 6, seed:int=0) -> bool:
+    '''
+    Purpose:
+        Check the quantile sketches.
+        1. The exact grid of the pivot table gives the percentile columns of
+           'preprocessing.summarise_pivot' for every window.
+        2. The grids of two halves of the years merge into the grid of every year.
+        3. On (n_values) random values fed in chunks to several sketches and
+           merged, the rank of each estimate is within 2 / (k) of its level.
+
+    Input  :
+        pivot   : Dataframe. Pivot table of the key.
+        key     : Str. Pivot key. Example: 'monthly'
+        start_yr: Int. Starting year of the ticker.
+        k       : Int. Accuracy of the sketches to check.
+        n_values: Int. Number of random values.
+        seed    : Int. Seed of the random values.
+
+    Return :
+        True if every check passes. Raises AssertionError otherwise.
+    '''
+
+    logger.info('Start running (verify_sketches) function.')
+
+    pivot_dict, pivot_dict_stats = {key: pivot}, {}
+    preprocessing.summarise_pivot(pivot_dict, pivot_dict_stats, [key], [start_yr] + START_YR_RANGE[1:], END_YR)
+    grid = SketchGrid.from_pivot(pivot, k=None)
+    percentile_cols = [f'{col}_diff' for col in QUANTILE_COLS]
+
+    for suffix, window_start_yr in panel.iter_stats_windows([start_yr] + START_YR_RANGE[1:]):
+        df = grid.quantiles(window_start_yr, END_YR)
+        expected = pivot_dict_stats[f'{key}{suffix}'][percentile_cols].reset_index(drop=True)
+        pd.testing.assert_frame_equal(df[percentile_cols], expected, check_exact=False, rtol=1e-12, atol=1e-12)
+
+    years = sorted({year for cells in grid.sketches.values() for year in cells})
+    half = years[len(years) // 2]
+    early, late = SketchGrid(grid.period_cols, None), SketchGrid(grid.period_cols, None)
+    for period, cells in grid.sketches.items():
+        for year, sketch in cells.items():
+            (early if year < half else late).cell(period, year).merge(sketch)
+    merged = merge_grids([early, late])
+    pd.testing.assert_frame_equal(merged.quantiles(start_yr, END_YR), grid.quantiles(start_yr, END_YR), check_exact=True)
+
+    rng = np.random.default_rng(seed)
+    values = rng.standard_t(3, n_values)
+    sketches = [QuantileSketch(k).update(chunk) for chunk in np.array_split(values, 7)]
+    sketch = sketches[0]
+    for other in sketches[1:]:
+        sketch.merge(other)
+    levels = np.array([0.01] + QUANTILE_LEVELS + [0.5, 0.99])
+    ranks = np.searchsorted(np.sort(values), sketch.quantile(levels)) / n_values
+    assert sketch.count == n_values and sketch.size < 4 * k, (sketch.count, sketch.size)
+    assert np.abs(ranks - levels).max() <= 2 / k, np.abs(ranks - levels).max()
+
+    logger.debug(f'----- Verified the sketches of ({key}), with a rank error of ({np.abs(ranks - levels).max():.5f}) '
+                 f'for ({sketch.size}) kept values of ({n_values}).')
+    return True
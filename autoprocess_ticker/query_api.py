@@ -0,0 +1,346 @@
+
+
+import os, json, logging, pickle, shutil, sys, tempfile, threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Text, Tuple
+import pandas as pd
+
+# Personal modules.
+from config.config import (
+    LOG_PROCESSING_FILEPATH, USE_SYMBOL_STORE, SYMBOL_STORE_DIR, ETF_SECTOR_DIR, YR_RANGE, QUERY_CACHE_BYTES, QUERY_INDEX_CACHE_BYTES, DATASET_ROOT
+)
+from config.config_logger import setup_logger
+from autoprocess_ticker import shared_frames
+from autoprocess_ticker.stats_store import STORAGE_SOURCES, OPTIONAL_STORAGE_SOURCES
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# ----------------------------------------------------------------------
+# Storage Layout.
+# ----------------------------------------------------------------------
+
+# Storage file of each source. Example: 'holiday' -> 'pivot_unique_days.pickle'
+QUERY_SOURCES = {**STORAGE_SOURCES, **OPTIONAL_STORAGE_SOURCES}
+SOURCE_FILES = {source: filename for filename, sources in QUERY_SOURCES.items() for source in sources}
+
+
+def get_ticker_dir(ticker:Text, etf_dir:Optional[Text]=None) -> Text:
+    if etf_dir is None:
+        etf_dir = SYMBOL_STORE_DIR if USE_SYMBOL_STORE else ETF_SECTOR_DIR
+    return f'{etf_dir}/{ticker}'
+
+
+def check_ticker_dir(ticker:Text, etf_dir:Optional[Text]=None, dataset_root:Text=DATASET_ROOT) -> Text:
+    '''
+    Purpose:
+        Resolve the folder of a ticker requested from outside, and refuse a folder out
+        of the dataset, so a caller can't have any file on the host unpickled.
+
+    Return :
+        Folder of the ticker. Raises PermissionError out of (dataset_root).
+    '''
+
+    root = os.path.realpath(dataset_root)
+    ticker_dir = get_ticker_dir(ticker, etf_dir)
+    if os.path.commonpath([root, os.path.realpath(ticker_dir)]) != root:
+        raise PermissionError(f'({ticker_dir}) is out of the dataset ({dataset_root}).')
+    return ticker_dir
+
+
+def get_storage_path(ticker:Text, source:Text, etf_dir:Optional[Text]=None) -> Text:
+    if source not in SOURCE_FILES:
+        raise KeyError(f'Unknown source ({source}). Use one of ({list(SOURCE_FILES)}).')
+    return f'{get_ticker_dir(ticker, etf_dir)}/storage/{SOURCE_FILES[source]}'
+
+
+def file_fingerprint(path:Text) -> Text:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise KeyError(f'({path}) does not exist.')
+    return f'{stat.st_mtime_ns}-{stat.st_size}'
+
+
+# ----------------------------------------------------------------------
+# LRU Cache.
+# ----------------------------------------------------------------------
+
+def estimate_size(value:Any) -> int:
+    '''
+    Purpose:
+        Estimate the memory of a loaded value in bytes. Dataframes are counted
+        with their memory usage and containers are walked recursively.
+    '''
+
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=False).sum())
+    if isinstance(value, dict):
+        return sum(estimate_size(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    '''
+    Thread-safe cache that evicts the least recently used entries once the total
+    size goes above (max_bytes).
+    '''
+
+    def __init__(self, max_bytes:int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[Any]:
+        with self._lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key][0]
+
+    def put(self, key, value:Any, size:int):
+        with self._lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.total_bytes += size
+            self.evict()
+
+    def evict(self):
+        # Keep at least the newest entry even if it is larger than the budget.
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.total_bytes -= evicted_size
+
+    def discard(self, match):
+        with self._lock:
+            for key in [key for key in self.entries if match(key)]:
+                self.total_bytes -= self.entries.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def info(self) -> Dict[Text, int]:
+        with self._lock:
+            return {'entries': len(self.entries), 'bytes': self.total_bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+_CACHE = LRUCache(QUERY_CACHE_BYTES)
+
+
+def configure_cache(max_bytes:int):
+    with _CACHE._lock:
+        _CACHE.max_bytes = max_bytes
+        _CACHE.evict()
+
+
+def cache_info() -> Dict[Text, int]:
+    return _CACHE.info()
+
+
+def clear_cache():
+    _CACHE.clear()
+    _INDEXES.clear()
+
+
+# ----------------------------------------------------------------------
+# Partition Sidecars.
+# ----------------------------------------------------------------------
+
+def get_partition_root(path:Text) -> Text:
+    # Example: '{ticker_dir}/storage/pivot_stats.pickle' -> '{ticker_dir}/storage/partitions/pivot_stats'
+    return os.path.join(os.path.dirname(path), 'partitions', os.path.splitext(os.path.basename(path))[0])
+
+
+def get_partition_name(source:Text, kind:Text, key:Text) -> Text:
+    return f'{source}__{kind}__{key}'
+
+
+# One lock per storage file, so the threads of the stats service write its partitions once.
+_PARTITION_LOCKS = {}
+_PARTITION_LOCKS_GUARD = threading.Lock()
+
+
+def get_partition_lock(path:Text) -> threading.Lock:
+    with _PARTITION_LOCKS_GUARD:
+        return _PARTITION_LOCKS.setdefault(path, threading.Lock())
+
+
+def write_partitions(path:Text, fingerprint:Text) -> Text:
+    '''
+    Purpose:
+        Split a storage file into one partition per dataframe, so a single pivot or
+        stats table is read without unpickling the whole file. Each partition is a
+        pickle (protocol 5) and a file of its out-of-band array buffers, which are
+        memory-mapped on load.
+
+    Input  :
+        path       : Str. Storage file. Example: '{ticker_dir}/storage/pivot_stats.pickle'
+        fingerprint: Str. Fingerprint of the storage file. Names the partition folder.
+
+    Return :
+        Partition folder of this version of the storage file.
+    '''
+
+    with get_partition_lock(path):
+        return _write_partitions(path, fingerprint)
+
+
+def _write_partitions(path:Text, fingerprint:Text) -> Text:
+    partition_root = get_partition_root(path)
+    partition_dir = os.path.join(partition_root, fingerprint)
+    if os.path.exists(os.path.join(partition_dir, 'index.json')):
+        return partition_dir
+
+    # A folder of its own, as the threads of a process share the pid.
+    os.makedirs(partition_root, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=f'{fingerprint}.tmp-', dir=partition_root)
+
+    with open(path, 'rb') as in_file:
+        content = pickle.load(in_file)
+    sources = QUERY_SOURCES[os.path.basename(path)]
+    pairs = [content] if len(sources) == 1 else content
+
+    index = {}
+    for source, (pivot_dict, pivot_stats) in zip(sources, pairs):
+        for kind, frames in [('pivot', pivot_dict), ('stats', pivot_stats)]:
+            for key, df in frames.items():
+                name = get_partition_name(source, kind, key)
+                with open(os.path.join(tmp_dir, f'{name}.buf'), 'wb') as buf_file:
+                    data, offsets = shared_frames.dump_buffers(df, buf_file)
+                with open(os.path.join(tmp_dir, f'{name}.pkl'), 'wb') as pkl_file:
+                    pkl_file.write(data)
+                index[name] = offsets
+
+    with open(os.path.join(tmp_dir, 'index.json'), 'w') as index_file:
+        json.dump(index, index_file)
+
+    # Another process may have written the same version in the meantime, which is as good.
+    try:
+        os.rename(tmp_dir, partition_dir)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not os.path.isdir(partition_dir):
+            raise
+
+    # Remove the partitions of the earlier versions. A reader that already mapped
+    # their buffers keeps its copy until it releases them.
+    for name in os.listdir(partition_root):
+        if name != fingerprint and '.tmp-' not in name:
+            shutil.rmtree(os.path.join(partition_root, name), ignore_errors=True)
+
+    logger.debug(f'----- Wrote ({len(index)}) partitions of ({path}) into ({partition_dir}).')
+    return partition_dir
+
+
+# The partition indexes of the storage files opened, within their own budget. 
+_INDEXES = LRUCache(QUERY_INDEX_CACHE_BYTES)
+
+
+def get_partition_index(path:Text, fingerprint:Text) -> Tuple[Text, Dict[Text, List]]:
+    partition_root = get_partition_root(path)
+    partition_dir = os.path.join(partition_root, fingerprint)
+    index = _INDEXES.get(partition_dir)
+    if index is None:
+        if not os.path.exists(os.path.join(partition_dir, 'index.json')):
+            write_partitions(path, fingerprint)
+        with open(os.path.join(partition_dir, 'index.json')) as index_file:
+            index = json.load(index_file)
+
+        # Drop the indexes of the earlier versions of the storage file.
+        _INDEXES.discard(lambda key: os.path.dirname(key) == partition_root and key != partition_dir)
+        _INDEXES.put(partition_dir, index, estimate_size(index))
+    return partition_dir, index
+
+
+def read_partition(partition_dir:Text, name:Text, offsets:List) -> pd.DataFrame:
+    with open(os.path.join(partition_dir, f'{name}.pkl'), 'rb') as pkl_file:
+        data = pkl_file.read()
+
+    # The arrays are views on the mapped file, so they share the page cache with
+    # every other process reading the same partition.
+    return shared_frames.load_buffers(data, os.path.join(partition_dir, f'{name}.buf'), offsets)
+
+
+def load_partition(ticker:Text, source:Text, kind:Text, key:Text, etf_dir:Optional[Text]=None) -> pd.DataFrame:
+    path = get_storage_path(ticker, source, etf_dir)
+    fingerprint = file_fingerprint(path)
+    cache_key = (path, fingerprint, source, kind, key)
+
+    df = _CACHE.get(cache_key)
+    if df is None:
+        partition_dir, index = get_partition_index(path, fingerprint)
+        name = get_partition_name(source, kind, key)
+        if name not in index:
+            raise KeyError(f'({key}) is not in the ({source}) {kind} of ({ticker}).')
+
+        df = read_partition(partition_dir, name, index[name])
+        # Drop the entries of the earlier versions of the storage file.
+        _CACHE.discard(lambda cached_key: cached_key[0] == path and cached_key[1] != fingerprint)
+        _CACHE.put(cache_key, df, estimate_size(df))
+
+    # A shallow copy, so adding columns does not change the cached dataframe.
+    return df.copy(deep=False)
+
+
+# ----------------------------------------------------------------------
+# Public API.
+# ----------------------------------------------------------------------
+
+def load_stats(ticker:Text, freq:Text, yr_range:Text=YR_RANGE[0], source:Text='price',
+               etf_dir:Optional[Text]=None) -> pd.DataFrame:
+    '''
+    Purpose:
+        Load one stats table of a ticker.
+
+    Input  :
+        ticker  : Str. Ticker symbol.
+        freq    : Str. Stats key without the year range. Example: 'monthly' / 'compiled_holiday'
+        yr_range: Str. One of (YR_RANGE). Example: 'max_yr' / 'range_10_yr'
+        source  : Str. One of (SOURCE_FILES). Example: 'price' / 'volume' / 'holiday'
+        etf_dir : Str. Folder that holds the ticker folder. The symbol store if not given.
+
+    Return :
+        Dataframe. Its values are read-only views on the partition file, so copy
+        it with 'df.copy()' before modifying values in place.
+    '''
+
+    stats_key = freq if yr_range == YR_RANGE[0] else f'{freq}_{yr_range}'
+    return load_partition(ticker, source, 'stats', stats_key, etf_dir)
+
+
+def load_pivot(ticker:Text, key:Text, source:Text='price', etf_dir:Optional[Text]=None) -> pd.DataFrame:
+    '''
+    Purpose:
+        Load one pivot table of a ticker. Same as (load_stats) for the inputs and
+        the returned dataframe. Example: load_pivot('SPY', 'compiled_holiday', 'holiday')
+    '''
+
+    return load_partition(ticker, source, 'pivot', key, etf_dir)
+
+
+def list_keys(ticker:Text, kind:Text='stats', source:Text='price', etf_dir:Optional[Text]=None) -> List[Text]:
+    '''
+    Purpose:
+        List the keys of the pivot ('pivot') or stats ('stats') tables of a ticker.
+    '''
+
+    path = get_storage_path(ticker, source, etf_dir)
+    _, index = get_partition_index(path, file_fingerprint(path))
+    prefix = get_partition_name(source, kind, '')
+    return [name[len(prefix):] for name in index if name.startswith(prefix)]
@@ -0,0 +1,236 @@
+
+
+import os, io, logging, hashlib, json, time, zlib, fcntl
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Text
+import luigi
+
+# Personal modules.
+from config.config import LOG_PROCESSING_FILEPATH, RAW_ARCHIVE_DIR
+from config.config_logger import setup_logger
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# ----------------------------------------------------------------------
+# Raw Archive.
+# ----------------------------------------------------------------------
+
+def checksum(data:bytes) -> Text:
+    # Same digest as 'run_manifest.content_fingerprint', so a CSV keeps its
+    # fingerprint whether it is kept as a file or in the archive.
+    return hashlib.blake2b(data, digest_size=10).hexdigest()
+
+
+class RawArchive:
+    '''
+    Append-only packed file for the raw ticker CSVs. Every CSV is compressed and
+    appended to the pack file, and a line with its key, offset, length and checksum
+    is appended to the index file. The last line of a key wins, so downloading a
+    ticker again only appends. A read seeks straight to the offset of the key.
+
+    Files:
+        raw_bars.pack : Compressed CSVs one after another.
+        raw_bars.index: One JSON line per appended CSV.
+        raw_bars.lock : Lock file so only one process appends at a time.
+
+    Note: The lock uses 'fcntl.flock', which is not reliable on some network file
+    systems. Keep the archive on a local disk or a file system with working locks.
+    '''
+
+    def __init__(self, archive_dir:Text):
+        self.archive_dir = archive_dir
+        self.pack_path = os.path.join(archive_dir, 'raw_bars.pack')
+        self.index_path = os.path.join(archive_dir, 'raw_bars.index')
+        self.lock_path = os.path.join(archive_dir, 'raw_bars.lock')
+        self.index = {}
+        self._index_pos = 0
+        self._index_inode = None
+
+    @contextmanager
+    def lock(self):
+        os.makedirs(self.archive_dir, exist_ok=True)
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def refresh(self):
+        '''
+        Purpose:
+            Read the index lines appended since the last refresh. The whole index is
+            read again if it was replaced by (compact).
+        '''
+
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            self.index, self._index_pos, self._index_inode = {}, 0, None
+            return
+
+        if stat.st_ino != self._index_inode or stat.st_size < self._index_pos:
+            self.index, self._index_pos, self._index_inode = {}, 0, stat.st_ino
+        if stat.st_size == self._index_pos:
+            return
+
+        with open(self.index_path, 'rb') as index_file:
+            index_file.seek(self._index_pos)
+            content = index_file.read()
+
+        # Skip a line that another process is still writing.
+        content = content[:content.rfind(b'\n') + 1]
+        for line in content.splitlines():
+            entry = json.loads(line)
+            self.index[entry['key']] = entry
+        self._index_pos += len(content)
+
+    def get(self, key:Text) -> Optional[Dict]:
+        self.refresh()
+        return self.index.get(key)
+
+    def exists(self, key:Text) -> bool:
+        return self.get(key) is not None
+
+    def keys(self) -> List[Text]:
+        self.refresh()
+        return sorted(self.index)
+
+    def read(self, key:Text) -> bytes:
+        '''
+        Purpose:
+            Read the CSV of a key and verify its checksum.
+        '''
+
+        for attempt in range(2):
+            entry = self.get(key)
+            if entry is None:
+                raise KeyError(f'({key}) is not in the raw archive ({self.archive_dir}).')
+
+            with open(self.pack_path, 'rb') as pack_file:
+                pack_file.seek(entry['offset'])
+                data = zlib.decompress(pack_file.read(entry['length']))
+            if checksum(data) == entry['checksum']:
+                return data
+
+            # The pack may have been compacted after the index was read, so read
+            # the whole index again and retry once.
+            self._index_inode = None
+
+        raise IOError(f'Checksum mismatch for ({key}) in the raw archive ({self.archive_dir}).')
+
+    def append(self, key:Text, data:bytes) -> Dict:
+        '''
+        Purpose:
+            Append the CSV of a key. Nothing is appended if the latest CSV of the
+            key has the same checksum.
+
+        Return :
+            Index entry of the key.
+        '''
+
+        data_checksum = checksum(data)
+        with self.lock():
+            entry = self.get(key)
+            if entry and entry['checksum'] == data_checksum:
+                return entry
+
+            compressed = zlib.compress(data)
+            with open(self.pack_path, 'ab') as pack_file:
+                offset = pack_file.seek(0, os.SEEK_END)
+                pack_file.write(compressed)
+                pack_file.flush()
+                os.fsync(pack_file.fileno())
+
+            # Only index the CSV once its bytes are on disk.
+            entry = {'key': key, 'offset': offset, 'length': len(compressed), 'size': len(data),
+                     'checksum': data_checksum, 'added_at': time.time()}
+            with open(self.index_path, 'ab') as index_file:
+                index_file.write((json.dumps(entry) + '\n').encode())
+
+        logger.debug(f'----- Appended ({key}) to the raw archive -- ({len(data)}) bytes.')
+        return entry
+
+    def compact(self) -> Dict[Text, int]:
+        '''
+        Purpose:
+            Rewrite the archive with only the latest CSV of each key, dropping the
+            older versions left by re-downloads.
+
+        Return :
+            Dictionary of the pack size before and after compacting, in bytes.
+        '''
+
+        logger.info('Start running (compact) function.')
+
+        with self.lock():
+            self.refresh()
+            size_before = os.path.getsize(self.pack_path) if os.path.exists(self.pack_path) else 0
+            tmp_pack_path, tmp_index_path = f'{self.pack_path}.tmp', f'{self.index_path}.tmp'
+
+            index = {}
+            with open(self.pack_path, 'rb') as pack_file, open(tmp_pack_path, 'wb') as tmp_pack_file:
+                for key in sorted(self.index):
+                    entry = dict(self.index[key])
+                    pack_file.seek(entry['offset'])
+                    compressed = pack_file.read(entry['length'])
+                    entry['offset'] = tmp_pack_file.tell()
+                    tmp_pack_file.write(compressed)
+                    index[key] = entry
+                tmp_pack_file.flush()
+                os.fsync(tmp_pack_file.fileno())
+
+            with open(tmp_index_path, 'w') as tmp_index_file:
+                tmp_index_file.writelines(json.dumps(entry) + '\n' for entry in index.values())
+
+            os.replace(tmp_pack_path, self.pack_path)
+            os.replace(tmp_index_path, self.index_path)
+            self._index_inode = None
+            self.refresh()
+
+        return {'size_before': size_before, 'size_after': os.path.getsize(self.pack_path)}
+
+
+# Cache the archive per folder so that every task in a process shares one index.
+_ARCHIVES = {}
+
+
+def get_archive(archive_dir:Text=RAW_ARCHIVE_DIR) -> RawArchive:
+    if archive_dir not in _ARCHIVES:
+        _ARCHIVES[archive_dir] = RawArchive(archive_dir)
+    return _ARCHIVES[archive_dir]
+
+
+# ----------------------------------------------------------------------
+# Luigi Target.
+# ----------------------------------------------------------------------
+
+class ArchiveTarget(luigi.Target):
+    '''
+    Luigi target for a CSV in the raw archive. Example:
+        ArchiveTarget('docs/dataset/ETF_sector/SPY/SPY_1d.csv')
+    '''
+
+    def __init__(self, key:Text, archive_dir:Text=RAW_ARCHIVE_DIR):
+        self.key = key
+        self.archive_dir = archive_dir
+
+    def exists(self) -> bool:
+        return get_archive(self.archive_dir).exists(self.key)
+
+    def open(self, mode:Text='r'):
+        data = get_archive(self.archive_dir).read(self.key)
+        return io.BytesIO(data) if 'b' in mode else io.StringIO(data.decode())
+
+    def write(self, data:bytes) -> Dict:
+        return get_archive(self.archive_dir).append(self.key, data)
+
+    def checksum(self) -> Text:
+        return get_archive(self.archive_dir).get(self.key)['checksum']
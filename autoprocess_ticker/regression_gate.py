@@ -0,0 +1,362 @@
+
+
+import os, json, logging, platform, queue, tempfile, time, tracemalloc
+import multiprocessing as mp
+from datetime import datetime
+from typing import Dict, List, Optional, Text, Tuple
+import luigi
+import numpy as np
+import pandas as pd
+
+# Personal modules.
+from config.config import (
+    LOG_PROCESSING_FILEPATH, YAHOO_VERSION, PERF_BASELINE_PATH, PERF_SCENARIOS, PERF_REPEATS, PERF_TIME_THRESHOLD,
+    PERF_MEMORY_THRESHOLD, PERF_NOISE_K, PERF_MIN_SECONDS, PERF_MIN_MB
+)
+from config.config_logger import setup_logger
+from autoprocess_ticker import local_download_server, memory_budget, stream_executor
+from autoprocess_ticker.benchmark import synthetic_tickers
+import luigi_pipeline
+from luigi_pipeline import CompileToExcel
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# ----------------------------------------------------------------------
+# Stage Measurements.
+# ----------------------------------------------------------------------
+
+def stage_name(stage:luigi.Task) -> Text:
+    # Name of a stage in the baseline. The downloads are kept apart per frequency. Example: 'DownloadTickerData[1wk]'
+    ticker_freq = getattr(stage, 'ticker_freq', None)
+    return f'{stage.get_task_family()}[{ticker_freq}]' if ticker_freq else stage.get_task_family()
+
+
+def measure_stages(tasks:List[luigi.Task], trace_memory:bool=False) -> Dict[Text, float]:
+    '''
+    Purpose:
+        Run the stages of each task one after the other in this process, from the
+        downloads to the workbook, and measure each stage. Completed stages are
+        skipped, and the run manifest is updated, like the Luigi worker does.
+
+    Input  :
+        tasks       : List of (CompileToExcel) tasks.
+        trace_memory: Bool. Measure the peak allocation of each stage with tracemalloc
+                      instead of its seconds. Tracing slows the stages down.
+
+    Return :
+        Dictionary of the stage name and its seconds summed over the tickers, or its
+        largest peak allocation in MB over the tickers with (trace_memory).
+    '''
+
+    logger.info('Start running (measure_stages) function.')
+
+    measures = {}
+    for task in tasks:
+        for stage in stream_executor.list_stages(task):
+            if stage.complete():
+                continue
+            name = stage_name(stage)
+            luigi_pipeline.record_start(stage)
+            if trace_memory:
+                tracemalloc.start()
+            start_time = time.perf_counter()
+            try:
+                stage.run()
+            except Exception as error:
+                luigi_pipeline.record_failure(stage, error)
+                raise
+            finally:
+                elapsed = time.perf_counter() - start_time
+                if trace_memory:
+                    _, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+            luigi_pipeline.record_success(stage)
+
+            if trace_memory:
+                measures[name] = max(measures.get(name, 0.0), peak / 1024 ** 2)
+            else:
+                measures[name] = measures.get(name, 0.0) + elapsed
+            logger.debug(f'----- Measured ({stage.task_id}) -- {round(elapsed, 3)} seconds')
+    return measures
+
+
+def run_repeat(jobs:List[Tuple[Text, int, Text]], trace_memory:bool, result_queue:mp.Queue):
+    '''
+    Purpose:
+        Measure the stages of the jobs with (measure_stages) in a spawned process, and
+        put the measures, the number of workbooks written and the peak resident memory
+        of the process into (result_queue).
+    '''
+
+    tasks = [CompileToExcel(ticker, start_yr, etf_dir, YAHOO_VERSION) for ticker, start_yr, etf_dir in jobs]
+    measures = measure_stages(tasks, trace_memory)
+    completed = sum(os.path.exists(f'{etf_dir}/{ticker}/{ticker}_seasonal_stats.xlsx') for ticker, _, etf_dir in jobs)
+    result_queue.put({'measures': measures, 'completed': completed, 'peak_rss_mb': memory_budget.read_peak_rss() / 1024 ** 2})
+
+
+def spawn_repeat(jobs:List[Tuple[Text, int, Text]], trace_memory:bool, dataset_root:Text) -> Dict:
+    # One repeat in a new process with its own run manifest, stage cache and raw archive, so no stage is skipped
+    # or restored from an earlier repeat. The spawned process reads them from the config on import.
+    os.environ.update({
+        'RUN_MANIFEST_PATH': os.path.join(dataset_root, 'run_manifest.sqlite'),
+        'STAGE_CACHE_DIR': os.path.join(dataset_root, '.stage_cache'),
+        'RAW_ARCHIVE_DIR': os.path.join(dataset_root, 'raw_archive'),
+    })
+    ctx = mp.get_context('spawn')
+    result_queue = ctx.Queue()
+    process = ctx.Process(target=run_repeat, args=(jobs, trace_memory, result_queue))
+    process.start()
+
+    # Read the result before joining, so a full queue doesn't block the exit of the process.
+    result = None
+    while result is None and (process.is_alive() or not result_queue.empty()):
+        try:
+            result = result_queue.get(timeout=1.0)
+        except queue.Empty:
+            pass
+    process.join()
+    if result is None:
+        raise RuntimeError(f'The benchmark process of ({jobs[0][2]}) exited with code ({process.exitcode}).')
+    return result
+
+
+def run_scenario(name:Text, tickers:int, start_yr:int, repeats:int=PERF_REPEATS, dataset_root:Text=None) -> Dict:
+    '''
+    Purpose:
+        Measure a scenario end to end (repeats) times, and once more with tracemalloc
+        for the peak allocation of each stage. Every repeat starts from an empty
+        dataset, and the downloads are served by the stand-in download server.
+
+    Input  :
+        name        : Str. Name of the scenario.
+        tickers     : Int. Number of synthetic tickers.
+        start_yr    : Int. Starting year of every ticker.
+        repeats     : Int. Timed runs of the scenario.
+        dataset_root: Str. Folder of the runs. A temporary folder is used if not given.
+
+    Return :
+        Dictionary of the scenario with the seconds of every run per stage. Example:
+            {'tickers': 2, 'start_yr': 2012, 'repeats': 5, 'total_seconds': [...], 'peak_rss_mb': [...],
+             'stages': {'DownloadTickerData[1d]': {'seconds': [...], 'peak_mb': 0.4}, ...}}
+    '''
+
+    logger.info('Start running (run_scenario) function.')
+
+    dataset_root = dataset_root or tempfile.mkdtemp(prefix=f'perf_{name}_')
+    server, host = local_download_server.start_server(latency=0.0)
+    os.environ['YAHOO_DOWNLOAD_HOST'] = host
+    runs = []
+
+    try:
+        for i in range(repeats + 1):
+            run_root = os.path.join(dataset_root, f'run_{i}')
+            etf_dir = os.path.join(run_root, 'ETF')
+            os.makedirs(etf_dir, exist_ok=True)
+            jobs = [(ticker, start_yr, etf_dir) for ticker in synthetic_tickers(tickers)]
+            # The last run traces the memory.
+            runs.append(spawn_repeat(jobs, i == repeats, run_root))
+            if runs[-1]['completed'] != tickers:
+                raise RuntimeError(f'Only ({runs[-1]["completed"]}) of ({tickers}) workbooks were written in ({etf_dir}).')
+            logger.debug(f'----- Ran ({name}) {i + 1} of {repeats + 1} times')
+    finally:
+        server.shutdown()
+
+    timed, traced = runs[:-1], runs[-1]
+    stages = {
+        stage: {'seconds': [round(run['measures'].get(stage, 0.0), 4) for run in timed], 'peak_mb': round(peak, 3)}
+        for stage, peak in traced['measures'].items()
+    }
+    return {
+        'tickers': tickers, 'start_yr': start_yr, 'repeats': repeats,
+        'total_seconds': [round(sum(run['measures'].values()), 4) for run in timed],
+        'peak_rss_mb': [round(run['peak_rss_mb'], 1) for run in timed],
+        'stages': stages,
+    }
+
+
+# ----------------------------------------------------------------------
+# Baseline.
+# ----------------------------------------------------------------------
+
+def describe_environment() -> Dict:
+    # Machine and versions of a baseline. The timings of another machine aren't comparable.
+    return {
+        'machine': platform.node(), 'processor': platform.machine(), 'cpus': os.cpu_count(),
+        'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+    }
+
+
+def measure_scenarios(scenarios:Dict[Text, Dict]=PERF_SCENARIOS, repeats:int=PERF_REPEATS, dataset_root:Text=None) -> Dict:
+    '''
+    Purpose:
+        Run every scenario with (run_scenario).
+
+    Input  :
+        scenarios   : Dictionary of the scenario name and its (tickers) and (start_yr).
+        repeats     : Int. Timed runs of each scenario.
+        dataset_root: Str. Folder of the runs. A temporary folder is used if not given.
+
+    Return :
+        Dictionary in the format of the baseline file, with the time and the machine of the runs.
+    '''
+
+    logger.info('Start running (measure_scenarios) function.')
+
+    dataset_root = dataset_root or tempfile.mkdtemp(prefix='perf_gate_')
+    results = {'created': datetime.now().isoformat(timespec='seconds'), 'environment': describe_environment(), 'scenarios': {}}
+    for name, scenario in scenarios.items():
+        results['scenarios'][name] = run_scenario(name, scenario['tickers'], scenario['start_yr'], repeats,
+                                                  os.path.join(dataset_root, name))
+    return results
+
+
+def save_baseline(results:Dict, path:Text=PERF_BASELINE_PATH):
+    # Write the results of (measure_scenarios) as the baseline.
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as out_file:
+        json.dump(results, out_file, indent=2)
+    logger.debug(f'----- Saved the performance baseline to ({path})')
+
+
+def load_baseline(path:Text=PERF_BASELINE_PATH) -> Dict:
+    # Read the baseline of (save_baseline).
+    with open(path) as in_file:
+        return json.load(in_file)
+
+
+# ----------------------------------------------------------------------
+# Comparison.
+# ----------------------------------------------------------------------
+
+def median_and_mad(samples:List[float]) -> Tuple[float, float]:
+    # Median of the samples and their median absolute deviation, scaled to the standard deviation of a normal distribution.
+    values = np.asarray(samples, dtype=np.float64)
+    median = float(np.median(values))
+    return median, float(np.median(np.abs(values - median))) * 1.4826
+
+
+def compare_samples(baseline:List[float], current:List[float], threshold:float=PERF_TIME_THRESHOLD,
+                    noise_k:float=PERF_NOISE_K, floor:float=PERF_MIN_SECONDS) -> Dict:
+    '''
+    Purpose:
+        Compare the median of the current runs with the median of the baseline runs.
+        The limit is the baseline median raised by (threshold), plus (noise_k) times the
+        larger spread of both runs, and at least (floor) over the baseline median. A
+        single measure has no spread, so the limit is the threshold and the floor only.
+        The runs must also not overlap, so one slow run of a busy machine doesn't fail it.
+
+    Return :
+        Dictionary of the medians, the limit, the change and the status. The (status)
+        is 'regressed' over the limit, 'improved' under the baseline by as much, else 'ok'.
+        Example: {'baseline': 1.2, 'current': 1.25, 'limit': 1.53, 'change_pct': 4.2, 'status': 'ok'}
+    '''
+
+    baseline_median, baseline_mad = median_and_mad(baseline)
+    current_median, current_mad = median_and_mad(current)
+    margin = max(baseline_median * threshold + noise_k * max(baseline_mad, current_mad), floor)
+
+    status = 'ok'
+    if current_median > baseline_median + margin and min(current) > max(baseline):
+        status = 'regressed'
+    elif current_median < baseline_median - margin and max(current) < min(baseline):
+        status = 'improved'
+    return {
+        'baseline': round(baseline_median, 4), 'current': round(current_median, 4), 'limit': round(baseline_median + margin, 4),
+        'change_pct': round((current_median / baseline_median - 1) * 100, 1) if baseline_median else 0.0,
+        'status': status,
+    }
+
+
+def compare_results(baseline:Dict, current:Dict, time_threshold:float=PERF_TIME_THRESHOLD,
+                    memory_threshold:float=PERF_MEMORY_THRESHOLD) -> List[Dict]:
+    '''
+    Purpose:
+        Compare the results of (measure_scenarios) with the baseline, for the seconds
+        and the peak allocation of every stage, the total seconds and the peak resident
+        memory of each scenario. A scenario or stage missing from the baseline is 'new'.
+
+    Input  :
+        baseline        : Dictionary of (load_baseline).
+        current         : Dictionary of (measure_scenarios).
+        time_threshold  : Float. Slowdown ratio over the baseline median allowed. Example: 0.2 for 20%
+        memory_threshold: Float. Growth ratio of the peak memory over the baseline allowed.
+
+    Return :
+        List of result dictionaries, one per scenario, stage and metric. Any 'regressed'
+        status fails the gate.
+    '''
+
+    logger.info('Start running (compare_results) function.')
+
+    if baseline.get('environment') != current.get('environment'):
+        logger.warning(f'----- The baseline was recorded on another machine or versions -- {baseline.get("environment")}')
+
+    results = []
+
+    def add(scenario, stage, metric, baseline_samples, current_samples, threshold, floor):
+        if baseline_samples is None:
+            row = {'baseline': '', 'current': round(float(np.median(current_samples)), 4), 'limit': '', 'change_pct': '',
+                   'status': 'new'}
+        else:
+            row = compare_samples(baseline_samples, current_samples, threshold, floor=floor)
+        results.append({'scenario': scenario, 'stage': stage, 'metric': metric, **row})
+
+    for scenario, current_scenario in current['scenarios'].items():
+        baseline_scenario = baseline['scenarios'].get(scenario, {})
+        if baseline_scenario and (baseline_scenario['tickers'], baseline_scenario['start_yr']) != \
+                (current_scenario['tickers'], current_scenario['start_yr']):
+            logger.warning(f'----- The scenario ({scenario}) has changed since the baseline, recording it as new')
+            baseline_scenario = {}
+
+        baseline_stages = baseline_scenario.get('stages', {})
+        for stage, measures in current_scenario['stages'].items():
+            baseline_measures = baseline_stages.get(stage)
+            add(scenario, stage, 'seconds', baseline_measures and baseline_measures['seconds'], measures['seconds'],
+                time_threshold, PERF_MIN_SECONDS)
+            add(scenario, stage, 'peak_mb', baseline_measures and [baseline_measures['peak_mb']], [measures['peak_mb']],
+                memory_threshold, PERF_MIN_MB)
+        add(scenario, 'total', 'seconds', baseline_scenario.get('total_seconds'), current_scenario['total_seconds'],
+            time_threshold, PERF_MIN_SECONDS)
+        add(scenario, 'process', 'peak_rss_mb', baseline_scenario.get('peak_rss_mb'), current_scenario['peak_rss_mb'],
+            memory_threshold, PERF_MIN_MB)
+
+    for result in results:
+        if result['status'] == 'regressed':
+            logger.warning(f'----- ({result["scenario"]}) ({result["stage"]}) {result["metric"]} regressed -- {result}')
+    return results
+
+
+def run_gate(baseline_path:Text=PERF_BASELINE_PATH, scenarios:Dict[Text, Dict]=PERF_SCENARIOS, repeats:int=PERF_REPEATS,
+             time_threshold:float=PERF_TIME_THRESHOLD, memory_threshold:float=PERF_MEMORY_THRESHOLD,
+             record:bool=False, dataset_root:Optional[Text]=None) -> List[Dict]:
+    '''
+    Purpose:
+        Measure the scenarios, and record them as the baseline with (record). Otherwise
+        compare them with the baseline. Without a baseline nothing is measured, and each
+        scenario gets the status 'no_baseline', which fails the gate like a regression,
+        so the gate never passes on a checkout that has no baseline.
+
+    Return :
+        List of result dictionaries of (compare_results). Every status is 'new' once
+        the baseline is recorded.
+    '''
+
+    logger.info('Start running (run_gate) function.')
+
+    if not record and not os.path.exists(baseline_path):
+        logger.error(f'----- No baseline at ({baseline_path}). Record one with (record) on the machine the gate runs on.')
+        return [{'scenario': scenario, 'stage': 'total', 'metric': 'seconds', 'baseline': '', 'current': '', 'limit': '',
+                 'change_pct': '', 'status': 'no_baseline'} for scenario in scenarios]
+
+    current = measure_scenarios(scenarios, repeats, dataset_root)
+    if record:
+        save_baseline(current, baseline_path)
+        return compare_results({'environment': current['environment'], 'scenarios': {}}, current)
+    return compare_results(load_baseline(baseline_path), current, time_threshold, memory_threshold)
@@ -0,0 +1,371 @@
+
+
+import os, logging, hashlib, json, shutil, sqlite3, time, ast, importlib.util
+from typing import Dict, List, Optional, Text, Tuple
+
+# Personal modules.
+from config.config import LOG_PROCESSING_FILEPATH, RUN_MANIFEST_PATH, STAGE_CACHE_DIR, STAGE_CODE_VERSION
+from config.config_logger import setup_logger
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# ----------------------------------------------------------------------
+# Fingerprints.
+# ----------------------------------------------------------------------
+
+def hash_values(*values) -> Text:
+    '''
+    Purpose:
+        Combine any number of values into a short fingerprint.
+    '''
+
+    return hashlib.sha1(json.dumps(values, default=str).encode()).hexdigest()[:20]
+
+
+def content_fingerprint(paths:List[Text], chunk_size:int=1 << 20) -> Text:
+    '''
+    Purpose:
+        Fingerprint files by their content. A file that is downloaded or written
+        again with the same bytes keeps the same fingerprint, so the stages after
+        it are not invalidated. Only used when a task finishes, never while
+        checking whether a task is complete.
+    '''
+
+    digest = hashlib.blake2b(digest_size=10)
+    for path in paths:
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+PACKAGE = 'autoprocess_ticker'
+_CODE_FINGERPRINTS = {}
+
+
+def package_imports(path:Text) -> List[Text]:
+    '''
+    Purpose:
+        List the modules of the package imported by a source file, without importing it.
+    '''
+
+    with open(path, 'rb') as file:
+        tree = ast.parse(file.read())
+
+    names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names.append(node.module)
+            # 'from autoprocess_ticker import x' imports the module x. 
+            if node.module == PACKAGE:
+                names += [f'{PACKAGE}.{alias.name}' for alias in node.names]
+    return [name for name in names if name.split('.')[0] == PACKAGE]
+
+
+def code_fingerprint(module_names:Tuple[Text, ...], version:Text=STAGE_CODE_VERSION) -> Text:
+    '''
+    Purpose:
+        Fingerprint the code of a stage by the sources of its modules and of the modules
+        of the package they import. The imports are parsed rather than taken from
+        'sys.modules', so every process gets the same fingerprint. The config is left
+        out, as its values are part of the (config_version) of each stage. Computed once
+        per process.
+
+    Input  :
+        module_names: Modules such as 'autoprocess_ticker.preprocessing'. Only the imports
+            of the modules inside the package are followed.
+        version: Bumped by hand for changes the sources don't show.
+    '''
+
+    key = (tuple(module_names), version)
+    if key not in _CODE_FINGERPRINTS:
+        sources, pending = {}, list(module_names)
+        while pending:
+            name = pending.pop()
+            if name in sources:
+                continue
+            spec = importlib.util.find_spec(name)
+            if spec is None or not spec.origin or not spec.origin.endswith('.py'):
+                continue
+
+            sources[name] = spec.origin
+            if name.split('.')[0] == PACKAGE:
+                pending += package_imports(spec.origin)
+
+        digest = hashlib.blake2b(version.encode(), digest_size=10)
+        for name in sorted(sources):
+            digest.update(name.encode())
+            with open(sources[name], 'rb') as file:
+                digest.update(file.read())
+        _CODE_FINGERPRINTS[key] = digest.hexdigest()
+    return _CODE_FINGERPRINTS[key]
+
+
+# ----------------------------------------------------------------------
+# Run Manifest.
+# ----------------------------------------------------------------------
+
+class RunManifest:
+    '''
+    SQLite index of every ticker and stage with its fingerprints and status. Luigi
+    checks completeness against this index with a dictionary lookup instead of
+    stat-ing every target file. Another table keeps the job list of each batch run
+    so a failed run can be resumed.
+
+    Note: SQLite locking is not reliable on some network file systems. Keep the
+    manifest on a local disk or a file system with working POSIX locks.
+    '''
+
+    def __init__(self, db_path:Text):
+        self.db_path = db_path
+        self.cache = {}
+        self._conn = None
+        self._pid = None
+
+    def connect(self) -> sqlite3.Connection:
+        # Luigi forks a process for each task when running with several workers.
+        # A connection must not be shared across processes, so open one per process.
+        if self._conn is None or self._pid != os.getpid():
+            if os.path.dirname(self.db_path):
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+
+            self._conn = sqlite3.connect(self.db_path, timeout=60)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript('''
+                CREATE TABLE IF NOT EXISTS stages (
+                    task_id TEXT PRIMARY KEY, ticker TEXT, etf_dir TEXT, stage TEXT,
+                    input_fp TEXT, output_fp TEXT, status TEXT, error TEXT,
+                    duration REAL, updated_at REAL, cache TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_stages_ticker ON stages (etf_dir, ticker);
+                CREATE TABLE IF NOT EXISTS runs (
+                    run_id INTEGER PRIMARY KEY AUTOINCREMENT, jobs TEXT, status TEXT,
+                    started_at REAL, finished_at REAL
+                );
+            ''')
+            # Add the columns that were introduced after the manifest was created. 
+            columns = [row['name'] for row in self._conn.execute('PRAGMA table_info(stages)')]
+            if 'cache' not in columns:
+                self._conn.execute('ALTER TABLE stages ADD COLUMN cache TEXT')
+
+            self._pid = os.getpid()
+            self.load()
+        return self._conn
+
+    def load(self):
+        '''
+        Purpose:
+            Read the whole manifest into memory with one query.
+        '''
+
+        rows = self._conn.execute('SELECT * FROM stages').fetchall()
+        self.cache = {row['task_id']: dict(row) for row in rows}
+        logger.debug(f'----- Loaded ({len(self.cache)}) entries from the run manifest ({self.db_path}).')
+
+    def get(self, task_id:Text) -> Optional[Dict]:
+        '''
+        Purpose:
+            Get the manifest entry of a task. Entries that are not done yet are
+            re-read from the database since another worker may have finished them.
+        '''
+
+        conn = self.connect()
+        entry = self.cache.get(task_id)
+        if entry is None or entry['status'] != 'done':
+            row = conn.execute('SELECT * FROM stages WHERE task_id = ?', (task_id,)).fetchone()
+            entry = dict(row) if row else None
+            if entry: self.cache[task_id] = entry
+        return entry
+
+    def record(self, task_id:Text, ticker:Text, etf_dir:Text, stage:Text, status:Text,
+               input_fp:Optional[Text]=None, output_fp:Optional[Text]=None,
+               error:Optional[Text]=None, duration:Optional[float]=None, cache:Optional[Text]=None):
+        '''
+        Purpose:
+            Insert or update the manifest entry of a task.
+        '''
+
+        conn = self.connect()
+        entry = {
+            'task_id': task_id, 'ticker': ticker, 'etf_dir': etf_dir, 'stage': stage,
+            'input_fp': input_fp, 'output_fp': output_fp, 'status': status, 'error': error,
+            'duration': duration, 'updated_at': time.time(), 'cache': cache,
+        }
+        with conn:
+            conn.execute(f'INSERT OR REPLACE INTO stages ({", ".join(entry)}) VALUES ({", ".join("?" * len(entry))})',
+                         tuple(entry.values()))
+        self.cache[task_id] = entry
+
+    def set_status(self, task_id:Text, ticker:Text, etf_dir:Text, stage:Text, status:Text):
+        '''
+        Purpose:
+            Update the status of a task but keep its fingerprints, so a running task
+            can still compare its inputs with the previous run.
+        '''
+
+        entry = self.get(task_id)
+        if entry is None:
+            self.record(task_id, ticker, etf_dir, stage, status)
+            return
+
+        conn = self.connect()
+        with conn:
+            conn.execute('UPDATE stages SET status = ?, updated_at = ? WHERE task_id = ?', (status, time.time(), task_id))
+        entry.update({'status': status, 'updated_at': time.time()})
+
+    def forget(self, tickers:List[Text]):
+        '''
+        Purpose:
+            Mark the entries of the tickers as stale so that they are recomputed.
+            The fingerprints are cleared, so the stages are neither adopted from
+            the files in place nor skipped as unchanged, and the outputs kept in
+            the stage cache under them are dropped, so they are not restored either.
+            Use this after editing the files of a ticker by hand.
+        '''
+
+        conn = self.connect()
+        for ticker in tickers:
+            for row in conn.execute('SELECT stage, input_fp FROM stages WHERE ticker = ? AND input_fp IS NOT NULL', (ticker,)):
+                drop_outputs(row['stage'], row['input_fp'])
+
+        with conn:
+            conn.executemany(
+                "UPDATE stages SET status = 'stale', input_fp = NULL, output_fp = NULL, updated_at = ? WHERE ticker = ?",
+                [(time.time(), ticker) for ticker in tickers]
+            )
+        self.load()
+
+    def summary(self) -> Dict[Text, Dict[Text, int]]:
+        '''
+        Purpose:
+            Count the entries for each stage and status.
+        '''
+
+        rows = self.connect().execute('SELECT stage, status, COUNT(*) AS counts FROM stages GROUP BY stage, status')
+        summary = {}
+        for row in rows:
+            summary.setdefault(row['stage'], {})[row['status']] = row['counts']
+        return summary
+
+    def cache_summary(self) -> Dict[Text, Dict[Text, float]]:
+        '''
+        Purpose:
+            Compute the cache hit rate of each stage from the latest run of every task.
+        '''
+
+        rows = self.connect().execute('''
+            SELECT stage, SUM(cache LIKE 'hit%') AS hits, SUM(cache = 'miss') AS misses
+            FROM stages WHERE cache IS NOT NULL GROUP BY stage
+        ''')
+        return {
+            row['stage']: {
+                'hits': row['hits'], 'misses': row['misses'],
+                'hit_rate': round(row['hits'] / (row['hits'] + row['misses']), 4),
+            }
+            for row in rows
+        }
+
+    def start_run(self, jobs:List[Tuple[Text, int, Text]]) -> int:
+        conn = self.connect()
+        with conn:
+            cursor = conn.execute('INSERT INTO runs (jobs, status, started_at) VALUES (?, ?, ?)',
+                                  (json.dumps(jobs), 'running', time.time()))
+        return cursor.lastrowid
+
+    def finish_run(self, run_id:int, succeeded:bool):
+        conn = self.connect()
+        with conn:
+            conn.execute('UPDATE runs SET status = ?, finished_at = ? WHERE run_id = ?',
+                         ('done' if succeeded else 'failed', time.time(), run_id))
+
+    def last_unfinished_run(self) -> Optional[Tuple[int, List[Tuple[Text, int, Text]]]]:
+        '''
+        Purpose:
+            Get the latest run that failed or crashed before finishing.
+
+        Return :
+            Tuple of the run ID and its jobs, or None if the latest run succeeded.
+        '''
+
+        row = self.connect().execute('SELECT * FROM runs ORDER BY run_id DESC LIMIT 1').fetchone()
+        if row is None or row['status'] == 'done':
+            return None
+        return row['run_id'], [tuple(job) for job in json.loads(row['jobs'])]
+
+
+# Cache the manifest per path so that every task in a process shares one copy.
+_MANIFESTS = {}
+
+
+def get_manifest(db_path:Text=RUN_MANIFEST_PATH) -> RunManifest:
+    if db_path not in _MANIFESTS:
+        _MANIFESTS[db_path] = RunManifest(db_path)
+    return _MANIFESTS[db_path]
+
+
+# ----------------------------------------------------------------------
+# Stage Cache.
+# ----------------------------------------------------------------------
+
+def cache_path(stage:Text, input_fp:Text, target_path:Text, idx:int=0) -> Text:
+    return os.path.join(STAGE_CACHE_DIR, stage, input_fp, f'{idx}_{os.path.basename(target_path)}')
+
+
+def store_outputs(stage:Text, input_fp:Text, target_paths:List[Text]):
+    '''
+    Purpose:
+        Keep a copy of the outputs of a stage under its input fingerprint. Not a hard
+        link, as some stages write their targets in place, such as the workbooks of
+        (pd.ExcelWriter), and a rerun would change the entry of the old fingerprint.
+    '''
+
+    for idx, target_path in enumerate(target_paths):
+        path = cache_path(stage, input_fp, target_path, idx)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp_path = f'{path}.tmp-{os.getpid()}'
+        shutil.copy2(target_path, tmp_path)
+        os.replace(tmp_path, path)
+    logger.debug(f'----- Stored the outputs of ({stage}) in the stage cache -- ({input_fp}).')
+
+
+def restore_outputs(stage:Text, input_fp:Text, target_paths:List[Text]) -> bool:
+    '''
+    Purpose:
+        Copy the cached outputs of a stage with the same input fingerprint back
+        into place.
+
+    Return :
+        True if every output was found in the cache.
+    '''
+
+    paths = [cache_path(stage, input_fp, target_path, idx) for idx, target_path in enumerate(target_paths)]
+    if not all(os.path.exists(path) for path in paths):
+        return False
+
+    for path, target_path in zip(paths, target_paths):
+        os.makedirs(os.path.dirname(target_path) or '.', exist_ok=True)
+        tmp_path = f'{target_path}.tmp-{os.getpid()}'
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, target_path)
+    logger.debug(f'----- Restored the outputs of ({stage}) from the stage cache -- ({input_fp}).')
+    return True
+
+
+def drop_outputs(stage:Text, input_fp:Text):
+    '''
+    Purpose:
+        Remove the cached outputs of a stage with the input fingerprint.
+    '''
+
+    shutil.rmtree(os.path.join(STAGE_CACHE_DIR, stage, input_fp), ignore_errors=True)
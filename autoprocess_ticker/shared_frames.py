@@ -0,0 +1,146 @@
+
+
+import os, contextlib, logging, mmap, pickle, tempfile
+from typing import Any, BinaryIO, Callable, Iterator, List, NamedTuple, Text, Tuple
+
+# Personal modules.
+from config.config import LOG_PROCESSING_FILEPATH, SHARED_FRAMES_DIR
+from config.config_logger import setup_logger
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# ----------------------------------------------------------------------
+# Out-Of-Band Buffers.
+# ----------------------------------------------------------------------
+
+# Alignment of every array buffer, so the arrays are aligned once mapped.
+ALIGNMENT = 64
+
+
+def dump_buffers(value:Any, out_file:BinaryIO) -> Tuple[bytes, List[Tuple[int, int]]]:
+    '''
+    Purpose:
+        Pickle (value) with protocol 5 and write its array buffers into (out_file)
+        instead of into the pickle.
+
+    Input  :
+        value   : Any picklable value. Example: a dataframe or a dictionary of dataframes.
+        out_file: Binary file to write the buffers into.
+
+    Return :
+        Tuple of the pickle without the buffers and the (offset, size) of each buffer.
+    '''
+
+    buffers = []
+    payload = pickle.dumps(value, protocol=5, buffer_callback=buffers.append)
+
+    offsets = []
+    for buffer in buffers:
+        raw = buffer.raw()
+        out_file.write(b'\0' * (-out_file.tell() % ALIGNMENT))
+        offsets.append((out_file.tell(), raw.nbytes))
+        out_file.write(raw)
+    return payload, offsets
+
+
+def load_buffers(payload:bytes, path:Text, offsets:List[Tuple[int, int]]) -> Any:
+    '''
+    Purpose:
+        Load a value written by (dump_buffers). The arrays are views on the mapped
+        file, so they are read-only and nothing is copied. The mapping stays open as
+        long as any of the arrays is referenced.
+    '''
+
+    if not offsets:
+        return pickle.loads(payload)
+
+    with open(path, 'rb') as in_file:
+        view = memoryview(mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ))
+    return pickle.loads(payload, buffers=[view[offset:offset + size] for offset, size in offsets])
+
+
+# ----------------------------------------------------------------------
+# Shared Frames.
+# ----------------------------------------------------------------------
+
+class SharedFrames(NamedTuple):
+    '''
+    Handle of frames placed in shared memory. Only the handle is sent to the worker
+    processes, and its size doesn't depend on the number of rows.
+    '''
+
+    path: Text
+    payload: bytes
+    offsets: List[Tuple[int, int]]
+    nbytes: int
+
+
+def get_shared_dir() -> Text:
+    # '/dev/shm' is backed by memory. Fall back to the temporary folder elsewhere.
+    return SHARED_FRAMES_DIR if os.path.isdir(SHARED_FRAMES_DIR) else tempfile.gettempdir()
+
+
+def share_frames(frames:Any) -> SharedFrames:
+    '''
+    Purpose:
+        Place the arrays of the frames of a ticker or a panel in shared memory. Call
+        (release_frames) once every worker is done with them.
+
+    Input  :
+        frames: Dataframe, or a dictionary / tuple of dataframes. Example: (df_ticker)
+
+    Return :
+        Handle to pass to (attach_frames) in the worker processes.
+    '''
+
+    fd, path = tempfile.mkstemp(prefix='frames-', suffix='.buf', dir=get_shared_dir())
+    with os.fdopen(fd, 'wb') as out_file:
+        payload, offsets = dump_buffers(frames, out_file)
+        nbytes = out_file.tell()
+
+    logger.debug(f'----- Shared ({nbytes}) bytes of arrays in ({path}).')
+    return SharedFrames(path, payload, offsets, nbytes)
+
+
+def attach_frames(handle:SharedFrames) -> Any:
+    '''
+    Purpose:
+        Rebuild the frames of (share_frames) in a worker process without copying the
+        arrays. The frames are read-only, so copy a frame before modifying it in place.
+    '''
+
+    return load_buffers(handle.payload, handle.path, handle.offsets)
+
+
+def release_frames(handle:SharedFrames):
+    # The workers that still map the file keep their pages until they drop the frames.
+    try:
+        os.remove(handle.path)
+    except FileNotFoundError:
+        pass
+
+
+@contextlib.contextmanager
+def shared_frames(frames:Any) -> Iterator[SharedFrames]:
+    handle = share_frames(frames)
+    try:
+        yield handle
+    finally:
+        release_frames(handle)
+
+
+def run_attached(func:Callable, handle:SharedFrames, *args) -> Any:
+    '''
+    Purpose:
+        Call (func) with the attached frames and (args) in a worker process.
+        Example: pool.submit(run_attached, ticker_stages.pivot_ticker_summary, handle, 1999)
+    '''
+
+    return func(attach_frames(handle), *args)
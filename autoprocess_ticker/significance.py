@@ -0,0 +1,354 @@
+
+
+import logging, pickle, warnings, zlib
+from typing import Dict, List, Optional, Text, Tuple
+import numpy as np
+import pandas as pd
+
+# Personal modules.
+from config.config import (
+    LOG_PROCESSING_FILEPATH, START_YR_RANGE, END_YR, SIGNIFICANCE_RESAMPLES, SIGNIFICANCE_ALPHA,
+    SIGNIFICANCE_SEED, SIGNIFICANCE_MAX_CELLS
+)
+from config.config_logger import setup_logger
+from autoprocess_ticker import preprocessing, panel, query_api, walk_forward
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# ----------------------------------------------------------------------
+# Significance Layout.
+# ----------------------------------------------------------------------
+
+# Columns of each significance table, followed by the period columns like the stats tables.
+SIG_METRICS = [
+    'avg_diff', 'avg_diff_ci_low', 'avg_diff_ci_high', 'avg_diff_p',
+    'up_prob', 'up_prob_ci_low', 'up_prob_ci_high', 'up_prob_p', 'n_years'
+]
+
+
+def get_windows(start_yr:int) -> List[Tuple[Text, int]]:
+    # Same windows and key suffixes as 'preprocessing.summarise_pivot'. Example: [('', 2004), ('_range_15_yr', 2006)]
+    return list(panel.iter_stats_windows([start_yr] + START_YR_RANGE[1:]))
+
+
+def get_rng(seed:int, ticker:Text, key:Text, stream:int) -> np.random.Generator:
+    # One stream per ticker, pivot key and purpose, so a ticker gets the same draws
+    # when it is tested alone or in any batch of tickers.
+    return np.random.default_rng([seed, zlib.crc32(ticker.encode()), zlib.crc32(key.encode()), stream])
+
+
+def split_values(values:np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # Values without NaN, and the masks of the years with a value, up and down.
+    valid = ~np.isnan(values)
+    return np.where(valid, values, 0.0), valid, values > 0, values < 0
+
+
+def window_stats(parts:Tuple[np.ndarray, ...], window:slice) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Mean, up probability and number of years over the years (second last axis) of a
+    # window, from the parts of (split_values). Same as 'summarise_pivot'.
+    filled, valid, up, down = (part[..., window, :] for part in parts)
+    counts = np.count_nonzero(valid, axis=-2)
+    up_counts, down_counts = np.count_nonzero(up, axis=-2), np.count_nonzero(down, axis=-2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(counts > 0, filled.sum(axis=-2) / counts, np.nan)
+        prob = up_counts / (up_counts + down_counts)
+    return mean, prob, counts
+
+
+# ----------------------------------------------------------------------
+# Resampling.
+# ----------------------------------------------------------------------
+
+def test_batch(
+        aligned:walk_forward.AlignedPivots,
+        key:Text,
+        tickers:range,
+        windows:List[slice],
+        n_resamples:int,
+        alpha:float,
+        seed:int,
+        batch_resamples:int,
+    ) -> np.ndarray:
+
+    '''
+    Purpose:
+        Test a batch of tickers for every window and period at once. The resamples
+        are drawn (batch_resamples) at a time to bound the memory.
+
+        1. Bootstrap: resample the years of a period with replacement, and take the
+           percentiles of the resampled mean and up probability.
+        2. Permutation: shuffle the period labels within each year, so a period is
+           compared with what any period of the same years would get. The p-value is
+           the share of shuffles whose mean (or up probability) is at least as far from
+           the overall value of the window as the observed one, both ways.
+
+    Input  :
+        aligned        : AlignedPivots of the tickers of the pivot key.
+        key            : Str. Pivot key. Example: 'monthly'
+        tickers        : Range of the positions of the batch in (aligned).
+        windows        : List of the positions of the years of each window in (aligned.years).
+        n_resamples    : Int. Number of bootstrap resamples and of shuffles per cell.
+        alpha          : Float. The confidence intervals cover (1 - alpha).
+        seed           : Int. Seed of the random streams.
+        batch_resamples: Int. Number of resamples drawn at once.
+
+    Return :
+        Array of window x ticker x period x metric, with the metrics of (SIG_METRICS).
+    '''
+
+    # Year x period, so the shuffles sort along the last axis.
+    values = aligned.values[tickers.start:tickers.stop].transpose(0, 2, 1)
+    rows = aligned.rows[tickers.start:tickers.stop]
+    spans = aligned.spans[tickers.start:tickers.stop]
+    names = aligned.tickers[tickers.start:tickers.stop]
+    n_tickers, n_years, n_periods = values.shape
+    n_windows = len(windows)
+
+    # Observed stats and the overall stats of each window of each ticker.
+    parts = split_values(values)
+    obs_mean, obs_prob, counts = (np.stack(stats) for stats in zip(*(window_stats(parts, window) for window in windows)))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        center_mean = np.stack([parts[0][:, window].sum(axis=(1, 2)) / parts[1][:, window].sum(axis=(1, 2))
+                                for window in windows])[..., None]
+        center_prob = np.stack([parts[2][:, window].sum(axis=(1, 2)) / (parts[2][:, window].sum(axis=(1, 2))
+                                + parts[3][:, window].sum(axis=(1, 2))) for window in windows])[..., None]
+    obs_dist_mean, obs_dist_prob = np.abs(obs_mean - center_mean) - 1e-12, np.abs(obs_prob - center_prob) - 1e-12
+
+    # The values of each period first, then NaN, then a zero that the empty draws point to.
+    padded = [np.concatenate([np.sort(values[:, window], axis=1), np.zeros((n_tickers, 1, n_periods))], axis=1)
+              for window in windows]
+
+    # The rows of a ticker first, then the rows it doesn't have. The draws of the missing
+    # rows are ranked last, so the (i)th smallest draw of a ticker moves one of its own
+    # rows to its (i)th row, and the stats of a shuffle come out in this order.
+    slots = np.stack([np.concatenate([ticker_rows, np.setdiff1d(np.arange(n_periods), ticker_rows)])
+                      for ticker_rows in rows])
+    obs_dist_mean_slots = np.take_along_axis(obs_dist_mean, slots[None], axis=2)
+    obs_dist_prob_slots = np.take_along_axis(obs_dist_prob, slots[None], axis=2)
+    rngs_perm = [get_rng(seed, ticker, key, 0) for ticker in names]
+    rngs_boot = [[get_rng(seed, ticker, key, w + 1) for ticker in names] for w in range(n_windows)]
+
+    boot_mean = np.empty((n_windows, n_tickers, n_resamples, n_periods))
+    boot_prob = np.empty((n_windows, n_tickers, n_resamples, n_periods))
+    exceed_mean = np.zeros((n_windows, n_tickers, n_periods))
+    exceed_prob = np.zeros((n_windows, n_tickers, n_periods))
+
+    for lo in range(0, n_resamples, batch_resamples):
+        size = min(batch_resamples, n_resamples - lo)
+
+        # Permutation. Each ticker draws for its own years and rows only. The draws are
+        # doubles, since the order of tied draws would depend on the rows of the batch.
+        draws = np.full((n_tickers, size, n_years, n_periods), np.inf)
+        for n, (ticker_rows, (start, stop)) in enumerate(zip(rows, spans)):
+            draws[n][:, start:stop, ticker_rows] = rngs_perm[n].random((size, stop - start, len(ticker_rows)))
+        shuffled = np.take_along_axis(values[:, None], draws.argsort(axis=-1), axis=-1)
+        shuffled_parts = split_values(shuffled)
+        del draws, shuffled
+
+        with np.errstate(invalid='ignore'):
+            for w, window in enumerate(windows):
+                perm_mean, perm_prob, _ = window_stats(shuffled_parts, window)
+                exceed_mean[w] += (np.abs(perm_mean - center_mean[w][..., None])
+                                   >= obs_dist_mean_slots[w][:, None]).sum(axis=1)
+                exceed_prob[w] += (np.abs(perm_prob - center_prob[w][..., None])
+                                   >= obs_dist_prob_slots[w][:, None]).sum(axis=1)
+        del shuffled_parts
+
+        # Bootstrap. Draw an index below the number of years of each period. The
+        # samples are summed along the second last axis, in the order of the draws.
+        for w, window in enumerate(windows):
+            n_slots = padded[w].shape[1] - 1
+            draws = np.zeros((n_tickers, size, n_slots, n_periods), dtype=np.float32)
+            for n, (ticker_rows, (start, stop)) in enumerate(zip(rows, spans)):
+                ticker_slots = max(0, min(stop, window.stop) - max(start, window.start))
+                draws[n][:, :ticker_slots, ticker_rows] = \
+                    rngs_boot[w][n].random((size, ticker_slots, len(ticker_rows)), dtype=np.float32)
+
+            count = counts[w][:, None, None]
+            idx = np.minimum((draws * count.astype(np.float32)).astype(np.intp), count - 1)
+            idx = np.where(np.arange(n_slots)[:, None] < count, idx, n_slots)
+            sample = np.take_along_axis(padded[w][:, None], idx, axis=-2)
+            up_counts, down_counts = np.count_nonzero(sample > 0, axis=-2), np.count_nonzero(sample < 0, axis=-2)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                boot_mean[w, :, lo:lo + size] = sample.sum(axis=-2) / count[:, :, 0]
+                boot_prob[w, :, lo:lo + size] = up_counts / (up_counts + down_counts)
+            del draws, idx, sample
+
+    with warnings.catch_warnings():
+        # A period without years has no resamples, and its intervals stay NaN. A
+        # resample with no up or down year has no up probability, and only those
+        # cells need the slower percentiles that skip NaN.
+        warnings.simplefilter('ignore', RuntimeWarning)
+        quantiles = [alpha / 2, 1 - alpha / 2]
+        mean_ci = np.quantile(boot_mean, quantiles, axis=2)
+        prob_ci = np.quantile(boot_prob, quantiles, axis=2)
+        partial = np.isnan(boot_prob).any(axis=2) & ~np.isnan(boot_prob).all(axis=2)
+        if partial.any():
+            prob_ci[:, partial] = np.nanquantile(boot_prob.transpose(0, 1, 3, 2)[partial], quantiles, axis=-1)
+
+    # Back from the order of the shuffles to the order of the periods.
+    np.put_along_axis(exceed_mean, slots[None], exceed_mean.copy(), axis=2)
+    np.put_along_axis(exceed_prob, slots[None], exceed_prob.copy(), axis=2)
+
+    has_years = counts > 0
+    p_mean = np.where(has_years, (1 + exceed_mean) / (n_resamples + 1), np.nan)
+    p_prob = np.where(has_years & ~np.isnan(obs_prob), (1 + exceed_prob) / (n_resamples + 1), np.nan)
+    return np.stack([
+        obs_mean, mean_ci[0], mean_ci[1], p_mean,
+        np.round(obs_prob, 4), prob_ci[0], prob_ci[1], p_prob, counts.astype(np.float64)
+    ], axis=-1)
+
+
+def test_pivots(
+        pivots:Dict[Text, pd.DataFrame],
+        key:Text,
+        windows:List[Tuple[Text, int]],
+        end_yr:int=END_YR,
+        n_resamples:int=SIGNIFICANCE_RESAMPLES,
+        alpha:float=SIGNIFICANCE_ALPHA,
+        seed:int=SIGNIFICANCE_SEED,
+    ) -> Dict[Text, Dict[Text, pd.DataFrame]]:
+
+    '''
+    Purpose:
+        Compute the significance tables of the pivot tables of many tickers for the
+        same key. The tickers are tested in batches of at most (SIGNIFICANCE_MAX_CELLS)
+        cells, and a ticker gets the same results in any batch.
+
+    Input  :
+        pivots     : Dictionary of ticker and its pivot table for (key).
+        key        : Str. Pivot key. Example: 'monthly' / 'compiled_holiday'
+        windows    : List of the key suffix and the start year of each window. Example: (get_windows)
+        end_yr     : Int. Ending year of every window.
+        n_resamples: Int. Number of bootstrap resamples and of shuffles per cell.
+        alpha      : Float. The confidence intervals cover (1 - alpha).
+        seed       : Int. Seed of the random streams.
+
+    Return :
+        Dictionary of ticker and its dictionary of stats key and significance table.
+        Example: {'SPY': {'monthly': df, 'monthly_range_15_yr': df, ...}}
+    '''
+
+    logger.info('Start running (test_pivots) function.')
+
+    aligned = walk_forward.align_pivots(pivots)
+    n_tickers, n_periods, n_years = aligned.values.shape
+    year_slices = [slice(*np.searchsorted(aligned.years, [start_yr, end_yr + 1])) for _, start_yr in windows]
+
+    # The bootstrap resamples of every window are kept for the percentiles, and the
+    # draws of each batch of resamples are the largest arrays.
+    batch_tickers = max(1, SIGNIFICANCE_MAX_CELLS // (2 * len(windows) * n_resamples * n_periods))
+    batch_resamples = max(1, min(n_resamples, SIGNIFICANCE_MAX_CELLS // (min(batch_tickers, n_tickers) * n_periods * n_years)))
+
+    results = {}
+    for lo in range(0, n_tickers, batch_tickers):
+        tickers = range(lo, min(lo + batch_tickers, n_tickers))
+        tested = test_batch(aligned, key, tickers, year_slices, n_resamples, alpha, seed, batch_resamples)
+
+        for i, n in enumerate(tickers):
+            results[aligned.tickers[n]] = tables = {}
+            for w, (suffix, _) in enumerate(windows):
+                df = pd.DataFrame(tested[w, i, aligned.rows[n]], columns=SIG_METRICS)
+                df['n_years'] = df['n_years'].astype(np.int64)
+                for col in aligned.frames[n].columns:
+                    df[col] = aligned.frames[n][col].to_numpy()
+                tables[f'{key}{suffix}'] = df
+
+    logger.debug(f'----- Tested ({n_tickers}) tickers of ({key}) in batches of ({batch_tickers}) tickers '
+                 f'and ({batch_resamples}) resamples.')
+    return results
+
+
+# ----------------------------------------------------------------------
+# Ticker Stage.
+# ----------------------------------------------------------------------
+
+def summarise_significance(pivot_dicts:Dict[Text, Dict[Text, pd.DataFrame]], ticker:Text,
+                           start_yr:int) -> Dict[Text, Dict[Text, pd.DataFrame]]:
+    '''
+    Purpose:
+        Compute the significance tables of every frequency, the holidays and the
+        special days of a ticker, for the same windows as its stats tables.
+
+    Input  :
+        pivot_dicts: Dictionary of source and its pivot tables. Example: {'price': pivot_ticker, 'holiday': ...}
+        ticker     : Str. Ticker symbol. Seeds the random streams.
+        start_yr   : Int. Starting year of the ticker.
+
+    Return :
+        Dictionary of source and its dictionary of stats key and significance table.
+    '''
+
+    windows = get_windows(start_yr)
+    return {
+        source: {
+            stats_key: df
+            for key in keys
+            for stats_key, df in test_pivots({ticker: pivot_dicts[source][key]}, key, windows)[ticker].items()
+        }
+        for source, keys in walk_forward.WALK_FORWARD_KEYS.items()
+    }
+
+
+def load_significance(ticker:Text, etf_dir:Optional[Text]=None) -> Dict[Text, Dict[Text, pd.DataFrame]]:
+    '''
+    Purpose:
+        Load the significance tables that (PivotSignificance) stored for a ticker.
+        Example: load_significance('SPY')['price']['monthly_range_10_yr']
+    '''
+
+    with open(f'{query_api.get_ticker_dir(ticker, etf_dir)}/storage/pivot_significance.pickle', 'rb') as in_file:
+        return pickle.load(in_file)
+
+
+# ----------------------------------------------------------------------
+# Verification.
+# ----------------------------------------------------------------------
+
+def verify_significance(pivots:Dict[Text, pd.DataFrame], key:Text, start_yr:int, n_resamples:int=200) -> bool:
+    '''
+    Purpose:
+        Check the significance tables of the tickers.
+        1. The observed (avg_diff) and (up_prob) match 'preprocessing.summarise_pivot'.
+        2. Each ticker gets identical tables alone and in the batch.
+        3. The intervals hold the observed value, and the p-values are within (0, 1].
+
+    Input  :
+        pivots: Dictionary of ticker and its pivot table for (key). Every ticker
+                must have data from (start_yr).
+
+    Return :
+        True if every check passes. Raises AssertionError otherwise.
+    '''
+
+    logger.info('Start running (verify_significance) function.')
+
+    windows = get_windows(start_yr)
+    batch = test_pivots(pivots, key, windows, n_resamples=n_resamples)
+
+    for ticker, pivot in pivots.items():
+        pivot_dict, pivot_dict_stats = {key: pivot}, {}
+        preprocessing.summarise_pivot(pivot_dict, pivot_dict_stats, [key], [start_yr] + START_YR_RANGE[1:], END_YR)
+        alone = test_pivots({ticker: pivot}, key, windows, n_resamples=n_resamples)[ticker]
+
+        assert alone.keys() == pivot_dict_stats.keys(), ticker
+        for stats_key, df in alone.items():
+            pd.testing.assert_frame_equal(batch[ticker][stats_key], df, check_exact=True)
+            for col in ['avg_diff', 'up_prob']:
+                pd.testing.assert_series_equal(df[col], pivot_dict_stats[stats_key][col], check_exact=False,
+                                               rtol=1e-9, atol=1e-12)
+
+            tested = df.dropna(subset=['avg_diff_ci_low', 'avg_diff_p'])
+            assert ((tested['avg_diff_ci_low'] <= tested['avg_diff'] + 1e-12)
+                    & (tested['avg_diff'] <= tested['avg_diff_ci_high'] + 1e-12)).all(), stats_key
+            assert ((tested['avg_diff_p'] > 0) & (tested['avg_diff_p'] <= 1)).all(), stats_key
+
+    logger.debug(f'----- Verified the significance tables of ({len(pivots)}) tickers for ({key}).')
+    return True
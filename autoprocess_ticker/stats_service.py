@@ -0,0 +1,135 @@
+
+
+import json, logging, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Text, Tuple
+from urllib.parse import urlparse, parse_qs
+import pandas as pd
+
+# Arrow is optional. Without it the service only serves JSON.
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# Personal modules.
+from config.config import (
+    LOG_PROCESSING_FILEPATH, YR_RANGE, STATS_SERVICE_PORT, STATS_SERVICE_CACHE_BYTES
+)
+from config.config_logger import setup_logger
+from autoprocess_ticker import query_api, stats_store
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# ----------------------------------------------------------------------
+# HTTP Service.
+# ----------------------------------------------------------------------
+
+def encode_frame(df:pd.DataFrame, fmt:Text) -> Tuple[bytes, Text]:
+    '''
+    Purpose:
+        Encode a dataframe as JSON ('split' orient) or an Arrow IPC stream.
+
+    Return :
+        Tuple of the content and its content type.
+    '''
+
+    if fmt == 'arrow':
+        if pa is None:
+            raise ValueError('Arrow output requires (pyarrow).')
+        table = pa.Table.from_pandas(df.rename(columns=str), preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes(), 'application/vnd.apache.arrow.stream'
+
+    return df.to_json(orient='split', index=False, date_format='iso').encode(), 'application/json'
+
+
+class StatsRequestHandler(BaseHTTPRequestHandler):
+    '''
+    Read-only endpoints:
+        /health
+        /tickers
+        /stats/{ticker}/{freq}?yr_range=max_yr&source=price&etf_dir=&format=json
+        /pivot/{ticker}/{key}?source=price&etf_dir=&format=json
+    '''
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+
+        try:
+            if parts == ['health']:
+                return self.send_content(json.dumps({'status': 'ok', 'cache': query_api.cache_info()}).encode(),
+                                         'application/json')
+            if parts == ['tickers']:
+                rows = stats_store.get_store().connect().execute('SELECT ticker, etf_dir FROM tickers ORDER BY ticker')
+                return self.send_content(json.dumps([{'ticker': ticker, 'etf_dir': etf_dir} for ticker, etf_dir in rows]).encode(),
+                                         'application/json')
+            if len(parts) == 3 and parts[0] in ('stats', 'pivot'):
+                query_api.check_ticker_dir(parts[1], query.get('etf_dir'))
+            if len(parts) == 3 and parts[0] == 'stats':
+                df = query_api.load_stats(parts[1], parts[2], query.get('yr_range', YR_RANGE[0]),
+                                          query.get('source', 'price'), query.get('etf_dir'))
+            elif len(parts) == 3 and parts[0] == 'pivot':
+                df = query_api.load_pivot(parts[1], parts[2], query.get('source', 'price'), query.get('etf_dir'))
+            else:
+                return self.send_json_error(404, 'Unknown endpoint.')
+            self.send_content(*encode_frame(df, query.get('format', 'json')))
+        except KeyError as error:
+            self.send_json_error(404, error.args[0])
+        except PermissionError as error:
+            self.send_json_error(403, str(error))
+        except ValueError as error:
+            self.send_json_error(406, str(error))
+        except Exception as error:
+            logger.exception(f'----- Stats service failed on ({self.path}) -- {error}')
+            self.send_json_error(500, f'Internal error: {type(error).__name__}')
+
+    def send_json_error(self, status:int, message:Text):
+        self.send_content(json.dumps({'error': message}).encode(), 'application/json', status)
+
+    def send_content(self, content:bytes, content_type:Text, status:int=200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        logger.debug(f'----- Stats service -- {format % args}')
+
+
+def start_service(port:int=STATS_SERVICE_PORT, max_bytes:int=STATS_SERVICE_CACHE_BYTES,
+                  background:bool=False) -> ThreadingHTTPServer:
+    '''
+    Purpose:
+        Start the stats service on localhost.
+
+    Input  :
+        port      : Int. Port to listen on. 0 picks a free port.
+        max_bytes : Int. Memory budget of the cache in bytes.
+        background: Bool. Serve on a daemon thread and return, instead of blocking.
+
+    Return :
+        The server. Call 'shutdown()' to stop it when running in the background.
+    '''
+
+    query_api.configure_cache(max_bytes)
+    server = ThreadingHTTPServer(('localhost', port), StatsRequestHandler)
+    logger.info(f'Started the stats service at (http://localhost:{server.server_address[1]}).')
+
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    else:
+        server.serve_forever()
+    return server
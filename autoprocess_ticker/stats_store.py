@@ -0,0 +1,306 @@
+
+
+import os, logging, pickle, re, sqlite3, time
+from typing import Dict, Iterator, List, Optional, Sequence, Text, Tuple
+import numpy as np
+import pandas as pd
+
+# Personal modules.
+from config.config import LOG_PROCESSING_FILEPATH, STATS_STORE_PATH, USE_SYMBOL_STORE, SYMBOL_STORE_DIR, YR_RANGE, QUANTILE_COLS
+from config.config_logger import setup_logger
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# ----------------------------------------------------------------------
+# Store Layout.
+# ----------------------------------------------------------------------
+
+# Columns from 'preprocessing.summarise_pivot' and 'preprocessing.summarise_pivot_vol'.
+SEASONAL_METRICS = [
+    'avg_diff', 'med_diff', *[f'{col}_diff' for col in QUANTILE_COLS], 'tot_diff', 'max_diff', 'min_diff', 'std_diff',
+    'up_overall', 'pos_avg_diff', 'up_counts', 'neg_avg_diff', 'down_counts', 'up_prob', 'down_prob',
+]
+VOLUME_METRICS = ['abv_avg_vol_counts', 'blw_avg_vol_counts', 'abv_avg_vol_prob']
+COUNT_METRICS = ['up_overall', 'up_counts', 'down_counts', 'abv_avg_vol_counts', 'blw_avg_vol_counts']
+KEY_COLS = ['ticker', 'etf_dir', 'source', 'freq', 'yr_range', 'period']
+
+# Storage files of a ticker and the stats dictionaries in each. Example:
+#   'pivot_unique_days.pickle' -> ((pivot, stats), (pivot, stats), (pivot, stats))
+STORAGE_SOURCES = {
+    'pivot_stats.pickle': ['price'],
+    'pivot_vol_stats.pickle': ['volume'],
+    'pivot_unique_days.pickle': ['holiday', 'special_days', 'special_days_weekly'],
+}
+
+# Storage files of the optional stages. They can be queried, but are not part of
+# the store, as most tickers do not have them.
+OPTIONAL_STORAGE_SOURCES = {
+    'pivot_intraday.pickle': ['intraday', 'intraday_volume'],
+    'pivot_periods.pickle': ['periods'],
+}
+
+# Operators allowed in the screener filters.
+FILTER_OPS = ['>=', '<=', '!=', '=', '>', '<']
+
+
+class StatsStore:
+    '''
+    SQLite store of the statistical summaries of every ticker, one row per ticker,
+    frequency, year range and period. The screener filters and ranks the tickers
+    with indexed queries instead of opening one workbook per ticker.
+
+    Tables:
+        seasonal_stats: Price change stats of the pivots and the unique days.
+        volume_stats  : Above-average volume stats. Only computed for 'max_yr'.
+        tickers       : Fingerprint of the storage files of each ingested ticker.
+    '''
+
+    def __init__(self, db_path:Text=STATS_STORE_PATH):
+        self.db_path = db_path
+        self._conn = None
+        self._pid = None
+
+    def connect(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            if os.path.dirname(self.db_path):
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+
+            self._conn = sqlite3.connect(self.db_path, timeout=60)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            # The store only holds copies of the storage files, so it is rebuilt when its columns change.
+            columns = [row[1] for row in self._conn.execute('PRAGMA table_info(seasonal_stats)')]
+            if columns and columns != KEY_COLS + SEASONAL_METRICS:
+                self._conn.executescript('DROP TABLE seasonal_stats; DROP TABLE volume_stats; DROP TABLE tickers;')
+                logger.debug(f'----- Dropped the tables of ({self.db_path}) to rebuild them with the new columns.')
+            metric_cols = ', '.join(f'{metric} {"INTEGER" if metric in COUNT_METRICS else "REAL"}' for metric in SEASONAL_METRICS)
+            volume_cols = ', '.join(f'{metric} {"INTEGER" if metric in COUNT_METRICS else "REAL"}' for metric in VOLUME_METRICS)
+            self._conn.executescript(f'''
+                CREATE TABLE IF NOT EXISTS seasonal_stats (
+                    {' TEXT, '.join(KEY_COLS)} TEXT, {metric_cols}, PRIMARY KEY ({', '.join(KEY_COLS)})
+                );
+                CREATE INDEX IF NOT EXISTS idx_seasonal_screen ON seasonal_stats (freq, yr_range, period);
+                CREATE TABLE IF NOT EXISTS volume_stats (
+                    {' TEXT, '.join(KEY_COLS)} TEXT, {volume_cols}, PRIMARY KEY ({', '.join(KEY_COLS)})
+                );
+                CREATE INDEX IF NOT EXISTS idx_volume_screen ON volume_stats (freq, yr_range, period);
+                CREATE TABLE IF NOT EXISTS tickers (
+                    ticker TEXT, etf_dir TEXT, fingerprint TEXT, updated_at REAL, PRIMARY KEY (ticker, etf_dir)
+                );
+            ''')
+            self._pid = os.getpid()
+        return self._conn
+
+    # ------------------------------------------------------------------
+    # Ingestion.
+    # ------------------------------------------------------------------
+
+    def fingerprint(self, ticker_dir:Text) -> Optional[Text]:
+        # Stat the storage files instead of hashing them, so an unchanged ticker is
+        # skipped without reading its pickles.
+        try:
+            stats = [os.stat(f'{ticker_dir}/storage/{filename}') for filename in STORAGE_SOURCES]
+        except FileNotFoundError:
+            return None
+        return ';'.join(f'{stat.st_mtime_ns}-{stat.st_size}' for stat in stats)
+
+    def ingest_ticker(self, ticker:Text, etf_dir:Text, force:bool=False) -> bool:
+        '''
+        Purpose:
+            Replace the rows of a ticker with the stats in its storage files.
+
+        Input  :
+            ticker : Str. Ticker symbol.
+            etf_dir: Str. Folder that holds the ticker folder.
+            force  : Bool. Ingest even if the storage files are unchanged.
+
+        Return :
+            True if the ticker was ingested. False if it was unchanged or has no outputs yet.
+        '''
+
+        ticker_dir = f'{etf_dir}/{ticker}'
+        fingerprint = self.fingerprint(ticker_dir)
+        if fingerprint is None:
+            logger.debug(f'----- Skipped ({ticker_dir}). The storage files do not exist yet.')
+            return False
+
+        conn = self.connect()
+        row = conn.execute('SELECT fingerprint FROM tickers WHERE ticker = ? AND etf_dir = ?', (ticker, etf_dir)).fetchone()
+        if row and row[0] == fingerprint and not force:
+            return False
+
+        seasonal_rows, volume_rows = [], []
+        for filename, sources in STORAGE_SOURCES.items():
+            with open(f'{ticker_dir}/storage/{filename}', 'rb') as in_file:
+                content = pickle.load(in_file)
+            # A single (pivot, stats) pair or a tuple of pairs for the unique days.
+            pairs = [content] if len(sources) == 1 else content
+
+            for source, (_, pivot_stats) in zip(sources, pairs):
+                rows = volume_rows if source == 'volume' else seasonal_rows
+                metrics = VOLUME_METRICS if source == 'volume' else SEASONAL_METRICS
+                rows.extend(iter_stats_rows(ticker, etf_dir, source, pivot_stats, metrics))
+
+        with conn:
+            for table in ['seasonal_stats', 'volume_stats']:
+                conn.execute(f'DELETE FROM {table} WHERE ticker = ? AND etf_dir = ?', (ticker, etf_dir))
+            conn.executemany(f'INSERT INTO seasonal_stats VALUES ({", ".join("?" * (len(KEY_COLS) + len(SEASONAL_METRICS)))})',
+                             seasonal_rows)
+            conn.executemany(f'INSERT INTO volume_stats VALUES ({", ".join("?" * (len(KEY_COLS) + len(VOLUME_METRICS)))})',
+                             volume_rows)
+            conn.execute('INSERT OR REPLACE INTO tickers VALUES (?, ?, ?, ?)', (ticker, etf_dir, fingerprint, time.time()))
+
+        logger.debug(f'----- Ingested ({len(seasonal_rows)}) seasonal and ({len(volume_rows)}) volume rows of ({ticker_dir}).')
+        return True
+
+    def refresh(self, jobs:List[Tuple[Text, int, Text]], force:bool=False) -> int:
+        '''
+        Purpose:
+            Ingest the tickers of the jobs whose storage files have changed.
+
+        Input  :
+            jobs : List of (ticker, start_yr, etf_dir).
+            force: Bool. Ingest every ticker again.
+
+        Return :
+            Number of ingested tickers.
+        '''
+
+        logger.info('Start running (refresh) function.')
+
+        ingested = sum(self.ingest_ticker(ticker, etf_dir, force) for ticker, etf_dir in list_ticker_dirs(jobs))
+        logger.info(f'Ingested ({ingested}) tickers into the stats store ({self.db_path}).')
+        return ingested
+
+    # ------------------------------------------------------------------
+    # Screener.
+    # ------------------------------------------------------------------
+
+    def screen(
+            self,
+            freq:Text,
+            yr_range:Text=YR_RANGE[0],
+            period:Optional[Text]=None,
+            filters:Sequence[Tuple[Text, Text, float]]=(),
+            order_by:Text='up_prob',
+            ascending:bool=False,
+            limit:Optional[int]=20,
+            source:Optional[Text]=None,
+        ) -> pd.DataFrame:
+
+        '''
+        Purpose:
+            Filter and rank the tickers by their stats for a frequency, year range and period.
+            Example: the tickers that rose in December in at least 80% of the years of 'range_15_yr'.
+                screen('monthly', 'range_15_yr', '12', [('up_prob', '>=', 0.8)])
+
+        Input  :
+            freq     : Str. Stats key without the year range. Example: 'monthly' / 'compiled_holiday'
+            yr_range : Str. One of (YR_RANGE). Example: 'max_yr' / 'range_15_yr'
+            period   : Str. Period values joined with '/'. Example: '12' / '12/3' / 'christmas/-1'
+                       All periods are returned if not given.
+            filters  : List of (metric, operator, value). Example: [('abv_avg_vol_prob', '>', 0.5)]
+            order_by : Str. Metric to rank the tickers by.
+            ascending: Bool. Rank from the lowest value.
+            limit    : Int. Number of rows to return. All rows if None.
+            source   : Str. Only needed when the same (freq) exists in several sources.
+                       Example: 'special_days' / 'special_days_weekly' for 'compiled_tww'.
+
+        Return :
+            Dataframe of the matching rows. The volume metrics are from 'max_yr'.
+        '''
+
+        metrics = SEASONAL_METRICS + VOLUME_METRICS
+        for metric, op, _ in filters:
+            if metric not in metrics or op not in FILTER_OPS:
+                raise ValueError(f'Invalid filter ({metric} {op}). Use a metric in ({metrics}) and an operator in ({FILTER_OPS}).')
+        if order_by not in metrics:
+            raise ValueError(f'Invalid (order_by) metric ({order_by}). Use one of ({metrics}).')
+
+        where, params = ['s.freq = ?', 's.yr_range = ?'], [freq, yr_range]
+        if period is not None: where.append('s.period = ?'); params.append(str(period))
+        if source is not None: where.append('s.source = ?'); params.append(source)
+        for metric, op, value in filters:
+            where.append(f'{"v" if metric in VOLUME_METRICS else "s"}.{metric} {op} ?')
+            params.append(value)
+
+        query = f'''
+            SELECT s.*, {', '.join(f'v.{metric}' for metric in VOLUME_METRICS)}
+            FROM seasonal_stats s LEFT JOIN volume_stats v
+                ON v.ticker = s.ticker AND v.etf_dir = s.etf_dir AND v.source = 'volume'
+                AND v.freq = s.freq AND v.yr_range = '{YR_RANGE[0]}' AND v.period = s.period
+            WHERE {' AND '.join(where)}
+            ORDER BY {order_by} IS NULL, {order_by} {'ASC' if ascending else 'DESC'}, s.ticker
+            {'' if limit is None else f'LIMIT {int(limit)}'}
+        '''
+        return pd.read_sql_query(query, self.connect(), params=params)
+
+
+# Cache the store per path so that every caller in a process shares one connection.
+_STORES = {}
+
+
+def get_store(db_path:Text=STATS_STORE_PATH) -> StatsStore:
+    if db_path not in _STORES:
+        _STORES[db_path] = StatsStore(db_path)
+    return _STORES[db_path]
+
+
+# ----------------------------------------------------------------------
+# Helpers.
+# ----------------------------------------------------------------------
+
+def list_ticker_dirs(jobs:List[Tuple[Text, int, Text]]) -> List[Tuple[Text, Text]]:
+    # Every ticker is kept once in the symbol store, no matter how many ETFs hold it.
+    if USE_SYMBOL_STORE:
+        return sorted({(ticker, SYMBOL_STORE_DIR) for ticker, _, _ in jobs})
+    return sorted({(ticker, etf_dir) for ticker, _, etf_dir in jobs})
+
+
+def split_stats_key(stats_key:Text) -> Tuple[Text, Text]:
+    '''
+    Purpose:
+        Split a stats key into the frequency and the year range.
+        Example: 'monthly_range_15_yr' -> ('monthly', 'range_15_yr'), 'monthly' -> ('monthly', 'max_yr')
+    '''
+
+    for yr_range in YR_RANGE[1:]:
+        if stats_key.endswith(f'_{yr_range}'):
+            return stats_key[:-len(yr_range) - 1], yr_range
+    return stats_key, YR_RANGE[0]
+
+
+def format_period_value(value) -> Text:
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        value = int(value)
+    return str(value)
+
+
+def iter_stats_rows(ticker:Text, etf_dir:Text, source:Text, pivot_stats:Dict[Text, pd.DataFrame],
+                    metrics:List[Text]) -> Iterator[Tuple]:
+    '''
+    Purpose:
+        Convert a stats dictionary into store rows. The period columns are the
+        columns that the export layout adds, so every column that
+        is not a metric or a per-year column. Example: ['month', 'trdr_day']
+    '''
+
+    per_year = re.compile(r'^abv_avg_vol_\d{4}$')
+    for stats_key, df in pivot_stats.items():
+        # The average volume tables are inputs of the volume stats, not stats.
+        if stats_key.endswith('_avg_vol_row') or stats_key.endswith('_avg_vol_col'):
+            continue
+
+        freq, yr_range = split_stats_key(stats_key)
+        period_cols = [col for col in df.columns if col not in metrics and not per_year.match(str(col))]
+        periods = ['/'.join(map(format_period_value, values)) for values in zip(*[df[col] for col in period_cols])]
+        values = df[metrics].astype(float).to_numpy()
+
+        for period, row in zip(periods, values):
+            yield (ticker, etf_dir, source, freq, yr_range, period, *[None if np.isnan(value) else value for value in row])
@@ -0,0 +1,253 @@
+
+
+import os, asyncio, logging, subprocess, time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Text
+import luigi
+from luigi.task import flatten
+
+# Personal modules.
+from config.config import LOG_PROCESSING_FILEPATH, WORKERS, STREAM_DOWNLOADS, STREAM_QUEUE_SIZE, MEMORY_BUDGET_MB
+from config.config_logger import setup_logger
+from autoprocess_ticker import memory_budget
+import luigi_pipeline
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# ----------------------------------------------------------------------
+# Stages.
+# ----------------------------------------------------------------------
+
+def list_stages(task:luigi.Task) -> List[luigi.Task]:
+    '''
+    Purpose:
+        List a task and every task it requires, each after its dependencies. A task
+        required twice is listed once. Example: the daily download of (ProcessTickerData).
+    '''
+
+    stages, visited = [], set()
+
+    def visit(stage):
+        if stage.task_id in visited:
+            return
+        visited.add(stage.task_id)
+        for dep in flatten(stage.requires()):
+            visit(dep)
+        stages.append(stage)
+
+    visit(task)
+    return stages
+
+
+def run_stages(stages:List[luigi.Task], spill:bool=False) -> Dict:
+    '''
+    Purpose:
+        Run the stages of a ticker in a worker process. Completed stages are skipped
+        like the Luigi worker does, and the run manifest is updated through the same
+        event handlers.
+
+    Input  :
+        stages: List of Luigi tasks ordered by (list_stages), without the downloads.
+        spill : Bool. Read the pivot tables from the storage files as they are written,
+                and return the freed memory to the system once done. See 'memory_budget'.
+
+    Return :
+        Dictionary of the number of stages run, the seconds taken, and the resident
+        memory of the worker.
+    '''
+
+    start_time = time.perf_counter()
+    n_stages = 0
+
+    for stage in stages:
+        if stage.complete():
+            continue
+        if hasattr(stage, 'spill_pivots'):
+            stage.spill_pivots = spill
+        luigi_pipeline.record_start(stage)
+        try:
+            stage.run()
+        except Exception as error:
+            luigi_pipeline.record_failure(stage, error)
+            raise
+        luigi_pipeline.record_success(stage)
+        n_stages += 1
+
+    if spill:
+        memory_budget.release_memory()
+    return {'stages': n_stages, 'process_seconds': round(time.perf_counter() - start_time, 2), 'pid': os.getpid(),
+            'rss': memory_budget.read_rss()}
+
+
+async def download(task:luigi_pipeline.DownloadTickerData, lock:asyncio.Lock):
+    '''
+    Purpose:
+        Run the 'curl' command of a download task without blocking the event loop, then
+        store the file the same way as (DownloadTickerData.run).
+
+    Input  :
+        task: Download task.
+        lock: Lock of the temporary file of the task. The same ticker in two ETF folders
+              downloads into the same temporary file in this process.
+    '''
+
+    async with lock:
+        luigi_pipeline.record_start(task)
+        os.makedirs(os.path.dirname(task.temp_path()), exist_ok=True)
+        process = await asyncio.create_subprocess_exec(*task.program_args(), stdout=subprocess.DEVNULL,
+                                                       stderr=subprocess.PIPE)
+        _, stderr = await process.communicate()
+
+        if process.returncode != 0:
+            error = RuntimeError(f'({task.task_id}) failed with exit code ({process.returncode}). {stderr.decode().strip()}')
+            luigi_pipeline.record_failure(task, error)
+            raise error
+
+        task.store_download()
+        luigi_pipeline.record_success(task)
+
+
+# ----------------------------------------------------------------------
+# Streaming Executor.
+# ----------------------------------------------------------------------
+
+async def stream_tasks(tasks:List[luigi.Task], workers:int, downloads:int, queue_size:int,
+                       budget_mb:int=0) -> List[Dict]:
+    '''
+    Purpose:
+        Download the tickers on the event loop and hand each downloaded ticker to a
+        pool of worker processes through a bounded queue. The downloads wait once the
+        queue is full, so they stay at most (queue_size) tickers ahead of the workers.
+
+    Input  :
+        tasks     : List of the final task of each ticker. Example: (CompileToExcel)
+        workers   : Int. Number of worker processes.
+        downloads : Int. Number of tickers to download at once.
+        queue_size: Int. Number of downloaded tickers waiting for a worker.
+        budget_mb : Int. Limit of the resident memory of the workers in MB. Unbounded if 0.
+
+    Return :
+        List of result dictionaries, one per task.
+    '''
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=queue_size)
+    budget = memory_budget.MemoryBudget(budget_mb * 1024 ** 2, workers) if budget_mb else None
+    pending = iter(tasks)
+    locks = {}
+    results = []
+
+    async def download_tickers():
+        # Every coroutine pulls the next task from the shared iterator.
+        for task in pending:
+            result = {'ticker': task.ticker, 'etf_dir': task.etf_dir, 'status': 'skipped'}
+            results.append(result)
+            if task.complete():
+                continue
+
+            start_time = time.perf_counter()
+            stages = list_stages(task)
+            download_stages = [
+                stage for stage in stages
+                if isinstance(stage, luigi_pipeline.DownloadTickerData) and not stage.complete()
+            ]
+            errors = [
+                error for error in await asyncio.gather(*[
+                    download(stage, locks.setdefault(stage.temp_path(), asyncio.Lock())) for stage in download_stages
+                ], return_exceptions=True)
+                if isinstance(error, Exception)
+            ]
+            result['download_seconds'] = round(time.perf_counter() - start_time, 2)
+
+            if errors:
+                result.update(status='failed', error=repr(errors[0]))
+                logger.error(f'----- Failed to download ({task.ticker}) -- {errors[0]}')
+                continue
+
+            # The footprint is estimated from the downloaded rows, so only with a budget.
+            if budget is not None:
+                footprint = memory_budget.estimate_footprint(stages)
+                result.update(rows=footprint['rows'], footprint_mb=round(footprint['bytes'] / 1024 ** 2, 1))
+
+            await queue.put((result, [
+                stage for stage in stages if not isinstance(stage, luigi_pipeline.DownloadTickerData)
+            ]))
+
+    async def process_tickers(pool):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+
+            result, stages = item
+            footprint = int(result.get('footprint_mb', 0) * 1024 ** 2)
+            spill = await budget.acquire(footprint) if budget is not None else False
+            worker = {}
+            try:
+                worker = await loop.run_in_executor(pool, run_stages, stages, spill)
+                result.update(worker, status='done', spilled=spill)
+            except Exception as error:
+                result.update(status='failed', error=repr(error))
+                logger.error(f'----- Failed to process ({result["ticker"]}) -- {error}')
+            finally:
+                if budget is not None:
+                    await budget.release(footprint, worker.get('pid'), worker.get('rss'))
+
+    # Spawn the workers, so they don't inherit the event loop and the open manifest connection.
+    with ProcessPoolExecutor(workers, mp_context=mp.get_context('spawn')) as pool:
+        consumers = [asyncio.ensure_future(process_tickers(pool)) for _ in range(workers)]
+        await asyncio.gather(*[download_tickers() for _ in range(downloads)])
+        for _ in consumers:
+            await queue.put(None)
+        await asyncio.gather(*consumers)
+
+    if budget is not None:
+        logger.info(f'Memory budget -- {budget.summary()}')
+    return results
+
+
+def run_streaming(
+        tasks:List[luigi.Task],
+        workers:int=int(WORKERS),
+        downloads:int=STREAM_DOWNLOADS,
+        queue_size:int=STREAM_QUEUE_SIZE,
+        budget_mb:int=MEMORY_BUDGET_MB,
+    ) -> List[Dict]:
+
+    '''
+    Purpose:
+        Run the tasks with the streaming executor instead of the Luigi scheduler. The
+        next tickers are downloaded while the earlier ones are preprocessed, so the
+        network latency is hidden behind the CPU-bound stages. The stages and their
+        outputs are the same as with Luigi, and the run manifest is updated the same way.
+
+    Input  :
+        tasks     : List of the final task of each ticker. Same as (collect_tickers.build_tasks).
+        workers   : Int. Number of worker processes.
+        downloads : Int. Number of tickers to download at once.
+        queue_size: Int. Number of downloaded tickers waiting for a worker.
+        budget_mb : Int. Limit of the resident memory of the workers in MB. Unbounded if 0.
+                    See 'memory_budget.MemoryBudget'.
+
+    Return :
+        List of result dictionaries, one per task. Example:
+            {'ticker': 'SPY', 'etf_dir': '...', 'status': 'done', 'download_seconds': 0.4,
+             'stages': 6, 'process_seconds': 2.1, 'pid': 4120, 'rss': 124000000, 'spilled': False}
+    '''
+
+    logger.info('Start running (run_streaming) function.')
+
+    start_time = time.perf_counter()
+    results = asyncio.run(stream_tasks(tasks, workers, downloads, queue_size, budget_mb))
+    counts = {status: sum(result['status'] == status for result in results) for status in ['done', 'skipped', 'failed']}
+
+    logger.info(f'Streamed ({len(tasks)}) tickers in ({time.perf_counter() - start_time:.1f}) seconds -- {counts}')
+    return results
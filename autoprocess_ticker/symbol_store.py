@@ -0,0 +1,197 @@
+
+
+import os, logging, json, shutil, fcntl
+from contextlib import contextmanager
+from typing import Dict, List, Text, Tuple
+
+# Personal modules.
+from config.config import LOG_PROCESSING_FILEPATH, SYMBOL_STORE_DIR, SYMBOL_MEMBERSHIP_FILEPATH
+from config.config_logger import setup_logger
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# ----------------------------------------------------------------------
+# Symbol Membership.
+# ----------------------------------------------------------------------
+
+def group_jobs(jobs:List[Tuple[Text, int, Text]]) -> Dict[Text, Tuple[int, List[Text]]]:
+    '''
+    Purpose:
+        Group the jobs by symbol so that each symbol is processed once no matter
+        how many baskets contain it.
+
+    Input  :
+        jobs: List of (ticker, start_yr, etf_dir). The (etf_dir) is the basket folder.
+
+    Return :
+        Dictionary of symbol and (start_yr, basket folders). The earliest start year
+        across the baskets is kept, so the symbol covers the history of every basket.
+    '''
+
+    grouped = {}
+    for ticker, start_yr, etf_dir in jobs:
+        prev_start_yr, basket_dirs = grouped.get(ticker, (start_yr, []))
+        if etf_dir not in basket_dirs:
+            basket_dirs.append(etf_dir)
+        grouped[ticker] = (min(prev_start_yr, start_yr), basket_dirs)
+    return grouped
+
+
+@contextmanager
+def lock_membership(filepath:Text=SYMBOL_MEMBERSHIP_FILEPATH):
+    '''
+    Purpose:
+        Hold an exclusive lock on the membership file while it is read and written,
+        as the distributed workers update it at the same time.
+
+    Note   :
+        The lock uses 'fcntl.flock', which is not reliable on some network file
+        systems. Keep the symbol store on a local disk or a file system with working locks.
+    '''
+
+    os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+    with open(f'{filepath}.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def update_membership(jobs:List[Tuple[Text, int, Text]], filepath:Text=SYMBOL_MEMBERSHIP_FILEPATH) -> Dict[Text, Dict]:
+    '''
+    Purpose:
+        Merge the baskets of each symbol into the membership file of the symbol store.
+        The file is read and replaced under (lock_membership), so no update is lost.
+
+    Input  :
+        jobs    : List of (ticker, start_yr, etf_dir).
+        filepath: Str. JSON file for the membership.
+
+    Return :
+        Dictionary of the updated membership. Example:
+            dict = {'SPY': {'start_yr': 1999, 'baskets': ['docs/dataset/ETF_sector']}}
+    '''
+
+    with lock_membership(filepath):
+        membership = load_membership(filepath)
+
+        for ticker, (start_yr, basket_dirs) in group_jobs(jobs).items():
+            entry = membership.setdefault(ticker, {'start_yr': start_yr, 'baskets': []})
+            entry['start_yr'] = min(entry['start_yr'], start_yr)
+            entry['baskets'] = sorted(set(entry['baskets']) | set(basket_dirs))
+
+        tmp_filepath = f'{filepath}.tmp-{os.getpid()}'
+        with open(tmp_filepath, 'w') as out_file:
+            json.dump(membership, out_file, indent=2, sort_keys=True)
+        os.replace(tmp_filepath, filepath)
+
+    logger.debug(f'----- Updated the membership of ({len(membership)}) symbols in ({filepath}).')
+    return membership
+
+
+def load_membership(filepath:Text=SYMBOL_MEMBERSHIP_FILEPATH) -> Dict[Text, Dict]:
+    if not os.path.exists(filepath):
+        return {}
+    with open(filepath) as in_file:
+        return json.load(in_file)
+
+
+# ----------------------------------------------------------------------
+# Basket Views.
+# ----------------------------------------------------------------------
+
+def get_symbol_dir(ticker:Text, store_dir:Text=SYMBOL_STORE_DIR) -> Text:
+    return f'{store_dir}/{ticker}'
+
+
+def link_basket_view(ticker:Text, basket_dir:Text, store_dir:Text=SYMBOL_STORE_DIR) -> Text:
+    '''
+    Purpose:
+        Link '{basket_dir}/{ticker}' to the symbol folder so the per-basket paths
+        keep working. Use a relative link so the dataset root can be moved or
+        mounted elsewhere.
+
+    Input  :
+        ticker    : Str. Ticker symbol.
+        basket_dir: Str. Basket folder. Example: 'docs/dataset/ETF_equity/PPA'
+        store_dir : Str. Folder of the symbol store.
+
+    Return :
+        Path of the basket view.
+
+    Note   :
+        A real folder at the view path is from the layout before the symbol store,
+        and is migrated first with (migrate_basket_folder).
+    '''
+
+    view_path = f'{basket_dir}/{ticker}'
+    symbol_dir = get_symbol_dir(ticker, store_dir)
+    os.makedirs(basket_dir, exist_ok=True)
+
+    if os.path.isdir(view_path) and not os.path.islink(view_path):
+        migrate_basket_folder(ticker, basket_dir, store_dir)
+
+    # Create the link under a temporary name and then swap it in, so readers
+    # never see a missing view.
+    tmp_path = f'{view_path}.tmp-{os.getpid()}'
+    os.symlink(os.path.relpath(symbol_dir, basket_dir), tmp_path)
+    os.replace(tmp_path, view_path)
+
+    logger.debug(f'----- Linked ({view_path}) to ({symbol_dir}).')
+    return view_path
+
+
+def migrate_basket_folder(ticker:Text, basket_dir:Text, store_dir:Text=SYMBOL_STORE_DIR):
+    '''
+    Purpose:
+        Move a real '{basket_dir}/{ticker}' folder of the layout before the symbol store
+        out of the way of its view. The first one becomes the symbol folder, so its
+        files are adopted instead of recomputed. The folders of the other baskets hold
+        their own copy of the same symbol, and are renamed with an '.old-layout' suffix,
+        so the basket reads the shared symbol folder from then on.
+
+    Input  :
+        ticker    : Str. Ticker symbol.
+        basket_dir: Str. Basket folder. Example: 'docs/dataset/ETF_equity/PPA'
+        store_dir : Str. Folder of the symbol store.
+
+    Raise  :
+        FileExistsError if the folder was renamed before and the renamed copy still exists.
+    '''
+
+    view_path = f'{basket_dir}/{ticker}'
+    symbol_dir = get_symbol_dir(ticker, store_dir)
+
+    if not os.path.exists(symbol_dir):
+        os.makedirs(store_dir, exist_ok=True)
+        shutil.move(view_path, symbol_dir)
+        logger.info(f'----- Moved the folder ({view_path}) into the symbol store as ({symbol_dir}).')
+        return
+
+    old_path = f'{view_path}.old-layout'
+    if os.path.exists(old_path):
+        raise FileExistsError(f'Both ({view_path}) and ({old_path}) exist. Remove one of them to link ({view_path}) to ({symbol_dir}).')
+    os.rename(view_path, old_path)
+    logger.warning(f'----- Renamed the folder ({view_path}) to ({old_path}). The basket reads ({symbol_dir}) from now on.')
+
+
+def migrate_basket_folders(jobs:List[Tuple[Text, int, Text]], store_dir:Text=SYMBOL_STORE_DIR):
+    '''
+    Purpose:
+        Link the baskets of the jobs that still have a folder of the layout before the
+        symbol store, before the run, so the files of those folders are adopted.
+    '''
+
+    for ticker, (_, basket_dirs) in group_jobs(jobs).items():
+        for basket_dir in basket_dirs:
+            view_path = f'{basket_dir}/{ticker}'
+            if os.path.isdir(view_path) and not os.path.islink(view_path):
+                link_basket_view(ticker, basket_dir, store_dir)
@@ -0,0 +1,307 @@
+
+
+import logging
+from concurrent.futures import Executor
+from types import ModuleType
+from typing import Any, Dict, Optional, Text, Tuple
+import pandas as pd
+
+# Personal modules.
+from config.config import (
+    LOG_PROCESSING_FILEPATH, FREQ_KEYS, FREQ_COLS, START_YR_RANGE, END_YR, HOLIDAYS_KEYS, SPECIAL_DAYS_KEYS,
+    PERIOD_KEYS, HOLIDAYS_DICT, SPEC_WEEKDAY_HOLIDAYS, SPEC_WEEKDAY_HOLIDAYS_BACKWARD, NON_SPEC_HOLIDAYS, NON_SPEC_OBSERVANCES,
+    PREPROCESSING_ENGINE
+)
+from config.config_logger import setup_logger
+from autoprocess_ticker import preprocessing, fast_preprocessing, compile_unique_days, shared_frames, periods
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# ----------------------------------------------------------------------
+# Engines.
+# ----------------------------------------------------------------------
+
+# Modules of the preprocessing functions. They have the same functions and outputs.
+ENGINES = {
+    'legacy': preprocessing,
+    'fast': fast_preprocessing,
+}
+
+
+def get_engine(engine:Text) -> ModuleType:
+    # The preprocessing module of an engine name. Example: 'fast' returns 'fast_preprocessing'.
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown preprocessing engine ({engine}). Use one of {list(ENGINES)}.')
+    return ENGINES[engine]
+
+
+# ----------------------------------------------------------------------
+# Ticker Stages.
+# ----------------------------------------------------------------------
+
+# The stages of a single ticker, shared by the Luigi tasks and the process pool workers.
+# Every call fills new dictionaries with the same keys as the (PIVOT_*) and (HOLIDAYS_DICT)
+# dictionaries of the config, so the tickers run in the same process don't share the
+# results or the start year. The input frames are not modified. The summaries are
+# returned flat, the layout of the storage files. See 'preprocessing.flatten_summary'.
+# The (engine) of every stage defaults to (PREPROCESSING_ENGINE). See (ENGINES).
+
+def trace_unique_period(df_ticker:Dict[Text, pd.DataFrame], start_yr:int,
+                        engine:Text=PREPROCESSING_ENGINE) -> Dict[Text, pd.DataFrame]:
+    '''
+    Purpose:
+        Trace the holidays, observances, and special days of a ticker.
+
+    Input  :
+        df_ticker: Dictionary. Preprocessed ticker data of (ProcessTickerData).
+        start_yr : Int. Starting year of the ticker.
+        engine   : Str. Preprocessing engine. Example: 'legacy' or 'fast'
+
+    Return :
+        New dictionary with the traced 'weekly' and 'daily_by_trdr_day' frames. The
+        other frames are the same as in (df_ticker).
+    '''
+
+    # The tracing only adds columns, so shallow copies keep the input frames unchanged
+    # without copying their values.
+    df_ticker = dict(df_ticker)
+    df_ticker_weekly = df_ticker['weekly'].copy(deep=False)
+    df_ticker_trdrDay = df_ticker['daily_by_trdr_day'].copy(deep=False)
+    holidays_dict = {holiday: [] for holiday in HOLIDAYS_DICT}
+    prep = get_engine(engine)
+
+    # Get the holidays, observances, and specialDay dates.
+    df_holidays = compile_unique_days.compile_trdr_holiday_dates(start_yr, END_YR, HOLIDAYS_KEYS)
+    df_tww = compile_unique_days.get_tww_dates(start_yr, END_YR)
+    tup_super_day = compile_unique_days.get_super_day_period(df_ticker_trdrDay)
+    tup_santa_rally = compile_unique_days.get_santa_rally_period(df_ticker_trdrDay, start_yr, END_YR)
+
+    # Trace the TWW & special days for 'daily_trdrDay' data.
+    prep.trace_special_days(df_ticker_trdrDay, tup_super_day, tup_santa_rally)
+    prep.trace_tww_trdr_days(df_ticker_trdrDay, df_tww)
+
+    # Trace the TWW period for 'weekly' data.
+    prep.trace_tww_trdr_days(df_ticker_weekly, df_tww)
+
+    # Trace the holidays and observances.
+    prep.trace_new_year(df_ticker_trdrDay, holidays_dict)
+
+    for holiday in SPEC_WEEKDAY_HOLIDAYS:
+        prep.trace_spec_weekday_holiday(df_ticker_trdrDay, df_holidays, holidays_dict, holiday)
+    for holiday in SPEC_WEEKDAY_HOLIDAYS_BACKWARD:
+        prep.trace_spec_weekday_holiday(df_ticker_trdrDay, df_holidays, holidays_dict, holiday,
+                                        day_forward=-1, idx_backtrace=2)
+    for holiday in NON_SPEC_HOLIDAYS:
+        prep.trace_non_spec_holiday(df_ticker_trdrDay, df_holidays, holidays_dict, holiday)
+    for observance in NON_SPEC_OBSERVANCES:
+        prep.trace_non_spec_observance(df_ticker_trdrDay, df_holidays, holidays_dict, observance)
+
+    df_ticker['weekly'] = df_ticker_weekly
+    df_ticker['daily_by_trdr_day'] = df_ticker_trdrDay
+    return df_ticker
+
+
+def pivot_ticker_summary(df_ticker:Dict[Text, pd.DataFrame], start_yr:int, engine:Text=PREPROCESSING_ENGINE) -> Tuple[Dict, Dict]:
+    '''
+    Purpose:
+        Create the price change pivot tables and their stats of a ticker.
+
+    Input  :
+        df_ticker: Dictionary. Preprocessed ticker data of (ProcessTickerData).
+        start_yr : Int. Starting year of the ticker.
+        engine   : Str. Preprocessing engine. Example: 'legacy' or 'fast'
+
+    Return :
+        Tuple of the pivot tables and their stats. Same as (PIVOT_TICKER, PIVOT_STATS).
+    '''
+
+    pivot_ticker, pivot_stats = dict.fromkeys(FREQ_KEYS), dict.fromkeys(FREQ_KEYS)
+    prep = get_engine(engine)
+    start_yr_range = [start_yr] + START_YR_RANGE[1:]
+
+    # Create pivot tables.
+    prep.create_pivot(df_ticker, pivot_ticker, FREQ_KEYS, FREQ_COLS, pivot_value='price_diff')
+
+    # Create statistical summary from pivot tables.
+    prep.summarise_pivot(pivot_ticker, pivot_stats, FREQ_KEYS, start_yr_range, END_YR)
+    return prep.flatten_summary(pivot_ticker, pivot_stats)
+
+
+def pivot_vol_summary(df_ticker:Dict[Text, pd.DataFrame], start_yr:int, engine:Text=PREPROCESSING_ENGINE) -> Tuple[Dict, Dict]:
+    '''
+    Purpose:
+        Create the volume pivot tables and their stats of a ticker. Same as
+        (pivot_ticker_summary) for the inputs.
+
+    Return :
+        Tuple of the pivot tables and their stats. Same as (PIVOT_VOLUME, PIVOT_VOLUME_STATS).
+    '''
+
+    pivot_volume, pivot_volume_stats = dict.fromkeys(FREQ_KEYS), dict.fromkeys(FREQ_KEYS)
+    prep = get_engine(engine)
+
+    # Create pivot tables.
+    prep.create_pivot(df_ticker, pivot_volume, FREQ_KEYS, FREQ_COLS, pivot_value='volume')
+
+    # Create statistical summary from pivot tables.
+    prep.compute_avg_vol(pivot_volume, pivot_volume_stats, FREQ_KEYS, [start_yr], END_YR)
+    prep.summarise_pivot_vol(pivot_volume, pivot_volume_stats, FREQ_KEYS, [start_yr], END_YR)
+    return prep.flatten_summary(pivot_volume, pivot_volume_stats)
+
+
+# Keys of the unique day pivot tables of each source and the frame they are pivoted from.
+UNIQUE_DAYS_PIVOTS = {
+    'holiday': ('daily_by_trdr_day', HOLIDAYS_KEYS),
+    'special_days': ('daily_by_trdr_day', SPECIAL_DAYS_KEYS),
+    'special_days_weekly': ('weekly', SPECIAL_DAYS_KEYS[5:]),
+}
+
+
+def create_unique_days_pivots(df_ticker:Dict[Text, pd.DataFrame], start_yr:int,
+                              raw_pivots:Optional[Dict[Text, Dict[Text, pd.DataFrame]]]=None,
+                              engine:Text=PREPROCESSING_ENGINE) -> Tuple[Dict, Dict, Dict]:
+    '''
+    Purpose:
+        Create the pivot tables of the holidays and special days of a ticker.
+
+    Input  :
+        df_ticker : Dictionary. Traced ticker data of (TraceUniquePeriod).
+        start_yr  : Int. Starting year of the ticker.
+        raw_pivots: Dictionary of the source of (UNIQUE_DAYS_PIVOTS) and the pivot tables
+                    of every year of its keys. Used instead of pivoting (df_ticker).
+        engine    : Str. Preprocessing engine. Example: 'legacy' or 'fast'
+
+    Return :
+        Tuple of the pivot tables of the holidays, the special days and the weekly
+        special days, indexed by their periods.
+    '''
+
+    # The frames are only read by (create_pivot_unique_days), so they are not copied.
+    df_ticker_weekly = df_ticker['weekly']
+    df_ticker_trdrDay = df_ticker['daily_by_trdr_day']
+    raw_pivots = raw_pivots or {}
+    prep = get_engine(engine)
+
+    pivot_holidays, pivot_special_days, pivot_special_days_weekly = {}, {}, {}
+
+    # Create pivot tables.
+    prep.create_pivot_unique_days(df_ticker_trdrDay, pivot_holidays, HOLIDAYS_KEYS, start_yr, END_YR, drop_idx=True,
+                                  raw_pivots=raw_pivots.get('holiday'))
+    prep.create_pivot_unique_days(df_ticker_trdrDay, pivot_special_days, SPECIAL_DAYS_KEYS, start_yr, END_YR,
+                                  raw_pivots=raw_pivots.get('special_days'))
+    prep.create_pivot_unique_days(df_ticker_weekly, pivot_special_days_weekly, SPECIAL_DAYS_KEYS[5:], start_yr, END_YR,
+                                  raw_pivots=raw_pivots.get('special_days_weekly'))
+
+    # Concat the TWW data and the data of the week after the TWW.
+    prep.concat_pivot_tww(pivot_special_days, SPECIAL_DAYS_KEYS[5:9])
+    prep.concat_pivot_tww(pivot_special_days_weekly, SPECIAL_DAYS_KEYS[5:9])
+
+    # Concat all the relevant datasets into 1 dataset.
+    prep.concat_pivot_unique_days(pivot_holidays, HOLIDAYS_KEYS, 'holiday')
+    prep.concat_pivot_unique_days(pivot_special_days, SPECIAL_DAYS_KEYS[5:9], 'tww')
+    prep.concat_pivot_unique_days(pivot_special_days_weekly, SPECIAL_DAYS_KEYS[5:9], 'tww')
+    return pivot_holidays, pivot_special_days, pivot_special_days_weekly
+
+
+# Keys of the unique day pivot tables of each source that are summarised.
+UNIQUE_DAYS_STATS_KEYS = {
+    'holiday': ['compiled_holiday'],
+    'special_days': SPECIAL_DAYS_KEYS[:5] + ['compiled_tww'],
+    'special_days_weekly': ['compiled_tww'],
+}
+
+
+def pivot_unique_days_summary(df_ticker:Dict[Text, pd.DataFrame], start_yr:int,
+                              engine:Text=PREPROCESSING_ENGINE) -> Tuple[Tuple, Tuple, Tuple]:
+    '''
+    Purpose:
+        Create the pivot tables and their stats of the holidays and special days of a
+        ticker.
+
+    Input  :
+        df_ticker: Dictionary. Traced ticker data of (TraceUniquePeriod).
+        start_yr : Int. Starting year of the ticker.
+        engine   : Str. Preprocessing engine. Example: 'legacy' or 'fast'
+
+    Return :
+        Tuple of the (pivot, stats) pairs of the holidays, the special days and the
+        weekly special days.
+    '''
+
+    pivot_holidays, pivot_special_days, pivot_special_days_weekly = create_unique_days_pivots(df_ticker, start_yr, engine=engine)
+    prep = get_engine(engine)
+    pivot_holidays_stats, pivot_special_days_stats, pivot_special_days_weekly_stats = {}, {}, {}
+    start_yr_range = [start_yr] + START_YR_RANGE[1:]
+
+    # Create statistical summary from pivot tables.
+    prep.summarise_pivot(pivot_holidays, pivot_holidays_stats, ['compiled_holiday'], start_yr_range, END_YR)
+    prep.summarise_pivot(pivot_special_days, pivot_special_days_stats, SPECIAL_DAYS_KEYS[:5], start_yr_range, END_YR)
+    prep.summarise_pivot(pivot_special_days, pivot_special_days_stats, ['compiled_tww'], start_yr_range, END_YR)
+    prep.summarise_pivot(pivot_special_days_weekly, pivot_special_days_weekly_stats, ['compiled_tww'], start_yr_range, END_YR)
+
+    return (
+        prep.flatten_summary(pivot_holidays, pivot_holidays_stats),
+        prep.flatten_summary(pivot_special_days, pivot_special_days_stats),
+        prep.flatten_summary(pivot_special_days_weekly, pivot_special_days_weekly_stats),
+    )
+
+
+def pivot_period_summary(df_ticker:Dict[Text, pd.DataFrame], start_yr:int) -> Tuple[Dict, Dict]:
+    '''
+    Purpose:
+        Create the price change pivot tables and their stats of the custom periods
+        of a ticker, all from its daily data. Same as (pivot_ticker_summary) for
+        the inputs.
+
+    Return :
+        Tuple of the pivot tables and their stats of every key of (PERIOD_KEYS).
+    '''
+
+    start_yr_range = [start_yr] + START_YR_RANGE[1:]
+    pivot_periods, pivot_periods_stats = periods.pivot_period_summary(df_ticker['daily_by_trdr_day'], PERIOD_KEYS,
+                                                                      start_yr_range, END_YR)
+    return preprocessing.flatten_summary(pivot_periods, pivot_periods_stats)
+
+
+# ----------------------------------------------------------------------
+# Process Pool.
+# ----------------------------------------------------------------------
+
+# Summary stages of a ticker and their storage file.
+SUMMARY_STAGES = {
+    'pivot_stats': pivot_ticker_summary,
+    'pivot_vol_stats': pivot_vol_summary,
+    'pivot_unique_days': pivot_unique_days_summary,
+}
+
+
+def summarise_shared(pool:Executor, df_ticker:Dict[Text, pd.DataFrame], start_yr:int) -> Dict[Text, Any]:
+    '''
+    Purpose:
+        Run the summary stages of a ticker in parallel on a process pool. The frames
+        are placed in shared memory once, and every worker maps them instead of
+        receiving a pickled copy.
+
+    Input  :
+        pool     : Process pool. Example: 'concurrent.futures.ProcessPoolExecutor'
+        df_ticker: Dictionary. Traced ticker data of (trace_unique_period).
+        start_yr : Int. Starting year of the ticker.
+
+    Return :
+        Dictionary of the storage file name and the result of its stage.
+        Example: {'pivot_stats': (pivot_ticker, pivot_stats), ...}
+    '''
+
+    with shared_frames.shared_frames(df_ticker) as handle:
+        futures = {
+            name: pool.submit(shared_frames.run_attached, stage, handle, start_yr)
+            for name, stage in SUMMARY_STAGES.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
@@ -0,0 +1,350 @@
+
+
+import logging
+from typing import Dict, List, NamedTuple, Optional, Text, Tuple
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Personal modules.
+from config.config import LOG_PROCESSING_FILEPATH, FREQ_KEYS, SPECIAL_DAYS_KEYS, QUANTILE_LEVELS, QUANTILE_COLS
+from config.config_logger import setup_logger
+from autoprocess_ticker import preprocessing, query_api
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# ----------------------------------------------------------------------
+# Walk-Forward Layout.
+# ----------------------------------------------------------------------
+
+# Same columns as 'preprocessing.summarise_pivot', plus the number of years with a value.
+PERCENTILE_METRICS = [f'{col}_diff' for col in QUANTILE_COLS]
+METRICS = [
+    'avg_diff', 'med_diff', *PERCENTILE_METRICS, 'tot_diff', 'max_diff', 'min_diff', 'std_diff', 'up_overall',
+    'pos_avg_diff', 'up_counts', 'neg_avg_diff', 'down_counts', 'up_prob', 'down_prob', 'n_years'
+]
+COUNT_METRICS = ['up_overall', 'up_counts', 'down_counts', 'n_years']
+
+# Pivot tables of each source that have stats. Same keys as 'ticker_stages' summarises.
+WALK_FORWARD_KEYS = {
+    'price': FREQ_KEYS,
+    'holiday': ['compiled_holiday'],
+    'special_days': SPECIAL_DAYS_KEYS[:5] + ['compiled_tww'],
+    'special_days_weekly': ['compiled_tww'],
+}
+
+
+def split_pivot(pivot:pd.DataFrame) -> Tuple[pd.DataFrame, np.ndarray, np.ndarray]:
+    '''
+    Purpose:
+        Split a pivot table into its period columns and an array of period x year.
+        The year columns are the non-text columns. A year missing between the first
+        and the last year becomes a column of NaN, so the years are consecutive.
+
+    Return :
+        Tuple of the period columns, the years, and the array of values.
+    '''
+
+    is_year = np.array([not isinstance(col, str) for col in pivot.columns])
+
+    col_years = np.asarray(pivot.columns[is_year], dtype=np.float64).astype(np.int64)
+    years = np.arange(col_years.min(), col_years.max() + 1)
+    values = np.full((len(pivot), len(years)), np.nan)
+    values[:, col_years - years[0]] = pivot.iloc[:, is_year].to_numpy(dtype=np.float64)
+    return pivot.iloc[:, ~is_year].copy(), years, values
+
+
+
+class AlignedPivots(NamedTuple):
+    '''
+    Pivot tables of many tickers for the same key as one array of ticker x period x
+    year. A period or year that a ticker doesn't have is NaN.
+    '''
+
+    tickers: List[Text]
+    periods: pd.MultiIndex
+    years: np.ndarray
+    values: np.ndarray
+    frames: List[pd.DataFrame]      # Period columns of each ticker.
+    rows: List[np.ndarray]          # Position in (periods) of each row of each ticker.
+    spans: List[Tuple[int, int]]    # Positions in (years) of the first and the last year of each ticker, plus one.
+
+
+def align_pivots(pivots:Dict[Text, pd.DataFrame]) -> AlignedPivots:
+    '''
+    Purpose:
+        Align the pivot tables of many tickers on the same periods and years. The
+        periods are in the order the tickers first list them.
+
+    Input  :
+        pivots: Dictionary of ticker and its pivot table for the same key.
+
+    Return :
+        AlignedPivots.
+    '''
+
+    splits = [split_pivot(pivot) for pivot in pivots.values()]
+    periods = pd.MultiIndex.from_tuples(list(dict.fromkeys(
+        period for df_periods, _, _ in splits for period in df_periods.itertuples(index=False, name=None)
+    )), names=list(splits[0][0].columns))
+    years = np.arange(min(split[1][0] for split in splits), max(split[1][-1] for split in splits) + 1)
+
+    values = np.full((len(pivots), len(periods), len(years)), np.nan)
+    rows, spans = [], []
+    for n, (df_periods, ticker_years, ticker_values) in enumerate(splits):
+        rows.append(periods.get_indexer(list(df_periods.itertuples(index=False, name=None))))
+        spans.append((ticker_years[0] - years[0], ticker_years[-1] - years[0] + 1))
+        values[n][rows[-1], spans[-1][0]:spans[-1][1]] = ticker_values
+
+    return AlignedPivots(list(pivots), periods, years, values, [split[0] for split in splits], rows, spans)
+
+
+class WalkForwardCube:
+    '''
+    Trailing stats of a pivot table as a 3-D array of end year x period x metric.
+    The stats of end year Y only use the years before Y, from Y - window to Y - 1,
+    or every year before Y if (window) is None.
+    '''
+
+    def __init__(self, periods:pd.DataFrame, end_years:np.ndarray, window:Optional[int], values:np.ndarray):
+        self.periods = periods
+        self.end_years = end_years
+        self.window = window
+        self.values = values
+
+    def stats(self, end_yr:int) -> pd.DataFrame:
+        '''
+        Purpose:
+            Stats table of one end year, laid out like the output of
+            'preprocessing.summarise_pivot' with the period columns at the end.
+        '''
+
+        idx = int(np.searchsorted(self.end_years, end_yr))
+        if idx == len(self.end_years) or self.end_years[idx] != end_yr:
+            raise KeyError(f'No stats for the end year ({end_yr}). Use one of ({self.end_years[0]}) to ({self.end_years[-1]}).')
+
+        df = pd.DataFrame(self.values[idx], index=self.periods.index, columns=METRICS)
+        df[COUNT_METRICS] = df[COUNT_METRICS].astype(np.int64)
+        for col in self.periods.columns:
+            df[col] = self.periods[col]
+        return df
+
+    def to_frame(self) -> pd.DataFrame:
+        # Long table with one row per end year and period. Example index: (2010, 12) for 'monthly'.
+        frames = {end_yr: self.stats(end_yr).set_index(list(self.periods.columns)) for end_yr in self.end_years}
+        return pd.concat(frames, names=['end_yr'])
+
+
+# ----------------------------------------------------------------------
+# Trailing Stats.
+# ----------------------------------------------------------------------
+
+def trailing_stats(values:np.ndarray, window:Optional[int]=None, metrics:List[Text]=METRICS) -> Dict[Text, np.ndarray]:
+    '''
+    Purpose:
+        Compute the trailing stats along the last axis (the years) for every end
+        position in one pass. The sums and counts come from cumulative sums along the
+        years, so each end year costs a subtraction instead of a new summary. The
+        median, percentiles, max and min can't be updated that way, and are read from
+        a rolling view of the years sorted once. They are skipped unless (metrics) asks
+        for them.
+
+    Input  :
+        values : Array of ... x year, with consecutive years.
+        window : Int. Number of trailing years. Every earlier year if not given.
+        metrics: List of the metrics to return. Example: ['up_prob', 'n_years']
+
+    Return :
+        Dictionary of metric and array of ... x end year. End position (i) uses the
+        years before position (i + 1).
+    '''
+
+    n_years = values.shape[-1]
+    size = n_years if window is None else min(window, n_years)
+
+    # End position (i - 1) uses the years at positions (start[i - 1]) to (i - 1).
+    end = np.arange(1, n_years + 1)
+    start = np.maximum(end - size, 0)
+
+    def trailing_sum(arr:np.ndarray) -> np.ndarray:
+        csum = np.zeros((*arr.shape[:-1], n_years + 1))
+        np.cumsum(arr, axis=-1, out=csum[..., 1:])
+        return csum[..., end] - csum[..., start]
+
+    has_value = ~np.isnan(values)
+    filled = np.where(has_value, values, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Center each period on its mean before summing the squares, so the variance
+        # doesn't lose its digits to the difference of two large sums.
+        period_mean = filled.sum(axis=-1, keepdims=True) / np.maximum(has_value.sum(axis=-1, keepdims=True), 1)
+        centered = np.where(has_value, values - period_mean, 0.0)
+
+        stats = {}
+        counts = trailing_sum(has_value)
+        stats['tot_diff'] = trailing_sum(filled)
+        stats['avg_diff'] = np.where(counts > 0, stats['tot_diff'] / counts, np.nan)
+
+        centered_sum, centered_sqr = trailing_sum(centered), trailing_sum(centered ** 2)
+        variance = np.maximum(centered_sqr - centered_sum ** 2 / counts, 0.0) / (counts - 1)
+        stats['std_diff'] = np.where(counts > 1, np.sqrt(variance), np.nan)
+        stats['up_overall'] = (stats['avg_diff'] > 0).astype(np.float64)
+
+        up_counts, down_counts = trailing_sum(values > 0), trailing_sum(values < 0)
+        stats['pos_avg_diff'] = np.where(up_counts > 0, trailing_sum(np.where(values > 0, values, 0.0)) / up_counts, np.nan)
+        stats['neg_avg_diff'] = np.where(down_counts > 0, trailing_sum(np.where(values < 0, values, 0.0)) / down_counts, np.nan)
+        stats['up_counts'], stats['down_counts'], stats['n_years'] = up_counts, down_counts, counts
+
+        prob = np.round(up_counts / (up_counts + down_counts), 4)
+        stats['up_prob'] = prob
+        stats['down_prob'] = 1 - prob
+
+    if {'max_diff', 'min_diff', 'med_diff', *PERCENTILE_METRICS} & set(metrics):
+        # Rolling view of ... x end year x window. The first windows start with NaN padding.
+        padded = np.concatenate([np.full((*values.shape[:-1], size - 1), np.nan), values], axis=-1)
+        # Sort each window once. The NaN sort last, so the first (n_years) values of a
+        # window are its values in order, and every order stat is an index into them.
+        windows = np.sort(sliding_window_view(padded, size, axis=-1), axis=-1)
+        n_values = counts.astype(np.int64)
+        last = np.maximum(n_values - 1, 0)
+
+        def window_quantile(level:float) -> np.ndarray:
+            # Linear interpolation between the closest ranks, as 'np.nanquantile' does.
+            positions = level * last
+            lower = np.floor(positions).astype(np.int64)
+            upper = np.minimum(lower + 1, last)
+            lower_values = np.take_along_axis(windows, lower[..., None], axis=-1)[..., 0]
+            upper_values = np.take_along_axis(windows, upper[..., None], axis=-1)[..., 0]
+            return np.where(n_values > 0, lower_values + (upper_values - lower_values) * (positions - lower), np.nan)
+
+        stats['max_diff'] = np.take_along_axis(windows, last[..., None], axis=-1)[..., 0]
+        stats['min_diff'] = windows[..., 0]
+        stats['med_diff'] = window_quantile(0.5)
+        for metric, level in zip(PERCENTILE_METRICS, QUANTILE_LEVELS):
+            if metric in metrics:
+                stats[metric] = window_quantile(level)
+
+    return {metric: stats[metric] for metric in metrics}
+
+
+def walk_forward(pivot:pd.DataFrame, window:Optional[int]=None) -> WalkForwardCube:
+    '''
+    Purpose:
+        Compute the trailing stats of a pivot table for every end year in one pass
+        with (trailing_stats).
+
+    Input  :
+        pivot : Dataframe. Pivot table of 'preprocessing.create_pivot' or
+                'preprocessing.create_pivot_unique_days'.
+        window: Int. Number of trailing years. Every earlier year if not given.
+
+    Return :
+        WalkForwardCube. The end years run from the year after the first year to
+        the year after the last year.
+    '''
+
+    periods, years, values = split_pivot(pivot)
+    stats = trailing_stats(values, window)
+
+    cube = np.stack([stats[metric].T for metric in METRICS], axis=-1)
+    logger.debug(f'----- Created a walk-forward cube of shape ({cube.shape}) with a window of ({window}) years.')
+    return WalkForwardCube(periods, years + 1, window, cube)
+
+
+def walk_forward_pivots(pivot_dict:Dict[Text, pd.DataFrame], keys:List[Text],
+                        window:Optional[int]=None) -> Dict[Text, WalkForwardCube]:
+    '''
+    Purpose:
+        Same as (walk_forward) for the pivot tables of (keys) in (pivot_dict).
+        Example: walk_forward_pivots(pivot_ticker, FREQ_KEYS, window=10)
+    '''
+
+    return {key: walk_forward(pivot_dict[key], window) for key in keys}
+
+
+def walk_forward_ticker(ticker:Text, window:Optional[int]=None,
+                        etf_dir:Optional[Text]=None) -> Dict[Text, Dict[Text, WalkForwardCube]]:
+    '''
+    Purpose:
+        Compute the walk-forward cubes of every frequency, the holidays and the
+        special days of a ticker from its stored pivot tables. The pipeline is not
+        run again.
+
+    Input  :
+        ticker : Str. Ticker symbol.
+        window : Int. Number of trailing years. Every earlier year if not given.
+        etf_dir: Str. Folder that holds the ticker folder. The symbol store if not given.
+
+    Return :
+        Dictionary of source and its dictionary of pivot key and cube. Example:
+            cubes['price']['monthly'].stats(2015)
+    '''
+
+    logger.info('Start running (walk_forward_ticker) function.')
+
+    return {
+        source: {key: walk_forward(query_api.load_pivot(ticker, key, source, etf_dir), window) for key in keys}
+        for source, keys in WALK_FORWARD_KEYS.items()
+    }
+
+
+# ----------------------------------------------------------------------
+# Verification.
+# ----------------------------------------------------------------------
+
+def verify_cube(pivot:pd.DataFrame, key:Text, cube:WalkForwardCube, rtol:float=1e-9, atol:float=1e-12) -> int:
+    '''
+    Purpose:
+        Check every end year of a cube against 'preprocessing.summarise_pivot' run on
+        the same pivot table cut down to the trailing years. The cumulative sums don't
+        add the years in the same order, so the values are compared within (rtol) and
+        (atol) instead of bit for bit.
+
+    Return :
+        Number of end years checked. Raises AssertionError otherwise.
+    '''
+
+    year_cols = [col for col in pivot.columns if not isinstance(col, str)]
+    period_cols = [col for col in pivot.columns if isinstance(col, str)]
+    n_checked = 0
+
+    for end_yr in cube.end_years:
+        start_yr = -np.inf if cube.window is None else end_yr - cube.window
+        window_cols = [col for col in year_cols if start_yr <= col < end_yr]
+        if not window_cols:
+            continue
+
+        pivot_dict, pivot_dict_stats = {key: pivot[period_cols + window_cols]}, {}
+        preprocessing.summarise_pivot(pivot_dict, pivot_dict_stats, [key], [window_cols[0]], window_cols[-1])
+        metrics = [metric for metric in METRICS if metric != 'n_years']
+        pd.testing.assert_frame_equal(cube.stats(end_yr)[metrics], pivot_dict_stats[key][metrics],
+                                      check_exact=False, rtol=rtol, atol=atol)
+        n_checked += 1
+    return n_checked
+
+
+def verify_walk_forward(ticker:Text, window:Optional[int]=None, etf_dir:Optional[Text]=None) -> bool:
+    '''
+    Purpose:
+        Check the walk-forward cubes of a ticker with (verify_cube). Same inputs as
+        (walk_forward_ticker).
+
+    Return :
+        True if every end year matches. Raises AssertionError otherwise.
+    '''
+
+    logger.info('Start running (verify_walk_forward) function.')
+
+    n_checked = 0
+    for source, cubes in walk_forward_ticker(ticker, window, etf_dir).items():
+        for key, cube in cubes.items():
+            n_checked += verify_cube(query_api.load_pivot(ticker, key, source, etf_dir), key, cube)
+
+    logger.debug(f'----- Verified ({n_checked}) walk-forward stats tables of ({ticker}).')
+    return True
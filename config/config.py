@@ -10,6 +10,46 @@ import os, logging
 LOCAL_SCHEDULER = '--local-scheduler' 
 WORKERS = '6'
 
+# Scheduler mode. Set to 'central' to let several worker processes or hosts 
+# share the same 'luigid' scheduler (start it with: luigid --port 8082). 
+SCHEDULER_MODE = os.environ.get('LUIGI_SCHEDULER_MODE', 'local')
+SCHEDULER_HOST = os.environ.get('LUIGI_SCHEDULER_HOST', 'localhost')
+SCHEDULER_PORT = os.environ.get('LUIGI_SCHEDULER_PORT', '8082')
+
+# Shard the ticker list across hosts when running with the local scheduler. 
+# Format: 'index/count'. Example: '0/3' runs the first of three shards. 
+SHARD = os.environ.get('PIPELINE_SHARD', '0/1')
+
+# Streaming executor. Download up to 'STREAM_DOWNLOADS' tickers at once and hold up to 
+# 'STREAM_QUEUE_SIZE' downloaded tickers until a worker process is free to preprocess them. 
+STREAM_DOWNLOADS = int(os.environ.get('STREAM_DOWNLOADS', '4'))
+STREAM_QUEUE_SIZE = int(os.environ.get('STREAM_QUEUE_SIZE', '8'))
+
+# Memory budget of the streaming executor. Set 'MEMORY_BUDGET_MB' to bound the resident memory of the worker 
+# processes (0 turns it off). A ticker is admitted once its footprint, estimated from the rows of its daily bars, 
+# fits in the budget, and at most 'MEMORY_MAX_LARGE' tickers above 'MEMORY_LARGE_MB' run at once. Past 
+# 'MEMORY_SPILL_RATIO' of the budget, the pivot tables are read from the storage files as they are written. 
+MEMORY_BUDGET_MB = int(os.environ.get('MEMORY_BUDGET_MB', '0'))
+MEMORY_LARGE_MB = int(os.environ.get('MEMORY_LARGE_MB', '128'))
+MEMORY_MAX_LARGE = int(os.environ.get('MEMORY_MAX_LARGE', '1'))
+MEMORY_SPILL_RATIO = float(os.environ.get('MEMORY_SPILL_RATIO', '0.8'))
+# Footprint model of a worker process, fitted on the peak resident memory of the synthetic tickers. 
+MEMORY_BASE_MB = 110
+MEMORY_BYTES_PER_ROW = 2500
+
+# Export scheduler. Once the pivot stages of every ticker are done, write the workbooks in 'EXPORT_WORKERS' 
+# processes, the costliest ticker first (0 writes them with the Luigi workers instead). 
+EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', '0'))
+
+# Preprocessing engine of the ticker stages. 'legacy' for 'preprocessing', 'fast' for 'fast_preprocessing'. 
+# The outputs of both engines must agree within 'ENGINE_RTOL' and 'ENGINE_ATOL'. See 'equivalence'. 
+PREPROCESSING_ENGINE = os.environ.get('PREPROCESSING_ENGINE', 'legacy')
+ENGINE_RTOL = 1e-9
+ENGINE_ATOL = 1e-12
+
+# Folder of the shared arrays that the worker processes map instead of unpickling the frames. 
+SHARED_FRAMES_DIR = os.environ.get('SHARED_FRAMES_DIR', '/dev/shm')
+
 
 # ----------------------------------------------------------------------
 # Date & Year Range.
@@ -39,6 +79,10 @@ TICKER = 'SPY'
 TICKER_FREQ = ['1mo', '1wk', '1d']
 YAHOO_VERSION = 'v7'
 
+# Host for downloading the ticker data. Point it to a local stand-in server 
+# for benchmarking without hitting the network. 
+YAHOO_DOWNLOAD_HOST = os.environ.get('YAHOO_DOWNLOAD_HOST', 'https://query1.finance.yahoo.com')
+
 
 # --------------------------------------------------------------
 # Tickers Dictionary. 
@@ -79,9 +123,130 @@ LOG_PROCESSING_FILEPATH = 'logs/runtime/log_processing.log'
 LOG_PIPELINE_SECTOR_DIR = f'logs/pipeline/ETF_sector'
 LOG_PIPELINE_EQUITY_DIR = f'logs/pipeline/ETF_equity'
 
-# Directory for storing the ETF data. 
-ETF_SECTOR_DIR = f'docs/dataset/ETF_sector'
-ETF_EQUITY_DIR = f'docs/dataset/ETF_equity' 
+# Directory for storing the ETF data. Every worker process or host must 
+# point 'DATASET_ROOT' to the same shared location when running distributed. 
+DATASET_ROOT = os.environ.get('DATASET_ROOT', 'docs/dataset')
+ETF_SECTOR_DIR = f'{DATASET_ROOT}/ETF_sector'
+ETF_EQUITY_DIR = f'{DATASET_ROOT}/ETF_equity' 
+
+# Canonical store with one folder per symbol. Each symbol is downloaded and processed 
+# once, and the ETF folders link to it. The membership file keeps the ETFs of each symbol. 
+USE_SYMBOL_STORE = True
+SYMBOL_STORE_DIR = f'{DATASET_ROOT}/symbols'
+SYMBOL_MEMBERSHIP_FILEPATH = f'{SYMBOL_STORE_DIR}/membership.json'
+
+# Keep the raw ticker CSVs in one append-only packed archive instead of a file per 
+# ticker and frequency. Set 'RAW_STORAGE' to 'files' to write the CSVs into the ticker folders. 
+RAW_STORAGE = os.environ.get('RAW_STORAGE', 'archive')
+RAW_ARCHIVE_DIR = os.environ.get('RAW_ARCHIVE_DIR', f'{DATASET_ROOT}/raw_archive')
+
+# Run manifest for tracking the status of each ticker and stage. Luigi checks the 
+# manifest instead of stat-ing every target file when 'USE_RUN_MANIFEST' is enabled. 
+USE_RUN_MANIFEST = True
+RUN_MANIFEST_PATH = os.environ.get('RUN_MANIFEST_PATH', f'{DATASET_ROOT}/run_manifest.sqlite')
+
+# Live progress of a run, read from the run manifest every 'PROGRESS_INTERVAL' seconds. It is printed on the 
+# terminal and written to 'PROGRESS_STATUS_PATH' for polling. The throughput is over the last 'PROGRESS_WINDOW' seconds. 
+USE_PROGRESS = True
+PROGRESS_STATUS_PATH = os.environ.get('PROGRESS_STATUS_PATH', f'{DATASET_ROOT}/run_status.json')
+PROGRESS_INTERVAL = float(os.environ.get('PROGRESS_INTERVAL', '5'))
+PROGRESS_WINDOW = float(os.environ.get('PROGRESS_WINDOW', '300'))
+
+# Keep the outputs of each stage under the fingerprint of its inputs and config, 
+# so a stage with unchanged inputs is skipped or restored instead of recomputed. 
+USE_STAGE_CACHE = True
+STAGE_CACHE_DIR = os.environ.get('STAGE_CACHE_DIR', f'{DATASET_ROOT}/.stage_cache')
+# The sources of the modules of each stage are part of its fingerprint. Bump the version to 
+# recompute every stage after a change the sources don't show, such as a library upgrade. 
+STAGE_CODE_VERSION = os.environ.get('STAGE_CODE_VERSION', '1')
+
+# Indexed store of the stats of every ticker for the screener. Refreshed after each run 
+# when 'USE_STATS_STORE' is enabled. 
+USE_STATS_STORE = True
+STATS_STORE_PATH = os.environ.get('STATS_STORE_PATH', f'{DATASET_ROOT}/stats_store.sqlite')
+
+# Local read-only service of the pivots and stats for the dashboard. The cache keeps 
+# the loaded storage files within the memory budget. 
+STATS_SERVICE_PORT = int(os.environ.get('STATS_SERVICE_PORT', '8090'))
+STATS_SERVICE_CACHE_BYTES = int(os.environ.get('STATS_SERVICE_CACHE_BYTES', str(512 * 1024 ** 2)))
+QUERY_CACHE_BYTES = int(os.environ.get('QUERY_CACHE_BYTES', str(256 * 1024 ** 2)))
+QUERY_INDEX_CACHE_BYTES = int(os.environ.get('QUERY_INDEX_CACHE_BYTES', str(16 * 1024 ** 2)))
+
+# Seasonal backtester. The tickers are evaluated in batches of at most 'BACKTEST_MAX_CELLS' 
+# (rule, threshold, ticker, period, year) cells to bound the memory of the broadcast arrays. 
+BACKTEST_MAX_CELLS = int(os.environ.get('BACKTEST_MAX_CELLS', str(2 ** 24)))
+BACKTEST_MIN_YEARS = int(os.environ.get('BACKTEST_MIN_YEARS', '5'))
+
+# Optional significance stage. Bootstrap confidence intervals and permutation p-values of 
+# the (avg_diff) and (up_prob) of each period, with 'SIGNIFICANCE_RESAMPLES' resamples per cell. 
+USE_SIGNIFICANCE = False
+SIGNIFICANCE_RESAMPLES = int(os.environ.get('SIGNIFICANCE_RESAMPLES', '2000'))
+SIGNIFICANCE_ALPHA = float(os.environ.get('SIGNIFICANCE_ALPHA', '0.05'))
+SIGNIFICANCE_SEED = int(os.environ.get('SIGNIFICANCE_SEED', '0'))
+SIGNIFICANCE_MAX_CELLS = int(os.environ.get('SIGNIFICANCE_MAX_CELLS', str(2 ** 24)))
+
+# Percentiles of each period in the summaries, next to the median. Example: 'p5_diff' / 'p95_vol' 
+# The quantile sketches keep at most about 3 x 'SKETCH_K' values each. Set 'SKETCH_K' to 0 to keep every value. 
+QUANTILE_LEVELS = [0.05, 0.25, 0.75, 0.95]
+QUANTILE_COLS = [f'p{round(level * 100)}' for level in QUANTILE_LEVELS]
+SKETCH_K = int(os.environ.get('SKETCH_K', '200')) or None
+
+# Optional intraday stage. Each key pivots the bars of its Yahoo interval on its period columns, 
+# and the CSVs are read 'INTRADAY_CHUNK_ROWS' rows at a time, so the memory doesn't grow with the history. 
+USE_INTRADAY = False
+INTRADAY_KEYS = ['intraday_by_hour', 'intraday_by_weekday_hour', 'intraday_by_minute_bucket']
+INTRADAY_COLS = [['hour'], ['weekday', 'hour'], ['minute_bucket']]
+INTRADAY_TICKER_FREQ = ['60m', '60m', '5m']
+INTRADAY_BUCKET_MINUTES = int(os.environ.get('INTRADAY_BUCKET_MINUTES', '15'))
+INTRADAY_CHUNK_ROWS = int(os.environ.get('INTRADAY_CHUNK_ROWS', '200000'))
+INTRADAY_TIMEZONE = 'America/New_York'
+
+# Optional custom period stage. Each key groups the daily bars by the period codes of 'periods.PERIOD_SPECS', 
+# so every grouping is derived from the daily download. 
+USE_CUSTOM_PERIODS = False
+PERIOD_KEYS = [
+    'quarterly', 'daily_by_dom', 'daily_by_week_of_month', 'turn_of_month', 'first_trdr_days_of_yr', 'last_trdr_days_of_yr'
+]
+PERIOD_COLS = [
+    ['quarter'], ['month', 'dom'], ['month', 'week_of_month'], ['turn_of_month'], ['first_trdr_day_of_yr'], ['last_trdr_day_of_yr']
+]
+# Trading days before and after each month end, and at the start and the end of each year. 
+TURN_OF_MONTH_DAYS = int(os.environ.get('TURN_OF_MONTH_DAYS', '3'))
+YR_EDGE_DAYS = int(os.environ.get('YR_EDGE_DAYS', '5'))
+
+# Keep the pivot tables of each ticker by year with the partial aggregates of every year, 
+# so an update only pivots and aggregates the years whose rows changed. 
+USE_INCREMENTAL_STATS = False
+
+# Peak allocation budgets in MB of the preprocessing hot paths, for one synthetic ticker from 1999. 
+# 'run_benchmark.py memory' measures the peaks with tracemalloc and fails once a budget is exceeded. 
+MEMORY_BUDGETS_MB = {
+    'trace_unique_period': 5.5,
+    'create_unique_days_pivots': 1.0,
+    'summarise_pivot': 1.0,
+    'compute_avg_vol': 0.3,
+    'summarise_pivot_vol': 0.5,
+    'pivot_ticker_summary': 2.0,
+    'pivot_vol_summary': 1.3,
+    'pivot_unique_days_summary': 2.0,
+}
+
+# Performance regression gate. 'run_benchmark.py gate' runs each scenario 'PERF_REPEATS' times from the downloads, 
+# served by the stand-in download server, to the workbooks, and compares the seconds and the peak memory of every stage 
+# with the baseline file. A stage regresses once its median is over the baseline by more than the threshold plus 
+# 'PERF_NOISE_K' times the spread (MAD) of the runs, and by more than the floor of 'PERF_MIN_SECONDS' / 'PERF_MIN_MB', 
+# with every run slower than every baseline run. 
+PERF_BASELINE_PATH = os.environ.get('PERF_BASELINE_PATH', 'docs/perf_baseline.json')
+PERF_SCENARIOS = {
+    'short_history': {'tickers': 2, 'start_yr': 2012},
+    'long_history': {'tickers': 2, 'start_yr': 1990},
+}
+PERF_REPEATS = int(os.environ.get('PERF_REPEATS', '5'))
+PERF_TIME_THRESHOLD = float(os.environ.get('PERF_TIME_THRESHOLD', '0.25'))
+PERF_MEMORY_THRESHOLD = float(os.environ.get('PERF_MEMORY_THRESHOLD', '0.1'))
+PERF_NOISE_K = 3.0
+PERF_MIN_SECONDS = 0.05
+PERF_MIN_MB = 1.0
 
 # Others.  
 PROJECT_PATH = os.getcwd()
@@ -5,31 +5,206 @@ import luigi
 from luigi.contrib.external_program import ExternalProgramTask
 from luigi.parameter import Parameter, IntParameter, DateParameter
 from luigi import LocalTarget, Task
+from luigi.task import flatten
 
 import numpy as np
 import pandas as pd
-import pickle
+import os, pickle, time, functools
 from datetime import datetime
 
 # Personal modules.
 from config.config import *
-from autoprocess_ticker import web_download, data_management, preprocessing, compile_unique_days
+from autoprocess_ticker import web_download, data_management, preprocessing, compile_unique_days, run_manifest, symbol_store, raw_archive, ticker_stages, significance, intraday, incremental, memory_budget
+
+
+# --------------------------------------------------------------
+# Run Manifest.
+# --------------------------------------------------------------
+
+class ManifestMixin:
+    '''
+    Check the completeness against the run manifest instead of walking the task 
+    graph. A task is complete if the manifest marks it as done, its input fingerprint 
+    still matches the recorded output fingerprints of the upstream tasks, and its own 
+    outputs still exist. The fingerprints are dictionary lookups, and the outputs one 
+    existence check each. The upstream tasks are never checked, as a re-run of any of 
+    them changes its output fingerprint in the manifest. 
+    '''
+
+    # Config values that affect the outputs of the stage. Changing any of them 
+    # changes the input fingerprint, so the stage is recomputed. 
+    config_version = ()
+
+    # Modules whose code computes the outputs of the stage. Their sources are part of the 
+    # input fingerprint, so a code change recomputes the stage instead of restoring the 
+    # outputs of the old code from the stage cache. The downloads have none. 
+    code_modules = ()
+
+    # Whether the run was skipped, restored from the stage cache, or computed. 
+    cache_status = None
+
+    def input_fingerprint(self):
+        manifest = run_manifest.get_manifest()
+        upstream = [manifest.get(dep.task_id) for dep in flatten(self.requires())]
+
+        # The fingerprint is unknown until every upstream task is done. 
+        if any(entry is None or entry['status'] != 'done' for entry in upstream):
+            return None
+        code_version = [run_manifest.code_fingerprint(self.code_modules)] if self.code_modules else []
+        return run_manifest.hash_values(self.task_id, self.config_version, *code_version, 
+                                        *[entry['output_fp'] for entry in upstream])
+
+    def output_paths(self):
+        return [target.path for target in flatten(self.output())]
+
+    def output_fingerprint(self):
+        return run_manifest.content_fingerprint(self.output_paths())
+
+    def record_status(self, status, error=None, duration=None):
+        manifest = run_manifest.get_manifest()
+        if status == 'running':
+            manifest.set_status(self.task_id, self.ticker, self.etf_dir, self.get_task_family(), status)
+            return
+
+        input_fp = output_fp = None
+        if status == 'done':
+            input_fp = self.input_fingerprint()
+            output_fp = self.output_fingerprint()
+
+        manifest.record(self.task_id, self.ticker, self.etf_dir, self.get_task_family(), status, 
+                        input_fp, output_fp, error, duration, self.cache_status)
+
+    def complete(self):
+        if not USE_RUN_MANIFEST:
+            return super().complete()
+
+        # The outputs created before the manifest existed have no entry until (adopt_outputs). 
+        # A deleted output is rebuilt. 
+        entry = run_manifest.get_manifest().get(self.task_id)
+        return entry is not None and entry['status'] == 'done' and entry['input_fp'] == self.input_fingerprint() \
+            and super().complete()
+
+
+def adopt_outputs(tasks):
+    '''
+    Purpose: 
+        Record the outputs that were created before the run manifest existed as done, 
+        upstream first, so they are not recomputed. This reads the files of those 
+        stages once, then the manifest is used from the next run onwards. Called 
+        before a run, never while checking whether a task is complete. 
+
+    Input  : 
+        tasks: List of the final Luigi tasks. 
+
+    Return : 
+        Number of adopted stages. 
+    '''
+
+    if not USE_RUN_MANIFEST:
+        return 0
+
+    manifest = run_manifest.get_manifest()
+    visited, adopted = set(), 0
+
+    def visit(task):
+        nonlocal adopted
+        if task.task_id in visited:
+            return
+        visited.add(task.task_id)
+        for dep in flatten(task.requires()):
+            visit(dep)
+
+        # Only adopted once every upstream task is done, which gives its input fingerprint. 
+        if isinstance(task, ManifestMixin) and manifest.get(task.task_id) is None \
+                and task.input_fingerprint() is not None and super(ManifestMixin, task).complete():
+            # Luigi reuses the task instances of a process, so clear the status of an earlier run. 
+            task.cache_status = None
+            task.record_status('done')
+            adopted += 1
+
+    for task in tasks:
+        visit(task)
+    return adopted
+
+
+def cached_stage(run):
+    '''
+    Purpose: 
+        Wrap the (run) method of a stage to skip it when its inputs are unchanged. 
+        1. Skip if the previous run had the same input fingerprint and the outputs 
+           are still in place. Example: the CSV was downloaded again with the same bytes. 
+        2. Restore the outputs from the stage cache if a run with the same input 
+           fingerprint was kept there. 
+        3. Otherwise, run the stage and keep its outputs in the stage cache. 
+    '''
+
+    @functools.wraps(run)
+    def wrapper(self):
+        if not (USE_RUN_MANIFEST and USE_STAGE_CACHE):
+            return run(self)
+
+        stage = self.get_task_family()
+        input_fp = self.input_fingerprint()
+        entry = run_manifest.get_manifest().get(self.task_id)
+
+        if entry and entry['input_fp'] == input_fp and entry['output_fp'] \
+                and all(os.path.exists(path) for path in self.output_paths()):
+            self.cache_status = 'hit_skip'
+        elif run_manifest.restore_outputs(stage, input_fp, self.output_paths()):
+            self.cache_status = 'hit_restore'
+        else:
+            run(self)
+            run_manifest.store_outputs(stage, input_fp, self.output_paths())
+            self.cache_status = 'miss'
+    return wrapper
+
+
+@Task.event_handler(luigi.Event.START)
+def record_start(task):
+    if USE_RUN_MANIFEST and isinstance(task, ManifestMixin):
+        task.start_time = time.time()
+        task.record_status('running')
+
+
+@Task.event_handler(luigi.Event.SUCCESS)
+def record_success(task):
+    if USE_RUN_MANIFEST and isinstance(task, ManifestMixin):
+        task.record_status('done', duration=time.time() - getattr(task, 'start_time', time.time()))
+
+
+@Task.event_handler(luigi.Event.FAILURE)
+def record_failure(task, exception):
+    if USE_RUN_MANIFEST and isinstance(task, ManifestMixin):
+        task.record_status('failed', error=repr(exception))
 
 
 # --------------------------------------------------------------
 # Pipeline.
 # --------------------------------------------------------------
 
-class DownloadTickerData(ExternalProgramTask):
+class DownloadTickerData(ManifestMixin, ExternalProgramTask):
     ticker = luigi.Parameter(default=None)
     ticker_freq = luigi.Parameter(default=None)
     start_yr = luigi.IntParameter(default=1999) 
     etf_dir = luigi.Parameter(default=ETF_SECTOR_DIR) 
     yahoo_version = luigi.Parameter(default=YAHOO_VERSION)
+
+    config_version = (END_YR,)
+
+    def use_archive(self):
+        # The intraday CSVs are read in chunks, so they stay plain files.
+        return RAW_STORAGE == 'archive' and self.ticker_freq not in INTRADAY_TICKER_FREQ
     
     def output(self):
         ticker_filename = f'{self.ticker}_{self.ticker_freq}.csv'
+        if self.use_archive():
+            return raw_archive.ArchiveTarget(f"{self.etf_dir}/{self.ticker}/{ticker_filename}")
         return luigi.LocalTarget(f"{self.etf_dir}/{self.ticker}/{ticker_filename}") 
+
+    def output_fingerprint(self):
+        if self.use_archive():
+            return self.output().checksum()
+        return super().output_fingerprint()
     
     def program_args(self):
         start_date = {
@@ -43,22 +218,49 @@ class DownloadTickerData(ExternalProgramTask):
             '1d': int(datetime.timestamp(datetime(END_YR + 1, 1, 6)))
         }
 
+        # The intraday bars cover the same dates as the daily bars.
+        for ticker_freq in INTRADAY_TICKER_FREQ:
+            start_date[ticker_freq], end_date[ticker_freq] = start_date['1d'], end_date['1d']
+
         # Direct URL link for downloading the ticker data. 
-        ticker_download = f'https://query1.finance.yahoo.com/{self.yahoo_version}/finance/download/{self.ticker}?'
+        ticker_download = f'{YAHOO_DOWNLOAD_HOST}/{self.yahoo_version}/finance/download/{self.ticker}?'
         ticker_download_param = f'period1={start_date[self.ticker_freq]}&period2={end_date[self.ticker_freq]}&interval={self.ticker_freq}&events=history'
         ticker_download_url = "".join([ticker_download, ticker_download_param])
 
-        # Directly download the ticker data via 'curl'. 
-        with self.output().open('w') as out_file:
-            return ["curl", "-L", "-o", self.output().path, ticker_download_url]
+        # Directly download the ticker data via 'curl' into a temporary file. 
+        return ["curl", "-L", "-f", "-s", "-o", self.temp_path(), ticker_download_url]
+
+    def temp_path(self):
+        if self.use_archive():
+            return f'{RAW_ARCHIVE_DIR}/tmp/{self.ticker}_{self.ticker_freq}.part-{os.getpid()}'
+        return f'{self.output().path}.part-{os.getpid()}'
+
+    def run(self):
+        # Download into a temporary file, then move it into place or append it to the raw 
+        # archive once it completes so other workers sharing the dataset root never read a partial file. 
+        os.makedirs(os.path.dirname(self.temp_path()), exist_ok=True)
+        super().run()
+        self.store_download()
+
+    def store_download(self):
+        # Also called by the streaming executor, which runs the download itself. 
+        if self.use_archive():
+            with open(self.temp_path(), 'rb') as in_file:
+                self.output().write(in_file.read())
+            os.remove(self.temp_path())
+        else:
+            os.replace(self.temp_path(), self.output().path)
             
 
-class ProcessTickerData(luigi.Task):
+class ProcessTickerData(ManifestMixin, luigi.Task):
     ticker = luigi.Parameter(default=None)
     start_yr = luigi.IntParameter(default=1999) 
     etf_dir = luigi.Parameter(default=ETF_SECTOR_DIR) 
     yahoo_version = luigi.Parameter(default=YAHOO_VERSION)
 
+    config_version = (FREQ_KEYS, FREQ_COLS, TICKER_FREQ)
+    code_modules = ('luigi_pipeline', 'autoprocess_ticker.preprocessing')
+
     def requires(self):
         return {
             FREQ_KEYS[0]: DownloadTickerData(self.ticker, TICKER_FREQ[0], self.start_yr, self.etf_dir, self.yahoo_version),
@@ -70,9 +272,13 @@ class ProcessTickerData(luigi.Task):
     def output(self):
         return luigi.LocalTarget(f"{self.etf_dir}/{self.ticker}/storage/df_ticker.pickle", format=luigi.format.Nop) 
 
+    @cached_stage
     def run(self):
         # Read file. 
-        df_ticker = {freq: pd.read_csv(self.input()[freq].path, parse_dates=['Date']) for freq in FREQ_KEYS} 
+        df_ticker = {}
+        for freq in FREQ_KEYS:
+            with self.input()[freq].open('r') as in_file:
+                df_ticker[freq] = pd.read_csv(in_file, parse_dates=['Date'])
 
         # Initial preprocessing. 
         preprocessing.init_preprocess(df_ticker, FREQ_KEYS, FREQ_COLS)
@@ -81,12 +287,17 @@ class ProcessTickerData(luigi.Task):
             pickle.dump(df_ticker, out_file)
 
 
-class PivotTickerSummary(luigi.Task):
+class PivotTickerSummary(ManifestMixin, luigi.Task):
     ticker = luigi.Parameter(default=None)
     start_yr = luigi.IntParameter(default=1999) 
     etf_dir = luigi.Parameter(default=ETF_SECTOR_DIR) 
     yahoo_version = luigi.Parameter(default=YAHOO_VERSION)
 
+    # The start year of the first window is the (start_yr) param, so only the rest is included. 
+    config_version = (FREQ_KEYS, FREQ_COLS, YR_RANGE, START_YR_RANGE[1:], END_YR, QUANTILE_LEVELS, PREPROCESSING_ENGINE, 
+                      USE_INCREMENTAL_STATS)
+    code_modules = ('luigi_pipeline', 'autoprocess_ticker.ticker_stages', 'autoprocess_ticker.incremental')
+
     def requires(self):
         return ProcessTickerData(self.ticker, self.start_yr, self.etf_dir, self.yahoo_version) 
 
@@ -94,27 +305,31 @@ class PivotTickerSummary(luigi.Task):
         return luigi.LocalTarget(f"{self.etf_dir}/{self.ticker}/storage/pivot_stats.pickle", 
                                  format=luigi.format.Nop) 
 
+    @cached_stage
     def run(self):
         with self.input().open() as in_file:
             df_ticker = pickle.load(in_file)
 
-        # Create pivot tables. 
-        preprocessing.create_pivot(df_ticker, PIVOT_TICKER, FREQ_KEYS, FREQ_COLS, pivot_value='price_diff')
-
-        # Create statistical summary from pivot tables. 
-        START_YR_RANGE[0] = self.start_yr
-        preprocessing.summarise_pivot(PIVOT_TICKER, PIVOT_STATS, FREQ_KEYS, START_YR_RANGE, END_YR)
+        # Create pivot tables and their statistical summary. 
+        if USE_INCREMENTAL_STATS:
+            storage_dir = os.path.dirname(self.output().path)
+            pivot_ticker, pivot_stats = incremental.run_stage('ticker', df_ticker, self.start_yr, storage_dir)
+        else:
+            pivot_ticker, pivot_stats = ticker_stages.pivot_ticker_summary(df_ticker, self.start_yr)
 
         with self.output().open('w') as out_file:
-            pickle.dump((PIVOT_TICKER, PIVOT_STATS), out_file) 
+            pickle.dump((pivot_ticker, pivot_stats), out_file) 
 
 
-class PivotVolSummary(luigi.Task):
+class PivotVolSummary(ManifestMixin, luigi.Task):
     ticker = luigi.Parameter(default=None)
     start_yr = luigi.IntParameter(default=1999) 
     etf_dir = luigi.Parameter(default=ETF_SECTOR_DIR) 
     yahoo_version = luigi.Parameter(default=YAHOO_VERSION)
 
+    config_version = (FREQ_KEYS, FREQ_COLS, YR_RANGE, END_YR, QUANTILE_LEVELS, PREPROCESSING_ENGINE, USE_INCREMENTAL_STATS)
+    code_modules = ('luigi_pipeline', 'autoprocess_ticker.ticker_stages', 'autoprocess_ticker.incremental')
+
     def requires(self):
         return ProcessTickerData(self.ticker, self.start_yr, self.etf_dir, self.yahoo_version) 
 
@@ -122,28 +337,32 @@ class PivotVolSummary(luigi.Task):
         return luigi.LocalTarget(f"{self.etf_dir}/{self.ticker}/storage/pivot_vol_stats.pickle", 
                                  format=luigi.format.Nop) 
 
+    @cached_stage
     def run(self):
         with self.input().open() as in_file:
             df_ticker = pickle.load(in_file)
         
-        # Create pivot tables. 
-        preprocessing.create_pivot(df_ticker, PIVOT_VOLUME, FREQ_KEYS, FREQ_COLS, pivot_value='volume')
-
-        # Create statistical summary from pivot tables. 
-        START_YR_RANGE[0] = self.start_yr
-        preprocessing.compute_avg_vol(PIVOT_VOLUME, PIVOT_VOLUME_STATS, FREQ_KEYS, [START_YR_RANGE[0]], END_YR)
-        preprocessing.summarise_pivot_vol(PIVOT_VOLUME, PIVOT_VOLUME_STATS, FREQ_KEYS, [START_YR_RANGE[0]], END_YR)
+        # Create pivot tables and their statistical summary. 
+        if USE_INCREMENTAL_STATS:
+            storage_dir = os.path.dirname(self.output().path)
+            pivot_volume, pivot_volume_stats = incremental.run_stage('vol', df_ticker, self.start_yr, storage_dir)
+        else:
+            pivot_volume, pivot_volume_stats = ticker_stages.pivot_vol_summary(df_ticker, self.start_yr)
 
         with self.output().open('w') as out_file:
-            pickle.dump((PIVOT_VOLUME, PIVOT_VOLUME_STATS), out_file) 
+            pickle.dump((pivot_volume, pivot_volume_stats), out_file) 
 
 
-class TraceUniquePeriod(luigi.Task):
+class TraceUniquePeriod(ManifestMixin, luigi.Task):
     ticker = luigi.Parameter(default=None)
     start_yr = luigi.IntParameter(default=1999) 
     etf_dir = luigi.Parameter(default=ETF_SECTOR_DIR) 
     yahoo_version = luigi.Parameter(default=YAHOO_VERSION)
 
+    config_version = (HOLIDAYS_KEYS, SPEC_WEEKDAY_HOLIDAYS, SPEC_WEEKDAY_HOLIDAYS_BACKWARD, 
+                      NON_SPEC_HOLIDAYS, NON_SPEC_OBSERVANCES, END_YR, PREPROCESSING_ENGINE)
+    code_modules = ('luigi_pipeline', 'autoprocess_ticker.ticker_stages')
+
     def requires(self):
         return ProcessTickerData(self.ticker, self.start_yr, self.etf_dir, self.yahoo_version) 
 
@@ -151,52 +370,29 @@ class TraceUniquePeriod(luigi.Task):
         return luigi.LocalTarget(f"{self.etf_dir}/{self.ticker}/storage/df_ticker_unique_days.pickle", 
                                  format=luigi.format.Nop) 
 
+    @cached_stage
     def run(self):
         with self.input().open() as in_file:
             df_ticker = pickle.load(in_file)
 
-            df_ticker_weekly = df_ticker['weekly'].copy()
-            df_ticker_trdrDay = df_ticker['daily_by_trdr_day'].copy()
-
-            # Get the holidays, observances, and specialDay dates.
-            df_holidays = compile_unique_days.compile_trdr_holiday_dates(self.start_yr, END_YR, HOLIDAYS_KEYS)
-            df_tww = compile_unique_days.get_tww_dates(self.start_yr, END_YR)
-            tup_super_day = compile_unique_days.get_super_day_period(df_ticker_trdrDay) 
-            tup_santa_rally = compile_unique_days.get_santa_rally_period(df_ticker_trdrDay, self.start_yr, END_YR)
-        
-            # Trace the TWW & special days for 'daily_trdrDay' data. 
-            preprocessing.trace_special_days(df_ticker_trdrDay, tup_super_day, tup_santa_rally) 
-            preprocessing.trace_tww_trdr_days(df_ticker_trdrDay, df_tww) 
-
-            # Trace the TWW period for 'weekly' data. 
-            preprocessing.trace_tww_trdr_days(df_ticker_weekly, df_tww)
-
-            # Trace the holidays and observances. 
-            preprocessing.trace_new_year(df_ticker_trdrDay, HOLIDAYS_DICT) 
-
-            for holiday in SPEC_WEEKDAY_HOLIDAYS:
-                preprocessing.trace_spec_weekday_holiday(df_ticker_trdrDay, df_holidays, HOLIDAYS_DICT, holiday)
-            for holiday in SPEC_WEEKDAY_HOLIDAYS_BACKWARD:
-                preprocessing.trace_spec_weekday_holiday(df_ticker_trdrDay, df_holidays, HOLIDAYS_DICT, holiday, 
-                                                       day_forward=-1, idx_backtrace=2)
-            for holiday in NON_SPEC_HOLIDAYS:
-                preprocessing.trace_non_spec_holiday(df_ticker_trdrDay, df_holidays, HOLIDAYS_DICT, holiday) 
-            for observance in NON_SPEC_OBSERVANCES:
-                preprocessing.trace_non_spec_observance(df_ticker_trdrDay, df_holidays, HOLIDAYS_DICT, observance)
-
-            df_ticker['weekly'] = df_ticker_weekly 
-            df_ticker['daily_by_trdr_day'] = df_ticker_trdrDay 
+        # Trace the holidays, observances, and special days. 
+        df_ticker = ticker_stages.trace_unique_period(df_ticker, self.start_yr)
 
         with self.output().open('w') as out_file:
             pickle.dump(df_ticker, out_file) 
 
 
-class PivotUniqueDaysSummary(luigi.Task):
+class PivotUniqueDaysSummary(ManifestMixin, luigi.Task):
     ticker = luigi.Parameter(default=None)
     start_yr = luigi.IntParameter(default=1999) 
     etf_dir = luigi.Parameter(default=ETF_SECTOR_DIR) 
     yahoo_version = luigi.Parameter(default=YAHOO_VERSION)
 
+    # The start year of the first window is the (start_yr) param, so only the rest is included. 
+    config_version = (HOLIDAYS_KEYS, SPECIAL_DAYS_KEYS, YR_RANGE, START_YR_RANGE[1:], END_YR, QUANTILE_LEVELS, 
+                      PREPROCESSING_ENGINE, USE_INCREMENTAL_STATS)
+    code_modules = ('luigi_pipeline', 'autoprocess_ticker.ticker_stages', 'autoprocess_ticker.incremental')
+
     def requires(self):
         return TraceUniquePeriod(self.ticker, self.start_yr, self.etf_dir, self.yahoo_version) 
 
@@ -204,76 +400,169 @@ class PivotUniqueDaysSummary(luigi.Task):
         return luigi.LocalTarget(f"{self.etf_dir}/{self.ticker}/storage/pivot_unique_days.pickle", 
                                  format=luigi.format.Nop) 
 
+    @cached_stage
     def run(self):
         with self.input().open() as in_file:
             df_ticker = pickle.load(in_file)
 
-            df_ticker_weekly = df_ticker['weekly'].copy()
-            df_ticker_trdrDay = df_ticker['daily_by_trdr_day'].copy()
+        # Create pivot tables and their statistical summary for the holidays and special days. 
+        if USE_INCREMENTAL_STATS:
+            storage_dir = os.path.dirname(self.output().path)
+            pivot_holidays, pivot_special_days, pivot_special_days_weekly = \
+                incremental.run_stage('unique_days', df_ticker, self.start_yr, storage_dir)
+        else:
+            pivot_holidays, pivot_special_days, pivot_special_days_weekly = \
+                ticker_stages.pivot_unique_days_summary(df_ticker, self.start_yr)
+
+        with self.output().open('w') as out_file:
+            pickle.dump((pivot_holidays, pivot_special_days, pivot_special_days_weekly), out_file) 
 
-            # Create pivot tables. 
-            preprocessing.create_pivot_unique_days(df_ticker_trdrDay, PIVOT_HOLIDAYS, HOLIDAYS_KEYS, self.start_yr, END_YR, drop_idx=True)
-            preprocessing.create_pivot_unique_days(df_ticker_trdrDay, PIVOT_SPECIAL_DAYS, SPECIAL_DAYS_KEYS, self.start_yr, END_YR)
-            preprocessing.create_pivot_unique_days(df_ticker_weekly, PIVOT_SPECIAL_DAYS_WEEKLY, SPECIAL_DAYS_KEYS[5:], self.start_yr, END_YR)
 
-            # Concat the TWW data and the data of the week after the TWW. 
-            preprocessing.concat_pivot_tww(PIVOT_SPECIAL_DAYS, SPECIAL_DAYS_KEYS[5:9])
-            preprocessing.concat_pivot_tww(PIVOT_SPECIAL_DAYS_WEEKLY, SPECIAL_DAYS_KEYS[5:9])
+class PivotIntradaySummary(ManifestMixin, luigi.Task):
+    ticker = luigi.Parameter(default=None)
+    start_yr = luigi.IntParameter(default=1999)
+    etf_dir = luigi.Parameter(default=ETF_SECTOR_DIR)
+    yahoo_version = luigi.Parameter(default=YAHOO_VERSION)
 
-            # Concat all the relevant datasets into 1 dataset. 
-            preprocessing.concat_pivot_unique_days(PIVOT_HOLIDAYS, HOLIDAYS_KEYS, 'holiday')
-            preprocessing.concat_pivot_unique_days(PIVOT_SPECIAL_DAYS, SPECIAL_DAYS_KEYS[5:9], 'tww') 
-            preprocessing.concat_pivot_unique_days(PIVOT_SPECIAL_DAYS_WEEKLY, SPECIAL_DAYS_KEYS[5:9], 'tww') 
+    config_version = (INTRADAY_KEYS, INTRADAY_COLS, INTRADAY_TICKER_FREQ, INTRADAY_BUCKET_MINUTES, INTRADAY_TIMEZONE,
+                      YR_RANGE, START_YR_RANGE[1:], END_YR, QUANTILE_LEVELS, SKETCH_K)
+    code_modules = ('luigi_pipeline', 'autoprocess_ticker.intraday')
 
-            # Create statistical summary from pivot tables. 
-            START_YR_RANGE[0] = self.start_yr
-            preprocessing.summarise_pivot(PIVOT_HOLIDAYS, PIVOT_HOLIDAYS_STATS, ['compiled_holiday'], START_YR_RANGE, END_YR)
-            preprocessing.summarise_pivot(PIVOT_SPECIAL_DAYS, PIVOT_SPECIAL_DAYS_STATS, SPECIAL_DAYS_KEYS[:5], START_YR_RANGE, END_YR)
-            preprocessing.summarise_pivot(PIVOT_SPECIAL_DAYS, PIVOT_SPECIAL_DAYS_STATS, ['compiled_tww'], START_YR_RANGE, END_YR)
-            preprocessing.summarise_pivot(PIVOT_SPECIAL_DAYS_WEEKLY, PIVOT_SPECIAL_DAYS_WEEKLY_STATS, ['compiled_tww'], START_YR_RANGE, END_YR)
+    def requires(self):
+        return {
+            ticker_freq: DownloadTickerData(self.ticker, ticker_freq, self.start_yr, self.etf_dir, self.yahoo_version)
+            for ticker_freq in sorted(set(INTRADAY_TICKER_FREQ))
+        }
 
-            # # Concat all the relevant datasets into 1 dataset. 
-            # preprocessing.concat_pivot_unique_days(PIVOT_HOLIDAYS_STATS, HOLIDAYS_KEYS, 'holiday')
-            # preprocessing.concat_pivot_unique_days(PIVOT_SPECIAL_DAYS_STATS, SPECIAL_DAYS_KEYS[5:9], 'tww') 
-            # preprocessing.concat_pivot_unique_days(PIVOT_SPECIAL_DAYS_WEEKLY_STATS, SPECIAL_DAYS_KEYS[5:9], 'tww') 
+    def output(self):
+        return (
+            luigi.LocalTarget(f"{self.etf_dir}/{self.ticker}/storage/pivot_intraday.pickle", format=luigi.format.Nop),
+            luigi.LocalTarget(f"{self.etf_dir}/{self.ticker}/storage/intraday_sketches.pickle", format=luigi.format.Nop)
+        )
 
-            # Group multiple data into tuples. 
-            pivot_holidays = (PIVOT_HOLIDAYS, PIVOT_HOLIDAYS_STATS)
-            pivot_special_days = (PIVOT_SPECIAL_DAYS, PIVOT_SPECIAL_DAYS_STATS)
-            pivot_special_days_weekly = (PIVOT_SPECIAL_DAYS_WEEKLY, PIVOT_SPECIAL_DAYS_WEEKLY_STATS)
+    @cached_stage
+    def run(self):
+        # Aggregate the intraday bars chunk by chunk, so the whole CSV is never in memory.
+        aggregator = intraday.aggregate_intraday({ticker_freq: target.path for ticker_freq, target in self.input().items()})
+        pivot_intraday, pivot_intraday_volume = intraday.pivot_intraday_summary(aggregator, self.start_yr)
+
+        out_pivot, out_sketches = self.output()
+        with out_pivot.open('w') as out_file:
+            pickle.dump((pivot_intraday, pivot_intraday_volume), out_file)
+        with out_sketches.open('w') as out_file:
+            pickle.dump(aggregator.grids, out_file)
+
+
+class PivotPeriodSummary(ManifestMixin, luigi.Task):
+    ticker = luigi.Parameter(default=None)
+    start_yr = luigi.IntParameter(default=1999)
+    etf_dir = luigi.Parameter(default=ETF_SECTOR_DIR)
+    yahoo_version = luigi.Parameter(default=YAHOO_VERSION)
+
+    config_version = (PERIOD_KEYS, PERIOD_COLS, TURN_OF_MONTH_DAYS, YR_EDGE_DAYS, YR_RANGE, START_YR_RANGE[1:], END_YR,
+                      QUANTILE_LEVELS)
+    code_modules = ('luigi_pipeline', 'autoprocess_ticker.ticker_stages')
+
+    def requires(self):
+        return ProcessTickerData(self.ticker, self.start_yr, self.etf_dir, self.yahoo_version)
+
+    def output(self):
+        return luigi.LocalTarget(f"{self.etf_dir}/{self.ticker}/storage/pivot_periods.pickle",
+                                 format=luigi.format.Nop)
+
+    @cached_stage
+    def run(self):
+        with self.input().open() as in_file:
+            df_ticker = pickle.load(in_file)
+
+        # Create pivot tables and their statistical summary for every custom period in one pass.
+        pivot_periods, pivot_periods_stats = ticker_stages.pivot_period_summary(df_ticker, self.start_yr)
 
         with self.output().open('w') as out_file:
-            pickle.dump((pivot_holidays, pivot_special_days, pivot_special_days_weekly), out_file) 
+            pickle.dump((pivot_periods, pivot_periods_stats), out_file)
 
 
-class CompileToExcel(luigi.Task):
+class PivotSignificance(ManifestMixin, luigi.Task):
+    ticker = luigi.Parameter(default=None)
+    start_yr = luigi.IntParameter(default=1999)
+    etf_dir = luigi.Parameter(default=ETF_SECTOR_DIR)
+    yahoo_version = luigi.Parameter(default=YAHOO_VERSION)
+
+    config_version = (FREQ_KEYS, SPECIAL_DAYS_KEYS, YR_RANGE, START_YR_RANGE[1:], END_YR,
+                      SIGNIFICANCE_RESAMPLES, SIGNIFICANCE_ALPHA, SIGNIFICANCE_SEED)
+    code_modules = ('luigi_pipeline', 'autoprocess_ticker.significance')
+
+    def requires(self):
+        yield PivotTickerSummary(self.ticker, self.start_yr, self.etf_dir, self.yahoo_version)
+        yield PivotUniqueDaysSummary(self.ticker, self.start_yr, self.etf_dir, self.yahoo_version)
+
+    def output(self):
+        return luigi.LocalTarget(f"{self.etf_dir}/{self.ticker}/storage/pivot_significance.pickle",
+                                 format=luigi.format.Nop)
+
+    @cached_stage
+    def run(self):
+        in_file_1, in_file_2 = self.input()
+
+        with in_file_1.open() as in_file:
+            pivot_ticker, _ = pickle.load(in_file)
+        with in_file_2.open() as in_file:
+            pivot_holidays, pivot_special_days, pivot_special_days_weekly = pickle.load(in_file)
+
+        # Bootstrap intervals and permutation p-values of the price change of each period.
+        pivot_dicts = {
+            'price': pivot_ticker,
+            'holiday': pivot_holidays[0],
+            'special_days': pivot_special_days[0],
+            'special_days_weekly': pivot_special_days_weekly[0],
+        }
+        pivot_significance = significance.summarise_significance(pivot_dicts, self.ticker, self.start_yr)
+
+        with self.output().open('w') as out_file:
+            pickle.dump(pivot_significance, out_file)
+
+
+class CompileToExcel(ManifestMixin, luigi.Task):
     ticker = luigi.Parameter(default=None)
     start_yr = luigi.IntParameter(default=1999) 
     etf_dir = luigi.Parameter(default=ETF_SECTOR_DIR) 
     yahoo_version = luigi.Parameter(default=YAHOO_VERSION)
 
+    config_version = (FREQ_KEYS, SPECIAL_DAYS_KEYS, EXCEL_SHEET_NAMES, EXCEL_START_COL, EXCEL_START_ROW, EXCEL_DISTANCE)
+    code_modules = ('luigi_pipeline', 'autoprocess_ticker.data_management', 'autoprocess_ticker.memory_budget')
+
+    # Set by the streaming executor near its memory budget. Not a parameter, so the task id stays the same. 
+    spill_pivots = False
+
     def requires(self):
         yield PivotTickerSummary(self.ticker, self.start_yr, self.etf_dir, self.yahoo_version),
         yield PivotVolSummary(self.ticker, self.start_yr, self.etf_dir, self.yahoo_version), 
         yield PivotUniqueDaysSummary(self.ticker, self.start_yr, self.etf_dir, self.yahoo_version) 
 
+        # The significance stage is optional. It is run with the rest of the ticker stages. 
+        if USE_SIGNIFICANCE: 
+            yield PivotSignificance(self.ticker, self.start_yr, self.etf_dir, self.yahoo_version)
+
+        # The intraday stage is optional, as the intraday history is far larger.
+        if USE_INTRADAY:
+            yield PivotIntradaySummary(self.ticker, self.start_yr, self.etf_dir, self.yahoo_version)
+
+        # The custom periods are optional, and are written last.
+        if USE_CUSTOM_PERIODS:
+            yield PivotPeriodSummary(self.ticker, self.start_yr, self.etf_dir, self.yahoo_version)
+
     def output(self):
         return luigi.LocalTarget(f"{self.etf_dir}/{self.ticker}/{self.ticker}_seasonal_stats.xlsx",
                                  format=luigi.format.Nop) 
 
+    @cached_stage
     def run(self):
-        in_file_1, in_file_2, in_file_3 = self.input()
+        in_file_1, in_file_2, in_file_3 = self.input()[:3]
         
         with in_file_1[0].open() as in_file:
             pivot_ticker, pivot_stats = pickle.load(in_file)
         with in_file_2[0].open() as in_file:
             pivot_volume, pivot_volume_stats = pickle.load(in_file)
-        with in_file_3.open() as in_file:
-            pivot_holidays, pivot_special_days, pivot_special_days_weekly = pickle.load(in_file)
-
-        pivot_holidays, pivot_holidays_stats = pivot_holidays
-        pivot_special_days, pivot_special_days_stats = pivot_special_days
-        pivot_special_days_weekly, pivot_special_days_weekly_stats = pivot_special_days_weekly
 
         with pd.ExcelWriter(self.output().path) as out_file:
             # Save pivot ticker data and volume. Multiple sheets. 
@@ -282,6 +571,18 @@ class CompileToExcel(luigi.Task):
                                                   EXCEL_START_COL, EXCEL_START_ROW, EXCEL_DISTANCE)
                 data_management.multi_sheet_write(out_file, pivot_volume, pivot_volume_stats, f'{EXCEL_SHEET_NAMES[i]}_vol', 
                                                   freq, EXCEL_START_COL, EXCEL_START_ROW, EXCEL_DISTANCE) 
+
+            # In spill mode, drop the written pivot tables before the next ones are read from the storage file. 
+            if self.spill_pivots: 
+                del pivot_ticker, pivot_stats, pivot_volume, pivot_volume_stats
+                memory_budget.release_memory()
+
+            with in_file_3.open() as in_file:
+                pivot_holidays, pivot_special_days, pivot_special_days_weekly = pickle.load(in_file)
+
+            pivot_holidays, pivot_holidays_stats = pivot_holidays
+            pivot_special_days, pivot_special_days_stats = pivot_special_days
+            pivot_special_days_weekly, pivot_special_days_weekly_stats = pivot_special_days_weekly
             
             # Save pivot tables Special Day data. Single sheet. 
             data_management.single_sheet_multi_write(out_file, pivot_special_days, pivot_special_days_stats, 
@@ -299,6 +600,44 @@ class CompileToExcel(luigi.Task):
             data_management.single_sheet_multi_write(out_file, pivot_special_days_weekly, pivot_special_days_weekly_stats, 
                                                     'tww_wk', ['compiled_tww'], EXCEL_START_COL, EXCEL_START_ROW, EXCEL_DISTANCE)
 
+            if self.spill_pivots: 
+                del pivot_holidays, pivot_holidays_stats, pivot_special_days, pivot_special_days_stats
+                del pivot_special_days_weekly, pivot_special_days_weekly_stats
+                memory_budget.release_memory()
+
+            # Save pivot tables of the custom periods. One sheet per period key.
+            if USE_CUSTOM_PERIODS:
+                with self.input()[-1].open() as in_file:
+                    pivot_periods, pivot_periods_stats = pickle.load(in_file)
+                for key in PERIOD_KEYS:
+                    data_management.multi_sheet_write(out_file, pivot_periods, pivot_periods_stats, key[:31], key,
+                                                      EXCEL_START_COL, EXCEL_START_ROW, EXCEL_DISTANCE)
+
+
+class SymbolBasketViews(luigi.Task):
+    ticker = luigi.Parameter(default=None)
+    start_yr = luigi.IntParameter(default=1999) 
+    basket_dirs = luigi.ListParameter(default=[ETF_SECTOR_DIR]) 
+    etf_dir = luigi.Parameter(default=SYMBOL_STORE_DIR) 
+    yahoo_version = luigi.Parameter(default=YAHOO_VERSION)
+
+    def requires(self):
+        return CompileToExcel(self.ticker, self.start_yr, self.etf_dir, self.yahoo_version) 
+
+    def output(self):
+        return [luigi.LocalTarget(f"{basket_dir}/{self.ticker}") for basket_dir in self.basket_dirs]
+
+    def complete(self):
+        # A view is only complete once linked, so the folders of the layout before the symbol store 
+        # are migrated. The symbol stages are checked as well, so a deleted workbook is rebuilt. 
+        return all(os.path.islink(target.path) for target in self.output()) and super().complete() \
+            and self.requires().complete()
+
+    def run(self):
+        # Link every ETF folder that holds the symbol to the symbol folder. 
+        for basket_dir in self.basket_dirs: 
+            symbol_store.link_basket_view(self.ticker, basket_dir, self.etf_dir)
+
 
 # --------------------------------------------------------------
 # Run.
@@ -309,5 +648,6 @@ class CompileToExcel(luigi.Task):
 # Example: luigi --module [python-file] [class] --[parameter-name] 1 \ --[parameter-name]=$(date +"%Y-%m-%d") \ ...
 # Example: python [name].py --local-scheduler [class] --[parameter-name] [value]
 # To enable Central Scheduler, write: luigid (at 'localhost:8082')
+# Example: python [name].py --scheduler-host localhost --scheduler-port 8082 [class] --[parameter-name] [value]
 if __name__ == "__main__":
     luigi.run()
@@ -0,0 +1,52 @@
+
+
+import argparse, logging, re
+
+import pandas as pd
+
+from autoprocess_ticker import backtest, collect_tickers, stats_store
+from config.config_logger import setup_logger
+from config.config import DICT_SECTORS, DICT_EQUITIES, LOG_PROCESSING_FILEPATH, BACKTEST_MIN_YEARS
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+def parse_rule(text:str) -> backtest.Rule:
+    # Example: 'up_prob>0.6/0.7' -> Rule('up_prob', '>', (0.6, 0.7)), 'short:up_prob<0.3' -> side of -1.
+    match = re.match(rf'^\s*(?:(long|short):)?(\w+)\s*({"|".join(map(re.escape, sorted(backtest.RULE_OPS, key=len, reverse=True)))})\s*(\S+)\s*$', text)
+    if match is None:
+        raise argparse.ArgumentTypeError(f'Invalid rule ({text}). Example: up_prob>0.6/0.7 or short:up_prob<0.3')
+    thresholds = tuple(float(value) for value in match.group(4).split('/'))
+    return backtest.Rule(match.group(2), match.group(3), thresholds, -1 if match.group(1) == 'short' else 1)
+
+
+# --------------------------------------------------------------
+# Run.
+# --------------------------------------------------------------
+
+# Example: python run_backtest.py --key monthly --window 10
+# Example: python run_backtest.py --key compiled_holiday --source holiday --rules "up_prob>0.6/0.7/0.8" "short:up_prob<0.3"
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Backtest the seasonal rules on the pivot tables of every ticker.')
+    parser.add_argument('--key', default='monthly', help="Example: 'monthly' / 'daily_by_trdr_day' / 'compiled_holiday'")
+    parser.add_argument('--source', default='price', help="Example: 'price' / 'holiday' / 'special_days'")
+    parser.add_argument('--rules', type=parse_rule, nargs='+', default=backtest.DEFAULT_RULES)
+    parser.add_argument('--window', type=int, default=None, help='Number of trailing years. Every earlier year if not given.')
+    parser.add_argument('--min-years', type=int, default=BACKTEST_MIN_YEARS)
+    parser.add_argument('--order-by', default='total_return')
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+    logger.info(f'CLI Input: {args}')
+
+    ticker_dirs = stats_store.list_ticker_dirs(collect_tickers.list_ticker_jobs(DICT_SECTORS, DICT_EQUITIES, shard='0/1'))
+    result = backtest.backtest(ticker_dirs, args.key, args.source, args.rules, args.window, args.min_years)
+
+    df = result.summary.sort_values(args.order_by, ascending=False).head(args.limit)
+    with pd.option_context('display.max_columns', None, 'display.width', 200):
+        print(df.to_string(index=False))
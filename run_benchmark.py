@@ -0,0 +1,172 @@
+
+
+import argparse, logging, sys
+
+from autoprocess_ticker import benchmark, regression_gate
+from config.config_logger import setup_logger
+from config.config import (
+    LOG_PROCESSING_FILEPATH, ETF_SECTOR_DIR, PERF_BASELINE_PATH, PERF_SCENARIOS, PERF_REPEATS, PERF_TIME_THRESHOLD,
+    PERF_MEMORY_THRESHOLD
+)
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# --------------------------------------------------------------
+# Run.
+# --------------------------------------------------------------
+
+# Example: python run_benchmark.py workers --tickers 8 --workers 1 2 4
+# Example: python run_benchmark.py stream --tickers 16 --workers 4 --latency 0.2
+# Example: python run_benchmark.py panel --tickers 100
+# Example: python run_benchmark.py shared --tickers 8 32 128 --workers 4
+# Example: python run_benchmark.py walk --windows 0 5 10
+# Example: python run_benchmark.py backtest --tickers 100 --freq daily_by_trdr_day
+# Example: python run_benchmark.py significance --tickers 20 --resamples 2000
+# Example: python run_benchmark.py intraday --years 1 4 16 --interval 5m
+# Example: python run_benchmark.py periods --tickers 20
+# Example: python run_benchmark.py incremental --tickers 10
+# Example: python run_benchmark.py memory
+# Example: python run_benchmark.py budget --tickers 24 --workers 4 --budgets 0 1024 512
+# Example: python run_benchmark.py export --tickers 16 --workers 4
+# Example: python run_benchmark.py engines --start-yrs 1990 1999 2012 --recorded SPY:1993
+# Example: python run_benchmark.py gate --record
+# Example: python run_benchmark.py gate --scenarios short_history:2:2012 --repeats 3
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the ticker pipeline with the stand-in download server.')
+    subparsers = parser.add_subparsers(dest='scenario', required=True)
+
+    parser_workers = subparsers.add_parser('workers', help='Throughput with several workers sharing a central scheduler.')
+    parser_workers.add_argument('--tickers', type=int, default=8)
+    parser_workers.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser_workers.add_argument('--latency', type=float, default=0.0)
+    parser_workers.add_argument('--dataset-root', default=None)
+
+    parser_stream = subparsers.add_parser('stream', help='Luigi against the streaming executor, end to end.')
+    parser_stream.add_argument('--tickers', type=int, default=16)
+    parser_stream.add_argument('--workers', type=int, default=4)
+    parser_stream.add_argument('--latency', type=float, default=0.2)
+    parser_stream.add_argument('--dataset-root', default=None)
+
+    parser_shared = subparsers.add_parser('shared', help='Pickled frames against shared memory for the process pool.')
+    parser_shared.add_argument('--tickers', type=int, nargs='+', default=[8, 32, 128])
+    parser_shared.add_argument('--workers', type=int, default=4)
+
+    parser_walk = subparsers.add_parser('walk', help='Per-year summaries against the walk-forward cube.')
+    parser_walk.add_argument('--windows', type=int, nargs='+', default=[0, 5, 10], help='0 for every earlier year.')
+    parser_walk.add_argument('--start-yr', type=int, default=1999)
+
+    parser_backtest = subparsers.add_parser('backtest', help='Vectorized rule sweep against a plain loop.')
+    parser_backtest.add_argument('--tickers', type=int, default=100)
+    parser_backtest.add_argument('--freq', default='daily_by_trdr_day')
+    parser_backtest.add_argument('--window', type=int, default=10)
+
+    parser_significance = subparsers.add_parser('significance', help='Significance tables per ticker against batched.')
+    parser_significance.add_argument('--tickers', type=int, default=20)
+    parser_significance.add_argument('--freq', default='monthly')
+    parser_significance.add_argument('--resamples', type=int, default=2000)
+
+    parser_intraday = subparsers.add_parser('intraday', help='Whole-file intraday pivots against chunked aggregation.')
+    parser_intraday.add_argument('--years', type=int, nargs='+', default=[1, 4, 16])
+    parser_intraday.add_argument('--interval', default='5m')
+    parser_intraday.add_argument('--chunk-rows', type=int, default=50000)
+
+    parser_periods = subparsers.add_parser('periods', help='One pivot table per custom period against the batched pass.')
+    parser_periods.add_argument('--tickers', type=int, default=20)
+
+    parser_incremental = subparsers.add_parser('incremental', help='Full rebuild against the per-year incremental update.')
+    parser_incremental.add_argument('--tickers', type=int, default=10)
+
+    parser_memory = subparsers.add_parser('memory', help='Peak allocation of the hot paths against their budgets.')
+    parser_memory.add_argument('--start-yr', type=int, default=1999)
+
+    parser_budget = subparsers.add_parser('budget', help='Streaming throughput and peak memory under memory budgets.')
+    parser_budget.add_argument('--tickers', type=int, default=24)
+    parser_budget.add_argument('--workers', type=int, default=4)
+    parser_budget.add_argument('--budgets', type=int, nargs='+', default=[0, 1024, 512], help='MB. 0 for no budget.')
+    parser_budget.add_argument('--dataset-root', default=None)
+
+    parser_export = subparsers.add_parser('export', help='Export phase in the given order against the costliest first.')
+    parser_export.add_argument('--tickers', type=int, default=16)
+    parser_export.add_argument('--workers', type=int, default=4)
+    parser_export.add_argument('--dataset-root', default=None)
+
+    parser_engines = subparsers.add_parser('engines', help='Outputs and timings of the fast preprocessing engine against legacy.')
+    parser_engines.add_argument('--start-yrs', type=int, nargs='+', default=[1990, 1999, 2012], help='One synthetic ticker each.')
+    parser_engines.add_argument('--recorded', nargs='*', default=[], help='Processed tickers. Example: SPY:1993')
+    parser_engines.add_argument('--etf-dir', default=ETF_SECTOR_DIR, help='Folder of the recorded tickers.')
+    parser_engines.add_argument('--engine', default='fast')
+    parser_engines.add_argument('--repeats', type=int, default=3)
+
+    parser_gate = subparsers.add_parser('gate', help='Stage timings and peak memory against the stored baseline.')
+    parser_gate.add_argument('--record', action='store_true', help='Record the runs as the new baseline.')
+    parser_gate.add_argument('--baseline', default=PERF_BASELINE_PATH)
+    parser_gate.add_argument('--scenarios', nargs='*', default=[], help='Instead of PERF_SCENARIOS. Example: short:2:2012')
+    parser_gate.add_argument('--repeats', type=int, default=PERF_REPEATS)
+    parser_gate.add_argument('--time-threshold', type=float, default=PERF_TIME_THRESHOLD)
+    parser_gate.add_argument('--memory-threshold', type=float, default=PERF_MEMORY_THRESHOLD)
+    parser_gate.add_argument('--dataset-root', default=None)
+
+    parser_panel = subparsers.add_parser('panel', help='Per-ticker preprocessing against the panel engine.')
+    parser_panel.add_argument('--tickers', type=int, default=100)
+    parser_panel.add_argument('--start-yr', type=int, default=1999)
+
+    args = parser.parse_args()
+    logger.info(f'CLI Input: {args}')
+
+    if args.scenario == 'workers':
+        results = benchmark.bench_worker_scaling(args.tickers, args.workers, latency=args.latency,
+                                                 dataset_root=args.dataset_root)
+        print(benchmark.format_results(results))
+    elif args.scenario == 'stream':
+        results = benchmark.bench_streaming(args.tickers, args.workers, latency=args.latency,
+                                            dataset_root=args.dataset_root)
+        print(benchmark.format_results(results))
+    elif args.scenario == 'shared':
+        print(benchmark.format_results(benchmark.bench_shared_frames(args.tickers, args.workers)))
+    elif args.scenario == 'walk':
+        print(benchmark.format_results(benchmark.bench_walk_forward(args.windows, args.start_yr)))
+    elif args.scenario == 'backtest':
+        print(benchmark.format_results(benchmark.bench_backtest(args.tickers, args.freq, args.window)))
+    elif args.scenario == 'significance':
+        print(benchmark.format_results(benchmark.bench_significance(args.tickers, args.freq, args.resamples)))
+    elif args.scenario == 'intraday':
+        print(benchmark.format_results(benchmark.bench_intraday(args.years, args.interval, args.chunk_rows)))
+    elif args.scenario == 'periods':
+        print(benchmark.format_results(benchmark.bench_periods(args.tickers)))
+    elif args.scenario == 'incremental':
+        print(benchmark.format_results(benchmark.bench_incremental(args.tickers)))
+    elif args.scenario == 'memory':
+        results = benchmark.bench_memory(args.start_yr)
+        print(benchmark.format_results(results))
+        if any(result['status'] == 'over' for result in results):
+            sys.exit(1)
+    elif args.scenario == 'budget':
+        print(benchmark.format_results(benchmark.bench_memory_budget(args.tickers, args.workers, args.budgets,
+                                                                     dataset_root=args.dataset_root)))
+    elif args.scenario == 'export':
+        print(benchmark.format_results(benchmark.bench_export(args.tickers, args.workers, dataset_root=args.dataset_root)))
+    elif args.scenario == 'engines':
+        recorded = [(item.split(':')[0], int(item.split(':')[1]), args.etf_dir) for item in args.recorded]
+        results = benchmark.bench_engines(args.start_yrs, recorded, args.engine, args.repeats)
+        print(benchmark.format_results(results))
+        if any(result['status'] == 'mismatch' for result in results):
+            sys.exit(1)
+    elif args.scenario == 'gate':
+        scenarios = {
+            item.split(':')[0]: {'tickers': int(item.split(':')[1]), 'start_yr': int(item.split(':')[2])}
+            for item in args.scenarios
+        } or PERF_SCENARIOS
+        results = regression_gate.run_gate(args.baseline, scenarios, args.repeats, args.time_threshold,
+                                           args.memory_threshold, args.record, args.dataset_root)
+        print(benchmark.format_results(results))
+        if any(result['status'] in ('regressed', 'no_baseline') for result in results):
+            sys.exit(1)
+    elif args.scenario == 'panel':
+        print(benchmark.format_results(benchmark.bench_panel(args.tickers, args.start_yr)))
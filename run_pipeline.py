@@ -1,10 +1,12 @@
 
 
-import subprocess, logging
+import subprocess, logging, argparse
 
-from autoprocess_ticker import collect_tickers
+from autoprocess_ticker import collect_tickers, run_manifest, raw_archive, progress
 from config.config_logger import setup_logger
-from config.config import DICT_SECTORS, DICT_EQUITIES, DICT_COMMODITIES, LOG_PROCESSING_FILEPATH
+from config.config import (
+    DICT_SECTORS, DICT_EQUITIES, DICT_COMMODITIES, LOG_PROCESSING_FILEPATH, MEMORY_BUDGET_MB, EXPORT_WORKERS, PROGRESS_STATUS_PATH
+)
 
 
 # --------------------------------------------------------------
@@ -19,12 +21,71 @@ logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEP
 # Run.
 # --------------------------------------------------------------
 
+# Example: python run_pipeline.py --dry-run --category S
+# Example: python run_pipeline.py --resume
+# Example: python run_pipeline.py --stream --category S
+# Example: python run_pipeline.py --stream --memory-budget 4096 --category D
+# Example: python run_pipeline.py --export-workers 8 --category D
+# Example: python run_pipeline.py --status
 if __name__ == "__main__":
-    commline_input = input(
+    parser = argparse.ArgumentParser(description='Collect the ticker data. Prompt for the category if not given.')
+    parser.add_argument('--category', choices=['S', 'E', 'D'], default=None)
+    parser.add_argument('--resume', action='store_true', help='Resume the latest failed or crashed run.')
+    parser.add_argument('--dry-run', action='store_true', help='Report the stages that would be recomputed.')
+    parser.add_argument('--forget', nargs='+', default=None, help='Mark the tickers as stale in the run manifest to recompute them.')
+    parser.add_argument('--compact-archive', action='store_true', help='Drop the old CSV versions from the raw archive.')
+    parser.add_argument('--stream', action='store_true', help='Overlap the downloads with the preprocessing in one streaming run.')
+    parser.add_argument('--memory-budget', type=int, default=MEMORY_BUDGET_MB, help='Limit of the resident memory of the streaming workers in MB.')
+    parser.add_argument('--export-workers', type=int, default=EXPORT_WORKERS, help='Write the workbooks in their own process pool, the costliest first. 0 to turn off.')
+    parser.add_argument('--status', action='store_true', help='Print the progress of the current or latest run from its status file.')
+    args = parser.parse_args()
+
+    if args.status: 
+        status = progress.read_status()
+        print(progress.format_status(status) if status else f'No run has written ({PROGRESS_STATUS_PATH}) yet.')
+        raise SystemExit(0)
+
+    if args.compact_archive: 
+        sizes = raw_archive.get_archive().compact()
+        logger.info(f'Compacted the raw archive -- {sizes}') 
+        raise SystemExit(0)
+
+    if args.forget: 
+        run_manifest.get_manifest().forget(args.forget)
+        logger.info(f'Marked ({args.forget}) as stale in the run manifest.') 
+
+    if args.dry_run: 
+        jobs = collect_tickers.list_ticker_jobs(
+            DICT_SECTORS if args.category in ('S', 'D', None) else None, 
+            DICT_EQUITIES if args.category in ('E', 'D', None) else None
+        )
+        pending = collect_tickers.report_pending(jobs)
+        for ticker_dir, stages in sorted(pending.items()): 
+            print(f'{ticker_dir}: {", ".join(sorted(stages))}')
+        print(f'{len(pending)} of {len(jobs)} tickers would be recomputed.')
+        print(f'Manifest summary: {run_manifest.get_manifest().summary()}')
+        print(f'Cache hit rates: {run_manifest.get_manifest().cache_summary()}')
+        raise SystemExit(0)
+
+    if args.stream: 
+        logger.info('Collecting the ticker data with the streaming executor...') 
+        succeeded = collect_tickers.collect_streaming(
+            DICT_SECTORS if args.category in ('S', 'D', None) else None, 
+            DICT_EQUITIES if args.category in ('E', 'D', None) else None, 
+            budget_mb=args.memory_budget
+        )
+        raise SystemExit(0 if succeeded else 1)
+
+    if args.resume: 
+        logger.info('Resuming the latest failed or crashed run...') 
+        raise SystemExit(0 if collect_tickers.resume_last_run() else 1)
+
+    commline_input = args.category or input(
         '''
         What ticker category do you wish to collect? 
         S: ETF Sectors.
         E: ETF Equities. 
+        D: ETF Sectors & Equities in a shared queue (set LUIGI_SCHEDULER_MODE=central to use luigid). 
         Q: Quit.
 
         Please select: 
@@ -38,6 +99,9 @@ if __name__ == "__main__":
     elif commline_input == 'E': 
         logger.info('Collecting ETF equity data from Yahoo...') 
         collect_tickers.collect_equities(DICT_EQUITIES)
+    elif commline_input == 'D': 
+        logger.info('Collecting ETF sector and equity data from Yahoo in a shared queue...') 
+        collect_tickers.collect_distributed(DICT_SECTORS, DICT_EQUITIES, export_workers=args.export_workers)
     elif commline_input == 'Q': 
         logger.info('You have quitted the process.') 
     else:
@@ -0,0 +1,56 @@
+
+
+import argparse, logging, re
+
+import pandas as pd
+
+from autoprocess_ticker import collect_tickers, stats_store
+from config.config_logger import setup_logger
+from config.config import DICT_SECTORS, DICT_EQUITIES, LOG_PROCESSING_FILEPATH, YR_RANGE
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+def parse_filter(text:str):
+    # Example: 'up_prob>=0.8' -> ('up_prob', '>=', 0.8)
+    match = re.match(rf'^\s*(\w+)\s*({"|".join(map(re.escape, stats_store.FILTER_OPS))})\s*(\S+)\s*$', text)
+    if match is None:
+        raise argparse.ArgumentTypeError(f'Invalid filter ({text}). Example: up_prob>=0.8')
+    return match.group(1), match.group(2), float(match.group(3))
+
+
+# --------------------------------------------------------------
+# Run.
+# --------------------------------------------------------------
+
+# Example: python run_screener.py --refresh
+# Example: python run_screener.py --freq monthly --yr-range range_15_yr --period 12 --where "up_prob>=0.8"
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Rank and filter the tickers by their seasonal stats.')
+    parser.add_argument('--refresh', action='store_true', help='Ingest the tickers whose outputs changed before screening.')
+    parser.add_argument('--freq', default=None, help="Example: 'monthly' / 'weekly' / 'compiled_holiday'")
+    parser.add_argument('--yr-range', default=YR_RANGE[0], choices=YR_RANGE)
+    parser.add_argument('--period', default=None, help="Period values joined with '/'. Example: '12' / '12/3'")
+    parser.add_argument('--source', default=None)
+    parser.add_argument('--where', type=parse_filter, nargs='+', default=[], help='Example: up_prob>=0.8 abv_avg_vol_prob>0.5')
+    parser.add_argument('--order-by', default='up_prob')
+    parser.add_argument('--ascending', action='store_true')
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+    logger.info(f'CLI Input: {args}')
+
+    store = stats_store.get_store()
+    if args.refresh:
+        store.refresh(collect_tickers.list_ticker_jobs(DICT_SECTORS, DICT_EQUITIES, shard='0/1'))
+
+    if args.freq:
+        df = store.screen(args.freq, args.yr_range, args.period, args.where, args.order_by, args.ascending,
+                          args.limit, args.source)
+        with pd.option_context('display.max_columns', None, 'display.width', 200):
+            print(df.drop(columns='etf_dir').to_string(index=False))
@@ -0,0 +1,31 @@
+
+
+import argparse, logging
+
+from autoprocess_ticker import stats_service
+from config.config_logger import setup_logger
+from config.config import LOG_PROCESSING_FILEPATH, STATS_SERVICE_PORT, STATS_SERVICE_CACHE_BYTES
+
+
+# --------------------------------------------------------------
+# Logger setup.
+# --------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+logger, file_handler, stream_handler = setup_logger(logger, LOG_PROCESSING_FILEPATH)
+
+
+# --------------------------------------------------------------
+# Run.
+# --------------------------------------------------------------
+
+# Example: python run_stats_service.py --port 8090
+# Example: curl "http://localhost:8090/stats/SPY/monthly?yr_range=range_10_yr"
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve the pivots and stats of the tickers on localhost.')
+    parser.add_argument('--port', type=int, default=STATS_SERVICE_PORT)
+    parser.add_argument('--cache-mb', type=int, default=STATS_SERVICE_CACHE_BYTES // 1024 ** 2)
+    args = parser.parse_args()
+    logger.info(f'CLI Input: {args}')
+
+    stats_service.start_service(args.port, args.cache_mb * 1024 ** 2)